@@ -1,6 +1,7 @@
 __all__ = [
-    "AttestationResult", "DomainInfo", "KeyTriple", "MessageType",
-    "SendMethod", "AccessMethod"
+    "AttestationResult", "DomainInfo", "KeyTriple", "DestinationInfo",
+    "IndexedMessage", "InboxChanges", "MessageType", "SendMethod",
+    "AccessMethod", "CompressionMethod"
 ]
 
 from collections import namedtuple
@@ -17,6 +18,24 @@ KeyTriple = namedtuple(
     ['hash', 'key', 'signature']
 )
 
+DestinationInfo = namedtuple(
+    'DestinationInfo',
+    [
+        'url', 'webref_url', 'hash_algo', 'attestation', 'signatures',
+        'key_list', 'etag', 'last_modified', 'source'
+    ]
+)
+
+IndexedMessage = namedtuple(
+    'IndexedMessage',
+    ['url', 'id', 'type', 'name', 'size', 'version']
+)
+
+InboxChanges = namedtuple(
+    'InboxChanges',
+    ['new', 'changed', 'removed']
+)
+
 
 class AttestationResult(enum.IntEnum):
     success = 0
@@ -68,3 +87,18 @@ class AccessMethod(str, enum.Enum):
     def __str__(self):
         # output value instead of member name
         return self.value
+
+
+class CompressionMethod(str, enum.Enum):
+    # deflate, always available
+    zlib = "zlib"
+    # zstandard, requires zstandard package
+    zstd = "zstd"
+
+    def __str__(self):
+        # output value instead of member name
+        return self.value
+
+    def __bytes__(self):
+        # for headers
+        return self.value.encode("ascii")
@@ -1,10 +1,17 @@
-__all__ = ("CbFileResponse", "CbHttpResponse")
+__all__ = (
+    "CbFileResponse", "CbHttpResponse", "FileRange", "parse_range",
+    "file_etag", "ranged_file_response"
+)
 
+import re
+from hashlib import sha256
 
 from django.http import FileResponse, HttpResponse
 
 from .signals import successful_transmitted
 
+_range_re = re.compile(r"^\s*bytes\s*=\s*(\d*)\s*-\s*(\d*)\s*$")
+
 
 class CbHttpResponse(HttpResponse):
     def close(self):
@@ -15,9 +22,147 @@ class CbHttpResponse(HttpResponse):
 
 
 class CbFileResponse(FileResponse):
+    # streamed file, file_to_stream is reset if streaming_content is
+    # wrapped (e.g. by GZipMiddleware)
+    streamed_file = None
+
+    def _set_streaming_content(self, value):
+        if hasattr(value, "read"):
+            self.streamed_file = value
+        super()._set_streaming_content(value)
 
     def close(self):
         super().close()
-        successful_transmitted.send(
-            sender=CbFileResponse, response=self
+        # a FileRange must be read till its end, which is only the case
+        # if it contains the last byte of the file and the client got it
+        if getattr(self.streamed_file, "finished", True):
+            successful_transmitted.send(
+                sender=CbFileResponse, response=self
+            )
+
+
+class FileRange(object):
+    """
+    Readable [start, end) slice of fileob
+
+    finished is set if the reader asks for more after the final byte
+    of fileob was returned
+    """
+    fileob = None
+    # bytes left
+    remaining = 0
+    # range ends with the file
+    final = False
+    finished = False
+
+    def __init__(self, fileob, start, end, size):
+        self.fileob = fileob
+        if start:
+            fileob.seek(start)
+        self.remaining = end - start
+        self.final = end >= size
+
+    def read(self, size=-1):
+        if self.remaining <= 0:
+            self.finished = self.final
+            return b""
+        if size is None or size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.fileob.read(size)
+        if not data:
+            # file shorter than expected
+            self.remaining = 0
+            return b""
+        self.remaining -= len(data)
+        return data
+
+    def close(self):
+        self.fileob.close()
+
+
+def file_etag(name, size):
+    """ strong etag of an immutable stored file """
+    return '"%s"' % sha256(
+        ("%s\x1e%s" % (name, size)).encode("utf8")
+    ).hexdigest()
+
+
+def parse_range(header, size):
+    """
+    Parse single byte range
+
+    Arguments:
+        header {str} -- Range header
+        size {int} -- file size
+
+    Returns:
+        (start, end) -- end is exclusive, None: serve whole file, (size, size): not satisfiable
+    """  # noqa: E501
+    # multiple ranges are not supported, RFC 7233 allows ignoring Range
+    match = _range_re.match(header or "")
+    if not match or match.group(1) == match.group(2) == "":
+        return None
+    if match.group(1) == "":
+        # suffix range
+        length = int(match.group(2))
+        if not length:
+            return size, size
+        return max(0, size - length), size
+    start = int(match.group(1))
+    end = size
+    if match.group(2) != "":
+        end = int(match.group(2)) + 1
+        if end <= start:
+            return None
+        end = min(end, size)
+    if start >= size:
+        return size, size
+    return start, end
+
+
+def ranged_file_response(request, fileob, size, etag):
+    """
+    CbFileResponse of fileob, honoring Range and If-Range
+
+    Only a response serving the final byte can complete the transmission,
+    so an interrupted download can be resumed with a Range request.
+    Range is also evaluated for POST, which is used for retrieving
+    messages.
+
+    Arguments:
+        request {HttpRequest} -- request
+        fileob {file} -- opened file
+        size {int} -- file size
+        etag {str} -- strong etag, see file_etag
+
+    Returns:
+        HttpResponse -- 200, 206 or 416 response
+    """  # noqa: E501
+    byte_range = parse_range(request.headers.get("Range"), size)
+    if_range = request.headers.get("If-Range")
+    # only strong etags, no dates: Last-Modified is not sent
+    if byte_range and if_range is not None and if_range.strip() != etag:
+        byte_range = None
+    if byte_range and byte_range[0] >= size:
+        fileob.close()
+        ret = HttpResponse(status=416)
+        ret["Content-Range"] = "bytes */%s" % size
+        ret["ETag"] = etag
+        return ret
+    if byte_range:
+        start, end = byte_range
+        ret = CbFileResponse(
+            FileRange(fileob, start, end, size), status=206,
+            content_type="application/octet-stream"
+        )
+        ret["Content-Range"] = "bytes %s-%s/%s" % (start, end - 1, size)
+    else:
+        start, end = 0, size
+        ret = CbFileResponse(
+            FileRange(fileob, start, end, size),
+            content_type="application/octet-stream"
         )
+    ret["Content-Length"] = end - start
+    ret["Accept-Ranges"] = "bytes"
+    ret["ETag"] = etag
+    return ret
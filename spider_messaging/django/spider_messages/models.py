@@ -1,10 +1,14 @@
 __all__ = [
     "PostBox", "WebReference", "MessageContent"
 ]
+import base64
+import binascii
 import json
 import math
 import logging
+from hashlib import sha256
 from itertools import chain
+from urllib.parse import urljoin
 
 import requests
 from django.conf import settings
@@ -12,8 +16,11 @@ from django.core.exceptions import ValidationError
 from django.core.files import File
 from django.core.files.temp import NamedTemporaryFile
 from django.db import models
-from django.http import HttpResponse, HttpResponsePermanentRedirect
+from django.http import (
+    HttpResponse, HttpResponseNotModified, HttpResponsePermanentRedirect
+)
 from django.test import Client
+from django.utils.http import parse_etags
 from django.utils.translation import pgettext
 from django.views.decorators.csrf import csrf_exempt
 from rdflib import XSD, Literal
@@ -25,9 +32,12 @@ from spkcspider.apps.spider.models import (
 from spkcspider.apps.spider.queryfilters import info_or
 from spkcspider.constants import VariantType
 from spkcspider.utils.fields import add_by_field
+from spkcspider.utils.security import get_hashob
 from spkcspider.utils.urls import merge_get_url
 
-from .http import CbFileResponse
+from spider_messaging.utils.session import get_session
+
+from .http import file_etag, ranged_file_response
 
 logger = logging.getLogger(__name__)
 
@@ -91,6 +101,75 @@ class PostBox(DataContent):
             context["request"].auth_token.persist >= 0
         ):
             ret.add("push_webref")
+        ret.add("descriptor")
+        return ret
+
+    def get_descriptor(self, context):
+        """
+        Compact form of the postbox graph for senders
+
+        Arguments:
+            context {dict} -- access kwargs, requires hostpart
+
+        Returns:
+            dict -- url, hash_algorithm, attestation and signatures
+        """
+        from .forms import PostBoxForm
+        signatures = {}
+        mapped_hashes = []
+        for smarttag in self.associated.smarttags.filter(
+            name="key"
+        ).select_related("target"):
+            target = smarttag.target
+            mapped_hashes.append(
+                PostBoxForm.extract_pubkeyhash.search(target.info).group(2)
+            )
+            signatures[
+                urljoin(context["hostpart"], target.get_absolute_url())
+            ] = {
+                "key": target.attachedblobs.get(
+                    name="key"
+                ).as_bytes.decode("ascii"),
+                "hash": target.getlist("hash", 1)[0],
+                "signature": smarttag.data.get("signature") or ""
+            }
+        hasher = get_hashob()
+        for mh in sorted(mapped_hashes):
+            hasher.update(binascii.unhexlify(mh))
+        return {
+            "type": "PostBox",
+            "url": urljoin(
+                context["hostpart"], self.associated.get_absolute_url()
+            ),
+            "hash_algorithm": settings.SPIDER_HASH_ALGORITHM.name,
+            "attestation": base64.b64encode(
+                hasher.finalize()
+            ).decode("ascii"),
+            "signatures": signatures
+        }
+
+    @csrf_exempt
+    def access_descriptor(self, **kwargs):
+        # canonical json, so the etag is stable and can be strong
+        body = json.dumps(
+            self.get_descriptor(kwargs), sort_keys=True,
+            separators=(",", ":")
+        ).encode("utf8")
+        etag = '"%s"' % sha256(body).hexdigest()
+        cache_control = "%s, max-age=%i" % (
+            "public" if self.associated.usercomponent.public else "private",
+            getattr(settings, "SPIDER_MESSAGES_DESCRIPTOR_MAX_AGE", 60)
+        )
+        etags = parse_etags(
+            kwargs["request"].META.get("HTTP_IF_NONE_MATCH", "")
+        )
+        if etag in etags or "*" in etags:
+            ret = HttpResponseNotModified()
+        else:
+            ret = HttpResponse(body, content_type="application/json")
+        ret["ETag"] = etag
+        ret["Cache-Control"] = cache_control
+        ret["Vary"] = "X-TOKEN"
         return ret
 
     @csrf_exempt
@@ -188,6 +267,61 @@ class WebReference(DataContent):
         return ret
 
     @csrf_exempt
+    def retrieve_remote(self, fp, max_size, referer, params):
+        """
+        Download message content into fp
+
+        Interrupted downloads are resumed with Range requests, at most
+        SPIDER_MESSAGES_RESUME_ATTEMPTS times
+
+        Arguments:
+            fp {file} -- output
+            max_size {int,float} -- maximal size, math.inf: unlimited
+            referer {str} -- url of WebReference
+            params {dict} -- requests parameters
+
+        Returns:
+            int -- written size, None: too big/not specified
+        """
+        # shared by all users: must neither store nor send cookies
+        session = get_session("spider_messages", cookies=False)
+        data = {"max_size": max_size if max_size != math.inf else ""}
+        headers = {"Referer": referer}
+        attempts = getattr(settings, "SPIDER_MESSAGES_RESUME_ATTEMPTS", 3)
+        written_size = 0
+        while True:
+            with session.post(
+                self.quota_data["url"], data=data, headers=headers,
+                stream=True, **params
+            ) as resp:
+                resp.raise_for_status()
+                if "If-Range" not in headers:
+                    c_length = resp.headers.get("content-length")
+                    c_length = int(c_length) if c_length else math.inf
+                    if max_size < c_length:
+                        return None
+                elif resp.status_code != 206 or not resp.headers.get(
+                    "Content-Range", ""
+                ).startswith("bytes %s-" % written_size):
+                    raise ValueError("resume failed: %s" % resp.status_code)
+                try:
+                    for chunk in resp.iter_content(fp.DEFAULT_CHUNK_SIZE):
+                        written_size += fp.write(chunk)
+                    return written_size
+                except (
+                    requests.exceptions.ChunkedEncodingError,
+                    requests.exceptions.ConnectionError
+                ):
+                    etag = resp.headers.get("ETag")
+                    if (
+                        attempts <= 0 or not etag or etag.startswith("W/") or
+                        resp.headers.get("Accept-Ranges") != "bytes"
+                    ):
+                        raise
+                    attempts -= 1
+                    headers["Range"] = "bytes=%s-" % written_size
+                    headers["If-Range"] = etag
+
     def access_message(self, **kwargs):
         cached_content = self.associated.attachedfiles.filter(
             name="cache"
@@ -265,45 +399,25 @@ class WebReference(DataContent):
                     return HttpResponse("Quota", status=413)
             else:
                 try:
-                    with requests.post(
-                        self.quota_data["url"],
-                        data={
-                            "max_size": (
-                                max_size if max_size != math.inf else ""
-                            )
-                        },
-                        headers={
-                            "Referer": merge_get_url(
-                                "%s%s" % (
-                                    kwargs["hostpart"],
-                                    kwargs["request"].path
-                                )
-                            ),
-                            "Connection": "close"
-                        },
-                        stream=True,
-                        **params
-                    ) as resp:
-                        resp.raise_for_status()
-                        c_length = resp.get("content-length", math.inf)
-                        if isinstance(c_length, str):
-                            c_length = int(c_length)
-                        if max_size < c_length:
-                            return HttpResponse(
-                                "Too big/not specified", status=413
+                    fp = NamedTemporaryFile(
+                        suffix='.upload',
+                        dir=settings.FILE_UPLOAD_TEMP_DIR
+                    )
+                    written_size = self.retrieve_remote(
+                        fp, max_size, merge_get_url(
+                            "%s%s" % (
+                                kwargs["hostpart"],
+                                kwargs["request"].path
                             )
-                        fp = NamedTemporaryFile(
-                            suffix='.upload',
-                            dir=settings.FILE_UPLOAD_TEMP_DIR
+                        ), params
+                    )
+                    if written_size is None:
+                        return HttpResponse(
+                            "Too big/not specified", status=413
                         )
-                        written_size = 0
-                        for chunk in resp.iter_content(
-                            fp.DEFAULT_CHUNK_SIZE
-                        ):
-                            written_size += fp.write(chunk)
-                        self.update_used_space(written_size, "remote")
-                        # saves object
-                        cached_content.file.save("", File(fp))
+                    self.update_used_space(written_size, "remote")
+                    # saves object
+                    cached_content.file.save("", File(fp))
 
                 except requests.exceptions.SSLError as exc:
                     logger.info(
@@ -325,9 +439,13 @@ class WebReference(DataContent):
                     )
                     return HttpResponse("other error", status=502)
 
-        ret = CbFileResponse(
-            cached_content.file.open("rb")
+        ret = ranged_file_response(
+            kwargs["request"], cached_content.file.open("rb"),
+            cached_content.file.size,
+            file_etag(cached_content.file.name, cached_content.file.size)
         )
+        if ret.status_code == 416:
+            return ret
 
         q = models.Q()
         for i in kwargs["request"].POST.getlist("keyhash"):
@@ -408,9 +526,12 @@ class MessageContent(DataContent):
         f = self.associated.attachedfiles.get(
             name="encrypted_content"
         )
-        ret = CbFileResponse(
-            f.file.open()
+        ret = ranged_file_response(
+            kwargs["request"], f.file.open("rb"), f.file.size,
+            file_etag(f.file.name, f.file.size)
         )
+        if ret.status_code == 416:
+            return ret
         keyhashes = kwargs["request"].POST.getlist("keyhash")
         keyhashes_q = info_or(
             pubkeyhash=keyhashes,
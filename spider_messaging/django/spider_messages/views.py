@@ -8,7 +8,7 @@ from spkcspider.apps.spider.models import AssignedContent, AuthToken
 from spkcspider.apps.spider.views import UserTestMixin
 from spkcspider.utils.settings import get_settings_func
 
-from .http import CbFileResponse, CbHttpResponse
+from .http import CbHttpResponse, file_etag, ranged_file_response
 from .models import MessageContent
 
 _empty_set = frozenset()
@@ -66,19 +66,23 @@ class MessageContentView(UserTestMixin, View):
                 return HttpResponse(status=400)
         if s is not None and s < f.file.size:
             ret = CbHttpResponse()
+            # cached, needs only content-length
+            ret["content-length"] = f.file.size
         else:
-            ret = CbFileResponse(
-                f.file.open()
+            # resumable, only the final range completes the transmission
+            ret = ranged_file_response(
+                request, f.file.open("rb"), f.file.size,
+                file_etag(f.file.name, f.file.size)
             )
+            if ret.status_code == 416:
+                return ret
             ret.msgreceivers = self.receivers
 
         ret.msgcopies = self.object.smarttags.filter(
             name="unread", target=None
         )
-        # cached, needs only content-length
         # don't add key-list; it is just for own keys
         # owner should access message objects via access_view
-        ret["content-length"] = f.file.size
         return ret
 
     def options(self, request, *args, **kwargs):
@@ -10,12 +10,15 @@ from datetime import timedelta as td
 from cryptography import x509
 from cryptography.hazmat.backends import default_backend
 from cryptography.hazmat.primitives import hashes, serialization
-from cryptography.hazmat.primitives.asymmetric import rsa
 from cryptography.x509.oid import NameOID
 from OpenSSL import crypto
 
 from twisted.internet import asyncioreactor, ssl
 
+from spider_messaging.utils.crypto import (
+    certificate_hash, generate_private_key, private_key_pem
+)
+
 from .cmd import parser
 from .core import load_priv_key
 from .pop3 import POP3Factory, SpiderPostbox
@@ -32,19 +35,9 @@ def main(argv):
     argv.hash = getattr(hashes, argv.hash)()
     cert = None
     if not os.path.exists(argv.keys[0]) and not argv.no_gen:
-        pkey = rsa.generate_private_key(
-            public_exponent=65537,
-            key_size=argv.keysize,
-            backend=default_backend()
-        )
+        pkey = generate_private_key(argv.keytype, argv.keysize)
         with open(argv.keys[0], "wb") as f:
-            f.write(
-                pkey.private_bytes(
-                    encoding=serialization.Encoding.PEM,
-                    format=serialization.PrivateFormat.TraditionalOpenSSL,
-                    encryption_algorithm=serialization.NoEncryption(),
-                )
-            )
+            f.write(private_key_pem(pkey))
         subject = x509.Name(
             [
                 x509.NameAttribute(
@@ -70,7 +63,9 @@ def main(argv):
         #    critical=False
         # )
 
-        cert = cert.sign(pkey, hashes.SHA512(), default_backend())
+        cert = cert.sign(
+            pkey, certificate_hash(pkey, hashes.SHA512()), default_backend()
+        )
         del pkey
 
         with open(argv.cert, "wb") as f:
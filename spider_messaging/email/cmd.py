@@ -14,7 +14,11 @@ parser.add_argument(
 )
 parser.add_argument(
     '--keysize', "-s", action='store', default=8192, type=int,
-    help="Keysize for auto generated keys"
+    help="Keysize for auto generated rsa keys"
+)
+parser.add_argument(
+    '--keytype', "-t", action='store', default="rsa",
+    choices=["rsa", "ed25519"], help="Type of auto generated keys"
 )
 parser.add_argument(
     '--hash', action='store', help="Hash algorithm", default="SHA512"
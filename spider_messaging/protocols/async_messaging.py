@@ -0,0 +1,715 @@
+__all__ = ["AsyncPostBox"]
+
+import asyncio
+import functools
+import json
+import logging
+import tempfile
+
+import aiohttp
+from rdflib import Graph
+from spkcspider.utils.urls import merge_get_url, replace_action
+
+from spider_messaging.constants import AccessMethod, SendMethod
+from spider_messaging.exceptions import (
+    CheckError, DestException, NotReady, SrcException
+)
+from spider_messaging.protocols.index import (
+    MessageIndex, extract_indexed_messages
+)
+from spider_messaging.protocols.messaging import PostBox
+from spider_messaging.utils.concurrency import host_key
+from spider_messaging.utils.graph import (
+    max_pages_in_flight, stream_chunk_size
+)
+from spider_messaging.utils.html import HtmlProperties
+from spider_messaging.utils.misc import MessageDecryptor
+from spider_messaging.utils.turtle import TurtleStream, parse_stream
+
+logger = logging.getLogger(__name__)
+
+
+def _form_fields(data):
+    # requests style dict (values can be lists) to aiohttp fields
+    fields = []
+    for name, value in data.items():
+        if not isinstance(value, (list, tuple)):
+            value = [value]
+        for item in value:
+            fields.append((name, str(item)))
+    return fields
+
+
+class AsyncPostBox(PostBox):
+    """
+    asyncio variant of PostBox
+
+    Network io uses a pooled keep-alive aiohttp session, crypto and graph
+    parsing run in an executor.
+    Use: postbox = await AsyncPostBox.create(checker, priv_key, url)
+    """
+    executor = None
+    # connection pool of created sessions
+    connection_limit = 100
+    connection_limit_per_host = 0
+    keepalive_timeout = 30
+    _own_session = False
+
+    def __init__(
+        self, attestation_checker, priv_key, url=None, token=None,
+        executor=None, dest_cache=None
+    ):
+        """
+        Setup without retrieving anything, call update() afterwards or
+        use create()
+        """
+        self.executor = executor
+        self._initial = self._setup(
+            attestation_checker, priv_key, url, token, dest_cache
+        )
+
+    @classmethod
+    async def create(
+        cls, attestation_checker, priv_key, url=None, token=None, graph=None,
+        session=None, executor=None, dest_cache=None
+    ):
+        self = cls(
+            attestation_checker, priv_key, url=url, token=token,
+            executor=executor, dest_cache=dest_cache
+        )
+        token, use_get_token = self._initial
+        await self.update(token, graph, session, use_get_token)
+        return self
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+
+    async def close(self):
+        if self._own_session and self.session:
+            await self.session.close()
+        self.session = None
+
+    def _create_session(self):
+        self._own_session = True
+        return aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(
+                limit=self.connection_limit,
+                limit_per_host=self.connection_limit_per_host,
+                keepalive_timeout=self.keepalive_timeout
+            )
+        )
+
+    async def _run(self, func, *args, **kwargs):
+        return await asyncio.get_event_loop().run_in_executor(
+            self.executor, functools.partial(func, *args, **kwargs)
+        )
+
+    async def _read_chunks(self, fileob):
+        """
+        Yields chunks of fileob, every read runs in the executor
+
+        Used for upload bodies, so the encryption (and compression) of an
+        EncryptedFile does not block the event loop.
+        """
+        chunk = await self._run(fileob.read, self.chunk_size)
+        while chunk:
+            yield chunk
+            chunk = await self._run(fileob.read, self.chunk_size)
+
+    async def _fetch(
+        self, method, url, exc_class=None, msg=None, timeout=60, **kwargs
+    ):
+        """
+        Request url and read response completely
+
+        Keyword Arguments:
+            exc_class {Exception} -- wrap http errors in (default: {None})
+            msg {str} -- message of wrapped exception (default: {None})
+
+        Returns:
+            (response, content)
+        """
+        async with self.session.request(
+            method, url, timeout=aiohttp.ClientTimeout(total=timeout),
+            **kwargs
+        ) as response:
+            content = await response.read()
+            try:
+                response.raise_for_status()
+            except aiohttp.ClientResponseError as exc:
+                if not exc_class:
+                    raise
+                raise exc_class(
+                    msg, content.decode("utf8", "replace")
+                ) from exc
+            return response, content
+
+    async def _parse(self, graph, data, format="turtle"):
+        if self.stream_graphs and format == "turtle":
+            await self._run(parse_stream, graph, [data])
+        else:
+            await self._run(graph.parse, data=data, format=format)
+        return graph
+
+    async def _fetch_graph(
+        self, url, graph=None, exc_class=None, msg=None, timeout=60,
+        **kwargs
+    ):
+        """
+        GET turtle url and parse it, with stream_graphs while downloading
+
+        Keyword Arguments:
+            graph {Graph} -- target graph, None: new graph (default: {None})
+            exc_class {Exception} -- wrap http errors in (default: {None})
+            msg {str} -- message of wrapped exception (default: {None})
+
+        Returns:
+            Graph -- graph
+        """
+        if graph is None:
+            graph = Graph()
+        if not self.stream_graphs:
+            content = (await self._fetch(
+                "GET", url, exc_class=exc_class, msg=msg, timeout=timeout,
+                **kwargs
+            ))[1]
+            return await self._parse(graph, content)
+        stream = TurtleStream()
+
+        def _feed(chunk):
+            if chunk is None:
+                triples = stream.close()
+            else:
+                triples = stream.feed(chunk)
+            if triples:
+                graph.addN((s, p, o, graph) for s, p, o in triples)
+
+        async with self.session.get(
+            url, timeout=aiohttp.ClientTimeout(total=timeout), **kwargs
+        ) as response:
+            try:
+                response.raise_for_status()
+            except aiohttp.ClientResponseError as exc:
+                if not exc_class:
+                    raise
+                raise exc_class(
+                    msg, (await response.read()).decode("utf8", "replace")
+                ) from exc
+            async for chunk in response.content.iter_chunked(
+                stream_chunk_size
+            ):
+                await self._run(_feed, chunk)
+        await self._run(_feed, None)
+        return graph
+
+    async def update(
+        self, token=None, graph=None, session=None, use_get_token=None
+    ):
+        if session:
+            self.session = session
+            self._own_session = False
+        elif session is False or not self.session:
+            self.session = self._create_session()
+        use_get_token = self._update_token(token, use_get_token)
+        # empty graph or None
+        if not graph:
+            assert self.url
+            try:
+                # replaces graph with itself if graph is specified
+                graph = await self.retrieve_filtered_graph(
+                    self.url, out=graph
+                )
+            except Exception as exc:
+                # don't retry if result is clear
+                if use_get_token is not None:
+                    raise exc
+                self.use_get_token = True
+                # replaces graph with itself if graph is specified
+                graph = await self.retrieve_filtered_graph(
+                    self.url, out=graph
+                )
+            retrieved_url = await self.retrieve_missing(graph, self.url)
+        else:
+            retrieved_url = await self.retrieve_missing(graph)
+        await self._run(self._update_from_graph, graph, retrieved_url)
+
+    async def retrieve_missing(self, graph, url=None, timeout=60):
+        retrieved_url, merged_url, headers, missing_pages = \
+            await self._run(self._missing_pages, graph, url)
+        semaphore = asyncio.Semaphore(
+            self.max_pages_in_flight or max_pages_in_flight
+        )
+
+        async def _retrieve(page):
+            async with semaphore:
+                if self.stream_graphs:
+                    return await self._fetch_graph(
+                        merge_get_url(merged_url, page=page),
+                        headers=headers, timeout=timeout
+                    )
+                content = (await self._fetch(
+                    "GET", merge_get_url(merged_url, page=page),
+                    headers=headers, timeout=timeout
+                ))[1]
+            # every page is parsed in its own graph, parallel in executor
+            return await self._parse(Graph(), content)
+
+        page_graphs = await asyncio.gather(*map(_retrieve, missing_pages))
+
+        def _merge():
+            for page_graph in page_graphs:
+                graph.addN((s, p, o, graph) for s, p, o in page_graph)
+        await self._run(_merge)
+        return retrieved_url
+
+    async def retrieve_filtered_graph(self, url=None, timeout=60, out=None):
+        merged_url, headers = self._filtered_graph_url(url)
+        return await self._fetch_graph(
+            merged_url, graph=out, headers=headers, timeout=timeout
+        )
+
+    async def _send_dest(self, aes_key, fetch_url, dest):
+        info, dest_url, fresh = self._dest_lookup(dest)
+        if not fresh and self.use_descriptor:
+            descriptor_info = await self._dest_descriptor(dest, info)
+            if descriptor_info:
+                info, fresh = descriptor_info, True
+        if not fresh:
+            try:
+                response, content = await self._fetch(
+                    "GET", dest_url, headers=self._dest_headers(info, "graph")
+                )
+                if info and response.status == 304:
+                    self.dest_cache.touch(dest)
+                else:
+                    g_dest = await self._parse(Graph(), content)
+                    await self.retrieve_missing(g_dest, dest_url)
+            except Exception as exc:
+                raise DestException("postbox retrieval failed") from exc
+            if not info or response.status != 304:
+                info = await self._run(
+                    self._dest_info, dest, g_dest, response.headers
+                )
+
+        dest_key_list = await self._run(self._dest_key_list, aes_key, info)
+        try:
+            await self._fetch(
+                "POST", info.webref_url, data={
+                    "url": fetch_url,
+                    "key_list": json.dumps(dest_key_list)
+                }
+            )
+        except Exception as exc:
+            # keys could have changed
+            self._dest_invalidate(dest)
+            raise DestException("post webref failed") from exc
+
+    async def _dest_descriptor(self, dest, info):
+        try:
+            response, content = await self._fetch(
+                "GET", replace_action(dest, "descriptor/"),
+                headers=self._dest_headers(info, "descriptor")
+            )
+            if info and response.status == 304:
+                self.dest_cache.touch(dest)
+                return info
+            postbox_url, options = self.parse_descriptor(content)
+        except (
+            aiohttp.ClientError, asyncio.TimeoutError, ValueError
+        ) as exc:
+            logger.debug("no descriptor for %s, use turtle: %s", dest, exc)
+            return None
+        return await self._run(
+            self._dest_check, dest, postbox_url, options, response.headers,
+            "descriptor"
+        )
+
+    def _cookie_state(self):
+        return frozenset(
+            (m.key, m.value, m["domain"], m["path"])
+            for m in self.session.cookie_jar
+        )
+
+    async def _send_dests(
+        self, aes_key, receivers_furls, max_workers=None, max_per_host=None
+    ):
+        semaphore = asyncio.Semaphore(max_workers) if max_workers else None
+        host_semaphores = {}
+
+        async def _send(item):
+            receiver, furl = item
+            host_semaphore = None
+            if max_per_host:
+                host_semaphore = host_semaphores.setdefault(
+                    host_key(receiver), asyncio.Semaphore(max_per_host)
+                )
+                await host_semaphore.acquire()
+            if semaphore:
+                await semaphore.acquire()
+            try:
+                await self._send_dest(aes_key, furl, receiver)
+            except Exception as exc:
+                # for autoremoval simulate access
+                try:
+                    await self._fetch("GET", furl)
+                except Exception as exc2:
+                    logger.info(
+                        "could not invalidate token", exc_info=exc2
+                    )
+                return item, exc
+            finally:
+                if semaphore:
+                    semaphore.release()
+                if host_semaphore:
+                    host_semaphore.release()
+            return item, None
+        return await asyncio.gather(*map(_send, receivers_furls))
+
+    async def send(
+        self, inp, receivers, headers=b"\n", mode=SendMethod.shared,
+        aes_key=None, max_workers=None, max_per_host=None
+    ):
+        """
+        Encrypt and upload message, push webreferences to receivers
+
+        See PostBox.send, max_workers defaults here to unlimited
+        """
+        if not self.ok:
+            raise NotReady()
+        if isinstance(receivers, str):
+            receivers = [receivers]
+        inp, aes_key, nonce, fencryptor, src_key_list = await self._run(
+            self._prepare_send, inp, aes_key, mode
+        )
+
+        message_create_url, src_headers = self._message_create_url()
+        csrftoken = self._csrf_lookup(message_create_url)
+        if not csrftoken:
+            content = (await self._fetch(
+                "GET", message_create_url, SrcException,
+                "retrieval csrftoken failed", headers=src_headers
+            ))[1]
+            csrftoken = self._extract_csrftoken(
+                await self._run(HtmlProperties, content)
+            )
+            self._csrf_set(message_create_url, csrftoken)
+        # create message object
+        form = aiohttp.FormData(_form_fields(
+            self._message_create_data(src_key_list, receivers)
+        ))
+        # compression probing and encryption happen while reading
+        encrypted = await self._run(
+            self._encrypted_content, inp, aes_key, nonce, fencryptor, headers
+        )
+        form.add_field(
+            "encrypted_content",
+            self._read_chunks(encrypted),
+            filename="encrypted_content",
+            content_type="application/octet-stream"
+        )
+        try:
+            response, content = await self._fetch(
+                "POST", message_create_url, SrcException,
+                "Message creation failed", data=form, headers={
+                    "X-CSRFToken": csrftoken,
+                    **src_headers  # only for src
+                }
+            )
+        except SrcException:
+            # maybe the token is stale
+            self._csrf_invalidate(message_create_url)
+            raise
+        text = content.decode("utf8", "replace")
+        if message_create_url == str(response.url):
+            self._csrf_invalidate(message_create_url)
+            raise SrcException("Message creation failed", text)
+        g = await self._run(HtmlProperties, content)
+        furls = await self._run(self._extract_fetch_urls, g, receivers, text)
+        return self._collect_send_results(
+            await self._send_dests(
+                aes_key, zip(receivers, furls),
+                max_workers=max_workers, max_per_host=max_per_host
+            ),
+            aes_key
+        )
+
+    async def receive(
+        self, message_id, outfp=None, access_method=AccessMethod.view,
+        extra_key_hashes=None, max_size=None
+    ):
+        if not self.ok:
+            raise NotReady()
+        cache_key = self._message_cache_key(message_id, access_method)
+        # hits need no postbox graph
+        ret = await self._run(
+            self._receive_cached, cache_key, outfp, access_method
+        )
+        if ret:
+            return ret
+        location = await self._run(
+            self._find_message, await self._message_graph(), message_id
+        )
+        return await self._receive_message(
+            location, outfp, access_method=access_method,
+            extra_key_hashes=extra_key_hashes, max_size=max_size,
+            cache_key=cache_key
+        )
+
+    async def receive_many(
+        self, message_ids, outfps=None, access_method=AccessMethod.view,
+        extra_key_hashes=None, max_size=None, max_workers=None,
+        max_per_host=None
+    ):
+        """
+        Receive multiple messages with one graph retrieval
+
+        See PostBox.receive_many, max_workers defaults here to unlimited
+        """
+        if not self.ok:
+            raise NotReady()
+        message_ids = list(message_ids)
+        limit = min(filter(None, (max_workers, max_per_host)), default=None)
+        semaphore = asyncio.Semaphore(limit) if limit else None
+
+        async def _limited(func, *args, **kwargs):
+            try:
+                if semaphore:
+                    await semaphore.acquire()
+                return await func(*args, **kwargs), None
+            except Exception as exc:
+                return None, exc
+            finally:
+                if semaphore:
+                    semaphore.release()
+
+        results = {}
+        if self.message_cache and access_method != AccessMethod.bypass:
+            # hits need no postbox graph
+            results = self._cached_results(zip(
+                message_ids, await asyncio.gather(*(
+                    _limited(
+                        self._run, self._receive_cached,
+                        self._message_cache_key(message_id, access_method),
+                        functools.partial(
+                            self._message_sink, outfps, message_id
+                        ), access_method
+                    ) for message_id in message_ids
+                ))
+            ))
+            message_ids = [x for x in message_ids if x not in results]
+            if not message_ids:
+                return results
+        missing, found = await self._run(
+            self._find_messages, await self._message_graph(), message_ids
+        )
+        results.update(missing)
+        results.update(zip(found.keys(), await asyncio.gather(*(
+            _limited(
+                self._receive_message,
+                location, self._message_sink(outfps, message_id),
+                access_method=access_method,
+                extra_key_hashes=extra_key_hashes, max_size=max_size,
+                cache_key=self._message_cache_key(message_id, access_method)
+            ) for message_id, location in found.items()
+        ))))
+        return results
+
+    async def _message_graph(self):
+        merged_url, headers = self.merge_and_headers(
+            self.url, raw="embed"
+        )
+        graph = await self._fetch_graph(merged_url, headers=headers)
+        await self.retrieve_missing(graph, merged_url)
+        return graph
+
+    async def _receive_message(
+        self, location, outfp=None, access_method=AccessMethod.view,
+        extra_key_hashes=None, max_size=None, cache_key=None
+    ):
+        base, hash_algo = location
+        if not outfp:
+            outfp = tempfile.TemporaryFile()
+
+        retrieve_url, headers, data, pub_key_hashalg = \
+            await self._run(
+                self._message_request,
+                base, hash_algo, access_method, extra_key_hashes, max_size
+            )
+        cachefile = None
+        async with self.session.post(
+            retrieve_url, headers=headers, data=_form_fields(data)
+        ) as response:
+            if response.status >= 400:
+                raise DestException(
+                    "Message retrieval failed", await response.text()
+                )
+            decrypted_key = await self._run(
+                self._decrypt_key,
+                response.headers["X-KEYLIST"], pub_key_hashalg, hash_algo
+            )
+            decryptor = MessageDecryptor(
+                decrypted_key, outfp, chunk_size=self.chunk_size,
+                max_workers=self.crypt_workers
+            )
+
+            async def _sink(chunk):
+                if cachefile:
+                    await self._run(cachefile.write, chunk)
+                await self._run(decryptor.feed, chunk)
+            try:
+                if cache_key:
+                    cachefile = await self._run(
+                        self.message_cache.create_tempfile
+                    )
+                await self._download(
+                    response, retrieve_url, headers, data, _sink
+                )
+                headers = await self._run(decryptor.finalize)
+            except BaseException:
+                await self._run(self._discard_cachefile, cachefile)
+                raise
+            await self._run(
+                self._add_cachefile, cache_key, cachefile, location,
+                response.headers["X-KEYLIST"], decrypted_key, access_method
+            )
+        return outfp, headers, decrypted_key
+
+    async def _download(self, response, url, headers, data, sink, start=0):
+        """
+        Stream response (starting at start) into sink
+
+        Interrupted downloads are resumed with Range requests, ranges are
+        not downloaded in parallel (range_workers is ignored)
+
+        Returns:
+            int -- end position
+        """
+        etag = self._resumable(response.headers)
+        position = start
+        attempts = self.resume_attempts
+        resumed = None
+        try:
+            while True:
+                try:
+                    async for chunk in response.content.iter_chunked(
+                        self.chunk_size
+                    ):
+                        await sink(chunk)
+                        position += len(chunk)
+                    return position
+                except (
+                    aiohttp.ClientPayloadError, aiohttp.ClientConnectionError
+                ) as exc:
+                    if not etag or attempts <= 0:
+                        raise DestException(
+                            "Message retrieval interrupted"
+                        ) from exc
+                    attempts -= 1
+                if resumed:
+                    resumed.release()
+                resumed = response = await self.session.post(
+                    url, data=_form_fields(data),
+                    headers=self._range_headers(headers, position, None, etag)
+                )
+                content_range = self._content_range(
+                    response.status, response.headers
+                )
+                if not content_range or content_range[0] != position:
+                    # If-Range: message changed
+                    raise DestException(
+                        "Message range retrieval failed", response.status
+                    )
+        finally:
+            if resumed:
+                resumed.release()
+
+    async def list_messages(self):
+        merged_url, headers = self.merge_and_headers(
+            self.url, raw="embed"
+        )
+        try:
+            graph = await self._fetch_graph(merged_url, headers=headers)
+        except Exception as exc:
+            raise SrcException("Could not list messages") from exc
+        return await self._run(self._extract_messages, graph)
+
+    async def sync(self, index, timeout=60):
+        if not self.ok:
+            raise NotReady()
+        if not isinstance(index, MessageIndex):
+            index = MessageIndex(index)
+        merged_url, headers = await self._run(self._sync_request, index)
+        try:
+            response, content = await self._fetch(
+                "GET", merged_url, headers=headers, timeout=timeout
+            )
+        except Exception as exc:
+            raise SrcException("Could not sync messages") from exc
+        if response.status == 304:
+            return await self._run(index.not_modified, self.url)
+        graph = await self._parse(Graph(), content)
+        await self.retrieve_missing(graph, merged_url)
+        messages = await self._run(extract_indexed_messages, graph)
+        return await self._run(
+            index.update, self.url, messages,
+            etag=response.headers.get("ETag"),
+            last_modified=response.headers.get("Last-Modified")
+        )
+
+    async def check(self, url=None):
+        if not url or url.startswith(self.url):
+            graph = await self.retrieve_filtered_graph()
+        else:
+            graph = await self.retrieve_filtered_graph(url)
+        await self.retrieve_missing(graph)
+        return await self._run(self._check_result, graph, url)
+
+    async def sign(self, confirm=False):
+        url, headers = self.merge_and_headers(self.url)
+        graph = await self.retrieve_filtered_graph()
+        await self.retrieve_missing(graph)
+        try:
+            sign_info = self._sign_info(
+                await self._run(self.check_graph, graph)
+            )
+        except CheckError as exc:
+            sign_info = self._sign_info(exc)
+        attestation, errored, key_list = sign_info
+
+        if not confirm:
+            return (
+                self.hash_key_public in errored,
+                key_list
+            )
+        postbox_update = self._sign_url()
+        # retrieve csrftoken
+        content = (await self._fetch(
+            "GET", postbox_update, headers=headers
+        ))[1]
+        graph = await self._run(HtmlProperties, content)
+        csrftoken, fields, own_signature = await self._run(
+            self._sign_fields, graph, attestation
+        )
+        # update
+        try:
+            content = (await self._fetch(
+                "POST", postbox_update, data=fields, headers={
+                    "X-CSRFToken": csrftoken,
+                    **headers
+                }
+            ))[1]
+            graph = await self._run(HtmlProperties, content)
+            await self._run(self._check_signed, graph, own_signature)
+        except SrcException as exc:
+            raise exc
+        except Exception as exc:
+            raise SrcException(
+                "could not update signature", own_signature
+            ) from exc
+        return (
+            self.hash_key_public in errored,
+            key_list
+        )
@@ -3,15 +3,19 @@ __all__ = ["AttestationChecker"]
 import base64
 import binascii
 import sqlite3
+import threading
+import weakref
+from collections import OrderedDict
+from contextlib import contextmanager
 from itertools import repeat
 
 from cryptography.exceptions import InvalidSignature
 from cryptography.hazmat.backends import default_backend
-from cryptography.hazmat.primitives import hashes, serialization
-from cryptography.hazmat.primitives.asymmetric import padding
+from cryptography.hazmat.primitives import hashes
 
 from spider_messaging.constants import AttestationResult, DomainInfo, KeyTriple
-from spider_messaging.utils.keys import load_public_key
+from spider_messaging.utils.crypto import verify_signature
+from spider_messaging.utils.keys import key_fingerprint, load_public_key
 
 
 def _extract_hash_key2(val, algo=None):
@@ -49,15 +53,8 @@ def _extract_hash_key2(val, algo=None):
 
     # third analysis (check if v is public key)
     if hasattr(v, "public_bytes"):
-        digest = hashes.Hash(algo, backend=default_backend())
-        digest.update(
-            v.public_bytes(
-                encoding=serialization.Encoding.PEM,
-                format=serialization.PublicFormat.SubjectPublicKeyInfo
-            ).strip()
-        )
         return KeyTriple(
-            digest.finalize(),
+            key_fingerprint(v, algo),
             v,
             signature
         )
@@ -68,14 +65,7 @@ def _extract_hash_key2(val, algo=None):
 def _extract_hash_key(val, algo=None, check_hash=False):
     ret = _extract_hash_key2(val, algo=algo)
     if check_hash and algo and ret[1] and len(val) >= 2:
-        digest = hashes.Hash(algo, backend=default_backend())
-        digest.update(
-            ret[1].public_bytes(
-                encoding=serialization.Encoding.PEM,
-                format=serialization.PublicFormat.SubjectPublicKeyInfo
-            ).strip()
-        )
-        if ret[0] != digest.finalize():
+        if ret[0] != key_fingerprint(ret[1], algo):
             raise ValueError("Key does not match hash")
     return ret
 
@@ -84,11 +74,68 @@ def _extract_only_hash(val, algo=None, check_hash=False):
     return _extract_hash_key(val, algo=algo, check_hash=check_hash)[0]
 
 
+class _Connection(sqlite3.Connection):
+    """ weak referencable connection, knows if it was closed """
+    closed = False
+
+    def close(self):
+        self.closed = True
+        super().close()
+
+
+def _signature_cache_key(entry, attestation):
+    # (key fingerprint, attestation, signature digest)
+    digest = hashes.Hash(hashes.SHA256(), backend=default_backend())
+    digest.update(entry[2].encode("ascii"))
+    return (
+        key_fingerprint(entry[1], hashes.SHA256()),
+        attestation,
+        digest.finalize()
+    )
+
+
 class AttestationChecker(object):
-    con = None
+    """
+    Attestations of domains, safe for concurrent use
+
+    Every thread uses its own connection (WAL: readers run concurrently),
+    writers are serialized by lock. Domain infos and key hashes are
+    cached in memory.
+    In-memory databases use one shared connection, serialized by lock.
+    """
+    dbfile = None
+    # serializes writers (and everything in shared mode)
+    lock = None
+    # maximal size of in-memory front of verified signatures
+    signature_cache_size = 4096
+    # domains with cached (DomainInfo, key hashes)
+    domain_cache_size = 1024
+    # larger hash sets are passed to queries via a temporary table
+    # (SQLite limits the amount of variables)
+    max_inline_hashes = 256
+    _verified_signatures = None
+    # domain: (DomainInfo, frozenset of key hashes)
+    _domain_cache = None
+    # incremented after every write transaction, see _cached_domain
+    _generation = 0
+    _cache_lock = None
+    # connection of in-memory databases
+    _shared = None
+    # thread local: con, generation and dirty domains of transaction
+    _local = None
+    _connections = None
 
     def __init__(self, dbfile):
-        self.con = sqlite3.connect(dbfile)
+        self.dbfile = dbfile
+        self.lock = threading.RLock()
+        self._cache_lock = threading.Lock()
+        self._local = threading.local()
+        self._connections = weakref.WeakSet()
+        self._verified_signatures = set()
+        self._domain_cache = OrderedDict()
+        if dbfile in {":memory:", ""}:
+            # every connection would see its own database
+            self._shared = self._connect()
         self.create()
 
     def __del__(self):
@@ -100,8 +147,131 @@ class AttestationChecker(object):
     def __exit__(self, exc_type, exc_val, exc_tb):
         self.close()
 
+    @property
+    def con(self):
+        """ connection of current thread """
+        if self._shared:
+            return self._shared
+        con = getattr(self._local, "con", None)
+        if con is None or con.closed:
+            # first use in thread or checker was closed
+            con = self._connect()
+            self._local.con = con
+        return con
+
+    def _connect(self):
+        # autocommit, transactions are explicit, see _transaction
+        con = sqlite3.connect(
+            self.dbfile, check_same_thread=False, isolation_level=None,
+            factory=_Connection
+        )
+        self.configure(con)
+        self._connections.add(con)
+        return con
+
+    def configure(self, con):
+        # WAL: readers (e.g. MessageIndex in the same file) are not blocked
+        # by writers and commits only append to the log; synchronous=NORMAL
+        # is durable with WAL except for the last transactions on power loss
+        con.execute("PRAGMA busy_timeout=10000")
+        con.execute("PRAGMA journal_mode=WAL")
+        con.execute("PRAGMA synchronous=NORMAL")
+        con.execute("PRAGMA temp_store=MEMORY")
+        # in KiB
+        con.execute("PRAGMA cache_size=-8192")
+        # connection local, see _hash_filter
+        con.execute(
+            '''
+            CREATE TEMP TABLE IF NOT EXISTS hash_filter (
+                hash BLOB PRIMARY KEY NOT NULL
+            )
+            '''
+        )
+
+    @contextmanager
+    def _transaction(self, mode="DEFERRED"):
+        """
+        Transaction scope, nested scopes join the outer transaction
+
+        Keyword Arguments:
+            mode {str} -- DEFERRED (read) or IMMEDIATE (write) (default: {"DEFERRED"})
+        """  # noqa: E501
+        locked = self._shared is not None or mode != "DEFERRED"
+        if locked:
+            self.lock.acquire()
+        try:
+            con = self.con
+            cursor = con.cursor()
+            if con.in_transaction:
+                yield cursor
+                return
+            # snapshot is taken after, so older cached values are detected
+            self._local.generation = self._generation
+            self._local.dirty = set()
+            cursor.execute("BEGIN %s" % mode)
+            try:
+                yield cursor
+            except BaseException:
+                con.rollback()
+                raise
+            finally:
+                if con.in_transaction:
+                    con.commit()
+                if self._local.dirty:
+                    self._invalidate_domains(self._local.dirty)
+        finally:
+            if locked:
+                self.lock.release()
+
+    def _invalidate_domains(self, domains):
+        with self._cache_lock:
+            self._generation += 1
+            for domain in domains:
+                self._domain_cache.pop(domain, None)
+
+    def _lookup_domain(self, domain):
+        with self._cache_lock:
+            entry = self._domain_cache.get(domain)
+            if entry:
+                self._domain_cache.move_to_end(domain)
+            return entry
+
+    def _cached_domain(self, cursor, domain, cached=True):
+        """
+        Read-through cache of domains, only stores values if no write
+        happened since the transaction started
+
+        Returns:
+            (DomainInfo, frozenset) -- domain info and key hashes, None if unknown
+        """  # noqa: E501
+        if cached:
+            entry = self._lookup_domain(domain)
+            if entry:
+                return entry
+        domain_row = cursor.execute("""
+            SElECT id, attestation, hash_algo FROM domain WHERE url=?
+        """, (domain,)).fetchone()
+        if not domain_row:
+            return None
+        entry = (
+            DomainInfo(*domain_row),
+            frozenset(map(lambda x: x[0], cursor.execute("""
+                SELECT hash FROM key WHERE domain=?
+            """, (domain_row[0],))))
+        )
+        with self._cache_lock:
+            if self._local.generation == self._generation:
+                self._domain_cache[domain] = entry
+                self._domain_cache.move_to_end(domain)
+                while len(self._domain_cache) > self.domain_cache_size:
+                    self._domain_cache.popitem(last=False)
+        return entry
+
     def create(self):
-        cur = self.con.cursor()
+        with self._transaction("IMMEDIATE") as cur:
+            self._create(cur)
+
+    def _create(self, cur):
         cur.execute(
             '''
             CREATE TABLE IF NOT EXISTS domain (
@@ -123,10 +293,26 @@ class AttestationChecker(object):
             )
             '''
         )
-        self.con.commit()
+        cur.execute(
+            '''
+            CREATE TABLE IF NOT EXISTS signature (
+                key_hash BLOB NOT NULL,
+                attestation BLOB NOT NULL,
+                signature_hash BLOB NOT NULL,
+                PRIMARY KEY(key_hash, attestation, signature_hash)
+            )
+            '''
+        )
 
     def close(self):
-        self.con.close()
+        """
+        Close the connections of all threads
+
+        File databases are reopened on next use, in-memory databases
+        are lost and the checker cannot be used anymore
+        """
+        for con in list(self._connections):
+            con.close()
 
     @classmethod
     def calc_attestation(cls, key_list, algo, embed=False):
@@ -152,7 +338,8 @@ class AttestationChecker(object):
 
     @classmethod
     def check_signatures(
-        cls, key_list, algo=None, attestation=None, embed=False
+        cls, key_list, algo=None, attestation=None, embed=False,
+        signature_cache=None
     ):
         """
         Check signatures against (calculated) attestation
@@ -165,6 +352,7 @@ class AttestationChecker(object):
             algo {Hash} -- cryptography algorithm for hashing (default: {None})
             attestation {bytes,str} -- provide attestation instead of generating it again (default: {None})
             embed {bool} -- assert correct triples format, disables checks (default: {False})
+            signature_cache {AttestationChecker} -- skip verification of already verified signatures (default: {None})
 
         Raises:
             ValueError: Wrong input
@@ -189,36 +377,100 @@ class AttestationChecker(object):
         elif not attestation:
             raise ValueError("Provide either attestation or hash algo")
         errored = []
+        verified = []
         for entry in key_list:
             key = entry[1]
+            cache_key = None
             try:
-                hashalgo, signature = entry[2].split("=", 1)
-                hashalgo = getattr(hashes, hashalgo.upper())()
-                key.verify(
-                    base64.b64decode(signature),
-                    attestation,
-                    padding.PSS(
-                        mgf=padding.MGF1(hashalgo),
-                        salt_length=padding.PSS.MAX_LENGTH
-                    ),
-                    hashalgo
-                )
+                if signature_cache:
+                    cache_key = _signature_cache_key(entry, attestation)
+                    if signature_cache.is_signature_verified(cache_key):
+                        continue
+                verify_signature(key, entry[2], attestation, algo)
             except (InvalidSignature, ValueError):
                 errored.append(entry)
                 continue
+            if cache_key:
+                verified.append(cache_key)
+        if verified:
+            signature_cache.add_verified_signatures(verified)
         return (attestation, errored, key_list)
 
+    def is_signature_verified(self, cache_key):
+        if cache_key in self._verified_signatures:
+            return True
+        with self._transaction() as cursor:
+            row = cursor.execute("""
+                SELECT 1 FROM signature
+                WHERE key_hash=? AND attestation=? AND signature_hash=?
+            """, cache_key).fetchone()
+        if row:
+            self._remember_signatures((cache_key,))
+            return True
+        return False
+
+    def _remember_signatures(self, cache_keys):
+        with self._cache_lock:
+            if len(self._verified_signatures) >= self.signature_cache_size:
+                self._verified_signatures.clear()
+            self._verified_signatures.update(cache_keys)
+
+    def add_verified_signatures(self, cache_keys):
+        """
+        Remember verified signatures
+
+        Arguments:
+            cache_keys {Iterable} -- (key fingerprint, attestation, signature digest)
+        """  # noqa: E501
+        cache_keys = list(cache_keys)
+        with self._transaction("IMMEDIATE") as cursor:
+            cursor.executemany("""
+                INSERT OR IGNORE INTO signature
+                (key_hash, attestation, signature_hash)
+                VALUES(?, ?, ?)
+            """, cache_keys)
+        self._remember_signatures(cache_keys)
+
+    def purge_signatures(self, domain=None, *, attestation=None):
+        """
+        Forget verified signatures
+
+        Keyword Arguments:
+            domain {str} -- purge signatures of current domain attestation, None: all (default: {None})
+            attestation {bytes} -- purge signatures of attestation (default: {None})
+        """  # noqa: E501
+        if domain:
+            attestation = self.get_domain_info(domain).attestation
+            if not attestation:
+                return
+        with self._transaction("IMMEDIATE") as cursor:
+            self._purge_signatures(cursor, attestation)
+
+    def _purge_signatures(self, cursor, attestation):
+        if attestation:
+            cursor.execute("""
+                DELETE FROM signature WHERE attestation=?
+            """, (attestation,))
+            with self._cache_lock:
+                self._verified_signatures = set(filter(
+                    lambda x: x[1] != attestation, self._verified_signatures
+                ))
+        else:
+            cursor.execute("DELETE FROM signature")
+            with self._cache_lock:
+                self._verified_signatures.clear()
+
     def get_domain_info(self, domain):
-        domain_row = self.con.execute("""
-            SElECT id, attestation, hash_algo FROM domain WHERE url=?
-        """, (domain,)).fetchone()
-        if domain_row:
-            return DomainInfo(*domain_row)
+        entry = self._lookup_domain(domain)
+        if not entry:
+            with self._transaction() as cursor:
+                entry = self._cached_domain(cursor, domain, cached=False)
+        if entry:
+            return entry[0]
         return DomainInfo(None, None, None)
 
     def add(
-        self, domain, key_list, algo, *, attestation=None, _cur=None,
-        embed=False
+        self, domain, key_list, algo, *, attestation=None, embed=False
     ):
         """
             attestation: provide attestation instead of generating it again
@@ -230,52 +482,102 @@ class AttestationChecker(object):
                 pairs (key, signature): calc hash
                 triples (hash, key, signature): use hash
         """
-        # _cur is used if embedding in check
         if not embed:
             key_list = [
-                _extract_hash_key(x, algo, not _cur) for x in key_list
+                _extract_hash_key(x, algo, True) for x in key_list
             ]
+        with self._transaction("IMMEDIATE") as cursor:
+            self._add(cursor, domain, key_list, algo, attestation)
+        return key_list
+
+    def add_many(self, domains, algo, *, embed=False):
+        """
+        Add domains in one transaction
+
+        Arguments:
+            domains {dict,Iterable} -- domain: key_list or (domain, key_list[, attestation])
+            algo {Hash} -- hash algorithm
+
+        Keyword Arguments:
+            embed {bool} -- assert correct triples format, disables checks (default: {False})
+
+        Returns:
+            dict -- domain: key_list
+        """  # noqa: E501
+        if isinstance(domains, dict):
+            domains = domains.items()
+        # extract outside of the transaction, loads keys
+        prepared = []
+        for item in domains:
+            key_list = item[1]
+            if not embed:
+                key_list = [
+                    _extract_hash_key(x, algo, True) for x in key_list
+                ]
+            prepared.append(
+                (item[0], key_list, item[2] if len(item) >= 3 else None)
+            )
+        ret = {}
+        with self._transaction("IMMEDIATE") as cursor:
+            for domain, key_list, attestation in prepared:
+                self._add(cursor, domain, key_list, algo, attestation)
+                ret[domain] = key_list
+        return ret
+
+    def _add(self, cursor, domain, key_list, algo, attestation):
         assert \
-            not embed or \
             len(key_list) == 0 or \
             isinstance(key_list[0], KeyTriple)
         if isinstance(attestation, str):
             attestation = base64.b64decode(attestation)
         elif not attestation and algo:
             attestation = self.calc_attestation(key_list, algo, embed=True)
-        if _cur:
-            cursor = _cur
+        self._local.dirty.add(domain)
+        domain_row = cursor.execute("""
+            SElECT id, attestation FROM domain WHERE url=?
+        """, (domain,)).fetchone()
+        if domain_row:
+            domainid, old_attestation = domain_row
         else:
-            cursor = self.con.cursor()
+            cursor.execute("""
+                INSERT INTO domain (url) VALUES(?)
+            """, (domain,))
+            domainid, old_attestation = cursor.lastrowid, None
+        if attestation is not None and old_attestation and \
+           old_attestation != attestation:
+            # attestation changed, signatures are outdated
+            self._purge_signatures(cursor, old_attestation)
+        # update in place, the id is referenced by keys
         if attestation is None:
             cursor.execute("""
-                INSERT OR IGNORE INTO domain (url) VALUES(?)
-            """, (domain, ))
+                UPDATE domain SET hash_algo=? WHERE id=?
+            """, (algo.name.upper(), domainid))
         else:
-            if not attestation:
-                attestation = None
             cursor.execute("""
-                INSERT OR REPLACE INTO domain
-                (url, attestation)
-                VALUES(?, ?)
-            """, (domain, attestation))
-
-        cursor.execute("""
-            INSERT OR REPLACE INTO domain
-            (url, hash_algo)
-            VALUES(?, ?)
-        """, (domain, algo.name.upper()))
-
-        domainid = self.con.execute("""
-            SElECT id, attestation FROM domain WHERE url=?
-        """, (domain,)).fetchone()[0]
+                UPDATE domain SET attestation=?, hash_algo=? WHERE id=?
+            """, (attestation or None, algo.name.upper(), domainid))
 
         cursor.executemany("""
             INSERT OR IGNORE INTO key (domain, hash)
             VALUES(?, ?);
         """, zip(repeat(domainid), map(lambda x: x[0], key_list)))
-        self.con.commit()
-        return key_list
+
+    def _hash_filter(self, cursor, key_hashes):
+        """
+        Returns:
+            (expression, params) -- "IN (...)" expression matching hashes
+        """
+        key_hashes = list(key_hashes)
+        if len(key_hashes) <= self.max_inline_hashes:
+            return (
+                "IN ({})".format(", ".join(repeat("?", len(key_hashes)))),
+                key_hashes
+            )
+        cursor.execute("DELETE FROM temp.hash_filter")
+        cursor.executemany("""
+            INSERT OR IGNORE INTO temp.hash_filter (hash) VALUES(?)
+        """, zip(key_hashes))
+        return "IN (SELECT hash FROM temp.hash_filter)", []
 
     def check(
         self, domain, key_list, algo=None, *, attestation=None, auto_add=True,
@@ -288,6 +590,81 @@ class AttestationChecker(object):
                 triples (hash, key, signature): check signature, recalc
             embed: assert correct triples format, disables checks
         """
+        result, key_list, attestation = self._prepare_check(
+            key_list, algo, attestation, auto_add, embed
+        )
+        if result:
+            return result
+        with self._transaction() as cursor:
+            result, dirty = self._check(
+                cursor, domain, key_list, algo, attestation, auto_add
+            )
+        if dirty:
+            # check again with write lock
+            with self._transaction("IMMEDIATE") as cursor:
+                result = self._check(
+                    cursor, domain, key_list, algo, attestation, auto_add,
+                    write=True
+                )[0]
+        return result
+
+    def check_many(
+        self, domains, algo=None, *, auto_add=True, embed=False
+    ):
+        """
+        Check domains, database access happens in one transaction
+
+        Arguments:
+            domains {dict,Iterable} -- domain: key_list or (domain, key_list[, attestation])
+
+        Keyword Arguments:
+            algo {Hash} -- hash algorithm (default: {None})
+            auto_add {bool} -- see check (default: {True})
+            embed {bool} -- see check (default: {False})
+
+        Returns:
+            dict -- domain: result of check
+        """  # noqa: E501
+        if isinstance(domains, dict):
+            domains = domains.items()
+        ret = {}
+        pending = []
+        # signatures are checked outside of the transaction
+        for item in domains:
+            result, key_list, attestation = self._prepare_check(
+                item[1], algo, item[2] if len(item) >= 3 else None,
+                auto_add, embed
+            )
+            if result:
+                ret[item[0]] = result
+            else:
+                pending.append((item[0], key_list, attestation))
+        dirty = []
+        if pending:
+            with self._transaction() as cursor:
+                for domain, key_list, attestation in pending:
+                    ret[domain], needs_write = self._check(
+                        cursor, domain, key_list, algo, attestation,
+                        auto_add
+                    )
+                    if needs_write:
+                        dirty.append((domain, key_list, attestation))
+        if dirty:
+            with self._transaction("IMMEDIATE") as cursor:
+                for domain, key_list, attestation in dirty:
+                    ret[domain] = self._check(
+                        cursor, domain, key_list, algo, attestation,
+                        auto_add, write=True
+                    )[0]
+        return ret
+
+    def _prepare_check(self, key_list, algo, attestation, auto_add, embed):
+        """
+        Extract keys and check signatures
+
+        Returns:
+            (result, key_list, attestation) -- result is None if the database must be checked
+        """  # noqa: E501
         assert algo or not auto_add
         if not embed:
             key_list = [
@@ -298,8 +675,7 @@ class AttestationChecker(object):
             len(key_list) == 0 or \
             isinstance(key_list[0], KeyTriple)
         if len(key_list) == 0:
-            AttestationResult.error, [], key_list
-        only_hashes = set(map(lambda x: x[0], key_list))
+            return (AttestationResult.error, [], key_list), key_list, None
         if isinstance(attestation, str):
             attestation = base64.b64decode(attestation)
         elif not attestation and algo:
@@ -307,48 +683,52 @@ class AttestationChecker(object):
 
         if attestation:
             result = self.check_signatures(
-                key_list, attestation=attestation, embed=True
+                key_list, attestation=attestation, embed=True,
+                signature_cache=self
             )
             if result[1]:
-                return (AttestationResult.error, result[1], key_list)
+                return (
+                    (AttestationResult.error, result[1], key_list),
+                    key_list, attestation
+                )
+        return None, key_list, attestation
 
-        domain_row = self.con.execute("""
-            SElECT id, attestation FROM domain WHERE url=?
-        """, (domain,)).fetchone()
-        if not domain_row:
+    def _check(
+        self, cursor, domain, key_list, algo, attestation, auto_add,
+        write=False
+    ):
+        """
+        Returns:
+            (result, dirty) -- dirty: auto_add requires a write (write=False)
+        """
+        only_hashes = set(map(lambda x: x[0], key_list))
+        entry = self._cached_domain(cursor, domain, cached=not write)
+        if not entry:
             return (
-                AttestationResult.domain_unknown, [], key_list
+                (AttestationResult.domain_unknown, [], key_list), False
             )
+        domain_info, key_hashes = entry
         # nothing has changed, skip
-        if attestation and domain_row[1] == attestation:
-            return (AttestationResult.success, [], key_list)
-
-        # hack lists
-        old_hashes = self.con.execute("""
-            SELECT hash FROM key WHERE domain=? AND hash IN ({})
-        """.format(("?, "*len(only_hashes)).rstrip(", ")),
-            (domain_row[0], *only_hashes)
-        )
-        old_hashes = set(map(lambda x: x[0], old_hashes.fetchall()))
+        if attestation and domain_info.attestation == attestation:
+            return (AttestationResult.success, [], key_list), False
+
+        old_hashes = only_hashes.intersection(key_hashes)
         if len(old_hashes) == 0:
-            return (AttestationResult.error, [], key_list)
+            return (AttestationResult.error, [], key_list), False
         if old_hashes == only_hashes:
-            return (AttestationResult.success, [], key_list)
+            return (AttestationResult.success, [], key_list), False
         if auto_add:
-            # hack lists
-            _cur = self.con.cursor()
-            _cur.execute("""
-                DELETE FROM key WHERE domain=? AND hash NOT IN ({})
-            """.format(("?, "*len(only_hashes)).rstrip(", ")),
-                (domain_row[0], *only_hashes)
-            )
-            if only_hashes.issubset(old_hashes):
-                self.con.commit()
-                return (AttestationResult.success, [], key_list)
-            self.add(
-                domain, only_hashes.difference(old_hashes), algo,
-                attestation=attestation, _cur=_cur, embed=True
+            if not write:
+                return (AttestationResult.partial_success, [], key_list), True
+            expression, params = self._hash_filter(cursor, only_hashes)
+            cursor.execute("""
+                DELETE FROM key WHERE domain=? AND hash NOT {}
+            """.format(expression), (domain_info.id, *params))
+            # add new keys, update attestation
+            self._add(
+                cursor, domain, [
+                    KeyTriple(x, None, None)
+                    for x in only_hashes.difference(old_hashes)
+                ], algo, attestation
             )
-        if only_hashes.issubset(old_hashes):
-            return (AttestationResult.success, [], key_list)
-        return (AttestationResult.partial_success, [], key_list)
+        return (AttestationResult.partial_success, [], key_list), False
@@ -7,23 +7,25 @@ import logging
 import os
 from urllib.parse import parse_qs, urlencode
 
-import requests
 from cryptography.hazmat.backends import default_backend
-from cryptography.hazmat.primitives import hashes, serialization
-from cryptography.hazmat.primitives.asymmetric import padding
+from cryptography.hazmat.primitives import hashes
 from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
 from rdflib import Graph
 from spkcspider.constants import spkcgraph
-from spkcspider.utils.urls import merge_get_url, replace_action
+from spkcspider.utils.urls import replace_action
 
 from spider_messaging.constants import (
      AttestationResult
 )
 from spider_messaging.exceptions import HttpError
+from spider_messaging.utils.crypto import wrap_key
 from spider_messaging.utils.graph import (
-    extract_property, get_pages, map_keys
+    GraphIndex, extract_property, get_pages, map_keys, parse_response,
+    retrieve_pages
 )
-from spider_messaging.utils.misc import EncryptedFile
+from spider_messaging.utils.keys import key_fingerprint, key_info
+from spider_messaging.utils.misc import EncryptedFile, MultipartEncoder
+from spider_messaging.utils.session import get_session
 
 logger = logging.getLogger(__name__)
 
@@ -35,27 +37,24 @@ success_states = {
 
 class EncryptedContents(object):
     keys = None
+    # parse turtle while downloading, keeping only spkc triples
+    stream_graphs = False
 
     def __init__(self, priv_keys, session=None):
         if not isinstance(priv_keys, (list, tuple)):
             priv_keys = [priv_keys]
         self.keys = []
         for k in priv_keys:
-            self.keys.append((
-                k.public_key().public_bytes(
-                    encoding=serialization.Encoding.PEM,
-                    format=serialization.PublicFormat.SubjectPublicKeyInfo
-                ).strip(),
-                k
-            ))
+            self.keys.append((key_info(k).pem, k))
 
     @classmethod
     def retrieve_missing(
-        cls, graph_or_url, filters=None, x_token=None, timeout=60, session=None
+        cls, graph_or_url, filters=None, x_token=None, timeout=60,
+        session=None, max_in_flight=None
     ):
         if not session:
-            session = requests.Session()
-        if isinstance(graph_or_url, "str"):
+            session = get_session()
+        if isinstance(graph_or_url, str):
             assert filters is None, "No filters specified and url given"
             graph = cls.retrieve_filtered_graph(
                 graph_or_url, filters,
@@ -64,23 +63,20 @@ class EncryptedContents(object):
         else:
             graph = graph_or_url
         retrieved_url, missing_pages = get_pages(graph)
-        for page in missing_pages:
-            with session.get(
-                merge_get_url(retrieved_url, page=page), headers={
-                    "X-TOKEN": x_token or ""
-                },
-                timeout=timeout
-            ) as response:
-                response.raise_for_status()
-                graph.parse(data=response.content, format="turtle")
+        retrieve_pages(
+            session, retrieved_url, missing_pages, graph, headers={
+                "X-TOKEN": x_token or ""
+            }, timeout=timeout, max_in_flight=max_in_flight,
+            stream=cls.stream_graphs
+        )
         return graph, retrieved_url
 
-    @staticmethod
+    @classmethod
     def retrieve_filtered_graph(
-        url, filters, x_token=None, timeout=60, session=None
+        cls, url, filters, x_token=None, timeout=60, session=None
     ):
         if not session:
-            session = requests.Session()
+            session = get_session()
         splitted = url.split("?", 1)
         if len(splitted) == 2:
             GET = parse_qs(splitted[1])
@@ -94,10 +90,10 @@ class EncryptedContents(object):
             url,
             headers={
                 "X-TOKEN": x_token or ""
-            }, timeout=timeout
+            }, timeout=timeout, stream=cls.stream_graphs
         ) as response:
             response.raise_for_status()
-            graph.parse(data=response.content, format="turtle")
+            parse_response(graph, response, cls.stream_graphs)
         return graph
 
     @staticmethod
@@ -120,13 +116,14 @@ class EncryptedContents(object):
             session {[type]} -- [description] (default: {None})
         """
         if not session:
-            session = requests.Session()
+            session = get_session()
         graph, url = self.retrieve_missing(
             inp, ["\x1etype=PublicKey\x1e", "\x1eencrypted\x1e"],
             x_token=x_token, timeout=timeout, session=session
         )
         public_keys = {}
-        public_keys["all"], hash_algo = map_keys(graph)
+        index = GraphIndex.from_graph(graph)
+        public_keys["all"], hash_algo = map_keys(index)
         public_keys["all"] = public_keys["all"].values()
         public_keys = {
             "thirdparty": filter(
@@ -138,13 +135,11 @@ class EncryptedContents(object):
         for k in list(public_keys.keys()):
             public_keys[k] = list(map(lambda x: x["pubkey"], public_keys[k]))
         multimap = {}
-        hash_algos = set(extract_property(graph, "hash_algorithm").values())
+        hash_algos = set(extract_property(index, "hash_algorithm").values())
         for h in hash_algos:
-            algo = getattr(hashes, h.upper())
-            for pub, k in self.keys:
-                digest = hashes.Hash(algo, backend=default_backend())
-                digest.update(pub)
-                digest = digest.finalize().hex()
+            algo = getattr(hashes, h.upper())()
+            for _, k in self.keys:
+                digest = key_fingerprint(k, algo).hex()
                 multimap[f"{algo.name}={digest}"] = k
 
         for i in graph.query(
@@ -193,7 +188,7 @@ class EncryptedContents(object):
             hash_algo {} -- (default: {None})
         """
         if not session:
-            session = requests.Session()
+            session = get_session()
         if isinstance(inp, (list, tuple)):
             # be careful to not include thirdparty keys if incompatible
             keys = set(inp)
@@ -262,24 +257,18 @@ class EncryptedContents(object):
         body[key_list_name] = {}
 
         for k in keys:
-            enc = k[1].encrypt(
-                aes_key,
-                padding.OAEP(
-                    mgf=padding.MGF1(algorithm=hash_algo),
-                    algorithm=hash_algo, label=None
-                )
-            )
             # encrypt decryption key
             body[key_list_name][
                 "%s=%s" % (hash_algo.name, k[0].hex())
-            ] = base64.b64encode(enc).decode("ascii")
+            ] = wrap_key(k[1], aes_key, hash_algo)
         body[key_list_name] = json.dumps(body[key_list_name])
-        # create message object
+        # create message object, streamed
+        body = MultipartEncoder(body, files=files)
         response = session.post(
             update_url, data=body, headers={
+                "Content-Type": body.content_type,
                 "X-CSRFToken": csrftoken,
-            },
-            files=files
+            }
         )
         try:
             response.raise_for_status()
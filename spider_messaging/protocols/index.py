@@ -0,0 +1,242 @@
+__all__ = ["MessageIndex", "extract_indexed_messages"]
+
+import hashlib
+import sqlite3
+import threading
+import time
+from functools import wraps
+
+from rdflib import XSD, Literal
+from rdflib.plugins.sparql import prepareQuery
+from spkcspider.constants import spkcgraph
+
+from spider_messaging.constants import InboxChanges, IndexedMessage
+
+
+_indexed_messages_query = prepareQuery(
+    """
+        SELECT DISTINCT ?base ?type ?idvalue ?namevalue ?sizevalue ?keylist
+        WHERE {
+            ?base a <https://spkcspider.net/static/schemes/spkcgraph#spkc:Content> ;
+               spkc:type ?type ;
+               spkc:properties ?propname , ?propid .
+            ?propid spkc:name ?idname ;
+                    spkc:value ?idvalue .
+            ?propname spkc:name ?namename ;
+                      spkc:value ?namevalue .
+            OPTIONAL {
+                ?base spkc:properties ?propsize .
+                ?propsize spkc:name ?sizename ;
+                          spkc:value ?sizevalue .
+            }
+            OPTIONAL {
+                ?base spkc:properties ?propkeylist .
+                ?propkeylist spkc:name ?keylistname ;
+                             spkc:value ?keylist .
+            }
+        }
+    """,  # noqa E501
+    initNs={"spkc": spkcgraph}
+)
+
+
+def _locked(func):
+    @wraps(func)
+    def _wrapper(self, *args, **kwargs):
+        with self.lock:
+            return func(self, *args, **kwargs)
+    return _wrapper
+
+
+def extract_indexed_messages(graph):
+    """
+    Extract WebReferences and MessageContents of a postbox graph
+
+    Arguments:
+        graph {Graph} -- complete graph
+
+    Returns:
+        dict -- url: IndexedMessage
+    """
+    ret = {}
+    for i in graph.query(
+        _indexed_messages_query,
+        initBindings={
+            "idname": Literal("id", datatype=XSD.string),
+            "namename": Literal("name", datatype=XSD.string),
+            "sizename": Literal("size", datatype=XSD.string),
+            "keylistname": Literal("key_list", datatype=XSD.string),
+        }
+    ):
+        mtype = i.type.toPython()
+        if mtype not in {"WebReference", "MessageContent"}:
+            continue
+        name = i.namevalue.toPython() if i.namevalue is not None else None
+        size = i.sizevalue.toPython() if i.sizevalue is not None else None
+        # version: changes if message entry changes
+        digest = hashlib.sha256()
+        for part in (name, size, i.keylist):
+            digest.update(b"\0%s" % str(part).encode("utf8"))
+        ret[str(i.base)] = IndexedMessage(
+            url=str(i.base),
+            id=i.idvalue.toPython(),
+            type=mtype,
+            name=str(name) if name is not None else None,
+            size=int(size) if size is not None else None,
+            version=digest.digest()
+        )
+    return ret
+
+
+class MessageIndex(object):
+    """
+    Local index of the messages of postboxes
+
+    Can live in the attestation database file.
+    """
+    con = None
+    lock = None
+
+    def __init__(self, dbfile):
+        self.lock = threading.RLock()
+        self.con = sqlite3.connect(dbfile, check_same_thread=False)
+        self.create()
+
+    def __del__(self):
+        self.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def create(self):
+        cur = self.con.cursor()
+        cur.execute(
+            '''
+            CREATE TABLE IF NOT EXISTS message_index_state (
+                postbox TEXT PRIMARY KEY NOT NULL,
+                etag TEXT,
+                last_modified TEXT,
+                synced REAL
+            )
+            '''
+        )
+        cur.execute(
+            '''
+            CREATE TABLE IF NOT EXISTS message_index (
+                postbox TEXT NOT NULL,
+                url TEXT NOT NULL,
+                message_id INTEGER NOT NULL,
+                type TEXT NOT NULL,
+                name TEXT,
+                size INTEGER,
+                version BLOB NOT NULL,
+                seen REAL NOT NULL,
+                removed REAL,
+                PRIMARY KEY(postbox, url)
+            )
+            '''
+        )
+        self.con.commit()
+
+    def close(self):
+        self.con.close()
+
+    @_locked
+    def get_state(self, postbox):
+        """
+        Returns:
+            (etag, last_modified) -- version markers of last sync
+        """
+        row = self.con.execute("""
+            SELECT etag, last_modified FROM message_index_state
+            WHERE postbox=?
+        """, (postbox,)).fetchone()
+        return row or (None, None)
+
+    @_locked
+    def not_modified(self, postbox):
+        """ server reported no changes """
+        self.con.execute("""
+            UPDATE message_index_state SET synced=? WHERE postbox=?
+        """, (time.time(), postbox))
+        self.con.commit()
+        return InboxChanges([], [], [])
+
+    @_locked
+    def update(self, postbox, messages, etag=None, last_modified=None):
+        """
+        Update index with current messages of postbox
+
+        Arguments:
+            postbox {str} -- postbox url
+            messages {dict} -- url: IndexedMessage, see extract_indexed_messages
+
+        Keyword Arguments:
+            etag {str} -- version marker (default: {None})
+            last_modified {str} -- version marker (default: {None})
+
+        Returns:
+            InboxChanges -- new, changed and removed IndexedMessages
+        """  # noqa: E501
+        now = time.time()
+        known = {
+            row[0]: IndexedMessage(*row) for row in self.con.execute("""
+                SELECT url, message_id, type, name, size, version
+                FROM message_index WHERE postbox=? AND removed IS NULL
+            """, (postbox,))
+        }
+        new = []
+        changed = []
+        for url, message in messages.items():
+            old = known.pop(url, None)
+            if not old:
+                new.append(message)
+            elif old.version != message.version:
+                changed.append(message)
+        removed = list(known.values())
+        cur = self.con.cursor()
+        cur.executemany("""
+            INSERT OR REPLACE INTO message_index
+            (postbox, url, message_id, type, name, size, version, seen)
+            VALUES(?, ?, ?, ?, ?, ?, ?, ?)
+        """, [(postbox, *m, now) for m in new + changed])
+        cur.executemany("""
+            UPDATE message_index SET removed=? WHERE postbox=? AND url=?
+        """, [(now, postbox, m.url) for m in removed])
+        cur.execute("""
+            INSERT OR REPLACE INTO message_index_state
+            (postbox, etag, last_modified, synced)
+            VALUES(?, ?, ?, ?)
+        """, (postbox, etag, last_modified, now))
+        self.con.commit()
+        return InboxChanges(new, changed, removed)
+
+    @_locked
+    def messages(self, postbox, mtype=None, include_removed=False):
+        """
+        Indexed messages of postbox
+
+        Keyword Arguments:
+            mtype {str} -- filter by type, e.g. WebReference (default: {None})
+            include_removed {bool} -- also removed messages (default: {False})
+
+        Returns:
+            list(IndexedMessage) -- messages
+        """  # noqa: E501
+        query = """
+            SELECT url, message_id, type, name, size, version
+            FROM message_index WHERE postbox=?
+        """
+        params = [postbox]
+        if mtype:
+            query += " AND type=?"
+            params.append(mtype)
+        if not include_removed:
+            query += " AND removed IS NULL"
+        return [
+            IndexedMessage(*row)
+            for row in self.con.execute(query + " ORDER BY message_id", params)
+        ]
@@ -1,36 +1,55 @@
 __all__ = ["PostBox"]
 
 import base64
+import binascii
+import functools
 import io
 import json
 import logging
 import os
 import tempfile
-from email import parser as emailparser
-from email import policy
+import threading
 from urllib.parse import parse_qs
 
 import requests
 from cryptography.hazmat.backends import default_backend
-from cryptography.hazmat.primitives import hashes, serialization
-from cryptography.hazmat.primitives.asymmetric import padding
+from cryptography.hazmat.primitives import hashes
 from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
 from rdflib import XSD, Graph, Literal, URIRef
+from rdflib.plugins.sparql import prepareQuery
 from spkcspider.constants import spkcgraph
 from spkcspider.utils.urls import merge_get_url, replace_action
 
 from spider_messaging.constants import (
-    AccessMethod, AttestationResult, MessageType, SendMethod
+    AccessMethod, AttestationResult, CompressionMethod, DestinationInfo,
+    SendMethod
 )
 from spider_messaging.exceptions import (
     CheckError, DestException, DestSecurityException, NotReady, SrcException,
     ValidationError, WrongRecipient
 )
 from spider_messaging.protocols.attestation import AttestationChecker
+from spider_messaging.protocols.index import (
+    MessageIndex, extract_indexed_messages
+)
+from spider_messaging.utils.cache import DestinationCache
+from spider_messaging.utils.compression import (
+    compression_header, is_compressible
+)
+from spider_messaging.utils.concurrency import fan_out, host_key
 from spider_messaging.utils.graph import (
-    extract_property, get_pages, get_postboxes
+    GraphIndex, extract_property, get_pages, get_postboxes, parse_response,
+    retrieve_pages
 )
-from spider_messaging.utils.misc import EncryptedFile
+from spider_messaging.utils.crypto import sign_data, unwrap_key, wrap_key
+from spider_messaging.utils.epochs import EpochKeyCache, is_epoch_key
+from spider_messaging.utils.html import HtmlProperties
+from spider_messaging.utils.keys import key_fingerprint, key_info
+from spider_messaging.utils.misc import (
+    CompressedFile, EncryptedFile, MessageDecryptor, MultipartEncoder,
+    SegmentedEncryptedFile
+)
+from spider_messaging.utils.session import create_session, get_session
 
 logger = logging.getLogger(__name__)
 
@@ -39,6 +58,64 @@ success_states = {
     AttestationResult.partial_success
 }
 
+# prepared at import like the queries in utils.graph
+_fetch_url_query = prepareQuery(
+    """
+        SELECT ?name ?value
+        WHERE {
+            VALUES ?name {
+                "fetch_url"^^xsd:string "tokens"^^xsd:string
+            }
+            ?property spkc:name ?name ;
+                      spkc:value ?value .
+        }
+    """,
+    initNs={"spkc": spkcgraph, "xsd": XSD}
+)
+
+_fields_query = prepareQuery(
+    """
+        SELECT DISTINCT ?fieldname ?value
+        WHERE {
+            ?base spkc:fieldname ?fieldname ;
+                  spkc:value ?value .
+        }
+    """,
+    initNs={"spkc": spkcgraph}
+)
+
+_message_query = prepareQuery(
+    """
+        SELECT DISTINCT ?base ?idvalue ?hash_algorithm ?type
+        WHERE {
+            ?base a <https://spkcspider.net/static/schemes/spkcgraph#spkc:Content> ;
+                          spkc:type ?type ;
+                          spkc:properties ?propalg , ?propid .
+            ?propid spkc:name ?idname ;
+                    spkc:value ?idvalue .
+            ?propalg spkc:name ?algname ;
+                     spkc:value ?hash_algorithm .
+        }
+    """,  # noqa E501
+    initNs={"spkc": spkcgraph}
+)
+
+_messages_query = prepareQuery(
+    """
+        SELECT DISTINCT ?base ?idvalue ?namevalue ?type
+        WHERE {
+            ?base a <https://spkcspider.net/static/schemes/spkcgraph#spkc:Content> ;
+               spkc:type ?type ;
+               spkc:properties ?propname , ?propid .
+            ?propid spkc:name ?idname ;
+                    spkc:value ?idvalue .
+            ?propname spkc:name ?namename ;
+                      spkc:value ?namevalue .
+        }
+    """,  # noqa E501
+    initNs={"spkc": spkcgraph}
+)
+
 
 class PostBox(object):
     attestation_checker = None
@@ -53,10 +130,51 @@ class PostBox(object):
     use_get_token = None
     client_list = None
     state = None
+    # limit parallel page retrievals, None: automatic, 1: serial
+    max_pages_in_flight = None
+    # parse turtle while downloading, keeping only spkc triples
+    stream_graphs = False
+    # try json descriptor of postboxes first, fallback to turtle
+    use_descriptor = True
+    # name of a get_session session shared with other PostBoxes (shares
+    # connections, cookies and csrftokens), None: own session
+    shared_session = None
+    # checked destinations, None: disabled
+    dest_cache = None
+    # chunk size for receiving messages
+    chunk_size = 2 ** 16
+    # MessageCache for received messages, None: disabled
+    message_cache = None
+    # url: (csrftoken, cookie state), None: disabled
+    csrf_cache = None
+    # EpochKeys: wrap content keys under epoch keys (receivers must
+    # support it), None: encrypt content keys for every key
+    epoch_keys = None
+    # decrypted epoch keys of received messages, None: disabled
+    epoch_key_cache = None
+    # send segmented contents with segments of segment_size (receivers
+    # must support it), None: single stream format
+    segment_size = None
+    # threads encrypting/decrypting segments of segmented contents
+    crypt_workers = 1
+    # compress contents before encryption with CompressionMethod
+    # (receivers must support it), None: disabled
+    compression = None
+    # None: default level of compression method
+    compression_level = None
+    # smaller contents are not compressed
+    compression_min_size = 2 ** 10
+    # resumes of interrupted message downloads (Range requests)
+    resume_attempts = 3
+    # parallel range downloads of messages larger than range_size,
+    # 1: single request
+    range_workers = 1
+    # size of ranges of parallel downloads
+    range_size = 2 ** 24
 
     def __init__(
         self, attestation_checker, priv_key, url=None, token=None, graph=None,
-        session=None
+        session=None, dest_cache=None
     ):
         """
         [summary]
@@ -69,17 +187,28 @@ class PostBox(object):
             url {[type]} -- [description] (default: {None})
             token {[type]} -- [description] (default: {None})
             graph {[type]} -- empty graph: extract graph, specified graph: try to complete, None: create temp graph (default: {None})
-            session {[type]} -- [description] (default: {None})
+            session {[type]} -- session, False/None: own session, see shared_session (default: {None})
+            dest_cache {DestinationCache} -- cache for destinations, False: disable (default: {None})
         """  # noqa: E501
+        token, use_get_token = self._setup(
+            attestation_checker, priv_key, url, token, dest_cache
+        )
+        self.update(token, graph, session, use_get_token)
+
+    def _setup(
+        self, attestation_checker, priv_key, url, token, dest_cache=None
+    ):
+        self.csrf_cache = {}
+        self.epoch_key_cache = EpochKeyCache()
+        if dest_cache is None:
+            dest_cache = DestinationCache()
+        self.dest_cache = dest_cache if dest_cache is not False else None
         if isinstance(attestation_checker, AttestationChecker):
             self.attestation_checker = attestation_checker
         else:
             self.attestation_checker = AttestationChecker(attestation_checker)
         self.priv_key = priv_key
-        self.pem_key_public = self.priv_key.public_key().public_bytes(
-            encoding=serialization.Encoding.PEM,
-            format=serialization.PublicFormat.SubjectPublicKeyInfo
-        ).strip()
+        self.pem_key_public = key_info(self.priv_key).pem
         splitted = url.split("?", 1) if url else (None,)
         use_get_token = None
         if len(splitted) == 2:
@@ -91,7 +220,7 @@ class PostBox(object):
                     use_get_token = True
         else:
             self.url = splitted[0]
-        self.update(token, graph, session, use_get_token)
+        return token, use_get_token
 
     def update(
         self, token=None, graph=None, session=None, use_get_token=None
@@ -99,17 +228,12 @@ class PostBox(object):
         if session:
             self.session = session
         elif session is False or not self.session:
-            self.session = requests.Session()
-        if token:
-            self.token = token
-        elif use_get_token is not None:
-            # keep setting if token does not change
-            # first run: use_get_token is None so autodetect still starts
-            use_get_token = self.use_get_token
-        if use_get_token is not None:
-            self.use_get_token = use_get_token
-        else:
-            self.use_get_token = False
+            # cookies and csrftoken belong to this postbox
+            if self.shared_session and session is not False:
+                self.session = get_session(self.shared_session, cookies=True)
+            else:
+                self.session = create_session()
+        use_get_token = self._update_token(token, use_get_token)
         # empty graph or None
         if not graph:
             assert self.url
@@ -126,6 +250,22 @@ class PostBox(object):
             retrieved_url = self.retrieve_missing(graph, self.url)
         else:
             retrieved_url = self.retrieve_missing(graph)
+        self._update_from_graph(graph, retrieved_url)
+
+    def _update_token(self, token, use_get_token):
+        if token:
+            self.token = token
+        elif use_get_token is not None:
+            # keep setting if token does not change
+            # first run: use_get_token is None so autodetect still starts
+            use_get_token = self.use_get_token
+        if use_get_token is not None:
+            self.use_get_token = use_get_token
+        else:
+            self.use_get_token = False
+        return use_get_token
+
+    def _update_from_graph(self, graph, retrieved_url):
         if not self.token:
             # auto retrieve token from url
             splitted = retrieved_url.split("?", 1)
@@ -154,16 +294,15 @@ class PostBox(object):
 
         self.hash_algo = options["hash_algorithm"]
 
-        digest = hashes.Hash(self.hash_algo, backend=default_backend())
-        digest.update(self.pem_key_public)
-        self.hash_key_public = digest.finalize()
+        self.hash_key_public = key_fingerprint(self.priv_key, self.hash_algo)
         atth, errored, self.client_list = \
             self.attestation_checker.check_signatures(
                 map(
                     lambda x: (x["key"], x["signature"]),
                     options["signatures"].values()
                 ),
-                algo=self.hash_algo
+                algo=self.hash_algo,
+                signature_cache=self.attestation_checker
             )
         errored = set(map(lambda x: x[0], errored))
         own_key_found = list(filter(
@@ -192,7 +331,7 @@ class PostBox(object):
             {"X-TOKEN": self.token or ""}
         )
 
-    def retrieve_missing(self, graph, url=None, timeout=60):
+    def _missing_pages(self, graph, url=None):
         retrieved_url, missing_pages = get_pages(graph)
         if not url:
             url = retrieved_url
@@ -203,55 +342,233 @@ class PostBox(object):
         else:
             merged_url = url
             headers = {}
-        for page in missing_pages:
-            with self.session.get(
-                merge_get_url(merged_url, page=page), headers=headers,
-                timeout=timeout
-            ) as response:
-                response.raise_for_status()
-                graph.parse(data=response.content, format="turtle")
+        return retrieved_url, merged_url, headers, missing_pages
+
+    def retrieve_missing(self, graph, url=None, timeout=60):
+        retrieved_url, merged_url, headers, missing_pages = \
+            self._missing_pages(graph, url)
+        retrieve_pages(
+            self.session, merged_url, missing_pages, graph, headers=headers,
+            timeout=timeout, max_in_flight=self.max_pages_in_flight,
+            stream=self.stream_graphs
+        )
         return retrieved_url
 
-    def retrieve_filtered_graph(self, url=None, timeout=60, out=None):
+    def _filtered_graph_url(self, url=None):
         if not url or url == self.url:
-            merged_url, headers = self.merge_and_headers(
+            return self.merge_and_headers(
                 self.url, raw="embed", search="\x1etype=PostBox\x1e"
             )
-        else:
-            merged_url = merge_get_url(
-                url, raw="embed", search="\x1etype=PostBox\x1e"
-            )
-            headers = {}
-        response = self.session.get(
-            merged_url,
-            headers=headers, timeout=timeout
-        )
-        response.raise_for_status()
+        return merge_get_url(
+            url, raw="embed", search="\x1etype=PostBox\x1e"
+        ), {}
+
+    def retrieve_filtered_graph(self, url=None, timeout=60, out=None):
+        merged_url, headers = self._filtered_graph_url(url)
         if out is None:
             graph = Graph()
         else:
             graph = out
-        graph.parse(data=response.content, format="turtle")
-        return graph
+        with self.session.get(
+            merged_url,
+            headers=headers, timeout=timeout, stream=self.stream_graphs
+        ) as response:
+            response.raise_for_status()
+            return parse_response(graph, response, self.stream_graphs)
 
     def _send_dest(self, aes_key, fetch_url, dest):
+        info, dest_url, fresh = self._dest_lookup(dest)
+        if not fresh and self.use_descriptor:
+            descriptor_info = self._dest_descriptor(dest, info)
+            if descriptor_info:
+                info, fresh = descriptor_info, True
+        if not fresh:
+            with self.session.get(
+                dest_url, headers=self._dest_headers(info, "graph"),
+                timeout=60, stream=self.stream_graphs
+            ) as response_dest:
+                if info and response_dest.status_code == 304:
+                    self.dest_cache.touch(dest)
+                else:
+                    try:
+                        response_dest.raise_for_status()
+                        g_dest = parse_response(
+                            Graph(), response_dest, self.stream_graphs
+                        )
+                    except Exception as exc:
+                        raise DestException(
+                            "postbox retrieval failed"
+                        ) from exc
+            if not info or response_dest.status_code != 304:
+                try:
+                    self.retrieve_missing(g_dest, dest_url)
+                except Exception as exc:
+                    raise DestException("postbox retrieval failed") from exc
+                info = self._dest_info(dest, g_dest, response_dest.headers)
+
+        try:
+            response_dest = self.session.post(
+                info.webref_url, data={
+                    "url": fetch_url,
+                    "key_list": json.dumps(
+                        self._dest_key_list(aes_key, info)
+                    )
+                }, timeout=60
+            )
+            response_dest.raise_for_status()
+        except Exception as exc:
+            # keys could have changed
+            self._dest_invalidate(dest)
+            raise DestException("post webref failed") from exc
+
+    def _dest_lookup(self, dest):
+        """
+        Lookup destination in dest_cache
+
+        Returns:
+            (info, dest_url, fresh) -- info is None if not cached
+        """
+        info, fresh = None, False
+        if self.dest_cache is not None:
+            info, fresh = self.dest_cache.get(dest)
+        if fresh:
+            return info, None, True
         dest_url = merge_get_url(
             dest, raw="embed", search="\x1etype=PostBox\x1e"
         )
-        response_dest = self.session.get(dest_url, timeout=60)
+        return info, dest_url, False
+
+    @staticmethod
+    def _dest_headers(info, source):
+        """
+        Revalidation headers, etag and last modified are only valid for
+        the source (descriptor or graph) info was retrieved from
+
+        Returns:
+            dict -- headers
+        """
+        headers = {}
+        if info and info.source == source:
+            if info.etag:
+                headers["If-None-Match"] = info.etag
+            if info.last_modified:
+                headers["If-Modified-Since"] = info.last_modified
+        return headers
+
+    def _dest_descriptor(self, dest, info):
+        """
+        Check destination with the json descriptor of the postbox
+
+        Arguments:
+            dest {str} -- destination url
+            info {DestinationInfo} -- cached info or None
+
+        Returns:
+            DestinationInfo -- None if no descriptor is available
+        """
         try:
-            response_dest.raise_for_status()
-            g_dest = Graph()
-            g_dest.parse(data=response_dest.content, format="turtle")
-            self.retrieve_missing(g_dest, dest_url)
-        except Exception as exc:
-            raise DestException("postbox retrieval failed") from exc
+            with self.session.get(
+                replace_action(dest, "descriptor/"),
+                headers=self._dest_headers(info, "descriptor"), timeout=60
+            ) as response:
+                if info and response.status_code == 304:
+                    self.dest_cache.touch(dest)
+                    return info
+                response.raise_for_status()
+                postbox_url, options = self.parse_descriptor(
+                    response.content
+                )
+        except (requests.RequestException, ValueError) as exc:
+            logger.debug("no descriptor for %s, use turtle: %s", dest, exc)
+            return None
+        return self._dest_check(
+            dest, postbox_url, options, response.headers, "descriptor"
+        )
+
+    @staticmethod
+    def parse_descriptor(data):
+        """
+        Parse json descriptor of a postbox
+
+        Arguments:
+            data {bytes,str,dict} -- descriptor
+
+        Raises:
+            ValueError: invalid descriptor
+
+        Returns:
+            (str, dict) -- postbox url, options like get_postboxes
+        """
+        if not isinstance(data, dict):
+            data = json.loads(data)
+        try:
+            if data.get("type") != "PostBox":
+                raise ValueError("not a PostBox")
+            options = {
+                "hash_algorithm": getattr(
+                    hashes, data["hash_algorithm"].upper()
+                )(),
+                "attestation": base64.b64decode(data["attestation"]),
+                "signatures": {
+                    str(key_url): {
+                        "key": entry["key"],
+                        "hash": entry.get("hash"),
+                        "signature": entry.get("signature") or ""
+                    } for key_url, entry in data["signatures"].items()
+                }
+            }
+            return str(data["url"]), options
+        except (
+            AttributeError, KeyError, TypeError, binascii.Error
+        ) as exc:
+            raise ValueError("invalid descriptor") from exc
+
+    def _dest_invalidate(self, dest):
+        if self.dest_cache is not None:
+            self.dest_cache.invalidate(dest)
 
+    def _dest_info(self, dest, g_dest, response_headers=None):
+        """
+        Check destination postbox and cache result
+
+        Arguments:
+            dest {str} -- destination url
+            g_dest {Graph} -- graph of destination
+
+        Keyword Arguments:
+            response_headers {Mapping} -- for etag/last modified (default: {None})
+
+        Returns:
+            DestinationInfo -- checked destination
+        """  # noqa: E501
         dest_postboxes = get_postboxes(g_dest)
         if len(dest_postboxes) != 1:
+            self._dest_invalidate(dest)
             raise DestException("No postbox found/more than one found")
         dest_postbox_url, dest_options = next(iter(dest_postboxes.items()))
-        webref_url = replace_action(dest_postbox_url, "push_webref/")
+        return self._dest_check(
+            dest, dest_postbox_url, dest_options, response_headers, "graph"
+        )
+
+    def _dest_check(
+        self, dest, dest_postbox_url, dest_options, response_headers=None,
+        source="graph"
+    ):
+        """
+        Check destination postbox options and cache result
+
+        Arguments:
+            dest {str} -- destination url
+            dest_postbox_url {str} -- url of postbox
+            dest_options {dict} -- postbox options like get_postboxes
+
+        Keyword Arguments:
+            response_headers {Mapping} -- for etag/last modified (default: {None})
+            source {str} -- response_headers are of: descriptor, graph (default: {"graph"})
+
+        Returns:
+            DestinationInfo -- checked destination
+        """  # noqa: E501
         attestation = dest_options["attestation"]
 
         bdomain = dest_postbox_url.split("?", 1)[0]
@@ -265,51 +582,178 @@ class PostBox(object):
         )
         if result_dest == AttestationResult.domain_unknown:
             logger.info("add domain: %s", bdomain)
-            self.attestation_checker.attestation.add(
+            self.attestation_checker.add(
                 bdomain,
                 dest_keys,
                 algo=dest_options["hash_algorithm"], embed=True
             )
         elif result_dest == AttestationResult.error:
+            self._dest_invalidate(dest)
             if len(dest_keys) == 0:
                 raise DestException("No keys found")
             raise DestSecurityException("dest contains invalid keys", errors)
+        response_headers = response_headers or {}
+        info = DestinationInfo(
+            url=dest_postbox_url,
+            webref_url=replace_action(dest_postbox_url, "push_webref/"),
+            hash_algo=dest_options["hash_algorithm"],
+            attestation=attestation,
+            signatures=dest_options["signatures"],
+            key_list=tuple(dest_keys),
+            etag=response_headers.get("ETag"),
+            last_modified=response_headers.get("Last-Modified"),
+            source=source
+        )
+        if self.dest_cache is not None:
+            self.dest_cache.set(dest, info)
+        return info
 
-        dest_key_list = {}
+    def _dest_key_list(self, aes_key, info):
+        """
+        Encrypt aes_key for the keys of a checked destination
 
-        for k in dest_keys:
-            enc = k[1].encrypt(
-                aes_key,
-                padding.OAEP(
-                    mgf=padding.MGF1(algorithm=dest_options["hash_algorithm"]),
-                    algorithm=dest_options["hash_algorithm"], label=None
-                )
-            )
-            # encrypt decryption key
-            dest_key_list[
-                "%s=%s" % (dest_options["hash_algorithm"].name, k[0].hex())
-            ] = base64.b64encode(enc).decode("ascii")
+        Returns:
+            dict -- encrypted keys
+        """
+        return self._wrap_key(aes_key, info.key_list, info.hash_algo)
 
-        try:
-            response_dest = self.session.post(
-                webref_url, data={
-                    "url": fetch_url,
-                    "key_list": json.dumps(dest_key_list)
-                }, timeout=60
-            )
-            response_dest.raise_for_status()
-        except Exception as exc:
-            raise DestException("post webref failed") from exc
+    def _wrap_key(self, aes_key, keys, hash_algo):
+        """
+        Encrypt aes_key for keys, under the epoch key if epoch_keys is set
+
+        Arguments:
+            aes_key {bytes} -- content key
+            keys {Iterable((hash, public key, ...))} -- keys, hash is a digest of hash_algo
+            hash_algo {HashAlgorithm} -- hash algorithm
+
+        Returns:
+            dict -- key list
+        """  # noqa: E501
+        if self.epoch_keys is not None:
+            return self.epoch_keys.key_list(aes_key, keys, hash_algo)
+        # encrypt decryption key
+        return {
+            "%s=%s" % (hash_algo.name, k[0].hex()):
+                wrap_key(k[1], aes_key, hash_algo)
+            for k in keys
+        }
+
+    def _send_dests(
+        self, aes_key, receivers_furls, max_workers=1, max_per_host=None
+    ):
+        """
+        Push webreferences to destinations, in parallel if max_workers > 1
+
+        Arguments:
+            aes_key {bytes} -- content key
+            receivers_furls {Iterable((receiver, fetch_url))} -- destinations
+
+        Keyword Arguments:
+            max_workers {int} -- global limit of parallel sends (default: {1})
+            max_per_host {int} -- limit of parallel sends per host (default: {None})
+
+        Returns:
+            list(((receiver, fetch_url), exception)) -- in input order
+        """  # noqa: E501
+        def _send(item):
+            receiver, furl = item
+            try:
+                self._send_dest(aes_key, furl, receiver)
+            except Exception:
+                # for autoremoval simulate access
+                try:
+                    self.session.get(furl, timeout=60)
+                except Exception as exc:
+                    logger.info(
+                        "could not invalidate token", exc_info=exc
+                    )
+                raise
+
+        receivers_furls = list(receivers_furls)
+        results = fan_out(
+            _send, receivers_furls,
+            max_workers=max_workers, max_per_key=max_per_host,
+            key=lambda x: host_key(x[0])
+        )
+        return [
+            (item, exc) for item, (_, exc) in zip(receivers_furls, results)
+        ]
 
     def send(
         self, inp, receivers, headers=b"\n", mode=SendMethod.shared,
-        aes_key=None
+        aes_key=None, max_workers=1, max_per_host=None
     ):
+        """
+        Encrypt and upload message, push webreferences to receivers
+
+        Arguments:
+            inp {file,bytes,str} -- message content
+            receivers {str,list} -- destination postbox urls
+
+        Keyword Arguments:
+            headers {bytes} -- headers prepended to encrypted content (default: {b"\\n"})
+            mode {SendMethod} -- which own keys can decrypt (default: {SendMethod.shared})
+            aes_key {bytes} -- use instead of random key (default: {None})
+            max_workers {int} -- parallel destinations, 1: serial (default: {1})
+            max_per_host {int} -- parallel destinations per host (default: {None})
+
+        Returns:
+            (exceptions, fetch_urls, aes_key) -- lists keep receiver order
+        """  # noqa: E501
         if not self.ok:
             raise NotReady()
         if isinstance(receivers, str):
             receivers = [receivers]
+        inp, aes_key, nonce, fencryptor, src_key_list = \
+            self._prepare_send(inp, aes_key, mode)
+
+        message_create_url, src_headers = self._message_create_url()
+        csrftoken = self._message_csrftoken(message_create_url, src_headers)
+        # create message object, streamed
+        body = MultipartEncoder(
+            self._message_create_data(src_key_list, receivers),
+            files={
+                "encrypted_content": self._encrypted_content(
+                    inp, aes_key, nonce, fencryptor, headers
+                )
+            }
+        )
+        response = self.session.post(
+            message_create_url, data=body, headers={
+                "Content-Type": body.content_type,
+                "X-CSRFToken": csrftoken,
+                **src_headers  # only for src
+            }
+        )
+        try:
+            response.raise_for_status()
+        except Exception as exc:
+            # maybe the token is stale
+            self._csrf_invalidate(message_create_url)
+            raise SrcException(
+                "Message creation failed", response.text
+            ) from exc
+        if message_create_url == response.url:
+            self._csrf_invalidate(message_create_url)
+            raise SrcException("Message creation failed", response.text)
+        furls = self._extract_fetch_urls(
+            HtmlProperties(response.content), receivers, response.text
+        )
+        return self._collect_send_results(
+            self._send_dests(
+                aes_key, zip(receivers, furls),
+                max_workers=max_workers, max_per_host=max_per_host
+            ),
+            aes_key
+        )
+
+    def _prepare_send(self, inp, aes_key, mode):
+        """
+        Prepare input, content key, cipher and own key list for send
 
+        Returns:
+            (inp, aes_key, nonce, fencryptor, src_key_list)
+        """
         if isinstance(inp, (bytes, memoryview)):
             inp = io.BytesIO(bytes(inp))
         elif isinstance(inp, str):
@@ -329,123 +773,177 @@ class PostBox(object):
         if mode == SendMethod.stealth:
             pass
         elif mode == SendMethod.private:
-            enc = self.priv_key.public_key().encrypt(
+            src_key_list = self._wrap_key(
                 aes_key,
-                padding.OAEP(
-                    mgf=padding.MGF1(algorithm=self.hash_algo),
-                    algorithm=self.hash_algo, label=None
-                )
+                [(self.hash_key_public, self.priv_key.public_key())],
+                self.hash_algo
             )
-            # encrypt decryption key
-            src_key_list[
-                "%s=%s" % (self.hash_algo.name, self.pub_key_hash)
-            ] = base64.b64encode(enc).decode("ascii")
         elif mode == SendMethod.shared:
-            for k in self.client_list:
-                enc = k[1].encrypt(
-                    aes_key,
-                    padding.OAEP(
-                        mgf=padding.MGF1(algorithm=self.hash_algo),
-                        algorithm=self.hash_algo, label=None
-                    )
-                )
-                # encrypt decryption key
-                src_key_list[
-                    "%s=%s" % (self.hash_algo.name, k[0].hex())
-                ] = base64.b64encode(enc).decode("ascii")
+            src_key_list = self._wrap_key(
+                aes_key, self.client_list, self.hash_algo
+            )
         else:
             raise NotImplementedError()
+        return inp, aes_key, nonce, fencryptor, src_key_list
+
+    def _compress_content(self, inp, headers):
+        """
+        Compress content if enabled and the content is compressible
+
+        Returns:
+            (inp, headers) -- headers announce compression
+        """
+        if not self.compression or not is_compressible(
+            inp, self.compression_min_size
+        ):
+            return inp, headers
+        headers = EncryptedFile._format_headers(headers) or b""
+        return (
+            CompressedFile(
+                inp, self.compression, level=self.compression_level
+            ),
+            b"%b\n%b: %b" % (
+                headers.strip(), compression_header.encode("ascii"),
+                bytes(CompressionMethod(self.compression))
+            )
+        )
+
+    def _encrypted_content(self, inp, aes_key, nonce, fencryptor, headers):
+        """
+        Returns:
+            EncryptedFile -- segmented if segment_size is set
+        """
+        inp, headers = self._compress_content(inp, headers)
+        if self.segment_size:
+            return SegmentedEncryptedFile(
+                aes_key, inp, headers, segment_size=self.segment_size,
+                max_workers=self.crypt_workers
+            )
+        return EncryptedFile(fencryptor, inp, nonce, headers)
 
+    def _message_create_url(self):
         # remove raw as we parse html
-        message_create_url, src_headers = self.merge_and_headers(
+        return self.merge_and_headers(
             replace_action(
                 self.component_url, "add/MessageContent/"
             ), raw=None
         )
-        response = self.session.get(
-            message_create_url, headers=src_headers
-        )
+
+    def _message_csrftoken(self, url, headers):
+        """
+        csrftoken of message creation form, cached while cookies are unchanged
+
+        Returns:
+            str -- csrftoken
+        """  # noqa: E501
+        csrftoken = self._csrf_lookup(url)
+        if csrftoken:
+            return csrftoken
+        response = self.session.get(url, headers=headers)
         try:
             response.raise_for_status()
         except Exception as exc:
             raise SrcException(
                 "retrieval csrftoken failed", response.text
             ) from exc
-        g = Graph()
-        g.parse(data=response.content, format="html")
-        csrftoken = list(g.objects(predicate=spkcgraph["csrftoken"]))[0]
-        # create message object
-        response = self.session.post(
-            message_create_url, data={
-                "own_hash": self.hash_key_public,
-                "key_list": json.dumps(src_key_list),
-                "amount_tokens": len(receivers)
-            }, headers={
-                "X-CSRFToken": csrftoken,
-                **src_headers  # only for src
-            },
-            files={
-                "encrypted_content": EncryptedFile(
-                    fencryptor, inp, nonce, headers
-                )
-            }
+        csrftoken = self._extract_csrftoken(HtmlProperties(response.content))
+        self._csrf_set(url, csrftoken)
+        return csrftoken
+
+    def _cookie_state(self):
+        return frozenset(
+            (c.domain, c.path, c.name, c.value) for c in self.session.cookies
         )
-        try:
-            response.raise_for_status()
-        except Exception as exc:
-            raise SrcException(
-                "Message creation failed", response.text
-            ) from exc
-        if message_create_url == response.url:
-            raise SrcException("Message creation failed", response.text)
-        g = Graph()
-        g.parse(data=response.content, format="html")
-        fetch_url = list(map(lambda x: x.value, g.query(
-            """
-                SELECT ?value
-                WHERE {
-                    ?property spkc:name ?name ;
-                            spkc:value ?value .
-                }
-            """,
-            initNs={"spkc": spkcgraph},
-            initBindings={
-                "name": Literal(
-                    "fetch_url", datatype=XSD.string
-                )
-            }
-        )))
 
-        tokens = list(map(lambda x: x.value, g.query(
-            """
-                SELECT ?value
-                WHERE {
-                    ?property spkc:name ?name ;
-                            spkc:value ?value .
-                }
-            """,
-            initNs={"spkc": spkcgraph},
-            initBindings={
-                "name": Literal(
-                    "tokens", datatype=XSD.string
-                )
-            }
-        )))
+    def _csrf_lookup(self, url):
+        if self.csrf_cache is None:
+            return None
+        entry = self.csrf_cache.get(url)
+        # csrftokens are bound to the csrf cookie
+        if entry and entry[1] == self._cookie_state():
+            return entry[0]
+        return None
 
-        if not fetch_url or not tokens:
-            raise SrcException("Message creation failed", response.text)
-        fetch_url = fetch_url[0].toPython()
-        exceptions = []
-        final_fetch_urls = []
-        for receiver, token in zip(receivers, tokens):
-            furl = merge_get_url(fetch_url, token=token.toPython())
-            try:
-                self._send_dest(aes_key, furl, receiver)
-                final_fetch_urls.append(furl)
-            except Exception as exc:
-                exceptions.append(exc)
-                # for autoremoval simulate access
-                self.session.get(furl)
+    def _csrf_set(self, url, csrftoken):
+        if self.csrf_cache is not None:
+            self.csrf_cache[url] = (csrftoken, self._cookie_state())
+
+    def _csrf_invalidate(self, url):
+        if self.csrf_cache is not None:
+            self.csrf_cache.pop(url, None)
+
+    @staticmethod
+    def _extract_csrftoken(graph):
+        """
+        Arguments:
+            graph {Graph,HtmlProperties} -- parsed html page
+
+        Returns:
+            str -- csrftoken
+        """
+        if isinstance(graph, HtmlProperties):
+            if graph.csrftoken:
+                return graph.csrftoken
+            graph = graph.graph()
+        csrftoken = next(
+            graph.objects(predicate=spkcgraph["csrftoken"]), None
+        )
+        if csrftoken is None:
+            raise SrcException("No csrftoken found")
+        return csrftoken.toPython()
+
+    def _message_create_data(self, src_key_list, receivers):
+        return {
+            "own_hash": "%s=%s" % (
+                self.hash_algo.name, self.hash_key_public.hex()
+            ),
+            "key_list": json.dumps(src_key_list),
+            "amount_tokens": len(receivers)
+        }
+
+    @staticmethod
+    def _extract_fetch_urls(g, receivers, text=None):
+        """
+        Extract fetch urls with receiver tokens from message creation result
+
+        Arguments:
+            g {Graph,HtmlProperties} -- parsed html page
+            receivers {list} -- receivers
+
+        Returns:
+            list(str) -- one fetch url per receiver
+        """
+        fetch_url = []
+        tokens = []
+        if isinstance(g, HtmlProperties):
+            fetch_url = g.values("fetch_url")
+            tokens = g.values("tokens")
+            if not fetch_url or not tokens:
+                g = g.graph()
+        if not isinstance(g, HtmlProperties):
+            for i in g.query(_fetch_url_query):
+                if i.name.toPython() == "fetch_url":
+                    fetch_url.append(i.value.toPython())
+                else:
+                    tokens.append(i.value.toPython())
+
+        if not fetch_url or not tokens:
+            raise SrcException("Message creation failed", text)
+        fetch_url = fetch_url[0]
+        return [
+            merge_get_url(fetch_url, token=token)
+            for _, token in zip(receivers, tokens)
+        ]
+
+    @staticmethod
+    def _collect_send_results(results, aes_key):
+        exceptions = []
+        final_fetch_urls = []
+        for (receiver, furl), exc in results:
+            if exc:
+                exceptions.append(exc)
+            else:
+                final_fetch_urls.append(furl)
         return exceptions, final_fetch_urls, aes_key
 
     def receive(
@@ -454,69 +952,490 @@ class PostBox(object):
     ):
         if not self.ok:
             raise NotReady()
+        cache_key = self._message_cache_key(message_id, access_method)
+        # hits need no postbox graph
+        ret = self._receive_cached(cache_key, outfp, access_method)
+        if ret:
+            return ret
+        location = self._find_message(self._message_graph(), message_id)
+        return self._receive_message(
+            location, outfp, access_method=access_method,
+            extra_key_hashes=extra_key_hashes, max_size=max_size,
+            cache_key=cache_key
+        )
+
+    def receive_many(
+        self, message_ids, outfps=None, access_method=AccessMethod.view,
+        extra_key_hashes=None, max_size=None, max_workers=4,
+        max_per_host=None
+    ):
+        """
+        Receive multiple messages with one graph retrieval
+
+        Downloads, key decryption and decryption run in a thread pool
+
+        Arguments:
+            message_ids {Iterable} -- ids of messages
+
+        Keyword Arguments:
+            outfps {dict,callable} -- message id: sink or callable(message_id) returning sink, None: temporary files (default: {None})
+            access_method {AccessMethod} -- (default: {AccessMethod.view})
+            extra_key_hashes {Iterable} -- see receive (default: {None})
+            max_size {int} -- see receive (default: {None})
+            max_workers {int} -- parallel receives, 1: serial (default: {4})
+            max_per_host {int} -- limit parallel receives per host (default: {None})
+
+        Returns:
+            dict -- message id: ((outfp, headers, key), exception)
+        """  # noqa: E501
+        if not self.ok:
+            raise NotReady()
+        message_ids = list(message_ids)
+        results = {}
+        if self.message_cache and access_method != AccessMethod.bypass:
+            # hits need no postbox graph
+            results = self._cached_results(zip(
+                message_ids, fan_out(
+                    lambda message_id: self._receive_cached(
+                        self._message_cache_key(message_id, access_method),
+                        functools.partial(
+                            self._message_sink, outfps, message_id
+                        ), access_method
+                    ), message_ids, max_workers=max_workers
+                )
+            ))
+            message_ids = [x for x in message_ids if x not in results]
+            if not message_ids:
+                return results
+        missing, found = self._find_messages(
+            self._message_graph(), message_ids
+        )
+        results.update(missing)
+
+        def _receive(item):
+            message_id, location = item
+            return self._receive_message(
+                location, self._message_sink(outfps, message_id),
+                access_method=access_method,
+                extra_key_hashes=extra_key_hashes, max_size=max_size,
+                cache_key=self._message_cache_key(message_id, access_method)
+            )
+
+        results.update(zip(found.keys(), fan_out(
+            _receive, found.items(), max_workers=max_workers,
+            max_per_key=max_per_host, key=lambda x: host_key(x[1][0])
+        )))
+        return results
+
+    def _find_messages(self, graph, message_ids):
+        """
+        Locate messages, graph queries are not thread safe
+
+        Returns:
+            (results, found) -- errors of not found messages, message id: location
+        """  # noqa: E501
+        results = {}
+        found = {}
+        rows = self._query_messages(graph, message_ids)
+        for message_id in message_ids:
+            try:
+                found[message_id] = self._message_location(
+                    rows.get(Literal(message_id))
+                )
+            except Exception as exc:
+                results[message_id] = (None, exc)
+        return results, found
+
+    @staticmethod
+    def _cached_results(cached):
+        """
+        Arguments:
+            cached {Iterable((message_id, (result, exception)))} -- results of _receive_cached
 
+        Returns:
+            dict -- message id: (result, exception) of hits and failures
+        """  # noqa: E501
+        return {
+            message_id: ret for message_id, ret in cached
+            if ret[0] or ret[1]
+        }
+
+    @staticmethod
+    def _message_sink(outfps, message_id):
+        if callable(outfps):
+            return outfps(message_id)
+        elif outfps:
+            return outfps.get(message_id)
+        return None
+
+    def _message_graph(self):
+        """
+        Retrieve complete postbox graph with embedded messages
+        """
         merged_url, headers = self.merge_and_headers(
             self.url, raw="embed"
         )
 
-        response = self.session.get(
+        with self.session.get(
             merge_get_url(self.url, raw="embed"),
-            headers=headers
-        )
-        response.raise_for_status()
-        graph = Graph()
-        graph.parse(data=response.content, format="turtle")
+            headers=headers, stream=self.stream_graphs
+        ) as response:
+            response.raise_for_status()
+            graph = parse_response(Graph(), response, self.stream_graphs)
         self.retrieve_missing(graph, merged_url)
-        result = list(graph.query(
-            """
-                SELECT DISTINCT ?base ?hash_algorithm ?type
-                WHERE {
-                    ?base a <https://spkcspider.net/static/schemes/spkcgraph#spkc:Content> ;
-                                  spkc:type ?type ;
-                                  spkc:properties ?propalg , ?propid .
-                    ?propid spkc:name ?idname ;
-                            spkc:value ?idvalue .
-                    ?propalg spkc:name ?algname ;
-                             spkc:value ?hash_algorithm .
-                }
-            """,  # noqa E501
-            initNs={"spkc": spkcgraph},
-            initBindings={
-                "idvalue": Literal(message_id),
-                "algname": Literal(
-                    "hash_algorithm", datatype=XSD.string
-                ),
-                "idname": Literal(
-                    "id", datatype=XSD.string
-                ),
+        return graph
 
-            }
-        ))
-        if not result or result[0].type.toPython() not in {
+    def _receive_message(
+        self, location, outfp=None, access_method=AccessMethod.view,
+        extra_key_hashes=None, max_size=None, cache_key=None
+    ):
+        """
+        Retrieve and decrypt message
+
+        Arguments:
+            location {tuple} -- (base, hash_algo), see _find_message
+
+        Keyword Arguments:
+            cache_key {str} -- store retrieved message in message_cache, see _message_cache_key (default: {None})
+        """  # noqa: E501
+        base, hash_algo = location
+        if not outfp:
+            outfp = tempfile.TemporaryFile()
+
+        retrieve_url, headers, data, pub_key_hashalg = \
+            self._message_request(
+                base, hash_algo, access_method, extra_key_hashes, max_size
+            )
+        response = self.session.post(
+            retrieve_url, stream=True, data=data, headers=(
+                self._range_headers(headers, 0, self.range_size)
+                if self.range_workers > 1 else headers
+            )
+        )
+        try:
+            response.raise_for_status()
+        except Exception as exc:
+            raise DestException(
+                "Message retrieval failed", response.text
+            ) from exc
+        decrypted_key = self._decrypt_key(
+            response.headers["X-KEYLIST"], pub_key_hashalg, hash_algo
+        )
+
+        decryptor = MessageDecryptor(
+            decrypted_key, outfp, chunk_size=self.chunk_size,
+            max_workers=self.crypt_workers
+        )
+        cachefile = cache_key and self.message_cache.create_tempfile()
+
+        def _sink(chunk):
+            if cachefile:
+                cachefile.write(chunk)
+            decryptor.feed(chunk)
+        try:
+            self._download_message(
+                response, retrieve_url, headers, data, _sink
+            )
+            headers = decryptor.finalize()
+        except Exception:
+            self._discard_cachefile(cachefile)
+            raise
+        self._add_cachefile(
+            cache_key, cachefile, location, response.headers["X-KEYLIST"],
+            decrypted_key, access_method
+        )
+        return outfp, headers, decrypted_key
+
+    @staticmethod
+    def _range_headers(headers, start, end=None, etag=None):
+        """ headers requesting bytes [start, end) """
+        ret = dict(headers)
+        ret["Range"] = "bytes=%s-%s" % (start, "" if end is None else end - 1)
+        if etag:
+            ret["If-Range"] = etag
+        return ret
+
+    @staticmethod
+    def _resumable(headers):
+        """ strong etag if ranges of the response can be requested """
+        etag = headers.get("ETag")
+        if (
+            not etag or etag.startswith("W/") or
+            headers.get("Accept-Ranges") != "bytes"
+        ):
+            return None
+        return etag
+
+    @staticmethod
+    def _content_range(status, headers):
+        """
+        Returns:
+            (start, end, total) -- of 206 response, end is exclusive, None: no range
+        """  # noqa: E501
+        if status != 206:
+            return None
+        try:
+            unit, rest = headers["Content-Range"].split(" ", 1)
+            byte_range, total = rest.split("/", 1)
+            start, end = byte_range.split("-", 1)
+            if unit != "bytes":
+                raise ValueError()
+            return int(start), int(end) + 1, int(total)
+        except (KeyError, ValueError) as exc:
+            raise DestException("Invalid Content-Range") from exc
+
+    def _request_range(self, url, headers, data, start, end, etag):
+        response = self.session.post(
+            url, stream=True, data=data,
+            headers=self._range_headers(headers, start, end, etag)
+        )
+        content_range = self._content_range(
+            response.status_code, response.headers
+        )
+        if not content_range or content_range[0] != start:
+            response.close()
+            # If-Range: message changed
+            raise DestException(
+                "Message range retrieval failed", response.status_code
+            )
+        return response
+
+    def _download(
+        self, response, url, headers, data, sink, start=0, end=None
+    ):
+        """
+        Stream response (starting at start) into sink
+
+        Interrupted downloads are resumed with Range requests
+
+        Returns:
+            int -- end position
+        """
+        etag = self._resumable(response.headers)
+        position = start
+        attempts = self.resume_attempts
+        while True:
+            try:
+                with response:
+                    for chunk in response.iter_content(
+                        chunk_size=self.chunk_size
+                    ):
+                        sink(chunk)
+                        position += len(chunk)
+                return position
+            except (
+                requests.exceptions.ChunkedEncodingError,
+                requests.exceptions.ConnectionError
+            ) as exc:
+                if not etag or attempts <= 0:
+                    raise DestException(
+                        "Message retrieval interrupted"
+                    ) from exc
+                attempts -= 1
+            response = self._request_range(
+                url, headers, data, position, end, etag
+            )
+
+    def _download_message(self, response, url, headers, data, sink):
+        """
+        Stream message into sink, fetch further ranges of ranged responses
+
+        Ranges are downloaded in parallel into a temporary file, the final
+        range is requested last as it completes the transmission
+        """  # noqa: E501
+        content_range = self._content_range(
+            response.status_code, response.headers
+        )
+        if not content_range or content_range[1] >= content_range[2]:
+            self._download(response, url, headers, data, sink)
+            return
+        total = content_range[2]
+        etag = self._resumable(response.headers)
+        if not etag:
+            position = self._download(
+                response, url, headers, data, sink, 0, content_range[1]
+            )
+            self._download(
+                self._request_range(url, headers, data, position, None, None),
+                url, headers, data, sink, position
+            )
+            return
+        lock = threading.Lock()
+
+        def _fetch(byte_range, response=None):
+            start, end = byte_range
+            if not response:
+                response = self._request_range(
+                    url, headers, data, start, end, etag
+                )
+            position = [start]
+
+            def _write(chunk):
+                with lock:
+                    spool.seek(position[0])
+                    spool.write(chunk)
+                position[0] += len(chunk)
+            self._download(response, url, headers, data, _write, start, end)
+
+        ranges = [
+            (start, min(start + self.range_size, total))
+            for start in range(content_range[1], total, self.range_size)
+        ]
+        with tempfile.TemporaryFile() as spool:
+            _fetch(content_range[:2], response)
+            for _, exc in fan_out(
+                _fetch, ranges[:-1], max_workers=self.range_workers
+            ):
+                if exc:
+                    raise exc
+            _fetch(ranges[-1])
+            spool.seek(0)
+            chunk = spool.read(self.chunk_size)
+            while chunk:
+                sink(chunk)
+                chunk = spool.read(self.chunk_size)
+
+    def _message_cache_key(self, message_id, access_method):
+        # bypass is never cached
+        if not self.message_cache or access_method == AccessMethod.bypass:
+            return None
+        # messages wrapped for a replaced own key are retrieved again
+        return self.message_cache.cache_key(
+            self.url, message_id,
+            key_fingerprint(self.priv_key, hashes.SHA256())
+        )
+
+    def _receive_cached(
+        self, cache_key, outfp=None, access_method=AccessMethod.peek
+    ):
+        """
+        Decrypt message from message_cache, uses neither network nor graph
+
+        Arguments:
+            cache_key {str} -- see _message_cache_key, None: not cached
+
+        Keyword Arguments:
+            outfp {file,callable} -- sink or callable returning it, only called on hits, None: temporary file (default: {None})
+            access_method {AccessMethod} -- view: peeked messages are retrieved again to mark them as read (default: {AccessMethod.peek})
+
+        Returns:
+            (outfp, headers, key) -- None if not cached
+        """  # noqa: E501
+        if not cache_key:
+            return None
+        cached = self.message_cache.get(
+            cache_key, viewed=access_method == AccessMethod.view
+        )
+        if not cached:
+            return None
+        fileob, _, hash_algo, key_list, decrypted_key = cached
+        with fileob:
+            if not decrypted_key:
+                hash_algo = getattr(hashes, hash_algo.upper())()
+                decrypted_key = self._decrypt_key(
+                    key_list, self._pub_key_hashalg(hash_algo), hash_algo
+                )
+            if callable(outfp):
+                outfp = outfp()
+            if not outfp:
+                outfp = tempfile.TemporaryFile()
+            decryptor = MessageDecryptor(
+                decrypted_key, outfp, chunk_size=self.chunk_size,
+                max_workers=self.crypt_workers
+            )
+            try:
+                chunk = fileob.read(self.chunk_size)
+                while chunk:
+                    decryptor.feed(chunk)
+                    chunk = fileob.read(self.chunk_size)
+                headers = decryptor.finalize()
+            except Exception:
+                # corrupted, retrieve again next time
+                self.message_cache.discard(cache_key)
+                raise
+        return outfp, headers, decrypted_key
+
+    def _add_cachefile(
+        self, cache_key, cachefile, location, key_list, decrypted_key,
+        access_method
+    ):
+        if not cachefile:
+            return
+        cachefile.close()
+        self.message_cache.add(
+            cache_key, cachefile.name, location[0], location[1].name,
+            key_list, session_key=decrypted_key,
+            viewed=access_method == AccessMethod.view
+        )
+
+    @staticmethod
+    def _discard_cachefile(cachefile):
+        if not cachefile:
+            return
+        cachefile.close()
+        os.unlink(cachefile.name)
+
+    @staticmethod
+    def _find_message(graph, message_id):
+        """
+        Find message object with message_id in postbox graph
+
+        Returns:
+            (base, hash_algo) -- url of message object, used hash algorithm
+        """
+        row = PostBox._query_messages(graph, [message_id]).get(
+            Literal(message_id)
+        )
+        return PostBox._message_location(row)
+
+    @staticmethod
+    def _query_messages(graph, message_ids):
+        """
+        Find message objects of all message_ids with one query
+
+        Returns:
+            dict -- id literal: first result row
+        """
+        bindings = {
+            "algname": Literal(
+                "hash_algorithm", datatype=XSD.string
+            ),
+            "idname": Literal(
+                "id", datatype=XSD.string
+            ),
+        }
+        wanted = set(map(Literal, message_ids))
+        if len(wanted) == 1:
+            bindings["idvalue"] = next(iter(wanted))
+        rows = {}
+        for i in graph.query(_message_query, initBindings=bindings):
+            if i.idvalue in wanted:
+                rows.setdefault(i.idvalue, i)
+        return rows
+
+    @staticmethod
+    def _message_location(row):
+        if not row or row.type.toPython() not in {
             "WebReference", "MessageContent"
         }:
             raise SrcException("No Message")
         # every object has it's own copy of the hash algorithm, used
         hash_algo = getattr(
-            hashes, result[0].hash_algorithm.upper()
+            hashes, row.hash_algorithm.upper()
         )()
+        return row.base, hash_algo
 
-        if not outfp:
-            outfp = tempfile.TempFile()
-
-        if hash_algo == self.hash_algo:
-            pub_key_hashalg = "%s=%s" % (
-                hash_algo.name,
-                self.hash_key_public.hex()
-            )
-        else:
-            digest = hashes.Hash(hash_algo, backend=default_backend())
-            digest.update(self.pem_key_public)
-            pub_key_hashalg = "%s=%s" % (
-                hash_algo.name,
-                digest.finalize().hex()
-            )
+    def _message_request(
+        self, base, hash_algo, access_method, extra_key_hashes=None,
+        max_size=None
+    ):
+        """
+        Build retrieval request for message object
 
+        Returns:
+            (retrieve_url, headers, data, pub_key_hashalg)
+        """
+        pub_key_hashalg = self._pub_key_hashalg(hash_algo)
         key_hashes = list()
         if extra_key_hashes:
             extra_key_hashes = set(extra_key_hashes)
@@ -529,13 +1448,9 @@ class PostBox(object):
                             key[0]
                         )
                     else:
-                        digest = hashes.Hash(
-                            hash_algo, backend=default_backend()
-                        )
-                        digest.update(key[1])
                         key_hashalg = "%s=%s" % (
                             hash_algo.name,
-                            digest.finalize().hex()
+                            key_fingerprint(key[1], hash_algo).hex()
                         )
                     key_hashes.append(key_hashalg)
 
@@ -544,7 +1459,7 @@ class PostBox(object):
 
         retrieve_url, headers = self.merge_and_headers(
             replace_action(
-                result[0].base,
+                base,
                 "bypass/" if (
                     access_method == AccessMethod.bypass
                 ) else "message/"
@@ -556,101 +1471,52 @@ class PostBox(object):
                 "max_size": max_size or "",
                 "keyhash": key_hashes
             })
-        response = self.session.post(
-            retrieve_url, stream=True, headers=headers, data=data
+        return retrieve_url, headers, data, pub_key_hashalg
+
+    def _pub_key_hashalg(self, hash_algo):
+        """ key_list key of own key """
+        if hash_algo == self.hash_algo:
+            return "%s=%s" % (hash_algo.name, self.hash_key_public.hex())
+        return "%s=%s" % (
+            hash_algo.name,
+            key_fingerprint(self.priv_key, hash_algo).hex()
         )
-        try:
-            response.raise_for_status()
-        except Exception as exc:
-            raise DestException(
-                "Message retrieval failed", response.text
-            ) from exc
-        key_list = json.loads(response.headers["X-KEYLIST"])
+
+    def _decrypt_key(self, key_list, pub_key_hashalg, hash_algo):
+        key_list = json.loads(key_list)
         key = key_list.get(pub_key_hashalg, None)
         if not key:
             raise WrongRecipient("message not for me")
-        decrypted_key = self.priv_key.decrypt(
-            base64.b64decode(key),
-            padding.OAEP(
-                mgf=padding.MGF1(algorithm=hash_algo),
-                algorithm=hash_algo,
-                label=None
+        if is_epoch_key(key):
+            cache = self.epoch_key_cache
+            if cache is None:
+                cache = EpochKeyCache()
+            return cache.unwrap(
+                key, lambda x: unwrap_key(self.priv_key, x, hash_algo)
             )
-        )
-
-        headblock = b""
-        fdecryptor = None
-        eparser = emailparser.BytesFeedParser(policy=policy.default)
-        headers = None
-        for chunk in response.iter_content(chunk_size=256):
-            blob = None
-            if not fdecryptor:
-                headblock = b"%b%b" % (headblock, chunk)
-                if b"\0" in headblock:
-                    nonce, headblock = headblock.split(b"\0", 1)
-                    nonce = base64.b64decode(nonce)
-                    fdecryptor = Cipher(
-                        algorithms.AES(decrypted_key),
-                        modes.GCM(nonce),
-                        backend=default_backend()
-                    ).decryptor()
-                    blob = fdecryptor.update(headblock[:-16])
-                    headblock = headblock[-16:]
-                else:
-                    continue
-            else:
-                blob = fdecryptor.update(
-                    b"%b%b" % (headblock, chunk[:-16])
-                )
-                headblock = chunk[-16:]
-            if not headers:
-                if b"\n\n" not in blob:
-                    eparser.feed(blob)
-                    continue
-                headersrest, blob = blob.split(b"\n\n", 1)
-                eparser.feed(headersrest)
-                headers = eparser.close()
-                # check  what to do
-                t = headers.get("SPKC-Type", MessageType.email)
-                if t == MessageType.email:
-                    outfp.write(headers.as_bytes(
-                        unixfrom=True,
-                        policy=policy.SMTP
-                    ))
-            outfp.write(blob)
-        outfp.write(fdecryptor.finalize_with_tag(headblock))
-        return outfp, headers, decrypted_key
+        return unwrap_key(self.priv_key, key, hash_algo)
 
     def list_messages(self):
-        queried_webrefs = {}
-        queried_messages = {}
         merged_url, headers = self.merge_and_headers(
             self.url, raw="embed"
         )
-        response = self.session.get(
+        with self.session.get(
             merged_url,
-            headers=headers
-        )
-        try:
-            response.raise_for_status()
-        except Exception as exc:
-            raise SrcException("Could not list messages") from exc
-        graph = Graph()
-        graph.parse(data=response.content, format="turtle")
+            headers=headers, stream=self.stream_graphs
+        ) as response:
+            try:
+                response.raise_for_status()
+            except Exception as exc:
+                raise SrcException("Could not list messages") from exc
+            graph = parse_response(Graph(), response, self.stream_graphs)
+        return self._extract_messages(graph)
+
+    @staticmethod
+    def _extract_messages(graph):
+        queried_webrefs = {}
+        queried_messages = {}
         for i in graph.query(
-            """
-            SELECT DISTINCT ?base ?idvalue ?namevalue ?type
-            WHERE {
-                ?base a <https://spkcspider.net/static/schemes/spkcgraph#spkc:Content> ;
-                   spkc:type ?type ;
-                   spkc:properties ?propname , ?propid .
-                ?propid spkc:name ?idname ;
-                        spkc:value ?idvalue .
-                ?propname spkc:name ?namename ;
-                          spkc:value ?namevalue .
-            }
-        """,  # noqa E501
-            initNs={"spkc": spkcgraph},
+            _messages_query,
             initBindings={
                 "idname": Literal(
                     "id", datatype=XSD.string
@@ -672,10 +1538,59 @@ class PostBox(object):
             queried[str(i.base)]["name"] = i.namevalue
         return (queried_webrefs, queried_messages)
 
-    @staticmethod
+    def sync(self, index, timeout=60):
+        """
+        Update local message index
+
+        Only the changes are returned; an unchanged postbox (304 on the
+        stored ETag/Last-Modified) costs one request and no parsing.
+        A changed postbox is downloaded completely and diffed locally,
+        the listing has no cursor for single entries.
+
+        Arguments:
+            index {MessageIndex,str} -- index or its database file
+
+        Returns:
+            InboxChanges -- new, changed, removed IndexedMessages
+        """
+        if not self.ok:
+            raise NotReady()
+        if not isinstance(index, MessageIndex):
+            index = MessageIndex(index)
+        merged_url, headers = self._sync_request(index)
+        with self.session.get(
+            merged_url, headers=headers, timeout=timeout,
+            stream=self.stream_graphs
+        ) as response:
+            if response.status_code == 304:
+                return index.not_modified(self.url)
+            try:
+                response.raise_for_status()
+            except Exception as exc:
+                raise SrcException("Could not sync messages") from exc
+            graph = parse_response(Graph(), response, self.stream_graphs)
+        self.retrieve_missing(graph, merged_url)
+        return index.update(
+            self.url, extract_indexed_messages(graph),
+            etag=response.headers.get("ETag"),
+            last_modified=response.headers.get("Last-Modified")
+        )
+
+    def _sync_request(self, index):
+        merged_url, headers = self.merge_and_headers(
+            self.url, raw="embed"
+        )
+        etag, last_modified = index.get_state(self.url)
+        if etag:
+            headers["If-None-Match"] = etag
+        if last_modified:
+            headers["If-Modified-Since"] = last_modified
+        return merged_url, headers
+
+    @classmethod
     def simple_check(
-        url_or_graph, session=None, checker=None, auto_add=False,
-        token=None
+        cls, url_or_graph, session=None, checker=None, auto_add=False,
+        token=None, max_in_flight=None
     ):
         if isinstance(url_or_graph, Graph):
             graph = url_or_graph
@@ -687,33 +1602,92 @@ class PostBox(object):
                 url_or_graph, raw="embed", search="\x1etype=PostBox\x1e"
             )
             if not session:
-                session = requests.Session()
-            response = session.get(
+                session = get_session()
+            if cls.use_descriptor:
+                try:
+                    with session.get(
+                        replace_action(url, "descriptor/"), headers={
+                            "X-TOKEN": token or ""
+                        }, timeout=60
+                    ) as response:
+                        response.raise_for_status()
+                        options = cls.parse_descriptor(response.content)[1]
+                except (requests.RequestException, ValueError) as exc:
+                    logger.debug(
+                        "no descriptor for %s, use turtle: %s", url, exc
+                    )
+                else:
+                    return cls.check_options(
+                        url, options, checker=checker, auto_add=auto_add
+                    )
+            with session.get(
                 retrieve_url, headers={
                     "X-TOKEN": token or ""
-                }
-            )
-            response.raise_for_status()
-            graph = Graph()
-            graph.parse(data=response.content, format="turtle")
+                }, stream=cls.stream_graphs
+            ) as response:
+                response.raise_for_status()
+                graph = parse_response(Graph(), response, cls.stream_graphs)
             pages = get_pages(graph)[1]
-        for page in pages:
-            response = session.get(
-                merge_get_url(
-                    retrieve_url, page=page
-                ), headers={
-                    "X-TOKEN": token or ""
-                }
-            )
-            response.raise_for_status()
-            graph.parse(data=response.content, format="turtle")
-        postboxes = get_postboxes(graph)
+        retrieve_pages(
+            session, retrieve_url, pages, graph, headers={
+                "X-TOKEN": token or ""
+            }, max_in_flight=max_in_flight, stream=cls.stream_graphs
+        )
+        return cls.check_graph(
+            graph, url, checker=checker, auto_add=auto_add
+        )
+
+    @staticmethod
+    def check_graph(graph, url=None, checker=None, auto_add=False):
+        """
+        Check signatures of the postbox in a complete graph
+
+        Arguments:
+            graph {Graph} -- graph with all pages retrieved
+
+        Keyword Arguments:
+            url {str} -- postbox url, None: extract from graph (default: {None})
+            checker {AttestationChecker} -- check also against db (default: {None})
+            auto_add {bool} -- update db (default: {False})
+
+        Raises:
+            CheckError: validation failed
+
+        Returns:
+            dict -- result, errors, key_list and postbox options
+        """  # noqa: E501
+        index = GraphIndex.from_graph(graph)
+        if not url:
+            url = get_pages(index)[0]
+        postboxes = get_postboxes(index)
 
         if len(postboxes) != 1:
             raise CheckError("No postbox found/more than one found")
 
-        postbox, options = next(iter(postboxes.items()))
+        return PostBox.check_options(
+            url, next(iter(postboxes.values())), checker=checker,
+            auto_add=auto_add
+        )
+
+    @staticmethod
+    def check_options(url, options, checker=None, auto_add=False):
+        """
+        Check signatures of postbox options (from graph or descriptor)
+
+        Arguments:
+            url {str} -- postbox url
+            options {dict} -- postbox options like get_postboxes
+
+        Keyword Arguments:
+            checker {AttestationChecker} -- check also against db (default: {None})
+            auto_add {bool} -- update db (default: {False})
+
+        Raises:
+            CheckError: validation failed
 
+        Returns:
+            dict -- result, errors, key_list and postbox options
+        """  # noqa: E501
         if not isinstance(options.get("hash_algorithm"), hashes.HashAlgorithm):
             raise CheckError("Hash algorithm not found")
         if not isinstance(options.get("attestation"), bytes):
@@ -724,7 +1698,8 @@ class PostBox(object):
                 options["signatures"].values()
             ),
             attestation=options["attestation"],
-            algo=options["hash_algorithm"]
+            algo=options["hash_algorithm"],
+            signature_cache=checker
         )
         if errors:
             raise CheckError(
@@ -759,179 +1734,160 @@ class PostBox(object):
 
     def check(self, url=None):
         if not url or url.startswith(self.url):
-            merged_url, headers = self.merge_and_headers(
-                self.url, raw="embed", search="\x1etype=PostBox\x1e"
-            )
-            response = self.session.get(
-                merge_get_url(
-                    merged_url, raw="embed", search="\x1etype=PostBox\x1e"
-                ),
-                headers=headers
-            )
-            response.raise_for_status()
-            graph = Graph()
-            graph.parse(data=response.content, format="turtle")
-            for page in get_pages(graph):
-                with self.session.get(
-                    merge_get_url(
-                        merged_url, page=page
-                    ), headers=headers
-                ) as response:
-                    response.raise_for_status()
-                    graph.parse(data=response.content, format="turtle")
+            graph = self.retrieve_filtered_graph()
         else:
-            response = self.session.get(
-                merge_get_url(
-                    url, raw="embed", search="\x1etype=PostBox\x1e"
-                )
-            )
-            response.raise_for_status()
-            graph = Graph()
-            graph.parse(data=response.content, format="turtle")
-            for page in get_pages(graph):
-                response = self.session.get(
-                    merge_get_url(
-                        self.url, raw="embed", search="\x1etype=PostBox\x1e",
-                        page=page
-                    )
-                )
-                response.raise_for_status()
-                graph.parse(data=response.content, format="turtle")
-        if not url or url.startswith(self.url):
-            result = \
-                self.simple_check(
-                    graph,
-                    url=url, checker=self.attestation_checker,
-                    auto_add=True
-                )
+            graph = self.retrieve_filtered_graph(url)
+        self.retrieve_missing(graph)
+        return self._check_result(graph, url)
 
+    def _check_result(self, graph, url=None):
+        result = self.check_graph(
+            graph, url, checker=self.attestation_checker, auto_add=True
+        )
+        if not url or url.startswith(self.url):
             key_hashes = set(map(lambda x: x[0], result["key_list"]))
             if self.hash_key_public not in key_hashes:
                 self.state = AttestationResult.error
                 raise CheckError("Key is not part of chain")
             self.state = result["result"]
             self.client_list = result["key_list"]
-            return result
-        else:
-            return self.simple_check(
-                graph,
-                url=url, checker=self.attestation_checker,
-                auto_add=True
-            )
+        return result
 
     def sign(self, confirm=False):
         url, headers = self.merge_and_headers(self.url)
         try:
-            check_result = self.simple_check(
-                url, token=headers.get("X-TOKEN"),
-                session=self.session,
+            sign_info = self._sign_info(
+                self.simple_check(
+                    url, token=headers.get("X-TOKEN"),
+                    session=self.session,
+                )
             )
-            attestation = check_result["attestation"]
-            errored = set(map(lambda x: x[0], check_result["errors"]))
-            key_list = check_result["key_list"]
-            key_hashes = set(map(lambda x: x[0], key_list))
         except CheckError as exc:
+            sign_info = self._sign_info(exc)
+        attestation, errored, key_list = sign_info
+
+        if not confirm:
+            return (
+                self.hash_key_public in errored,
+                key_list
+            )
+        postbox_update = self._sign_url()
+        # retrieve csrftoken
+        response = self.session.get(
+            postbox_update, headers=headers
+        )
+        csrftoken, fields, own_signature = \
+            self._sign_fields(HtmlProperties(response.content), attestation)
+        # update
+        response = self.session.post(
+            postbox_update, data=fields, headers={
+                "X-CSRFToken": csrftoken,
+                **headers
+            }
+        )
+        try:
+            response.raise_for_status()
+            self._check_signed(
+                HtmlProperties(response.content), own_signature
+            )
+        except SrcException as exc:
+            raise exc
+        except Exception as exc:
+            raise SrcException(
+                "could not update signature", own_signature
+            ) from exc
+        return (
+            self.hash_key_public in errored,
+            key_list
+        )
+
+    def _sign_info(self, check_result):
+        """
+        Extract signing relevant data from check result or CheckError
+
+        Returns:
+            (attestation, errored hashes, key_list)
+        """
+        if isinstance(check_result, CheckError):
+            exc = check_result
             if not exc.key_list or not exc.errored or not exc.attestation:
                 raise exc
             attestation = exc.attestation
             errored = set(map(lambda x: x[0], exc.errored))
             key_list = exc.key_list
-            key_hashes = set(map(lambda x: x[0], key_list))
+        else:
+            attestation = check_result["attestation"]
+            errored = set(map(lambda x: x[0], check_result["errors"]))
+            key_list = check_result["key_list"]
+        key_hashes = set(map(lambda x: x[0], key_list))
 
         if self.hash_key_public not in key_hashes:
             raise CheckError("Key is not part of chain")
+        return attestation, errored, key_list
 
-        if not confirm:
-            return (
-                self.hash_key_public in errored,
-                key_list
-            )
+    def _sign_url(self):
         # change to update url
-        postbox_update = merge_get_url(
+        return merge_get_url(
             replace_action(
                 self.url, "update/"
             ), raw="embed", search="\x1etype=PostBox\x1e"
         )
-        # retrieve csrftoken
-        response = self.session.get(
-            postbox_update, headers=headers
-        )
-        graph = Graph()
-        graph.parse(data=response.content, format="html")
-        csrftoken = list(graph.objects(
-            predicate=spkcgraph["csrftoken"])
-        )[0].toPython()
-
-        fields = dict(map(
-            lambda x: (x[0].toPython(), x[1].toPython()),
-            graph.query(
-                """
-                    SELECT DISTINCT ?fieldname ?value
-                    WHERE {
-                        ?base spkc:fieldname ?fieldname ;
-                              spkc:value ?value .
-                    }
-                """,
-                initNs={"spkc": spkcgraph},
-                )
+
+    def _sign_fields(self, graph, attestation):
+        """
+        Extract form of update page and sign attestation
+
+        Arguments:
+            graph {Graph,HtmlProperties} -- parsed update page
+            attestation {bytes} -- attestation
+
+        Returns:
+            (csrftoken, fields, own_signature)
+        """
+        if isinstance(graph, HtmlProperties) and not graph.csrftoken:
+            graph = graph.graph()
+        csrftoken = self._extract_csrftoken(graph)
+
+        if isinstance(graph, HtmlProperties):
+            fields = graph.fields()
+        else:
+            fields = dict(map(
+                lambda x: (x[0].toPython(), x[1].toPython()),
+                graph.query(_fields_query)
             ))
 
         fields["signatures"] = []
         own_signature = None
         for key in self.client_list:
             if key[0] != self.hash_key_public:
+                # already in format: <algo>=<base64 signature>
                 signature = key[2]
             else:
                 # currently only one priv key is supported
-                signature = self.priv_key.sign(
-                    attestation,
-                    padding.PSS(
-                        mgf=padding.MGF1(self.hash_algo),
-                        salt_length=padding.PSS.MAX_LENGTH
-                    ),
-                    self.hash_algo
+                signature = sign_data(
+                    self.priv_key, attestation, self.hash_algo
                 )
+                own_signature = signature
             if signature:
                 fields["signatures"].append(
                     {
                         "hash": f"{self.hash_algo.name}={key[0].hex()}",
-                        "signature": "{}={}".format(
-                            self.hash_algo.name,
-                            base64.b64encode(
-                                signature
-                            ).decode("ascii")
-                        )
+                        "signature": signature
                     }
                 )
-            if key[0] == self.hash_key_public:
-                own_signature = fields["signatures"][-1]["signature"]
 
         fields["signatures"] = json.dumps(fields["signatures"])
-        # update
-        response = self.session.post(
-            postbox_update, data=fields, headers={
-                "X-CSRFToken": csrftoken,
-                **headers
-            }
-        )
-        try:
-            response.raise_for_status()
-            graph = Graph()
-            graph.parse(data=response.content, format="html")
-            vals = set(extract_property(graph, "signature").values())
-            breakpoint()
-            if own_signature not in vals:
-                raise SrcException("could not update signature", own_signature)
-        except SrcException as exc:
-            raise exc
-        except Exception as exc:
-            raise SrcException(
-                "could not update signature", own_signature
-            ) from exc
-        return (
-            self.hash_key_public in errored,
-            key_list
-        )
+        return csrftoken, fields, own_signature
+
+    @staticmethod
+    def _check_signed(graph, own_signature):
+        if isinstance(graph, HtmlProperties):
+            if own_signature in graph.values("signature"):
+                return
+            graph = graph.graph()
+        vals = set(extract_property(graph, "signature").values())
+        if own_signature not in vals:
+            raise SrcException("could not update signature", own_signature)
 
     @property
     def ok(self):
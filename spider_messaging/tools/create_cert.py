@@ -11,9 +11,11 @@ from datetime import timedelta as td
 from cryptography import x509
 from cryptography.hazmat.backends import default_backend
 from cryptography.hazmat.primitives import hashes, serialization
-from cryptography.hazmat.primitives.asymmetric import rsa
 from cryptography.x509.oid import NameOID
 
+from spider_messaging.utils.crypto import (
+    certificate_hash, generate_private_key, private_key_pem
+)
 from spider_messaging.utils.keys import load_priv_key
 
 logger = logging.getLogger(__name__)
@@ -39,7 +41,11 @@ parser.add_argument(
 )
 parser.add_argument(
     '--keysize', "-s", action='store', default=8192, type=int,
-    help="Keysize for auto generated keys"
+    help="Keysize for auto generated rsa keys"
+)
+parser.add_argument(
+    '--keytype', "-t", action='store', default="rsa",
+    choices=["rsa", "ed25519"], help="Type of auto generated keys"
 )
 parser.add_argument(
     '--address', "-a", action='store', nargs="+",
@@ -63,19 +69,9 @@ def main(argv):
         with open(argv.key, "rb") as f:
             private_key = load_priv_key(f.read())
     else:
-        private_key = rsa.generate_private_key(
-            public_exponent=65537,
-            key_size=argv.keysize,
-            backend=default_backend()
-        )
+        private_key = generate_private_key(argv.keytype, argv.keysize)
         with open(argv.key, "wb") as f:
-            f.write(
-                private_key.private_bytes(
-                    encoding=serialization.Encoding.PEM,
-                    format=serialization.PrivateFormat.TraditionalOpenSSL,
-                    encryption_algorithm=serialization.NoEncryption(),
-                )
-            )
+            f.write(private_key_pem(private_key))
     subject = x509.Name(
         [
             x509.NameAttribute(
@@ -102,7 +98,10 @@ def main(argv):
             critical=False
         )
 
-    cert = cert.sign(private_key, hashes.SHA512(), default_backend())
+    cert = cert.sign(
+        private_key, certificate_hash(private_key, hashes.SHA512()),
+        default_backend()
+    )
     del private_key
 
     with open(argv.cert, "wb") as f:
@@ -7,9 +7,9 @@ import os
 import sys
 
 from cryptography.hazmat.primitives import hashes
-from cryptography.hazmat.primitives.asymmetric import padding
 
-from spider_messaging.keys import load_priv_key
+from spider_messaging.utils.crypto import sign_data
+from spider_messaging.utils.keys import load_priv_key
 
 logger = logging.getLogger(__name__)
 
@@ -17,7 +17,8 @@ parser = argparse.ArgumentParser(
     description='Sign keys'
 )
 parser.add_argument(
-    '--hash', action='store', help="Hash algorithm", default="SHA512"
+    '--hash', action='store', help="Hash algorithm (rsa keys)",
+    default="SHA512"
 )
 parser.add_argument(
     '--key', action='store', dest="key",
@@ -49,20 +50,8 @@ def main(argv):
         if not pkey:
             argv.exit(1, "invalid key: %s" % argv.key)
     for tosign in argv.sign:
-        signature = pkey.sign(
-            base64.b64decode(tosign),
-            padding.PSS(
-                mgf=padding.MGF1(argv.hash),
-                salt_length=padding.PSS.MAX_LENGTH
-            ),
-            argv.hash
-        )
         print("Signature:")
-        print(
-            argv.hash.name,
-            base64.b64encode(signature).decode("ascii"),
-            sep="="
-        )
+        print(sign_data(pkey, base64.b64decode(tosign), argv.hash))
 
 
 if __name__ == "__main__":
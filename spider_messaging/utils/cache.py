@@ -0,0 +1,265 @@
+__all__ = ["DestinationCache", "MessageCache"]
+
+import hashlib
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+from cryptography.exceptions import InvalidTag
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+
+class DestinationCache(object):
+    """
+    LRU cache of checked destination postboxes (DestinationInfo)
+
+    Entries are fresh for ttl seconds, afterwards they can be revalidated
+    with a conditional request (etag, last_modified of entry)
+    """
+    ttl = None
+    maxsize = None
+    _entries = None
+    _lock = None
+
+    def __init__(self, ttl=300, maxsize=256):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, dest):
+        """
+        Returns:
+            (DestinationInfo, fresh) -- (None, False) if not cached
+        """
+        with self._lock:
+            item = self._entries.get(dest)
+            if not item:
+                return None, False
+            self._entries.move_to_end(dest)
+            return item[0], item[1] > time.monotonic()
+
+    def set(self, dest, info):
+        with self._lock:
+            self._entries[dest] = (info, time.monotonic() + self.ttl)
+            self._entries.move_to_end(dest)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def touch(self, dest):
+        """ entry was revalidated """
+        with self._lock:
+            item = self._entries.get(dest)
+            if item:
+                self._entries[dest] = (item[0], time.monotonic() + self.ttl)
+
+    def invalidate(self, dest=None):
+        """ remove dest or everything if dest is None """
+        with self._lock:
+            if dest is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(dest, None)
+
+
+class MessageCache(object):
+    """
+    On-disk, size bounded LRU cache of received messages
+
+    Keyed by postbox, message id and own key. Stores ciphertext, message
+    url, hash algorithm and key list (never plaintext), so hits need no
+    postbox graph. Optionally the session key is stored encrypted with
+    local_key (32 bytes, AES-GCM); then hits need neither network nor
+    private key.
+    Entries remember if they were retrieved with view (marked as read).
+    """
+    # version of table layout, older tables are dropped
+    schema_version = 2
+    directory = None
+    max_size = None
+    local_key = None
+    con = None
+    lock = None
+
+    def __init__(self, directory, max_size=2 ** 30, local_key=None):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.max_size = max_size
+        if local_key:
+            assert len(local_key) == 32
+            self.local_key = AESGCM(local_key)
+        self.lock = threading.RLock()
+        self.con = sqlite3.connect(
+            os.path.join(directory, "index.sqlite3"),
+            check_same_thread=False
+        )
+        if self.con.execute(
+            "PRAGMA user_version"
+        ).fetchone()[0] != self.schema_version:
+            # only a cache, files are overwritten or evicted
+            self.con.execute("DROP TABLE IF EXISTS message_cache")
+            self.con.execute(
+                "PRAGMA user_version=%d" % self.schema_version
+            )
+        self.con.execute(
+            '''
+            CREATE TABLE IF NOT EXISTS message_cache (
+                cache_key TEXT PRIMARY KEY NOT NULL,
+                size INTEGER NOT NULL,
+                accessed REAL NOT NULL,
+                base TEXT NOT NULL,
+                hash_algo TEXT NOT NULL,
+                key_list TEXT NOT NULL,
+                session_key BLOB,
+                viewed INTEGER NOT NULL DEFAULT 0
+            )
+            '''
+        )
+        self.con.commit()
+
+    def __del__(self):
+        self.close()
+
+    def close(self):
+        self.con.close()
+
+    @staticmethod
+    def cache_key(postbox, message_id, key_hash):
+        """
+        Arguments:
+            postbox {str} -- url of postbox
+            message_id {str} -- message id
+            key_hash {bytes} -- digest of own key, entries of rotated keys are not found
+        """  # noqa: E501
+        digest = hashlib.sha256()
+        digest.update(("%s\0%s\0" % (postbox, message_id)).encode("utf8"))
+        digest.update(key_hash)
+        return digest.hexdigest()
+
+    def _path(self, cache_key):
+        return os.path.join(self.directory, "%s.bin" % cache_key)
+
+    def get(self, cache_key, viewed=False):
+        """
+        Keyword Arguments:
+            viewed {bool} -- only entries retrieved with view (default: {False})
+
+        Returns:
+            (fileob, base, hash_algo, key_list, session_key) -- None if not cached, session_key is None if not stored
+        """  # noqa: E501
+        with self.lock:
+            row = self.con.execute("""
+                SELECT base, hash_algo, key_list, session_key, viewed
+                FROM message_cache WHERE cache_key=?
+            """, (cache_key,)).fetchone()
+            if not row or (viewed and not row[4]):
+                return None
+            try:
+                fileob = open(self._path(cache_key), "rb")
+            except FileNotFoundError:
+                self.discard(cache_key)
+                return None
+            self.con.execute("""
+                UPDATE message_cache SET accessed=? WHERE cache_key=?
+            """, (time.time(), cache_key))
+            self.con.commit()
+        session_key = None
+        if row[3] and self.local_key:
+            try:
+                session_key = self.local_key.decrypt(
+                    row[3][:12], row[3][12:], cache_key.encode("ascii")
+                )
+            except InvalidTag:
+                # other local key
+                pass
+        return (fileob, *row[:3], session_key)
+
+    def create_tempfile(self):
+        return tempfile.NamedTemporaryFile(
+            dir=self.directory, prefix="tmp", suffix=".part", delete=False
+        )
+
+    def add(
+        self, cache_key, tmpname, base, hash_algo, key_list, session_key=None,
+        viewed=False
+    ):
+        """
+        Move completely written temporary file into cache
+
+        Arguments:
+            cache_key {str} -- see cache_key
+            tmpname {str} -- name of file created by create_tempfile
+            base {str} -- url of message object
+            hash_algo {str} -- name of hash algorithm of message object
+            key_list {str} -- key list (json)
+
+        Keyword Arguments:
+            session_key {bytes} -- stored if local_key is set (default: {None})
+            viewed {bool} -- retrieved with view, kept if set before (default: {False})
+        """  # noqa: E501
+        size = os.path.getsize(tmpname)
+        if size > self.max_size:
+            os.unlink(tmpname)
+            return
+        wrapped = None
+        if session_key and self.local_key:
+            nonce = os.urandom(12)
+            wrapped = nonce + self.local_key.encrypt(
+                nonce, session_key, cache_key.encode("ascii")
+            )
+        with self.lock:
+            os.replace(tmpname, self._path(cache_key))
+            row = self.con.execute("""
+                SELECT viewed FROM message_cache WHERE cache_key=?
+            """, (cache_key,)).fetchone()
+            self.con.execute("""
+                INSERT OR REPLACE INTO message_cache
+                (
+                    cache_key, size, accessed, base, hash_algo, key_list,
+                    session_key, viewed
+                )
+                VALUES(?, ?, ?, ?, ?, ?, ?, ?)
+            """, (
+                cache_key, size, time.time(), base, hash_algo, key_list,
+                wrapped, bool(viewed or (row and row[0]))
+            ))
+            self.con.commit()
+            self._evict()
+
+    def _evict(self):
+        total = self.con.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM message_cache"
+        ).fetchone()[0]
+        if total <= self.max_size:
+            return
+        for cache_key, size in self.con.execute("""
+            SELECT cache_key, size FROM message_cache ORDER BY accessed
+        """).fetchall():
+            self.discard(cache_key)
+            total -= size
+            if total <= self.max_size:
+                break
+
+    def discard(self, cache_key):
+        with self.lock:
+            self.con.execute(
+                "DELETE FROM message_cache WHERE cache_key=?", (cache_key,)
+            )
+            self.con.commit()
+            try:
+                os.unlink(self._path(cache_key))
+            except FileNotFoundError:
+                pass
+
+    def clear(self):
+        with self.lock:
+            for (cache_key,) in self.con.execute(
+                "SELECT cache_key FROM message_cache"
+            ).fetchall():
+                self.discard(cache_key)
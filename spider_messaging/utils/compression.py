@@ -0,0 +1,246 @@
+__all__ = [
+    "available_compressions", "create_compressor", "create_decompressor",
+    "is_compressible"
+]
+
+import io
+import zlib
+
+from spider_messaging.constants import CompressionMethod
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# header in encrypted header block
+compression_header = "SPKC-Compression"
+# size of sample tested by is_compressible
+probe_size = 2 ** 16
+# sample must compress at least to this ratio
+max_ratio = 0.9
+# magic numbers of zstd frames and skippable frames (low 4 bits free)
+_zstd_magic = 0xFD2FB528
+_skippable_magic = 0x184D2A50
+
+
+def available_compressions():
+    ret = {CompressionMethod.zlib}
+    if zstandard:
+        ret.add(CompressionMethod.zstd)
+    return ret
+
+
+def create_compressor(method, level=None):
+    """
+    Arguments:
+        method {CompressionMethod,str} -- compression method
+
+    Keyword Arguments:
+        level {int} -- compression level, None: default of method (default: {None})
+
+    Raises:
+        ValueError: method unknown or unavailable
+
+    Returns:
+        object with compress(data) and flush()
+    """  # noqa: E501
+    method = CompressionMethod(method)
+    if method == CompressionMethod.zlib:
+        return zlib.compressobj(-1 if level is None else level)
+    if not zstandard:
+        raise ValueError("zstd requires the zstandard package")
+    return zstandard.ZstdCompressor(
+        level=3 if level is None else level
+    ).compressobj()
+
+
+class _ZlibWriter(object):
+    """ decompress into outfp, output is produced in bounded blocks """
+    outfp = None
+    chunk_size = None
+    _decompressor = None
+
+    def __init__(self, outfp, chunk_size):
+        self.outfp = outfp
+        self.chunk_size = chunk_size
+        self._decompressor = zlib.decompressobj()
+
+    def write(self, data):
+        data = self._decompressor.decompress(data, self.chunk_size)
+        while data:
+            self.outfp.write(data)
+            data = self._decompressor.decompress(
+                self._decompressor.unconsumed_tail, self.chunk_size
+            )
+
+    def flush(self):
+        self.outfp.write(self._decompressor.flush())
+        if not self._decompressor.eof:
+            raise ValueError("Truncated compressed content")
+
+
+class _ZstdFrames(object):
+    """
+    Follows the frame structure of zstd content (RFC 8878) without
+    decompressing it, complete if the content ends with a frame
+    """
+    # complete zstd frames seen, skippable frames are not counted
+    frames = 0
+    # bytes to skip before the next header
+    _skip = 0
+    # collected bytes of the next header
+    _head = b""
+    # (size, handler) of the next header
+    _expect = None
+    # current frame has a checksum
+    _checksum = False
+
+    def __init__(self):
+        self._expect = (4, self._magic)
+
+    @property
+    def complete(self):
+        return (
+            self.frames > 0 and not self._skip and not self._head and
+            self._expect[1] == self._magic
+        )
+
+    def feed(self, data):
+        view = memoryview(data).cast("B")
+        while view:
+            if self._skip:
+                n = min(self._skip, len(view))
+                self._skip -= n
+                view = view[n:]
+                continue
+            size, handler = self._expect
+            n = size - len(self._head)
+            self._head += bytes(view[:n])
+            view = view[n:]
+            if len(self._head) == size:
+                head, self._head = self._head, b""
+                handler(head)
+
+    def _magic(self, head):
+        magic = int.from_bytes(head, "little")
+        if magic == _zstd_magic:
+            self._expect = (1, self._descriptor)
+        elif magic & 0xFFFFFFF0 == _skippable_magic:
+            self._expect = (4, self._skippable)
+        else:
+            raise ValueError("Invalid zstd frame")
+
+    def _skippable(self, head):
+        self._skip = int.from_bytes(head, "little")
+        self._expect = (4, self._magic)
+
+    def _descriptor(self, head):
+        descriptor = head[0]
+        if descriptor & 0x08:
+            raise ValueError("Invalid zstd frame header")
+        single_segment = descriptor >> 5 & 1
+        self._checksum = bool(descriptor & 0x04)
+        # window descriptor, dictionary id, frame content size
+        self._skip = (
+            (1 - single_segment) + (0, 1, 2, 4)[descriptor & 0x03] +
+            (single_segment, 2, 4, 8)[descriptor >> 6]
+        )
+        self._expect = (3, self._block)
+
+    def _block(self, head):
+        value = int.from_bytes(head, "little")
+        block_type = value >> 1 & 0x03
+        if block_type == 3:
+            raise ValueError("Invalid zstd block")
+        # RLE blocks contain a single byte
+        self._skip = 1 if block_type == 1 else value >> 3
+        if value & 1:
+            # last block
+            if self._checksum:
+                self._skip += 4
+            self.frames += 1
+            self._expect = (4, self._magic)
+
+
+class _ZstdWriter(object):
+    """
+    decompress into outfp in blocks of chunk_size
+
+    The stream writer does not report the end of the content, so the
+    frame structure is followed for detecting truncated content
+    """
+    outfp = None
+    _decompressor = None
+    _frames = None
+
+    def __init__(self, outfp, chunk_size):
+        self.outfp = outfp
+        self._decompressor = zstandard.ZstdDecompressor().stream_writer(
+            outfp, write_size=chunk_size, closefd=False
+        )
+        self._frames = _ZstdFrames()
+
+    def write(self, data):
+        self._frames.feed(data)
+        self._decompressor.write(data)
+
+    def flush(self):
+        self._decompressor.flush()
+        if not self._frames.complete:
+            raise ValueError("Truncated compressed content")
+
+
+def create_decompressor(method, outfp, chunk_size=2 ** 16):
+    """
+    Arguments:
+        method {str} -- value of compression header
+        outfp {file} -- receives decompressed data
+
+    Keyword Arguments:
+        chunk_size {int} -- maximal size of written blocks (default: {2 ** 16})
+
+    Raises:
+        ValueError: method unknown or unavailable
+
+    Returns:
+        object with write(data) and flush()
+    """  # noqa: E501
+    try:
+        method = CompressionMethod(method.strip())
+    except ValueError as exc:
+        raise ValueError("Unknown compression: %s" % method) from exc
+    if method == CompressionMethod.zlib:
+        return _ZlibWriter(outfp, chunk_size)
+    if not zstandard:
+        raise ValueError("zstd requires the zstandard package")
+    return _ZstdWriter(outfp, chunk_size)
+
+
+def is_compressible(fileob, min_size=0):
+    """
+    Probe the next bytes of fileob, the position is kept
+
+    Non seekable files cannot be probed and are assumed compressible
+
+    Arguments:
+        fileob {file} -- input
+
+    Keyword Arguments:
+        min_size {int} -- smaller inputs are not worth it (default: {0})
+
+    Returns:
+        bool -- compression is worth it
+    """
+    try:
+        if not fileob.seekable():
+            return True
+        position = fileob.tell()
+        sample = fileob.read(max(probe_size, min_size))
+        fileob.seek(position)
+    except (AttributeError, OSError, io.UnsupportedOperation):
+        return True
+    if len(sample) < min_size:
+        return False
+    sample = sample[:probe_size]
+    return len(zlib.compress(sample, 1)) <= len(sample) * max_ratio
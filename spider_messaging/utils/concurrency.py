@@ -0,0 +1,58 @@
+__all__ = ["fan_out", "host_key"]
+
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+
+def host_key(url):
+    return urlsplit(url).netloc
+
+
+def fan_out(func, items, max_workers=1, max_per_key=None, key=None):
+    """
+    Call func for every item with bounded concurrency
+
+    Arguments:
+        func {callable} -- called with one item
+        items {Iterable} -- work items
+
+    Keyword Arguments:
+        max_workers {int} -- global limit, 1 or None: run in caller thread (default: {1})
+        max_per_key {int} -- limit of concurrent calls per key (default: {None})
+        key {callable} -- maps item to key, e.g. host_key (default: {None})
+
+    Returns:
+        list((result, exception)) -- in input order
+    """  # noqa: E501
+    items = list(items)
+
+    def _call(item):
+        try:
+            return func(item), None
+        except Exception as exc:
+            return None, exc
+
+    if not max_workers or max_workers <= 1 or len(items) <= 1:
+        return list(map(_call, items))
+
+    if max_per_key and key:
+        semaphores = {}
+        lock = threading.Lock()
+
+        def _limited(item):
+            k = key(item)
+            with lock:
+                semaphore = semaphores.get(k)
+                if not semaphore:
+                    semaphore = threading.BoundedSemaphore(max_per_key)
+                    semaphores[k] = semaphore
+            with semaphore:
+                return _call(item)
+    else:
+        _limited = _call
+
+    with ThreadPoolExecutor(
+        max_workers=min(max_workers, len(items))
+    ) as executor:
+        return list(executor.map(_limited, items))
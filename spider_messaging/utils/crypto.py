@@ -0,0 +1,275 @@
+__all__ = [
+    "generate_private_key", "private_key_pem", "certificate_hash",
+    "wrap_key", "unwrap_key", "sign_data", "verify_signature"
+]
+
+import base64
+
+from cryptography.exceptions import InvalidSignature
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import (
+    ed25519, padding, rsa, x25519
+)
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+from cryptography.hazmat.primitives.keywrap import (
+    aes_key_unwrap_with_padding, aes_key_wrap_with_padding
+)
+
+# tag of X25519 wrapped keys in key lists: x25519=<ephemeral key+wrapped>
+# (RSA wrapped keys are plain base64)
+x25519_tag = "x25519"
+# tag of Ed25519 signatures: ed25519=<signature>
+# (RSA-PSS signatures are tagged with the hash algorithm)
+ed25519_tag = "ed25519"
+
+# 2 ** 255 - 19, field of curve25519
+_p = 57896044618658097711785492504343953926634992332820282019728792003956564819949  # noqa: E501
+_raw = {
+    "encoding": serialization.Encoding.Raw,
+    "format": serialization.PublicFormat.Raw
+}
+# u coordinates of the points of small order on curve25519, shared
+# secrets with them are predictable
+_low_order_u = frozenset({
+    0, 1, _p - 1,
+    325606250916557431795983626356110631294008115727848805560023387167927233504,  # noqa: E501
+    39382357235489614581723060781553021112529911719440698176882885853963445705823  # noqa: E501
+})
+# hash algorithms accepted in the tags of RSA-PSS signatures
+_signature_hashes = {
+    algo.name: algo for algo in (
+        hashes.SHA256, hashes.SHA384, hashes.SHA512, hashes.SHA512_256,
+        hashes.SHA3_256, hashes.SHA3_384, hashes.SHA3_512
+    )
+}
+
+
+def generate_private_key(keytype="rsa", keysize=8192):
+    """
+    Arguments:
+        keytype {str} -- rsa or ed25519 (default: {"rsa"})
+        keysize {int} -- size of rsa keys (default: {8192})
+
+    Returns:
+        private key
+    """
+    if keytype == "ed25519":
+        return ed25519.Ed25519PrivateKey.generate()
+    elif keytype == "rsa":
+        return rsa.generate_private_key(
+            public_exponent=65537,
+            key_size=keysize,
+            backend=default_backend()
+        )
+    raise ValueError("unknown key type: %s" % keytype)
+
+
+def private_key_pem(private_key):
+    return private_key.private_bytes(
+        encoding=serialization.Encoding.PEM,
+        # Ed25519 keys have no traditional format
+        format=(
+            serialization.PrivateFormat.TraditionalOpenSSL
+            if isinstance(private_key, rsa.RSAPrivateKey)
+            else serialization.PrivateFormat.PKCS8
+        ),
+        encryption_algorithm=serialization.NoEncryption(),
+    )
+
+
+def certificate_hash(private_key, algo):
+    """ hash algorithm for signing certificates, Ed25519 requires None """
+    if isinstance(private_key, ed25519.Ed25519PrivateKey):
+        return None
+    return algo
+
+
+def _x25519_from_bytes(raw):
+    """ X25519 public key, rejects points of small order """
+    u = int.from_bytes(raw, "little") & ((1 << 255) - 1)
+    if u % _p in _low_order_u:
+        raise ValueError("X25519 key of small order")
+    return x25519.X25519PublicKey.from_public_bytes(raw)
+
+
+def _x25519_public(public_key):
+    if isinstance(public_key, x25519.X25519PublicKey):
+        return _x25519_from_bytes(public_key.public_bytes(**_raw))
+    if not isinstance(public_key, ed25519.Ed25519PublicKey):
+        raise ValueError("not a X25519/Ed25519 key")
+    # birational map of edwards y to montgomery u: u = (1 + y) / (1 - y)
+    y = int.from_bytes(public_key.public_bytes(**_raw), "little")
+    y &= (1 << 255) - 1
+    if y >= _p:
+        raise ValueError("non canonical Ed25519 key")
+    u = (1 + y) * pow(1 - y, _p - 2, _p) % _p
+    return _x25519_from_bytes(u.to_bytes(32, "little"))
+
+
+def _x25519_private(private_key):
+    if isinstance(private_key, x25519.X25519PrivateKey):
+        return private_key
+    # the X25519 scalar is the (clamped) first half of sha512(seed)
+    digest = hashes.Hash(hashes.SHA512(), backend=default_backend())
+    digest.update(private_key.private_bytes(
+        encoding=serialization.Encoding.Raw,
+        format=serialization.PrivateFormat.Raw,
+        encryption_algorithm=serialization.NoEncryption()
+    ))
+    return x25519.X25519PrivateKey.from_private_bytes(
+        digest.finalize()[:32]
+    )
+
+
+def _x25519_kek(shared, ephemeral, recipient):
+    return HKDF(
+        algorithm=hashes.SHA256(), length=32, salt=None,
+        info=b"spkc-x25519%s%s" % (ephemeral, recipient),
+        backend=default_backend()
+    ).derive(shared)
+
+
+def wrap_key(public_key, data, hash_algo):
+    """
+    Encrypt key for public key (key_list value)
+
+    RSA: OAEP, EC: ephemeral X25519 agreement, HKDF, AES key wrap
+
+    Arguments:
+        public_key {public key} -- RSA, Ed25519 or X25519 key
+        data {bytes} -- key
+        hash_algo {HashAlgorithm} -- OAEP hash algorithm
+
+    Returns:
+        str -- wrapped key
+    """
+    if isinstance(public_key, rsa.RSAPublicKey):
+        return base64.b64encode(public_key.encrypt(
+            data,
+            padding.OAEP(
+                mgf=padding.MGF1(algorithm=hash_algo),
+                algorithm=hash_algo, label=None
+            )
+        )).decode("ascii")
+    recipient = _x25519_public(public_key)
+    ephemeral = x25519.X25519PrivateKey.generate()
+    ephemeral_raw = ephemeral.public_key().public_bytes(**_raw)
+    kek = _x25519_kek(
+        ephemeral.exchange(recipient), ephemeral_raw,
+        recipient.public_bytes(**_raw)
+    )
+    return "%s=%s" % (
+        x25519_tag,
+        base64.b64encode(
+            ephemeral_raw + aes_key_wrap_with_padding(kek, data)
+        ).decode("ascii")
+    )
+
+
+def unwrap_key(private_key, value, hash_algo):
+    """
+    Decrypt key_list value
+
+    Arguments:
+        private_key {private key} -- RSA, Ed25519 or X25519 key
+        value {str} -- wrapped key
+        hash_algo {HashAlgorithm} -- OAEP hash algorithm
+
+    Raises:
+        ValueError: wrong key or value
+
+    Returns:
+        bytes -- key
+    """
+    if not value.startswith("%s=" % x25519_tag):
+        if not isinstance(private_key, rsa.RSAPrivateKey):
+            raise ValueError("RSA wrapped key requires RSA private key")
+        return private_key.decrypt(
+            base64.b64decode(value),
+            padding.OAEP(
+                mgf=padding.MGF1(algorithm=hash_algo),
+                algorithm=hash_algo,
+                label=None
+            )
+        )
+    if isinstance(private_key, rsa.RSAPrivateKey):
+        raise ValueError("X25519 wrapped key requires EC private key")
+    data = base64.b64decode(value[len(x25519_tag) + 1:])
+    private_key = _x25519_private(private_key)
+    kek = _x25519_kek(
+        private_key.exchange(_x25519_from_bytes(data[:32])),
+        data[:32], private_key.public_key().public_bytes(**_raw)
+    )
+    return aes_key_unwrap_with_padding(kek, data[32:])
+
+
+def sign_data(private_key, data, hash_algo):
+    """
+    Arguments:
+        private_key {private key} -- RSA or Ed25519 key
+        data {bytes} -- data, e.g. attestation
+        hash_algo {HashAlgorithm} -- PSS hash algorithm
+
+    Returns:
+        str -- <tag>=<base64 signature>, tag is ed25519 or the hash algorithm
+    """  # noqa: E501
+    if isinstance(private_key, ed25519.Ed25519PrivateKey):
+        return "%s=%s" % (
+            ed25519_tag,
+            base64.b64encode(private_key.sign(data)).decode("ascii")
+        )
+    return "%s=%s" % (
+        hash_algo.name,
+        base64.b64encode(
+            private_key.sign(
+                data,
+                padding.PSS(
+                    mgf=padding.MGF1(hash_algo),
+                    salt_length=padding.PSS.MAX_LENGTH
+                ),
+                hash_algo
+            )
+        ).decode("ascii")
+    )
+
+
+def verify_signature(public_key, signature, data, hash_algo=None):
+    """
+    Arguments:
+        public_key {public key} -- RSA or Ed25519 key
+        signature {str} -- <tag>=<base64 signature>
+        data {bytes} -- signed data
+
+    Keyword Arguments:
+        hash_algo {HashAlgorithm} -- required hash algorithm of RSA-PSS signatures, None: any of _signature_hashes (default: {None})
+
+    Raises:
+        InvalidSignature: signature does not match
+        ValueError: invalid format, weak or unexpected hash algorithm
+    """  # noqa: E501
+    tag, signature = signature.split("=", 1)
+    signature = base64.b64decode(signature)
+    if tag == ed25519_tag:
+        if not isinstance(public_key, ed25519.Ed25519PublicKey):
+            raise InvalidSignature()
+        public_key.verify(signature, data)
+        return
+    if not isinstance(public_key, rsa.RSAPublicKey):
+        raise InvalidSignature()
+    # the tag is untrusted input, only strong algorithms
+    algo = _signature_hashes.get(tag.lower())
+    if not algo:
+        raise ValueError("unsupported hash algorithm: %s" % tag)
+    if hash_algo and algo.name != hash_algo.name:
+        raise ValueError("unexpected hash algorithm: %s" % tag)
+    algo = algo()
+    public_key.verify(
+        signature,
+        data,
+        padding.PSS(
+            mgf=padding.MGF1(algo),
+            salt_length=padding.PSS.MAX_LENGTH
+        ),
+        algo
+    )
@@ -0,0 +1,144 @@
+__all__ = ["EpochKeys", "EpochKeyCache", "is_epoch_key"]
+
+import base64
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from cryptography.hazmat.primitives.keywrap import (
+    aes_key_unwrap, aes_key_wrap
+)
+
+from .crypto import wrap_key
+
+# key_list values of epoch mode: epoch:<wrapped kek>:<wrapped content key>
+# (base64 contains no ":", so they cannot be confused with plain values)
+epoch_prefix = "epoch:"
+
+
+def is_epoch_key(value):
+    return value.startswith(epoch_prefix)
+
+
+class EpochKeys(object):
+    """
+    Sender side key encryption keys (KEK) of recipient key sets
+
+    A KEK is encrypted (wrap_key) once for every key of a key set, content
+    keys are wrapped with AES key wrap under the KEK. A new KEK is used if
+    the key set (and so the attestation) changes or max_age is exceeded.
+    """
+    max_age = None
+    maxsize = None
+    # (hash algorithm, key hashes): (expires, kek, {key hash: wrapped kek})
+    _entries = None
+    _lock = None
+
+    def __init__(self, max_age=86400, maxsize=256):
+        self.max_age = max_age
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _epoch(self, keys, hash_algo):
+        ident = (hash_algo.name, frozenset(k[0] for k in keys))
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(ident)
+            if entry and entry[0] > now:
+                self._entries.move_to_end(ident)
+                return entry
+        kek = os.urandom(32)
+        wrapped = {
+            k[0]: wrap_key(k[1], kek, hash_algo) for k in keys
+        }
+        entry = (now + self.max_age, kek, wrapped)
+        with self._lock:
+            self._entries[ident] = entry
+            self._entries.move_to_end(ident)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        return entry
+
+    def key_list(self, aes_key, keys, hash_algo):
+        """
+        Wrap content key for recipient keys
+
+        Arguments:
+            aes_key {bytes} -- content key
+            keys {Iterable((hash, public key, ...))} -- recipient keys, hash is a digest of hash_algo
+            hash_algo {HashAlgorithm} -- hash algorithm of recipients
+
+        Returns:
+            dict -- key list
+        """  # noqa: E501
+        keys = list(keys)
+        _, kek, wrapped = self._epoch(keys, hash_algo)
+        wrapped_key = base64.b64encode(
+            aes_key_wrap(kek, aes_key)
+        ).decode("ascii")
+        return {
+            "%s=%s" % (hash_algo.name, k[0].hex()): "%s%s:%s" % (
+                epoch_prefix, wrapped[k[0]], wrapped_key
+            ) for k in keys
+        }
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class EpochKeyCache(object):
+    """
+    Receiver side, size bounded LRU cache of decrypted KEKs
+
+    Keyed by a digest of the encrypted KEK, so only the first message of
+    an epoch requires a private key operation
+    """
+    maxsize = None
+    _entries = None
+    _lock = None
+
+    def __init__(self, maxsize=256):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def unwrap(self, value, decrypt):
+        """
+        Unwrap content key of an epoch key_list value
+
+        Arguments:
+            value {str} -- key_list value
+            decrypt {callable} -- decrypts encrypted KEK (wrap_key format)
+
+        Raises:
+            ValueError: invalid value
+            InvalidUnwrap: KEK does not match
+
+        Returns:
+            bytes -- content key
+        """
+        try:
+            wrapped_kek, wrapped_key = \
+                value[len(epoch_prefix):].split(":")
+        except ValueError as exc:
+            raise ValueError("invalid epoch key") from exc
+        ident = hashlib.sha256(wrapped_kek.encode("ascii")).digest()
+        with self._lock:
+            kek = self._entries.get(ident)
+            if kek:
+                self._entries.move_to_end(ident)
+        if not kek:
+            kek = decrypt(wrapped_kek)
+            with self._lock:
+                self._entries[ident] = kek
+                while len(self._entries) > self.maxsize:
+                    self._entries.popitem(last=False)
+        return aes_key_unwrap(kek, base64.b64decode(wrapped_key))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
@@ -1,16 +1,317 @@
-__all__ = ["get_pages", "get_postboxes", "map_keys", "extract_property"]
+__all__ = [
+    "GraphIndex", "get_pages", "get_postboxes", "map_keys",
+    "extract_property", "parse_response", "retrieve_pages"
+]
 
 import logging
-from rdflib import XSD, Literal, URIRef
+from rdflib import XSD, Graph, Literal, URIRef
+from rdflib.plugins.sparql import prepareQuery
 
 from spkcspider.constants import spkcgraph
+from spkcspider.utils.urls import merge_get_url
 from cryptography.hazmat.backends import default_backend
-from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives import hashes
 
-from .keys import load_public_key
+from .concurrency import fan_out
+from .keys import key_info
+from .turtle import parse_stream
+
+# upper limit of parallel page retrievals if not specified
+max_pages_in_flight = 16
+# chunk size for streamed turtle responses
+stream_chunk_size = 2 ** 16
+
+# answer extractors with the original SPARQL queries instead of GraphIndex,
+# for cross-checking
+use_sparql = False
+
+# queries are parsed once at import, parsing is slow and not thread safe
+_extract_property_query = prepareQuery(
+    """
+        SELECT ?base ?prop_val
+        WHERE {
+
+            _:p1 spkc:name ?prop_name ;
+                 spkc:value ?prop_val .
+            OPTIONAL {
+                _:p1 ^spkc:properties ?base .
+            }
+        }
+    """,
+    initNs={"spkc": spkcgraph}
+)
+
+_num_pages_query = prepareQuery(
+    """
+        SELECT ?action_view ?pages
+        WHERE {
+            ?base spkc:pages.num_pages ?pages ;
+                  spkc:action:view ?action_view .
+        }
+    """,
+    initNs={"spkc": spkcgraph}
+)
+
+_current_pages_query = prepareQuery(
+    """
+        SELECT ?page
+        WHERE {
+            ?base spkc:pages.current_page ?page .
+        }
+    """,
+    initNs={"spkc": spkcgraph}
+)
+
+_map_keys_query = prepareQuery(
+    """
+        SELECT ?key_value ?hashalgo_value ?thirdparty_value
+        WHERE {
+            ?base spkc:contents | ( spkc:properties / spkc:value) ?kb .
+            ?kb spkc:type ?key_type .
+            _:p1 ^spkc:properties ?kb ;
+                 spkc:name        ?key_name ;
+                 spkc:value       ?key_value .
+            _:p2 ^spkc:properties ?kb ;
+                 spkc:name        ?hashalgo_name ;
+                 spkc:value       ?hashalgo_value .
+            OPTIONAL{
+                _:p3 ^spkc:properties ?kb ;
+                     spkc:name        ?thirdparty_name ;
+                     spkc:value       ?thirdparty_value .
+            }
+
+        }
+    """,
+    initNs={"spkc": spkcgraph}
+)
+
+# properties of all postboxes, signature entries joined in
+_postboxes_query = prepareQuery(
+    """
+        SELECT
+        ?postbox ?name ?value ?key_name ?key_value
+        WHERE {
+            ?postbox spkc:type ?postbox_type;
+                     spkc:properties ?property .
+            ?property spkc:name ?name ;
+                      spkc:value  ?value .
+            OPTIONAL {
+                ?value spkc:properties ?key_base_prop .
+                ?key_base_prop spkc:name ?key_name ;
+                               spkc:value ?key_value .
+            }
+        }
+    """,
+    initNs={"spkc": spkcgraph}
+)
+
+
+class GraphIndex(object):
+    """
+    One pass index over the spkc triples of a graph
+
+    Extractors accept a GraphIndex instead of a graph, so an index can be
+    shared between multiple extractions on the same (unchanged) graph.
+    Partial indexes only contain the subjects added with add_subjects,
+    they are used by extractors needing only a few subjects.
+    """
+    graph = None
+    # every subject is indexed
+    complete = False
+    # subject: {name: [values]}
+    properties = None
+    # property node: (subject, name)
+    property_nodes = None
+    # subject: type
+    types = None
+    # subject: [contents]
+    contents = None
+    # subject: (action:view, num_pages)
+    pages = None
+    # current_page values
+    read_pages = None
+    # subjects of partial index
+    _indexed = None
+
+    _pred_properties = spkcgraph["properties"]
+    _pred_name = spkcgraph["name"]
+    _pred_value = spkcgraph["value"]
+    _pred_type = spkcgraph["type"]
+    _pred_contents = spkcgraph["contents"]
+    _pred_num_pages = spkcgraph["pages.num_pages"]
+    _pred_current_page = spkcgraph["pages.current_page"]
+    _pred_action_view = spkcgraph["action:view"]
+
+    def __init__(self, graph, subjects=None):
+        """
+        Arguments:
+            graph {Graph} -- graph
+
+        Keyword Arguments:
+            subjects {Iterable} -- create partial index of subjects, None: one pass over all triples (default: {None})
+        """  # noqa: E501
+        self.graph = graph
+        self.properties = {}
+        self.property_nodes = {}
+        self.types = {}
+        self.contents = {}
+        self.pages = {}
+        self.read_pages = set()
+        if subjects is not None:
+            self._indexed = set()
+            self.add_subjects(subjects)
+            return
+        self.complete = True
+        # property node: base
+        bases = {}
+        # property node: name
+        names = {}
+        # property node: [values]
+        values = {}
+        num_pages = {}
+        action_view = {}
+
+        prefix = str(spkcgraph)
+        for s, p, o in graph.triples((None, None, None)):
+            if not p.startswith(prefix):
+                continue
+            if p == self._pred_properties:
+                bases[o] = s
+            elif p == self._pred_name:
+                names[s] = str(o)
+            elif p == self._pred_value:
+                values.setdefault(s, []).append(o)
+            elif p == self._pred_type:
+                self.types[s] = str(o)
+            elif p == self._pred_contents:
+                self.contents.setdefault(s, []).append(o)
+            elif p == self._pred_num_pages:
+                num_pages[s] = o
+            elif p == self._pred_current_page:
+                self.read_pages.add(o.toPython())
+            elif p == self._pred_action_view:
+                action_view[s] = o
+
+        for node, name in names.items():
+            if node not in values:
+                continue
+            base = bases.get(node)
+            self.property_nodes[node] = (base, name)
+            self.properties.setdefault(base, {}).setdefault(
+                name, []
+            ).extend(values[node])
+
+        for subject, pages in num_pages.items():
+            if subject in action_view:
+                self.pages[subject] = (action_view[subject], pages)
+
+    def add_subjects(self, subjects):
+        """
+        Add subjects to partial index, uses the indexes of the graph
+        instead of a pass over all triples
+
+        Arguments:
+            subjects {Iterable} -- subjects with their property nodes
+        """
+        if self.complete:
+            return
+        for subject in subjects:
+            if subject in self._indexed:
+                continue
+            self._indexed.add(subject)
+            num_pages = None
+            action_view = None
+            for p, o in self.graph.predicate_objects(subject):
+                if p == self._pred_properties:
+                    name = self.graph.value(o, self._pred_name)
+                    values = list(self.graph.objects(o, self._pred_value))
+                    if name is None or not values:
+                        continue
+                    self.property_nodes[o] = (subject, str(name))
+                    self.properties.setdefault(subject, {}).setdefault(
+                        str(name), []
+                    ).extend(values)
+                elif p == self._pred_type:
+                    self.types[subject] = str(o)
+                elif p == self._pred_contents:
+                    self.contents.setdefault(subject, []).append(o)
+                elif p == self._pred_num_pages:
+                    num_pages = o
+                elif p == self._pred_current_page:
+                    self.read_pages.add(o.toPython())
+                elif p == self._pred_action_view:
+                    action_view = o
+            if num_pages is not None and action_view is not None:
+                self.pages[subject] = (action_view, num_pages)
+
+    @classmethod
+    def from_graph(cls, graph, subjects=None):
+        """
+        Arguments:
+            graph {Graph,GraphIndex} -- graph or (reused) index
+
+        Keyword Arguments:
+            subjects {Iterable} -- partial index of subjects if graph is a Graph, see __init__ (default: {None})
+        """  # noqa: E501
+        if isinstance(graph, cls):
+            return graph
+        return cls(graph, subjects=subjects)
+
+    def get(self, subject, name, default=None):
+        """
+        First value of property
+
+        Arguments:
+            subject {URIRef,BNode} -- subject with spkc:properties
+            name {str} -- spkc:name of property
+
+        Keyword Arguments:
+            default {any} -- returned if property is missing (default: {None})
+
+        Returns:
+            Node -- value
+        """  # noqa: E501
+        vals = self.properties.get(subject, {}).get(name)
+        if not vals:
+            return default
+        return vals[0]
+
+    def values(self, subject, name):
+        return self.properties.get(subject, {}).get(name, [])
+
+    def subjects(self, type=None):
+        if type is None:
+            return list(self.properties.keys())
+        return [s for s, t in self.types.items() if t == type]
+
+
+def _unwrap_graph(graph):
+    if isinstance(graph, GraphIndex):
+        return graph.graph
+    return graph
 
 
 def extract_property(graph, name, url=None):
+    if use_sparql:
+        return _extract_property_sparql(_unwrap_graph(graph), name, url=url)
+    if url:
+        url = url.split("?", 1)[0]
+        index = GraphIndex.from_graph(graph, subjects=[URIRef(url)])
+        vals = index.values(URIRef(url), name)
+        if not vals:
+            raise KeyError(url)
+        return vals[-1].toPython()
+    index = GraphIndex.from_graph(graph)
+    ret = {}
+    for base, props in index.properties.items():
+        if name not in props:
+            continue
+        ret[base.toPython() if base is not None else None] = \
+            props[name][-1].toPython()
+    return ret
+
+
+def _extract_property_sparql(graph, name, url=None):
     bindings = {
         "prop_name": Literal(
             name, datatype=XSD.string
@@ -20,18 +321,7 @@ def extract_property(graph, name, url=None):
         url = url.split("?", 1)[0]
         bindings["base"] = URIRef(url)
     ret = dict(map(lambda x: (x[0].toPython(), x[1].toPython()), graph.query(
-        """
-            SELECT ?base ?prop_val
-            WHERE {
-
-                _:p1 spkc:name ?prop_name ;
-                     spkc:value ?prop_val .
-                OPTIONAL {
-                    _:p1 ^spkc:properties ?base .
-                }
-            }
-        """,
-        initNs={"spkc": spkcgraph},
+        _extract_property_query,
         initBindings=bindings
     )))
     if url:
@@ -41,28 +331,40 @@ def extract_property(graph, name, url=None):
 
 
 def get_pages(graph):
-    tmp = list(map(lambda x: x, graph.query(
-        """
-            SELECT ?action_view ?pages
-            WHERE {
-                ?base spkc:pages.num_pages ?pages ;
-                      spkc:action:view ?action_view .
-            }
-        """,
-        initNs={"spkc": spkcgraph}
-    )))
+    if use_sparql:
+        return _get_pages_sparql(_unwrap_graph(graph))
+    index = GraphIndex.from_graph(graph, subjects=(
+        _unwrap_graph(graph).subjects(GraphIndex._pred_num_pages, None)
+    ))
+    if not index.pages:
+        # same error as the SPARQL variant, callers catch it
+        raise IndexError("no pages found")
+    action_view, pages = next(iter(index.pages.values()))
+    url = str(action_view)
+    pages = pages.toPython()
+    read_pages = index.read_pages
+    if not index.complete:
+        # current_page of all subjects
+        read_pages = read_pages.union(map(
+            lambda x: x.toPython(),
+            index.graph.objects(None, GraphIndex._pred_current_page)
+        ))
+
+    def _iter():
+        for page in range(1, pages+1):
+            if page not in read_pages:
+                yield page
+    return url, _iter()
+
+
+def _get_pages_sparql(graph):
+    tmp = list(graph.query(_num_pages_query))
     url = str(tmp[0].action_view)
     pages = tmp[0].pages.toPython()
 
-    read_pages = set(map(lambda x: x[0].toPython(), graph.query(
-        """
-            SELECT ?page
-            WHERE {
-                ?base spkc:pages.current_page ?page .
-            }
-        """,
-        initNs={"spkc": spkcgraph}
-    )))
+    read_pages = set(map(
+        lambda x: x[0].toPython(), graph.query(_current_pages_query)
+    ))
 
     def _iter():
         for page in range(1, pages+1):
@@ -71,6 +373,76 @@ def get_pages(graph):
     return url, _iter()
 
 
+def parse_response(graph, response, stream=False):
+    """
+    Parse turtle response into graph
+
+    Arguments:
+        graph {Graph} -- target graph
+        response {requests.Response} -- response, requested with stream=True for streaming
+
+    Keyword Arguments:
+        stream {bool} -- parse incrementally and keep only spkc triples (default: {False})
+
+    Returns:
+        Graph -- graph
+    """  # noqa: E501
+    if stream:
+        return parse_stream(
+            graph, response.iter_content(stream_chunk_size)
+        )
+    graph.parse(data=response.content, format="turtle")
+    return graph
+
+
+def retrieve_pages(
+    session, url, pages, graph, headers=None, timeout=60, max_in_flight=None,
+    stream=False
+):
+    """
+    Retrieve pages concurrently and merge them into graph
+
+    Every page is parsed into its own graph, merged after all succeeded
+
+    Arguments:
+        session {requests.Session} -- session used for retrieval
+        url {str} -- url of listing, page is added as GET parameter
+        pages {Iterable(int)} -- pages to retrieve, e.g. from get_pages
+        graph {Graph} -- target graph
+
+    Keyword Arguments:
+        headers {dict} -- extra headers (default: {None})
+        timeout {int} -- timeout per request (default: {60})
+        max_in_flight {int} -- parallel retrievals, 1: serial (default: {None})
+        stream {bool} -- use streaming parser, see parse_response (default: {False})
+
+    Returns:
+        Graph -- graph
+    """  # noqa: E501
+    pages = list(pages)
+    if not pages:
+        return graph
+
+    def _retrieve(page):
+        with session.get(
+            merge_get_url(url, page=page), headers=headers,
+            timeout=timeout, stream=stream
+        ) as response:
+            response.raise_for_status()
+            return parse_response(Graph(), response, stream=stream)
+
+    results = fan_out(
+        _retrieve, pages,
+        max_workers=max_in_flight or min(len(pages), max_pages_in_flight)
+    )
+    for _, exc in results:
+        if exc:
+            raise exc
+    for page_graph, _ in results:
+        graph += page_graph
+    return graph
+
+
 def map_keys(graph, url=None, field="pubkeyhash", hash_algo=None):
     """
     [summary]
@@ -86,76 +458,38 @@ def map_keys(graph, url=None, field="pubkeyhash", hash_algo=None):
     Returns:
         [type] -- [description]
     """  # noqa E502
+    if use_sparql:
+        rows = _map_keys_sparql(_unwrap_graph(graph), url=url)
+    else:
+        rows = _map_keys_index(GraphIndex.from_graph(graph), url=url)
     _map = {}
     _found_algos = set()
-    bindings = {
-        "key_type": Literal(
-            "PublicKey", datatype=XSD.string
-        ),
-        "key_name": Literal(
-            "key", datatype=XSD.string
-        ),
-        "hashalgo_name": Literal(
-            "hash_algorithm", datatype=XSD.string
-        ),
-        "thirdparty_name": Literal(
-            "thirdparty", datatype=XSD.string
-        ),
-    }
-    if url:
-        bindings["base"] = URIRef(url.split("?", 1)[0])
-    for i in graph.query(
-        """
-            SELECT ?key_value ?hashalgo_value ?thirdparty_value
-            WHERE {
-                ?base spkc:contents | ( spkc:properties / spkc:value) ?kb .
-                ?kb spkc:type ?key_type .
-                _:p1 ^spkc:properties ?kb ;
-                     spkc:name        ?key_name ;
-                     spkc:value       ?key_value .
-                _:p2 ^spkc:properties ?kb ;
-                     spkc:name        ?hashalgo_name ;
-                     spkc:value       ?hashalgo_value .
-                OPTIONAL{
-                    _:p3 ^spkc:properties ?kb ;
-                         spkc:name        ?thirdparty_name ;
-                         spkc:value       ?thirdparty_value .
-                }
-
-            }
-        """,
-        initNs={"spkc": spkcgraph},
-        initBindings=bindings
-    ):
+    for key_value, hashalgo_value, thirdparty_value in rows:
         if hash_algo:
             _hash_algo = hash_algo
         else:
             _hash_algo = getattr(
-                hashes, i.hashalgo_value.toPython().upper()
+                hashes, hashalgo_value.toPython().upper()
             )()
             if hash_algo is None:
                 hash_algo = _hash_algo
             else:
                 _found_algos.add(_hash_algo.name)
-        digest = hashes.Hash(_hash_algo, backend=default_backend())
-        digest.update(i.key_value.encode("utf8"))
         item = {
             "thirdparty":
-                i.thirdparty_value.toPython() if i.thirdparty_value else False,
-            "hash": digest.finalize()
+                thirdparty_value.toPython() if thirdparty_value else False
         }
         try:
-            item["pubkey"] = load_public_key(i.key_value)
-            item["pubkeypem"] = item["pubkey"].public_bytes(
-                encoding=serialization.Encoding.PEM,
-                format=serialization.PublicFormat.SubjectPublicKeyInfo
-            ).strip()
-            digest = hashes.Hash(_hash_algo, backend=default_backend())
-            digest.update(item["pubkeypem"])
-            item["pubkeyhash"] = digest.finalize()
-            item["pubkeypem"] = item["pubkeypem"].decode("ascii")
+            info = key_info(key_value)
+            item["hash"] = info.fingerprint(_hash_algo, raw=True)
+            item["pubkey"] = info.key
+            item["pubkeypem"] = info.pem.decode("ascii")
+            item["pubkeyhash"] = info.fingerprint(_hash_algo)
         except Exception as exc:
             logging.info("Could not extract public key", exc_info=exc)
+            digest = hashes.Hash(_hash_algo, backend=default_backend())
+            digest.update(key_value.encode("utf8"))
+            item["hash"] = digest.finalize()
         if field not in item:
             continue
         _map[item.pop(field)] = item
@@ -165,70 +499,129 @@ def map_keys(graph, url=None, field="pubkeyhash", hash_algo=None):
     return _map, _found_algos
 
 
+def _map_keys_index(index, url=None):
+    if url:
+        base = URIRef(url.split("?", 1)[0])
+        candidates = list(index.contents.get(base, []))
+        for vals in index.properties.get(base, {}).values():
+            candidates.extend(vals)
+    else:
+        candidates = []
+        for contents in index.contents.values():
+            candidates.extend(contents)
+        for props in index.properties.values():
+            for vals in props.values():
+                candidates.extend(vals)
+    seen = set()
+    for kb in candidates:
+        if kb in seen or index.types.get(kb) != "PublicKey":
+            continue
+        seen.add(kb)
+        key_value = index.get(kb, "key")
+        hashalgo_value = index.get(kb, "hash_algorithm")
+        if key_value is None or hashalgo_value is None:
+            continue
+        yield key_value, hashalgo_value, index.get(kb, "thirdparty")
+
+
+def _map_keys_sparql(graph, url=None):
+    bindings = {
+        "key_type": Literal(
+            "PublicKey", datatype=XSD.string
+        ),
+        "key_name": Literal(
+            "key", datatype=XSD.string
+        ),
+        "hashalgo_name": Literal(
+            "hash_algorithm", datatype=XSD.string
+        ),
+        "thirdparty_name": Literal(
+            "thirdparty", datatype=XSD.string
+        ),
+    }
+    if url:
+        bindings["base"] = URIRef(url.split("?", 1)[0])
+    for i in graph.query(
+        _map_keys_query,
+        initBindings=bindings
+    ):
+        yield i.key_value, i.hashalgo_value, i.thirdparty_value
+
+
 def get_postboxes(graph, url=None):
+    if use_sparql:
+        return _get_postboxes_sparql(_unwrap_graph(graph), url=url)
+    if url:
+        uris = [URIRef(url.split("?", 1)[0])]
+    else:
+        uris = _unwrap_graph(graph).subjects(
+            GraphIndex._pred_type, Literal("PostBox", datatype=XSD.string)
+        )
+    index = GraphIndex.from_graph(graph, subjects=uris)
+    if url:
+        if index.types.get(uris[0]) != "PostBox":
+            uris = []
+    else:
+        uris = index.subjects("PostBox")
+    # signature entries
+    index.add_subjects([
+        key_base for uri in uris
+        for key_base in index.values(uri, "signatures")
+    ])
+    postboxes = {}
+    for uri in uris:
+        props = index.properties.get(uri)
+        if not props:
+            continue
+        postbox = postboxes.setdefault(str(uri), {})
+        for name, vals in props.items():
+            if name == "hash_algorithm":
+                postbox[name] = getattr(
+                    hashes, vals[-1].toPython().upper()
+                )()
+            else:
+                postbox[name] = vals[-1].toPython()
+        src = postbox["signatures"] = {}
+        for key_base in props.get("signatures", []):
+            key_props = index.properties.get(key_base)
+            if not key_props:
+                continue
+            entry = src.setdefault(str(key_base), {})
+            for key_name, key_vals in key_props.items():
+                entry[key_name] = key_vals[-1].toPython()
+    return postboxes
+
+
+def _get_postboxes_sparql(graph, url=None):
     postboxes = {}
     find_postbox_params = {
         "postbox_type": Literal(
             "PostBox", datatype=XSD.string
-        ),
-        "postbox_name": Literal(
-            "signatures", datatype=XSD.string
         )
     }
     if url:
         find_postbox_params["postbox"] = URIRef(url.split("?", 1)[0])
 
+    # one query for all postboxes and their signatures, grouped here
     for i in graph.query(
-        """
-            SELECT
-            ?postbox ?name ?value
-            WHERE {
-                ?postbox spkc:type ?postbox_type;
-                         spkc:properties ?property .
-                ?property spkc:name ?name ;
-                          spkc:value  ?value .
-            }
-        """,
-        initNs={"spkc": spkcgraph},
+        _postboxes_query,
         initBindings=find_postbox_params
     ):
-        postbox = str(i.postbox)
+        postbox = postboxes.setdefault(str(i.postbox), {})
         name = i.name.toPython()
-        postboxes.setdefault(postbox, {})
-        if name == "hash_algorithm":
-            postboxes[postbox][name] = getattr(
+        if name == "signatures":
+            src = postbox.setdefault("signatures", {})
+            if i.key_name is None:
+                continue
+            value = str(i.value)
+            src.setdefault(value, {})
+            src[value][str(i.key_name)] = i.key_value.toPython()
+        elif name == "hash_algorithm":
+            postbox[name] = getattr(
                 hashes, i.value.toPython().upper()
             )()
         else:
-            postboxes[postbox][name] = i.value.toPython()
-
-    uris = set(map(URIRef, postboxes.keys()))
-
-    for uri in uris:
-        postboxes[str(uri)]["signatures"] = {}
-        src = postboxes[str(uri)]["signatures"]
-        for i in graph.query(
-            """
-                SELECT
-                ?key_base ?key_name ?key_value
-                WHERE {
-                    ?postbox spkc:properties ?property .
-                    ?property spkc:name ?postbox_name ;
-                              spkc:value ?key_base .
-                    ?key_base spkc:properties ?key_base_prop .
-                    ?key_base_prop spkc:name ?key_name ;
-                                   spkc:value ?key_value .
-                }
-            """,
-            initNs={"spkc": spkcgraph},
-            initBindings={
-                "postbox": uri,
-                "postbox_name": Literal(
-                    "signatures", datatype=XSD.string
-                )
-            }
-        ):
-            value = str(i.key_base)
-            src.setdefault(value, {})
-            src[value][str(i.key_name)] = i.key_value.toPython()
+            postbox[name] = i.value.toPython()
+    for postbox in postboxes.values():
+        postbox.setdefault("signatures", {})
     return postboxes
@@ -0,0 +1,175 @@
+__all__ = ["HtmlProperties"]
+
+from html.parser import HTMLParser
+
+from rdflib import XSD, Graph, Literal
+from rdflib.plugin import PluginException
+
+from spider_messaging.exceptions import SrcException
+
+# elements without end tag
+_void_elements = frozenset({
+    "area", "base", "br", "col", "embed", "hr", "img", "input", "link",
+    "meta", "param", "source", "track", "wbr"
+})
+
+_captured = frozenset({"spkc:name", "spkc:fieldname", "spkc:value"})
+
+
+def _to_python(text, datatype):
+    # templates use both, prefixed and full datatypes
+    if datatype and datatype.startswith("xsd:"):
+        datatype = XSD[datatype[4:]]
+    if datatype and datatype.startswith(str(XSD)):
+        return Literal(text, datatype=datatype).toPython()
+    return text
+
+
+class _PropertyScanner(HTMLParser):
+    """
+    Collect csrftoken and the literals of spkc:Property elements
+
+    Only understands the markup of the spkcspider templates, not RDFa
+    """
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.csrftoken = None
+        self.properties = []
+        # (tag, property, capture)
+        self._stack = []
+        self._open_properties = []
+        # [property, predicate, datatype, text parts]
+        self._captures = []
+
+    def handle_starttag(self, tag, attrs):
+        attrs = dict(attrs)
+        prop = None
+        capture = None
+        if "spkc:Property" in (attrs.get("typeof") or "").split():
+            prop = {"name": None, "fieldname": None, "values": []}
+            self.properties.append(prop)
+            self._open_properties.append(prop)
+        predicate = attrs.get("property")
+        if predicate == "spkc:csrftoken":
+            self.csrftoken = attrs.get("content", attrs.get("value"))
+        elif (
+            predicate in _captured and self._open_properties and
+            # about/resource change the subject/object, not a literal
+            not {"about", "resource", "href", "src", "rel"}.intersection(
+                attrs
+            )
+        ):
+            if "content" in attrs:
+                self._set(
+                    self._open_properties[-1], predicate,
+                    _to_python(attrs["content"], attrs.get("datatype"))
+                )
+            elif tag not in _void_elements:
+                capture = [
+                    self._open_properties[-1], predicate,
+                    attrs.get("datatype"), []
+                ]
+                self._captures.append(capture)
+        if tag not in _void_elements:
+            self._stack.append((tag, prop, capture))
+
+    def handle_startendtag(self, tag, attrs):
+        self.handle_starttag(tag, attrs)
+        if tag not in _void_elements:
+            self.handle_endtag(tag)
+
+    def handle_endtag(self, tag):
+        if not any(x[0] == tag for x in self._stack):
+            return
+        while self._stack:
+            stag, prop, capture = self._stack.pop()
+            if capture:
+                self._captures.remove(capture)
+                self._set(
+                    capture[0], capture[1],
+                    _to_python("".join(capture[3]), capture[2])
+                )
+            if prop:
+                self._open_properties.remove(prop)
+            if stag == tag:
+                break
+
+    def handle_data(self, data):
+        for capture in self._captures:
+            capture[3].append(data)
+
+    @staticmethod
+    def _set(prop, predicate, value):
+        if predicate == "spkc:value":
+            prop["values"].append(value)
+        else:
+            prop[predicate[5:]] = value
+
+
+class HtmlProperties(object):
+    """
+    csrftoken and properties of a spkcspider html page, extracted by a
+    targeted scan instead of RDFa parsing
+
+    graph() parses the page with the RDFa parser as fallback
+    """
+    content = None
+    csrftoken = None
+    # list of {name, fieldname, values}
+    properties = None
+    _graph = None
+
+    def __init__(self, content):
+        if isinstance(content, (bytes, bytearray, memoryview)):
+            content = bytes(content).decode("utf8", "replace")
+        self.content = content
+        scanner = _PropertyScanner()
+        scanner.feed(content)
+        scanner.close()
+        self.csrftoken = scanner.csrftoken
+        self.properties = scanner.properties
+
+    def values(self, name):
+        """
+        Arguments:
+            name {str} -- property name
+
+        Returns:
+            list -- values of properties with name
+        """
+        ret = []
+        for prop in self.properties:
+            if prop["name"] == name:
+                ret.extend(prop["values"])
+        return ret
+
+    def fields(self):
+        """
+        Returns:
+            dict -- fieldname: value, last value for multiple values
+        """
+        return {
+            prop["fieldname"]: prop["values"][-1]
+            for prop in self.properties
+            if prop["fieldname"] and prop["values"]
+        }
+
+    def graph(self):
+        """
+        Raises:
+            SrcException: rdflib has no html (RDFa) parser, rdflib >= 6 dropped it
+
+        Returns:
+            Graph -- RDFa parsed page, cached
+        """  # noqa: E501
+        if self._graph is None:
+            try:
+                graph = Graph().parse(data=self.content, format="html")
+            except PluginException as exc:
+                raise SrcException(
+                    "Page lacks expected properties and the RDFa parser "
+                    "is not available"
+                ) from exc
+            self._graph = graph
+        return self._graph
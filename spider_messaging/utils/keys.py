@@ -1,8 +1,14 @@
-__all__ = ["load_public_key", "load_priv_key"]
+__all__ = [
+    "load_public_key", "load_priv_key", "key_info", "key_fingerprint",
+    "CachedKey", "KeyCache", "key_cache"
+]
 
 import getpass
+import threading
+from collections import OrderedDict
 
 from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives import hashes, serialization
 from cryptography.hazmat.primitives.serialization import (
     load_pem_private_key, load_pem_public_key
 )
@@ -11,6 +17,139 @@ from cryptography.x509 import load_pem_x509_certificate
 defbackend = default_backend()
 
 
+class CachedKey(object):
+    """
+    Parsed public key with its (stripped) PEM and memoized fingerprints
+    """
+    key = None
+    pem = None
+    raw = None
+    _fingerprints = None
+
+    def __init__(self, key, raw=None):
+        self.key = key
+        self.pem = key.public_bytes(
+            encoding=serialization.Encoding.PEM,
+            format=serialization.PublicFormat.SubjectPublicKeyInfo
+        ).strip()
+        self.raw = raw if raw is not None else self.pem
+        self._fingerprints = {}
+
+    def _digest(self, algo, data):
+        digest = hashes.Hash(algo, backend=defbackend)
+        digest.update(data)
+        return digest.finalize()
+
+    def fingerprint(self, algo, raw=False):
+        """
+        Hash of PEM (default) or of the raw input bytes
+
+        Arguments:
+            algo {HashAlgorithm} -- hash algorithm
+
+        Keyword Arguments:
+            raw {bool} -- hash raw input instead of PEM (default: {False})
+
+        Returns:
+            bytes -- digest
+        """
+        if raw and self.raw == self.pem:
+            raw = False
+        # dict operations are atomic, at worst a digest is calculated twice
+        cache_key = (algo.name, algo.digest_size, raw)
+        ret = self._fingerprints.get(cache_key)
+        if ret is None:
+            ret = self._digest(algo, self.raw if raw else self.pem)
+            self._fingerprints[cache_key] = ret
+        return ret
+
+
+class KeyCache(object):
+    """
+    Size bounded, thread safe LRU cache of CachedKey objects
+
+    Keyed by the raw key bytes, key objects are looked up by identity
+    """
+    maxsize = None
+    _entries = None
+    _objects = None
+    _lock = None
+
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        # id(key object) -> raw, safe as entries keep the key object alive
+        self._objects = {}
+        self._lock = threading.Lock()
+
+    def _get(self, raw):
+        with self._lock:
+            entry = self._entries.get(raw)
+            if entry:
+                self._entries.move_to_end(raw)
+            return entry
+
+    def _set(self, raw, entry):
+        with self._lock:
+            old = self._entries.get(raw)
+            if old:
+                return old
+            self._entries[raw] = entry
+            self._objects.setdefault(id(entry.key), raw)
+            while len(self._entries) > self.maxsize:
+                _raw, _entry = self._entries.popitem(last=False)
+                if self._objects.get(id(_entry.key)) == _raw:
+                    del self._objects[id(_entry.key)]
+        return entry
+
+    def get(self, key):
+        """
+        Get or create CachedKey
+
+        Arguments:
+            key {str,bytes,public key,private key,certificate} -- key
+
+        Raises:
+            ValueError: not a key
+
+        Returns:
+            CachedKey -- cached key
+        """
+        if isinstance(key, str):
+            key = key.encode("utf8")
+        elif not isinstance(key, bytes):
+            if hasattr(key, "public_key"):
+                # private key or certificate
+                key = key.public_key()
+            with self._lock:
+                raw = self._objects.get(id(key))
+                entry = self._entries.get(raw) if raw else None
+            if entry and entry.key is key:
+                return entry
+            entry = CachedKey(key)
+            return self._get(entry.pem) or self._set(entry.pem, entry)
+        entry = self._get(key)
+        if entry:
+            return entry
+        return self._set(key, CachedKey(_parse_public_key(key), raw=key))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._objects.clear()
+
+
+key_cache = KeyCache()
+
+
+def key_info(key):
+    return key_cache.get(key)
+
+
+def key_fingerprint(key, algo):
+    return key_cache.get(key).fingerprint(algo)
+
+
 def load_priv_key(data, func=lambda: getpass("Enter passphrase:")):
     key = None
     backend = None
@@ -36,23 +175,20 @@ def load_priv_key(data, func=lambda: getpass("Enter passphrase:")):
     return key, pw
 
 
-def load_public_key(key):
-    if isinstance(key, str):
-        key = key.encode("utf8")
-    elif hasattr(key, "public_bytes"):
-        return key
-    elif hasattr(key, "public_key"):
-        return key.public_key()
-    if isinstance(key, str):
-        key = key.encode("utf8")
+def _parse_public_key(key):
     try:
         return load_pem_x509_certificate(
             key, defbackend
         ).public_key()
     except ValueError:
-        try:
-            return load_pem_public_key(
-                key, defbackend
-            )
-        except ValueError:
-            raise
+        return load_pem_public_key(
+            key, defbackend
+        )
+
+
+def load_public_key(key):
+    if hasattr(key, "public_bytes"):
+        return key
+    elif hasattr(key, "public_key"):
+        return key.public_key()
+    return key_cache.get(key).key
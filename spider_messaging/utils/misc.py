@@ -1,49 +1,565 @@
-__all__ = ["EncryptedFile"]
+__all__ = [
+    "EncryptedFile", "SegmentedEncryptedFile", "CompressedFile",
+    "MessageDecryptor", "MultipartEncoder"
+]
 
 import io
 import base64
+import mmap
+import os
+import stat
+import uuid
+from email import parser as emailparser
+from email import policy
 
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
 
-class EncryptedFile(io.RawIOBase):
+from spider_messaging.constants import MessageType
+
+from .compression import (
+    compression_header, create_compressor, create_decompressor
+)
+from .segments import (
+    SegmentReader, default_segment_size, is_segmented, seal_segments,
+    segmented_length, split_segments
+)
+
+
+class _RawStream(io.RawIOBase):
+    """
+    Raw stream of the chunks yielded by iterob
+
+    Regular input files are memory mapped, other inputs are read in
+    read_size blocks into a reused buffer.
+    """
     iterob = None
-    _left = b""
+    # size of blocks read from input
+    read_size = 2 ** 16
+    # memory mapped input is released in blocks of drop_size
+    drop_size = 2 ** 24
+    # size of output, None if unknown
+    length = None
+    # current output chunk and position in it
+    _current = b""
+    _pos = 0
+
+    def readable(self):
+        return True
+
+    @staticmethod
+    def _input_size(fileob):
+        """ remaining size of input or None if unknown """
+        try:
+            if isinstance(fileob, io.BytesIO):
+                return fileob.getbuffer().nbytes - fileob.tell()
+            st = os.fstat(fileob.fileno())
+            if stat.S_ISREG(st.st_mode):
+                return max(0, st.st_size - fileob.tell())
+        except (AttributeError, OSError, ValueError):
+            pass
+        return None
+
+    @staticmethod
+    def _map_file(fileob):
+        """ returns (mmap or None, offset) for regular files else None """
+        try:
+            fileno = fileob.fileno()
+            offset = fileob.tell()
+            st = os.fstat(fileno)
+        except (AttributeError, OSError, io.UnsupportedOperation):
+            return None
+        if not stat.S_ISREG(st.st_mode):
+            return None
+        if st.st_size <= offset:
+            # empty rest, mmap cannot map empty files
+            return None, offset
+        try:
+            return mmap.mmap(fileno, 0, access=mmap.ACCESS_READ), offset
+        except (OSError, ValueError):
+            return None
+
+    @classmethod
+    def _iter_input(cls, fileob, read_size):
+        mapped = cls._map_file(fileob)
+        if mapped is not None:
+            mapped, offset = mapped
+            if not mapped:
+                return
+            # python >= 3.8: drop read pages, keeps resident memory low
+            madvise = getattr(mapped, "madvise", None)
+            if madvise:
+                madvise(mmap.MADV_SEQUENTIAL)
+            dropped = offset - offset % mmap.PAGESIZE
+            view = memoryview(mapped)
+            try:
+                for pos in range(offset, len(mapped), read_size):
+                    # previous chunks are consumed
+                    if madvise and pos - dropped >= cls.drop_size:
+                        upto = pos - pos % mmap.PAGESIZE
+                        madvise(mmap.MADV_DONTNEED, dropped, upto - dropped)
+                        dropped = upto
+                    yield view[pos:pos + read_size]
+                # advance position like reading
+                fileob.seek(len(mapped))
+            finally:
+                view.release()
+                try:
+                    mapped.close()
+                except BufferError:
+                    # chunk still referenced, closed by garbage collection
+                    pass
+            return
+        if hasattr(fileob, "readinto"):
+            buffer = bytearray(read_size)
+            view = memoryview(buffer)
+            size = fileob.readinto(buffer)
+            while size:
+                yield view[:size]
+                size = fileob.readinto(buffer)
+            return
+        chunk = fileob.read(read_size)
+        while chunk:
+            assert isinstance(chunk, bytes)
+            yield chunk
+            chunk = fileob.read(read_size)
+
+    def readinto(self, b):
+        view = memoryview(b).cast("B")
+        size = len(view)
+        written = 0
+        while written < size:
+            left = len(self._current) - self._pos
+            if not left:
+                self._current = next(self.iterob, None)
+                self._pos = 0
+                if self._current is None:
+                    self._current = b""
+                    break
+                continue
+            n = min(left, size - written)
+            view[written:written + n] = \
+                self._current[self._pos:self._pos + n]
+            self._pos += n
+            written += n
+        return written
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            ret = bytearray(self._current[self._pos:])
+            self._current, self._pos = b"", 0
+            for chunk in self.iterob:
+                ret += chunk
+            return bytes(ret)
+        ret = bytearray(size)
+        return bytes(memoryview(ret)[:self.readinto(ret)])
+
+
+class EncryptedFile(_RawStream):
+    """
+    Raw stream encrypting fileob on the fly
 
-    def __init__(self, fencryptor, fileob, nonce=None, headers=None):
-        self.iterob = self.init_iter(fencryptor, fileob, nonce, headers)
+    format: b64(nonce) \\0 encrypted(headers \\n\\n content) tag
+    """
+
+    def __init__(
+        self, fencryptor, fileob, nonce=None, headers=None, read_size=None
+    ):
+        if read_size:
+            self.read_size = read_size
+        headers = self._format_headers(headers)
+        size = self._input_size(fileob)
+        if size is not None:
+            # GCM: ciphertext has the size of the plaintext, 16 bytes tag
+            self.length = size + 16
+            if nonce:
+                self.length += len(base64.b64encode(nonce)) + 1
+            if headers is not None:
+                self.length += len(headers.strip()) + 2
+        self.iterob = self.init_iter(
+            fencryptor, fileob, nonce, headers, self.read_size
+        )
 
     @staticmethod
-    def init_iter(fencryptor, fileob, nonce=None, headers=None):
+    def _format_headers(headers):
         if isinstance(headers, dict):
             headers = b"\n".join(
                 map(
                     lambda x: b"%b: %b" % (
                         x[0].encode("utf8") if isinstance(x[0], str) else x[0],
-                        x[1].encode("utf8") if isinstance(x[0], str) else x[1]
-                    )
+                        x[1].encode("utf8") if isinstance(x[1], str) else x[1]
+                    ),
+                    headers.items()
                 )
             )
+        return headers
+
+    @classmethod
+    def init_iter(
+        cls, fencryptor, fileob, nonce=None, headers=None, read_size=2 ** 16
+    ):
+        """
+        Yields encrypted chunks, chunks are only valid until the next one
+        """
+        headers = cls._format_headers(headers)
         if nonce:
             yield b"%b\0" % base64.b64encode(nonce)
         if headers is not None:
             yield fencryptor.update(b"%b\n\n" % headers.strip())
-        chunk = fileob.read(512)
-        while chunk:
-            assert isinstance(chunk, bytes)
-            yield fencryptor.update(chunk)
-            chunk = fileob.read(512)
+        # update_into requires block size - 1 extra bytes
+        out = bytearray(read_size + 15)
+        out_view = memoryview(out)
+        for chunk in cls._iter_input(fileob, read_size):
+            yield out_view[:fencryptor.update_into(chunk, out)]
         yield fencryptor.finalize()
         yield fencryptor.tag
 
+
+class SegmentedEncryptedFile(EncryptedFile):
+    """
+    Raw stream encrypting fileob on the fly in independently
+    authenticated segments
+
+    format: see segments, encrypted(headers \n\n content) is split in
+    segments, batches of max_workers segments are encrypted in parallel
+    """
+
+    def __init__(
+        self, key, fileob, headers=None, segment_size=None, max_workers=1,
+        read_size=None
+    ):
+        """
+        Arguments:
+            key {bytes} -- AES key
+            fileob {file} -- content
+
+        Keyword Arguments:
+            headers {bytes,dict} -- headers prepended to content (default: {None})
+            segment_size {int} -- plaintext size of segments (default: {default_segment_size})
+            max_workers {int} -- threads encrypting segments, 1: caller thread (default: {1})
+            read_size {int} -- size of blocks read from input (default: {None})
+        """  # noqa: E501
+        if read_size:
+            self.read_size = read_size
+        if not segment_size:
+            segment_size = default_segment_size
+        headers = self._format_headers(headers)
+        head = b"" if headers is None else b"%b\n\n" % headers.strip()
+        size = self._input_size(fileob)
+        if size is not None:
+            self.length = segmented_length(len(head) + size, segment_size)
+        self.iterob = seal_segments(
+            key,
+            split_segments(
+                self._iter_head_input(head, fileob, self.read_size),
+                segment_size
+            ),
+            segment_size, max_workers=max_workers
+        )
+
+    @classmethod
+    def _iter_head_input(cls, head, fileob, read_size):
+        if head:
+            yield head
+        yield from cls._iter_input(fileob, read_size)
+
+
+class CompressedFile(_RawStream):
+    """
+    Raw stream compressing fileob on the fly, input for EncryptedFile
+
+    Size is unknown, so length is always None
+    """
+
+    def __init__(self, fileob, method, level=None, read_size=None):
+        """
+        Arguments:
+            fileob {file} -- content
+            method {CompressionMethod} -- compression method
+
+        Keyword Arguments:
+            level {int} -- compression level, None: default (default: {None})
+            read_size {int} -- size of blocks read from input (default: {None})
+        """  # noqa: E501
+        if read_size:
+            self.read_size = read_size
+        self.iterob = self.init_compress(
+            create_compressor(method, level), fileob, self.read_size
+        )
+
+    @classmethod
+    def init_compress(cls, compressor, fileob, read_size=2 ** 16):
+        for chunk in cls._iter_input(fileob, read_size):
+            yield compressor.compress(chunk)
+        yield compressor.flush()
+
+
+class MultipartEncoder(object):
+    """
+    Streaming multipart/form-data body
+
+    Pass as data to requests with the content_type header. Files are read
+    lazily in read_size blocks, so memory usage is independent of the
+    file sizes. len is the body size if all file sizes are known (length
+    attribute, e.g. EncryptedFile, or regular files) else 0 and the body
+    is sent chunked.
+    """
+    boundary = None
+    content_type = None
+    len = 0
+    read_size = 2 ** 16
+    parts = None
+    _iterob = None
+    _current = b""
+    _pos = 0
+
+    def __init__(self, fields=None, files=None, boundary=None):
+        """
+        Arguments:
+            fields {dict,list} -- name: value or list of values
+            files {dict} -- name: fileob or (filename, fileob[, content_type])
+        """  # noqa: E501
+        self.boundary = boundary or uuid.uuid4().hex
+        self.content_type = \
+            "multipart/form-data; boundary=%s" % self.boundary
+        self.parts = []
+        if isinstance(fields, dict):
+            fields = fields.items()
+        for name, values in fields or ():
+            if not isinstance(values, (list, tuple)):
+                values = [values]
+            for value in values:
+                if value is None:
+                    continue
+                if isinstance(value, str):
+                    value = value.encode("utf8")
+                elif not isinstance(value, bytes):
+                    value = str(value).encode("utf8")
+                self.parts.append((self._part_header(name), value))
+        for name, fileob in (files or {}).items():
+            filename, content_type = name, "application/octet-stream"
+            if isinstance(fileob, (list, tuple)):
+                if len(fileob) >= 3:
+                    content_type = fileob[2]
+                filename, fileob = fileob[:2]
+            self.parts.append((
+                self._part_header(name, filename, content_type), fileob
+            ))
+        self.len = self._calc_len()
+        self._iterob = self._iter_chunks()
+
+    @staticmethod
+    def _quote(value):
+        # html5 style
+        return value.replace('"', "%22").replace("\r", "%0D").replace(
+            "\n", "%0A"
+        )
+
+    def _part_header(self, name, filename=None, content_type=None):
+        if isinstance(name, bytes):
+            name = name.decode("utf8")
+        ret = '--%s\r\nContent-Disposition: form-data; name="%s"' % (
+            self.boundary, self._quote(str(name))
+        )
+        if filename is not None:
+            ret = '%s; filename="%s"\r\nContent-Type: %s' % (
+                ret, self._quote(str(filename)), content_type
+            )
+        return ("%s\r\n\r\n" % ret).encode("utf8")
+
+    def _calc_len(self):
+        size = len(self.boundary) + 6
+        for header, value in self.parts:
+            if isinstance(value, bytes):
+                value_size = len(value)
+            else:
+                value_size = getattr(value, "length", None)
+                if value_size is None:
+                    value_size = EncryptedFile._input_size(value)
+                if value_size is None:
+                    return 0
+            size += len(header) + value_size + 2
+        return size
+
+    def _iter_chunks(self):
+        for header, value in self.parts:
+            yield header
+            if isinstance(value, bytes):
+                yield value
+            else:
+                buffer = bytearray(self.read_size)
+                view = memoryview(buffer)
+                readinto = getattr(value, "readinto", None)
+                while True:
+                    if readinto:
+                        size = readinto(buffer)
+                        chunk = view[:size]
+                    else:
+                        chunk = value.read(self.read_size)
+                        size = len(chunk)
+                    if not size:
+                        break
+                    yield chunk
+            yield b"\r\n"
+        yield b"--%b--\r\n" % self.boundary.encode("ascii")
+
+    def __iter__(self):
+        # copy, chunks could be buffered by the transport
+        for chunk in self._iterob:
+            yield bytes(chunk)
+
     def read(self, size=-1):
-        if size == -1:
-            return b"".join(self.iterob)
-        elif size < len(self._left):
-            ret, self._left = self._left[:size], self._left[size:]
-            return ret
-        else:
-            for chunk in self.iterob:
-                self._left += chunk
-                if len(self._left) >= size:
+        if size is None or size < 0:
+            ret = bytearray(self._current[self._pos:])
+            self._current, self._pos = b"", 0
+            for chunk in self._iterob:
+                ret += chunk
+            return bytes(ret)
+        ret = bytearray()
+        while len(ret) < size:
+            if self._pos >= len(self._current):
+                self._current = next(self._iterob, None)
+                self._pos = 0
+                if self._current is None:
+                    self._current = b""
                     break
-            ret, self._left = self._left[:size], self._left[size:]
-            return ret
+                continue
+            n = min(size - len(ret), len(self._current) - self._pos)
+            ret += self._current[self._pos:self._pos + n]
+            self._pos += n
+        return bytes(ret)
+
+
+class MessageDecryptor(object):
+    """
+    Incremental decryption of an encrypted content
+
+    format: b64(nonce) \\0 encrypted(headers \\n\\n content) tag
+    or segmented (see segments, detected by the first byte)
+    Feed chunks as they arrive, finalize() verifies the tag.
+    Decrypts into a reused buffer, written data is a memoryview of it and
+    only valid during the write call.
+    """
+    outfp = None
+    headers = None
+    key = None
+    # threads decrypting segments of segmented contents
+    max_workers = 1
+    # initial size of output buffer, grows to largest chunk
+    chunk_size = 2 ** 16
+    # smaller chunks are copied to the tail before decrypting
+    small_chunk_size = 2 ** 15
+    _fdecryptor = None
+    _buffer = b""
+    _headblock = b""
+    _eparser = None
+    # last 16 bytes seen, could be the tag
+    _tail = b""
+    _out = None
+    # SegmentReader of segmented contents
+    _segments = None
+    # decompresses content of compressed contents
+    _decompressor = None
+
+    def __init__(self, key, outfp, chunk_size=None, max_workers=None):
+        self.key = key
+        self.outfp = outfp
+        if chunk_size:
+            self.chunk_size = chunk_size
+        if max_workers:
+            self.max_workers = max_workers
+        self._eparser = emailparser.BytesFeedParser(policy=policy.default)
+
+    def feed(self, chunk):
+        if self._segments:
+            for blob in self._segments.feed(chunk):
+                self._write(blob)
+            return
+        if not self._fdecryptor:
+            if not self._buffer and is_segmented(chunk):
+                self._segments = SegmentReader(
+                    self.key, max_workers=self.max_workers
+                )
+                self.feed(chunk)
+                return
+            blob = b"%b%b" % (self._buffer, chunk)
+            if b"\0" not in blob:
+                self._buffer = blob
+                return
+            nonce, chunk = blob.split(b"\0", 1)
+            self._buffer = b""
+            self._fdecryptor = Cipher(
+                algorithms.AES(self.key),
+                modes.GCM(base64.b64decode(nonce)),
+                backend=default_backend()
+            ).decryptor()
+        tail = self._tail
+        if len(chunk) < self.small_chunk_size or len(tail) < 16:
+            # small chunks: one copy is cheaper than a second decryptor call
+            blob = tail + chunk
+            # keep last 16 bytes, they could be the tag
+            self._tail = blob[-16:]
+            self._write(self._fdecryptor.update(blob[:-16]))
+            return
+        # decrypt without copying the chunk
+        chunk = memoryview(chunk)
+        self._decrypt(tail)
+        self._decrypt(chunk[:-16])
+        self._tail = bytes(chunk[-16:])
+
+    def _decrypt(self, data):
+        size = len(data)
+        if not size:
+            return
+        # update_into requires block size - 1 extra bytes
+        if not self._out or len(self._out) < size + 15:
+            self._out = bytearray(max(size, self.chunk_size) + 15)
+        written = self._fdecryptor.update_into(data, self._out)
+        self._write(memoryview(self._out)[:written])
+
+    def _write(self, blob):
+        if self.headers is None:
+            blob = b"%b%b" % (self._headblock, blob)
+            if b"\n\n" not in blob:
+                self._headblock = blob
+                return
+            headersrest, blob = blob.split(b"\n\n", 1)
+            self._headblock = b""
+            self._eparser.feed(headersrest)
+            self.headers = self._eparser.close()
+            compression = self.headers.get(compression_header)
+            if compression:
+                # transparent, remove header
+                del self.headers[compression_header]
+                self._decompressor = create_decompressor(
+                    compression, self.outfp, self.chunk_size
+                )
+            # check  what to do
+            t = self.headers.get("SPKC-Type", MessageType.email)
+            if t == MessageType.email:
+                self.outfp.write(self.headers.as_bytes(
+                    unixfrom=True,
+                    policy=policy.SMTP
+                ))
+        if not blob:
+            return
+        if self._decompressor:
+            self._decompressor.write(blob)
+        else:
+            self.outfp.write(blob)
+
+    def finalize(self):
+        if self._segments:
+            for blob in self._segments.finalize():
+                self._write(blob)
+        elif not self._fdecryptor:
+            raise ValueError("No nonce found")
+        else:
+            self._write(self._fdecryptor.finalize_with_tag(self._tail))
+        if self.headers is None:
+            # no header separator found
+            self._eparser.feed(self._headblock)
+            self.headers = self._eparser.close()
+        if self._decompressor:
+            self._decompressor.flush()
+        return self.headers
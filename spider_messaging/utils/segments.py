@@ -0,0 +1,276 @@
+__all__ = [
+    "SegmentReader", "is_segmented", "seal_segments", "segmented_length",
+    "split_segments"
+]
+
+import os
+import struct
+from concurrent.futures import ThreadPoolExecutor
+
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+# format (version 1):
+#   magic (1) | segment size (4, big endian) | nonce prefix (7)
+#   segments: encrypted(plaintext segment) tag (16)
+# plaintext (headers \n\n content) is split in segments of segment size,
+# the last segment can be shorter (or empty). Every segment is sealed
+# with nonce: prefix | segment index (4, big endian) | last flag (1)
+# and the stream header as associated data, so segments cannot be
+# reordered, truncated or moved between streams.
+# Legacy streams start with base64, so cannot start with the magic byte
+magic = b"\x01"
+_header = struct.Struct(">cI7s")
+header_size = _header.size
+tag_size = 16
+default_segment_size = 2 ** 16
+max_segment_size = 2 ** 30
+
+
+def is_segmented(data):
+    return data[:1] == magic
+
+
+def segmented_length(size, segment_size=default_segment_size):
+    """
+    Arguments:
+        size {int} -- plaintext size (headers \\n\\n content)
+
+    Keyword Arguments:
+        segment_size {int} -- (default: {default_segment_size})
+
+    Returns:
+        int -- size of encrypted stream
+    """
+    segments = max(1, -(-size // segment_size))
+    return header_size + size + segments * tag_size
+
+
+def _nonce(prefix, index, last):
+    return b"%b%b%b" % (
+        prefix, index.to_bytes(4, "big"), b"\x01" if last else b"\x00"
+    )
+
+
+def _map(executor, func, items):
+    if executor and len(items) > 1:
+        return list(executor.map(lambda x: func(*x), items))
+    return [func(*x) for x in items]
+
+
+def seal_segments(
+    key, segments, segment_size, max_workers=1, nonce_prefix=None
+):
+    """
+    Yields stream header and encrypted segments
+
+    Arguments:
+        key {bytes} -- AES key
+        segments {Iterable((index, plaintext, last))} -- see split_segments
+        segment_size {int} -- plaintext size of segments
+
+    Keyword Arguments:
+        max_workers {int} -- threads encrypting batches of segments, 1: caller thread (default: {1})
+        nonce_prefix {bytes} -- 7 bytes, random if None (default: {None})
+    """  # noqa: E501
+    if not nonce_prefix:
+        nonce_prefix = os.urandom(7)
+    header = _header.pack(magic, segment_size, nonce_prefix)
+    aesgcm = AESGCM(key)
+
+    def _seal(index, data, last):
+        return aesgcm.encrypt(_nonce(nonce_prefix, index, last), data, header)
+    yield header
+    executor = None
+    if max_workers and max_workers > 1:
+        executor = ThreadPoolExecutor(max_workers=max_workers)
+    try:
+        batch = []
+        for item in segments:
+            batch.append(item)
+            if len(batch) >= (max_workers or 1):
+                yield from _map(executor, _seal, batch)
+                batch = []
+        yield from _map(executor, _seal, batch)
+    finally:
+        if executor:
+            executor.shutdown(wait=False)
+
+
+def split_segments(chunks, segment_size):
+    """
+    Arguments:
+        chunks {Iterable(bytes)} -- plaintext, chunks of any size
+        segment_size {int} -- plaintext size of segments
+
+    Returns:
+        Iterable((index, plaintext, last)) -- at least one segment
+    """
+    buffer = bytearray()
+    index = 0
+    pending = None
+    for chunk in chunks:
+        buffer += chunk
+        while len(buffer) >= segment_size:
+            if pending is not None:
+                yield index, pending, False
+                index += 1
+            pending = bytes(buffer[:segment_size])
+            del buffer[:segment_size]
+    if buffer or pending is None:
+        if pending is not None:
+            yield index, pending, False
+            index += 1
+        yield index, bytes(buffer), True
+    else:
+        yield index, pending, True
+
+
+class SegmentReader(object):
+    """
+    Verify and decrypt segmented streams
+
+    Incremental: feed() returns the plaintext of complete segments,
+    finalize() the plaintext of the last segment. The last segment is
+    only known at the end, so one segment is held back.
+    Random access: decrypt_range() reads only the segments covering a
+    plaintext range from a seekable file.
+    """
+    segment_size = None
+    nonce_prefix = None
+    header = None
+    _aesgcm = None
+    _executor = None
+    max_workers = 1
+    _buffer = None
+    _index = 0
+
+    def __init__(self, key, max_workers=1):
+        self._aesgcm = AESGCM(key)
+        self._buffer = bytearray()
+        if max_workers and max_workers > 1:
+            self.max_workers = max_workers
+            self._executor = ThreadPoolExecutor(max_workers=max_workers)
+
+    def _parse_header(self, header):
+        if len(header) < header_size or not is_segmented(header):
+            raise ValueError("Not a segmented stream")
+        _, self.segment_size, self.nonce_prefix = \
+            _header.unpack(bytes(header[:header_size]))
+        if not 0 < self.segment_size <= max_segment_size:
+            raise ValueError("Invalid segment size")
+        self.header = bytes(header[:header_size])
+
+    def decrypt_segment(self, index, data, last):
+        """
+        Arguments:
+            index {int} -- segment index
+            data {bytes} -- encrypted segment with tag
+            last {bool} -- is final segment
+
+        Raises:
+            cryptography.exceptions.InvalidTag: modified, truncated or wrong key
+
+        Returns:
+            bytes -- plaintext
+        """  # noqa: E501
+        return self._aesgcm.decrypt(
+            _nonce(self.nonce_prefix, index, last), bytes(data), self.header
+        )
+
+    def feed(self, chunk):
+        """
+        Returns:
+            list(bytes) -- plaintext of segments completed by chunk
+        """
+        self._buffer += chunk
+        if not self.header:
+            if len(self._buffer) < header_size:
+                return []
+            self._parse_header(self._buffer)
+            del self._buffer[:header_size]
+        size = self.segment_size + tag_size
+        # the last complete segment could be the final one
+        count = (len(self._buffer) - 1) // size
+        if not count or count < self.max_workers:
+            return []
+        items = [
+            (
+                self._index + i,
+                bytes(self._buffer[i * size:(i + 1) * size]),
+                False
+            ) for i in range(count)
+        ]
+        del self._buffer[:count * size]
+        self._index += count
+        return _map(self._executor, self.decrypt_segment, items)
+
+    def finalize(self):
+        """
+        Returns:
+            list(bytes) -- plaintext of remaining segments
+        """
+        try:
+            if not self.header:
+                raise ValueError("Truncated stream")
+            size = self.segment_size + tag_size
+            count = max(1, -(-len(self._buffer) // size))
+            items = [
+                (
+                    self._index + i,
+                    bytes(self._buffer[i * size:(i + 1) * size]),
+                    i == count - 1
+                ) for i in range(count)
+            ]
+            self._buffer = bytearray()
+            self._index += count
+            return _map(self._executor, self.decrypt_segment, items)
+        finally:
+            self.close()
+
+    def close(self):
+        if self._executor:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+    def decrypt_range(self, fileob, start=0, end=None):
+        """
+        Verify and decrypt the segments covering a plaintext range
+
+        Arguments:
+            fileob {file} -- seekable file with complete segmented stream
+
+        Keyword Arguments:
+            start {int} -- first plaintext byte (default: {0})
+            end {int} -- plaintext end (exclusive), None: till end (default: {None})
+
+        Raises:
+            cryptography.exceptions.InvalidTag: segment modified
+            ValueError: invalid stream
+
+        Returns:
+            bytes -- plaintext[start:end], offsets include the headers
+        """  # noqa: E501
+        fileob.seek(0)
+        self._parse_header(fileob.read(header_size))
+        size = self.segment_size + tag_size
+        total = fileob.seek(0, os.SEEK_END) - header_size
+        count = max(1, -(-total // size))
+        plain_size = total - count * tag_size
+        if plain_size < 0:
+            raise ValueError("Truncated stream")
+        if end is None or end > plain_size:
+            end = plain_size
+        if start >= end:
+            return b""
+        first = start // self.segment_size
+        last = (end - 1) // self.segment_size
+        fileob.seek(header_size + first * size)
+        items = [
+            (index, fileob.read(size), index == count - 1)
+            for index in range(first, last + 1)
+        ]
+        plaintext = b"".join(
+            _map(self._executor, self.decrypt_segment, items)
+        )
+        offset = start - first * self.segment_size
+        return plaintext[offset:offset + end - start]
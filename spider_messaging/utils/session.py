@@ -0,0 +1,148 @@
+__all__ = [
+    "JitterRetry", "NoCookieJar", "PooledSession", "clear_sessions",
+    "create_session", "get_session"
+]
+
+import random
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.cookies import RequestsCookieJar
+from urllib3.util.retry import Retry
+
+# used if a request specifies no timeout, None: wait forever
+default_timeout = 60
+# retries of failed connects/reads and of retry_status responses
+default_retries = 3
+# base of exponential backoff in seconds, randomized by JitterRetry
+default_backoff_factor = 0.3
+# retry idempotent requests on these status codes
+retry_status = frozenset({502, 503, 504})
+# number of hosts with pooled connections
+default_pool_connections = 16
+# kept alive connections per host
+default_pool_maxsize = 16
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+class JitterRetry(Retry):
+    """
+    Retry with "full jitter" backoff
+
+    Sleeps a random time between 0 and the exponential backoff, so
+    clients failing together do not retry in lockstep
+    """
+
+    def get_backoff_time(self):
+        return random.uniform(0, super().get_backoff_time())
+
+
+class NoCookieJar(RequestsCookieJar):
+    """
+    Cookie jar which stays empty, so no cookies are sent
+
+    For sessions shared between users, cookies set for one request would
+    be replayed on all others
+    """
+
+    def set_cookie(self, cookie, *args, **kwargs):
+        pass
+
+
+class PooledSession(requests.Session):
+    """
+    Session which applies a default timeout
+    """
+    # used if a request specifies no timeout
+    timeout = None
+
+    def request(self, method, url, **kwargs):
+        if kwargs.get("timeout") is None:
+            kwargs["timeout"] = self.timeout
+        return super().request(method, url, **kwargs)
+
+
+def create_session(
+    timeout=None, retries=None, backoff_factor=None, pool_connections=None,
+    pool_maxsize=None, host_pool_maxsize=None, cookies=True
+):
+    """
+    Create session with keep-alive pools and retries
+
+    Keyword Arguments:
+        timeout {float} -- default timeout, None: default_timeout (default: {None})
+        retries {int} -- retries, None: default_retries (default: {None})
+        backoff_factor {float} -- None: default_backoff_factor (default: {None})
+        pool_connections {int} -- pooled hosts, None: default_pool_connections (default: {None})
+        pool_maxsize {int} -- connections per host, None: default_pool_maxsize (default: {None})
+        host_pool_maxsize {dict} -- connections for url prefixes, e.g. {"https://example.com/": 32} (default: {None})
+        cookies {bool} -- store cookies, False: NoCookieJar (default: {True})
+
+    Returns:
+        PooledSession -- session
+    """  # noqa: E501
+    if retries is None:
+        retries = default_retries
+    if pool_connections is None:
+        pool_connections = default_pool_connections
+    if pool_maxsize is None:
+        pool_maxsize = default_pool_maxsize
+    # only idempotent methods (default) are retried
+    retry = JitterRetry(
+        total=retries, connect=retries, read=retries, status=retries,
+        backoff_factor=(
+            default_backoff_factor if backoff_factor is None
+            else backoff_factor
+        ),
+        status_forcelist=retry_status, raise_on_status=False
+    )
+    session = PooledSession()
+    if not cookies:
+        session.cookies = NoCookieJar()
+    session.timeout = default_timeout if timeout is None else timeout
+    adapter = HTTPAdapter(
+        pool_connections=pool_connections, pool_maxsize=pool_maxsize,
+        max_retries=retry
+    )
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    for prefix, maxsize in (host_pool_maxsize or {}).items():
+        session.mount(prefix, HTTPAdapter(
+            pool_connections=1, pool_maxsize=maxsize, max_retries=retry
+        ))
+    return session
+
+
+def get_session(name="default", **kwargs):
+    """
+    Shared session of the process, created on first use
+
+    Shared sessions reject cookies unless created with cookies=True,
+    otherwise cookies of one user would be sent on requests of others
+
+    Keyword Arguments:
+        name {str} -- registry key, e.g. for different settings (default: {"default"})
+        **kwargs -- arguments of create_session, only used on creation
+
+    Returns:
+        PooledSession -- session
+    """  # noqa: E501
+    kwargs.setdefault("cookies", False)
+    with _sessions_lock:
+        session = _sessions.get(name)
+        if session is None:
+            session = create_session(**kwargs)
+            _sessions[name] = session
+        return session
+
+
+def clear_sessions():
+    """ Close and forget shared sessions, e.g. after fork """
+    with _sessions_lock:
+        sessions = list(_sessions.values())
+        _sessions.clear()
+    for session in sessions:
+        session.close()
@@ -0,0 +1,445 @@
+__all__ = ["TurtleStream", "is_spkc_predicate", "parse_stream"]
+
+import codecs
+import re
+from urllib.parse import urljoin
+
+from rdflib import RDF, XSD, BNode, Literal, URIRef
+from spkcspider.constants import spkcgraph
+
+_spkc_prefix = str(spkcgraph)
+_rdf_type = RDF.type
+_rdf_first = RDF.first
+_rdf_rest = RDF.rest
+_rdf_nil = RDF.nil
+
+_plx = r"(?:[\w:\-]|%[0-9A-Fa-f]{2}|\\[_~.\-!$&'()*+,;=/?#@%])"
+_token_re = re.compile(
+    r"""
+    [ \t\r\n]*
+    (?:(?P<comment>\#[^\r\n]*)
+    |(?P<iri><(?:[^<>"{}|^`\\\x00-\x20]|\\u[0-9A-Fa-f]{4}|\\U[0-9A-Fa-f]{8})*>)
+    |(?P<lstring>\"\"\"(?:"{0,2}(?:[^"\\]|\\.))*\"\"\"
+        |'''(?:'{0,2}(?:[^'\\]|\\.))*''')
+    |(?P<string>"(?:[^"\\\r\n]|\\.)*"|'(?:[^'\\\r\n]|\\.)*')
+    |(?P<langtag>@[A-Za-z]+(?:-[A-Za-z0-9]+)*)
+    |(?P<dtype>\^\^)
+    |(?P<number>[+-]?(?:(?:\d+\.\d*|\.\d+|\d+)[eE][+-]?\d+|\d*\.\d+|\d+))
+    |(?P<bnode>_:\w(?:[\w.\-\u00B7]*[\w\-\u00B7])?)
+    |(?P<pname>(?:[^\W\d_](?:[\w.\-]*[\w\-])?)?:
+        (?:%(plx)s(?:(?:%(plx)s|\.)*%(plx)s)?)?)
+    |(?P<word>[A-Za-z]+(?![\w:\-]))
+    |(?P<punct>[.;,\[\]()]))
+    """ % {"plx": _plx},
+    re.S | re.X
+)
+# characters which could continue a name, number or language tag
+_continue_re = re.compile(r"[\w.:%\\+\-]*")
+# tokens which are not closed by a delimiter
+_open_kinds = {"langtag", "number", "bnode", "pname", "word"}
+# incomplete tokens: terminators, tokenizing is retried after one arrived
+_terminators = [
+    ('"""', re.compile('"""')),
+    ("'''", re.compile("'''")),
+    ('"', re.compile('["\r\n]')),
+    ("'", re.compile("['\r\n]")),
+    ("<", re.compile(">")),
+    ("#", re.compile("[\r\n]")),
+]
+
+_escape_re = re.compile(
+    r"\\(?:u([0-9A-Fa-f]{4})|U([0-9A-Fa-f]{8})|(.))", re.S
+)
+_local_escape_re = re.compile(r"\\(.)")
+_echars = {
+    "t": "\t", "b": "\b", "n": "\n", "r": "\r", "f": "\f",
+    '"': '"', "'": "'", "\\": "\\"
+}
+
+# upper limit of cached iris per stream
+max_cached_names = 8192
+
+
+def is_spkc_predicate(predicate):
+    """
+    Default filter: predicates the messaging client uses, spkc:* and rdf:type
+    """
+    return predicate.startswith(_spkc_prefix) or predicate == _rdf_type
+
+
+def _unescape(value):
+    def _replace(match):
+        if match.group(3) is not None:
+            try:
+                return _echars[match.group(3)]
+            except KeyError:
+                raise ValueError(
+                    "invalid escape sequence: \\%s" % match.group(3)
+                )
+        return chr(int(match.group(1) or match.group(2), 16))
+    if "\\" not in value:
+        return value
+    return _escape_re.sub(_replace, value)
+
+
+def _string_value(kind, text):
+    if kind == "lstring":
+        return _unescape(text[3:-3])
+    return _unescape(text[1:-1])
+
+
+class TurtleStream(object):
+    """
+    Incremental Turtle parser
+
+    Data is fed in arbitrary chunks, complete statements are parsed as soon
+    as they arrive and only triples with wanted predicates are emitted.
+    Buffered is only the current statement, so memory does not grow with the
+    size of the document
+
+    Arguments:
+        keep {callable} -- predicate filter, None: keep all (default: {is_spkc_predicate})
+        base {str} -- base for relative iris (default: {None})
+    """  # noqa: E501
+    keep = None
+    base = None
+
+    def __init__(self, keep=is_spkc_predicate, base=None):
+        self.keep = keep
+        self.base = base
+        self._decoder = codecs.getincrementaldecoder("utf8")()
+        self._buf = ""
+        self._statement = []
+        self._depth = 0
+        self._prefixes = {}
+        self._bnodes = {}
+        # token text: iri
+        self._names = {}
+        # token text: (iri, keep)
+        self._predicates = {}
+        self._out = []
+        self._closed = False
+        # (terminator pattern, search position) of incomplete token
+        self._waiting = None
+
+    def feed(self, data):
+        """
+        Parse chunk
+
+        Arguments:
+            data {bytes,str} -- next chunk
+
+        Returns:
+            list((s, p, o)) -- triples completed by this chunk
+        """
+        if self._closed:
+            raise ValueError("stream is closed")
+        if not isinstance(data, str):
+            data = self._decoder.decode(data)
+        self._buf += data
+        if self._waiting:
+            # long tokens are not scanned again for every chunk
+            pattern, start = self._waiting
+            if not pattern.search(self._buf, start):
+                self._waiting = (pattern, max(len(self._buf) - 2, 0))
+                return self._flush()
+            self._waiting = None
+        self._tokenize(False)
+        return self._flush()
+
+    def close(self):
+        """
+        Parse remaining data
+
+        Raises:
+            ValueError -- document incomplete or invalid
+
+        Returns:
+            list((s, p, o)) -- remaining triples
+        """
+        if not self._closed:
+            self._buf += self._decoder.decode(b"", True)
+            self._tokenize(True)
+            self._closed = True
+            if self._statement:
+                raise ValueError("incomplete statement at end of document")
+        return self._flush()
+
+    def _flush(self):
+        out = self._out
+        self._out = []
+        return out
+
+    def _tokenize(self, final):
+        buf = self._buf
+        pos = 0
+        end = len(buf)
+        match_token = _token_re.match
+        statement = self._statement
+        # token is incomplete until a terminator arrives
+        incomplete = False
+        while pos < end:
+            match = match_token(buf, pos)
+            if not match:
+                if not final or not buf[pos:].strip(" \t\r\n"):
+                    incomplete = True
+                    break
+                raise ValueError(
+                    "invalid turtle near: %r" % buf[pos:pos + 40]
+                )
+            kind = match.lastgroup
+            mend = match.end()
+            if not final:
+                # token could continue in next chunk
+                if mend == end:
+                    incomplete = kind == "comment"
+                    break
+                if kind in _open_kinds and \
+                        _continue_re.match(buf, mend).end() == end:
+                    break
+                # start of an incomplete long string, not an empty string
+                if kind == "string" and mend - match.start(kind) == 2 and \
+                        buf.startswith(buf[mend - 1] * 3, mend - 2):
+                    incomplete = True
+                    break
+            pos = mend
+            if kind == "comment":
+                continue
+            text = match.group(kind)
+            if kind == "punct":
+                statement.append((text, text))
+                if text == "." and self._depth == 0:
+                    self._statement = []
+                    self._parse_statement(statement)
+                    statement = self._statement
+                elif text == "[" or text == "(":
+                    self._depth += 1
+                elif text == "]" or text == ")":
+                    self._depth -= 1
+                continue
+            statement.append((kind, text))
+            # SPARQL style directives are not terminated by "."
+            if statement[0][0] == "word":
+                directive = statement[0][1].upper()
+                if (directive == "PREFIX" and len(statement) == 3) or \
+                        (directive == "BASE" and len(statement) == 2):
+                    self._statement = []
+                    self._parse_directive(statement)
+                    statement = self._statement
+        self._buf = buf[pos:]
+        if incomplete:
+            self._waiting = self._terminator(self._buf)
+
+    @staticmethod
+    def _terminator(buf):
+        """
+        Returns:
+            (pattern, position) -- search for terminator of incomplete token at start of buf, None: unknown
+        """  # noqa: E501
+        start = buf.lstrip(" \t\r\n")
+        for opener, pattern in _terminators:
+            if start.startswith(opener):
+                # already scanned data contains no terminator
+                return pattern, max(len(buf) - 2, 0)
+        return None
+
+    def _parse_statement(self, tokens):
+        if tokens[0][0] == "langtag" and tokens[0][1] in {
+            "@prefix", "@base"
+        }:
+            self._parse_directive(tokens[:-1])
+            return
+        pos, subject = self._subject(tokens, 0, True)
+        if tokens[pos][0] != "." or tokens[0][0] != "[":
+            pos = self._predicate_object_list(tokens, pos, subject)
+        if tokens[pos][0] != "." or pos != len(tokens) - 1:
+            raise ValueError("expected end of statement")
+
+    def _parse_directive(self, tokens):
+        name = tokens[0][1].lstrip("@").lower()
+        if name == "prefix":
+            if len(tokens) != 3 or tokens[1][0] != "pname" or \
+                    not tokens[1][1].endswith(":") or tokens[2][0] != "iri":
+                raise ValueError("invalid prefix directive")
+            self._prefixes[tokens[1][1][:-1]] = self._named(tokens[2])
+        else:
+            if len(tokens) != 2 or tokens[1][0] != "iri":
+                raise ValueError("invalid base directive")
+            self.base = str(self._named(tokens[1]))
+        self._names.clear()
+        self._predicates.clear()
+
+    def _named(self, token):
+        """
+        Resolve iri or prefixed name token, None for other tokens
+        """
+        kind, text = token
+        name = self._names.get(text)
+        if name is not None:
+            return name
+        if kind == "iri":
+            value = _unescape(text[1:-1])
+            if self.base and ":" not in value.split("/", 1)[0]:
+                value = urljoin(self.base, value)
+        elif kind == "pname":
+            prefix, local = text.split(":", 1)
+            try:
+                value = self._prefixes[prefix]
+            except KeyError:
+                raise ValueError("unknown prefix: %s" % prefix)
+            value += _local_escape_re.sub(r"\1", local)
+        else:
+            return None
+        if len(self._names) >= max_cached_names:
+            self._names.clear()
+        name = self._names[text] = URIRef(value)
+        return name
+
+    def _bnode(self, label):
+        bnode = self._bnodes.get(label)
+        if bnode is None:
+            bnode = self._bnodes[label] = BNode()
+        return bnode
+
+    def _subject(self, tokens, pos, build):
+        kind = tokens[pos][0]
+        if kind == "[":
+            return self._blank_node_property_list(tokens, pos)
+        elif kind == "(":
+            return self._collection(tokens, pos)
+        elif kind == "bnode":
+            return pos + 1, self._bnode(tokens[pos][1][2:])
+        elif kind == "iri" or kind == "pname":
+            if not build:
+                return pos + 1, None
+            return pos + 1, self._named(tokens[pos])
+        raise ValueError("invalid subject or object")
+
+    def _predicate(self, tokens, pos):
+        text = tokens[pos][1]
+        predicate = self._predicates.get(text)
+        if predicate is None:
+            if tokens[pos] == ("word", "a"):
+                iri = _rdf_type
+            else:
+                iri = self._named(tokens[pos])
+                if iri is None:
+                    raise ValueError("invalid predicate")
+            predicate = (iri, self.keep is None or self.keep(iri))
+            self._predicates[text] = predicate
+        return pos + 1, predicate
+
+    def _object(self, tokens, pos, build):
+        kind, text = tokens[pos]
+        if kind == "string" or kind == "lstring":
+            nkind = tokens[pos + 1][0]
+            if nkind == "langtag":
+                if not build:
+                    return pos + 2, None
+                return pos + 2, Literal(
+                    _string_value(kind, text), lang=tokens[pos + 1][1][1:]
+                )
+            elif nkind == "dtype":
+                datatype = self._named(tokens[pos + 2])
+                if datatype is None:
+                    raise ValueError("invalid datatype")
+                if not build:
+                    return pos + 3, None
+                return pos + 3, Literal(
+                    _string_value(kind, text), datatype=datatype
+                )
+            if not build:
+                return pos + 1, None
+            return pos + 1, Literal(_string_value(kind, text))
+        elif kind == "number":
+            if not build:
+                return pos + 1, None
+            if "e" in text or "E" in text:
+                datatype = XSD.double
+            elif "." in text:
+                datatype = XSD.decimal
+            else:
+                datatype = XSD.integer
+            return pos + 1, Literal(text, datatype=datatype)
+        elif kind == "word" and (text == "true" or text == "false"):
+            if not build:
+                return pos + 1, None
+            return pos + 1, Literal(text, datatype=XSD.boolean)
+        return self._subject(tokens, pos, build)
+
+    def _blank_node_property_list(self, tokens, pos):
+        bnode = BNode()
+        pos += 1
+        if tokens[pos][0] != "]":
+            pos = self._predicate_object_list(tokens, pos, bnode)
+        if tokens[pos][0] != "]":
+            raise ValueError("expected ]")
+        return pos + 1, bnode
+
+    def _collection(self, tokens, pos):
+        keep_first = self.keep is None or self.keep(_rdf_first)
+        keep_rest = self.keep is None or self.keep(_rdf_rest)
+        out = self._out
+        pos += 1
+        head = node = None
+        while tokens[pos][0] != ")":
+            pos, item = self._object(tokens, pos, keep_first)
+            nextnode = BNode()
+            if node is None:
+                head = nextnode
+            elif keep_rest:
+                out.append((node, _rdf_rest, nextnode))
+            if keep_first:
+                out.append((nextnode, _rdf_first, item))
+            node = nextnode
+        if node is None:
+            return pos + 1, _rdf_nil
+        if keep_rest:
+            out.append((node, _rdf_rest, _rdf_nil))
+        return pos + 1, head
+
+    def _predicate_object_list(self, tokens, pos, subject):
+        out = self._out
+        while True:
+            pos, (predicate, keep) = self._predicate(tokens, pos)
+            while True:
+                # objects of dropped triples are only parsed
+                pos, obj = self._object(tokens, pos, keep)
+                if keep:
+                    out.append((subject, predicate, obj))
+                if tokens[pos][0] != ",":
+                    break
+                pos += 1
+            if tokens[pos][0] != ";":
+                return pos
+            # repeated and trailing ";" are allowed
+            while tokens[pos][0] == ";":
+                pos += 1
+            if tokens[pos][0] in {".", "]"}:
+                return pos
+
+
+def parse_stream(graph, chunks, keep=is_spkc_predicate, base=None):
+    """
+    Parse turtle chunks into graph, keeping only wanted predicates
+
+    Arguments:
+        graph {Graph} -- target graph
+        chunks {Iterable(bytes)} -- e.g. response.iter_content()
+
+    Keyword Arguments:
+        keep {callable} -- predicate filter, None: keep all (default: {is_spkc_predicate})
+        base {str} -- base for relative iris (default: {None})
+
+    Returns:
+        Graph -- graph
+    """  # noqa: E501
+    stream = TurtleStream(keep=keep, base=base)
+    for chunk in chunks:
+        triples = stream.feed(chunk)
+        if triples:
+            graph.addN((s, p, o, graph) for s, p, o in triples)
+    triples = stream.close()
+    if triples:
+        graph.addN((s, p, o, graph) for s, p, o in triples)
+    return graph
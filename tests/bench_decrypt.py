@@ -0,0 +1,63 @@
+"""
+CPU time per MB of decrypting received messages, legacy loop compared to
+MessageDecryptor
+
+Usage: python -m tests.bench_decrypt [--size MB] [--rounds N]
+"""
+
+import argparse
+import time
+
+from spider_messaging.utils.misc import MessageDecryptor
+
+from .legacy import legacy_decrypt
+from .test_decryptor import encrypt, split
+
+
+class NullFile(object):
+    def write(self, blob):
+        return len(blob)
+
+
+def _decryptor(key, chunks):
+    decryptor = MessageDecryptor(key, NullFile())
+    for chunk in chunks:
+        decryptor.feed(chunk)
+    decryptor.finalize()
+
+
+def _legacy(key, chunks):
+    legacy_decrypt(key, chunks, NullFile())
+
+
+def cpu_per_mb(func, key, chunks, size, rounds):
+    """ best CPU time in microseconds per MB """
+    best = None
+    for _ in range(rounds):
+        start = time.process_time()
+        func(key, chunks)
+        elapsed = time.process_time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best * 1e6 * 2 ** 20 / size
+
+
+def main(argv=None):
+    argparser = argparse.ArgumentParser(description=__doc__)
+    argparser.add_argument("--size", type=int, default=64, help="MB")
+    argparser.add_argument("--rounds", type=int, default=3)
+    argv = argparser.parse_args(argv)
+    size = argv.size * 2 ** 20
+    key, blob = encrypt(bytes(size), b"SPKC-Type: file\n")
+    print("chunk size      legacy us/MB   MessageDecryptor us/MB")
+    for chunk_size in [256, 2 ** 13, 2 ** 16, 2 ** 20]:
+        chunks = split(blob, chunk_size)
+        print("%10d %17.0f %24.0f" % (
+            chunk_size,
+            cpu_per_mb(_legacy, key, chunks, size, argv.rounds),
+            cpu_per_mb(_decryptor, key, chunks, size, argv.rounds)
+        ))
+
+
+if __name__ == "__main__":
+    main()
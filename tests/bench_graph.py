@@ -0,0 +1,66 @@
+"""
+Graph extractors on large synthetic postbox graphs, SPARQL compared to
+GraphIndex
+
+Usage: python -m tests.bench_graph [--messages N [N ...]] [--keys N]
+"""
+
+import argparse
+import time
+from unittest import mock
+
+from cryptography.hazmat.primitives.asymmetric import ed25519
+
+from spider_messaging.utils import graph as graph_module
+from spider_messaging.utils.graph import (
+    GraphIndex, extract_property, get_pages, get_postboxes, map_keys
+)
+
+from .test_graph import synthetic_postbox_graph
+
+extractors = [
+    ("get_pages", lambda graph: list(get_pages(graph)[1])),
+    ("get_postboxes", get_postboxes),
+    ("map_keys", map_keys),
+    ("extract_property", lambda graph: extract_property(graph, "id")),
+]
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    func(*args)
+    return time.perf_counter() - start
+
+
+def main(argv=None):
+    argparser = argparse.ArgumentParser(description=__doc__)
+    argparser.add_argument(
+        "--messages", type=int, nargs="+", default=[1000, 5000]
+    )
+    argparser.add_argument("--keys", type=int, default=10)
+    argv = argparser.parse_args(argv)
+    keys = [ed25519.Ed25519PrivateKey.generate() for _ in range(argv.keys)]
+    print("messages triples  extractor         sparql s   index s")
+    for messages in argv.messages:
+        graph = synthetic_postbox_graph(keys, messages, keys, pages=3)
+        for name, func in extractors:
+            with mock.patch.object(graph_module, "use_sparql", True):
+                sparql = timed(func, graph)
+            # index built per call, like callers passing a graph
+            index = timed(func, graph)
+            print("%8d %7d  %-16s %9.3f %9.3f" % (
+                messages, len(graph), name, sparql, index
+            ))
+        # one index shared by all extractors
+        start = time.perf_counter()
+        shared = GraphIndex(graph)
+        for name, func in extractors:
+            func(shared)
+        print("%8d %7d  %-16s %9s %9.3f" % (
+            messages, len(graph), "all, shared", "",
+            time.perf_counter() - start
+        ))
+
+
+if __name__ == "__main__":
+    main()
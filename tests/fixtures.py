@@ -0,0 +1,248 @@
+"""
+Synthetic postbox graphs and an in-process transport for requests
+"""
+
+import base64
+import io
+import json
+import os
+from http.client import HTTPMessage
+from types import SimpleNamespace
+from urllib.parse import urlsplit, urlunsplit
+
+import django
+import requests
+from cryptography.hazmat.primitives import hashes
+from django.conf import settings
+from rdflib import RDF, XSD, BNode, Graph, Literal, URIRef
+from spkcspider.constants import spkcgraph
+
+from spider_messaging.protocols.attestation import AttestationChecker
+from spider_messaging.utils.crypto import sign_data, wrap_key
+from spider_messaging.utils.keys import key_fingerprint, key_info
+
+host = "http://testserver"
+postbox_url = "%s/spider/content/1/view/" % host
+
+
+def setup_django():
+    """
+    Configure django once per process
+
+    Uses DJANGO_SETTINGS_MODULE (e.g. a spkcspider project with
+    spider_messages installed) if set, minimal settings otherwise
+    """
+    if (
+        not settings.configured and
+        "DJANGO_SETTINGS_MODULE" not in os.environ
+    ):
+        settings.configure(
+            ALLOWED_HOSTS=["testserver"], INSTALLED_APPS=[], MIDDLEWARE=[]
+        )
+    django.setup()
+
+
+def content_url(content_id, action="view"):
+    return "%s/spider/content/%s/%s/" % (host, content_id, action)
+
+
+def add_property(graph, base, name, value):
+    prop = BNode()
+    graph.add((base, spkcgraph["properties"], prop))
+    graph.add((prop, spkcgraph["name"], Literal(name, datatype=XSD.string)))
+    graph.add((prop, spkcgraph["value"], value))
+    return prop
+
+
+def add_content(graph, url, content_type):
+    base = URIRef(url)
+    graph.add((base, RDF.type, spkcgraph["spkc:Content"]))
+    graph.add((
+        base, spkcgraph["type"], Literal(content_type, datatype=XSD.string)
+    ))
+    return base
+
+
+def postbox_graph(
+    private_keys, url=postbox_url, graph=None, algo=hashes.SHA512(),
+    pages=1
+):
+    """
+    Graph of a postbox with signed keys
+
+    Arguments:
+        private_keys {list} -- keys of postbox, signatures are created with them
+
+    Keyword Arguments:
+        url {str} -- url of postbox (default: {postbox_url})
+        graph {Graph} -- add to graph (default: {None})
+        algo {HashAlgorithm} -- hash algorithm (default: {SHA512})
+        pages {int} -- announced number of pages (default: {1})
+
+    Returns:
+        Graph
+    """  # noqa: E501
+    if graph is None:
+        graph = Graph()
+    base = add_content(graph, url, "PostBox")
+    graph.add((
+        URIRef("%s/spider/component/%s/list/" % (host, abs(hash(url)))),
+        spkcgraph["contents"], base
+    ))
+    graph.add((
+        base, spkcgraph["action:view"], Literal(url, datatype=XSD.anyURI)
+    ))
+    graph.add((base, spkcgraph["pages.num_pages"], Literal(pages)))
+    graph.add((base, spkcgraph["pages.current_page"], Literal(1)))
+    add_property(
+        graph, base, "hash_algorithm",
+        Literal(algo.name, datatype=XSD.string)
+    )
+    hashed = [
+        key_fingerprint(key.public_key(), algo) for key in private_keys
+    ]
+    attestation = AttestationChecker.calc_attestation(hashed, algo)
+    add_property(
+        graph, base, "attestation", Literal(
+            base64.b64encode(attestation).decode("ascii"),
+            datatype=XSD.base64Binary
+        )
+    )
+    for i, key in enumerate(private_keys):
+        key_base = URIRef("%s-key%s/" % (url, i))
+        add_property(graph, base, "signatures", key_base)
+        add_property(graph, key_base, "key", Literal(
+            key_info(key.public_key()).pem.decode("ascii"),
+            datatype=XSD.string
+        ))
+        add_property(graph, key_base, "signature", Literal(
+            sign_data(key, attestation, algo), datatype=XSD.string
+        ))
+    return graph
+
+
+def key_list(aes_key, private_keys, algo=hashes.SHA512()):
+    """ key list (dict) of a message for private_keys """
+    return {
+        "%s=%s" % (
+            algo.name, key_fingerprint(key.public_key(), algo).hex()
+        ): wrap_key(key.public_key(), aes_key, algo)
+        for key in private_keys
+    }
+
+
+def add_message(
+    graph, message_id, keys, content_type="WebReference",
+    algo=hashes.SHA512(), name=None
+):
+    """
+    Add message object to postbox graph
+
+    Arguments:
+        message_id {int} -- id, content id of url
+        keys {dict} -- key list
+
+    Returns:
+        str -- url of message object
+    """
+    url = content_url(message_id)
+    base = add_content(graph, url, content_type)
+    add_property(graph, base, "id", Literal(message_id))
+    add_property(
+        graph, base, "name",
+        Literal(name or "message %s" % message_id, datatype=XSD.string)
+    )
+    add_property(
+        graph, base, "hash_algorithm", Literal(algo.name, datatype=XSD.string)
+    )
+    add_property(
+        graph, base, "key_list",
+        Literal(json.dumps(keys), datatype=XSD.string)
+    )
+    return url
+
+
+class _Body(io.BytesIO):
+    """ raw response, exposes headers for cookie extraction """
+
+    def __init__(self, body, headers):
+        super().__init__(body)
+        msg = HTTPMessage()
+        for key, value in headers.items():
+            msg[key] = value
+        self._original_response = SimpleNamespace(msg=msg)
+
+
+class InterruptedBody(_Body):
+    """ raw response, connection breaks after limit bytes """
+
+    def __init__(self, body, headers, limit):
+        super().__init__(body, headers)
+        self.limit = limit
+
+    def read(self, size=-1):
+        if self.tell() >= self.limit:
+            raise requests.exceptions.ConnectionError("interrupted")
+        if size is None or size < 0:
+            size = self.limit - self.tell()
+        return super().read(min(size, self.limit - self.tell()))
+
+
+class FakeTransport(requests.adapters.BaseAdapter):
+    """
+    Serves registered urls without network, records requests
+
+    Mount on a session for the host prefix. Handlers are called with the
+    PreparedRequest and return (status, headers, body), body can also be
+    a raw response like InterruptedBody.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.routes = {}
+        self.requests = []
+
+    def add(self, method, url, handler):
+        self.routes[(method, url)] = handler
+
+    def send(self, request, **kwargs):
+        self.requests.append(request)
+        parts = urlsplit(request.url)
+        url = urlunsplit((parts.scheme, parts.netloc, parts.path, "", ""))
+        handler = self.routes.get((request.method, url))
+        if handler:
+            status, headers, body = handler(request)
+        else:
+            status, headers, body = 404, {}, b""
+        response = requests.Response()
+        response.status_code = status
+        response.headers.update(headers)
+        if isinstance(body, _Body):
+            response.raw = body
+        else:
+            response.raw = _Body(body, headers)
+        response.url = request.url
+        response.request = request
+        response.encoding = "utf8"
+        return response
+
+    def close(self):
+        pass
+
+
+def add_public_key(
+    graph, component_url, url, key, algo=hashes.SHA512(), thirdparty=None
+):
+    """ add PublicKey content of key to component """
+    base = add_content(graph, url, "PublicKey")
+    graph.add((URIRef(component_url), spkcgraph["contents"], base))
+    add_property(graph, base, "key", Literal(
+        key_info(key.public_key()).pem.decode("ascii"),
+        datatype=XSD.string
+    ))
+    add_property(
+        graph, base, "hash_algorithm", Literal(algo.name, datatype=XSD.string)
+    )
+    if thirdparty is not None:
+        add_property(graph, base, "thirdparty", Literal(thirdparty))
+    return url
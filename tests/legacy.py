@@ -0,0 +1,68 @@
+"""
+Reference implementations of replaced code paths
+
+Used to check that reworked code produces identical results and for
+comparing benchmarks.
+"""
+
+import base64
+from email import parser as emailparser
+from email import policy
+
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+
+from spider_messaging.constants import MessageType
+
+
+def legacy_decrypt(key, chunks, outfp):
+    """
+    Decryption loop of PostBox.receive before MessageDecryptor
+
+    Chunks must be at least 16 bytes long (the last one excepted) and the
+    header separator must not be split, like it was with 256 byte chunks.
+
+    Returns:
+        headers
+    """
+    headblock = b""
+    fdecryptor = None
+    eparser = emailparser.BytesFeedParser(policy=policy.default)
+    headers = None
+    for chunk in chunks:
+        blob = None
+        if not fdecryptor:
+            headblock = b"%b%b" % (headblock, chunk)
+            if b"\0" in headblock:
+                nonce, headblock = headblock.split(b"\0", 1)
+                nonce = base64.b64decode(nonce)
+                fdecryptor = Cipher(
+                    algorithms.AES(key),
+                    modes.GCM(nonce),
+                    backend=default_backend()
+                ).decryptor()
+                blob = fdecryptor.update(headblock[:-16])
+                headblock = headblock[-16:]
+            else:
+                continue
+        else:
+            blob = fdecryptor.update(
+                b"%b%b" % (headblock, chunk[:-16])
+            )
+            headblock = chunk[-16:]
+        if not headers:
+            if b"\n\n" not in blob:
+                eparser.feed(blob)
+                continue
+            headersrest, blob = blob.split(b"\n\n", 1)
+            eparser.feed(headersrest)
+            headers = eparser.close()
+            t = headers.get("SPKC-Type", MessageType.email)
+            if t == MessageType.email:
+                outfp.write(headers.as_bytes(
+                    unixfrom=True,
+                    policy=policy.SMTP
+                ))
+        outfp.write(blob)
+    outfp.write(fdecryptor.finalize_with_tag(headblock))
+    return headers
@@ -0,0 +1,105 @@
+import asyncio
+import io
+import os
+import threading
+import unittest
+
+from cryptography.hazmat.primitives.asymmetric import ed25519
+
+from spider_messaging.constants import SendMethod
+from spider_messaging.utils.misc import MessageDecryptor
+
+try:
+    import aiohttp
+    from aiohttp import web
+
+    from spider_messaging.protocols.async_messaging import AsyncPostBox
+except ImportError:
+    aiohttp = None
+
+
+class ThreadRecordingFile(io.RawIOBase):
+    """ records the threads reading from it """
+
+    def __init__(self, fileob):
+        self.fileob = fileob
+        self.threads = set()
+
+    def readable(self):
+        return True
+
+    def read(self, size=-1):
+        self.threads.add(threading.get_ident())
+        return self.fileob.read(size)
+
+
+@unittest.skipIf(not aiohttp, "aiohttp not installed")
+class AsyncUploadTests(unittest.TestCase):
+    def setUp(self):
+        self.postbox = AsyncPostBox(
+            ":memory:", ed25519.Ed25519PrivateKey.generate()
+        )
+        self.postbox.chunk_size = 2 ** 14
+
+    def tearDown(self):
+        self.postbox.attestation_checker.close()
+
+    def upload(self, data, headers):
+        """ returns (received body, threads reading the encrypted file) """
+        loop = asyncio.new_event_loop()
+        received = []
+
+        async def handler(request):
+            form = await request.post()
+            received.append(form["encrypted_content"].file.read())
+            return web.Response()
+
+        async def run():
+            app = web.Application(client_max_size=2 ** 30)
+            app.router.add_post("/", handler)
+            runner = web.AppRunner(app)
+            await runner.setup()
+            site = web.TCPSite(runner, "127.0.0.1", 0)
+            await site.start()
+            port = site._server.sockets[0].getsockname()[1]
+            inp, aes_key, nonce, fencryptor, _ = \
+                self.postbox._prepare_send(data, None, SendMethod.stealth)
+            encrypted = ThreadRecordingFile(
+                self.postbox._encrypted_content(
+                    inp, aes_key, nonce, fencryptor, headers
+                )
+            )
+            form = aiohttp.FormData()
+            form.add_field(
+                "encrypted_content",
+                self.postbox._read_chunks(encrypted),
+                filename="encrypted_content",
+                content_type="application/octet-stream"
+            )
+            try:
+                async with aiohttp.ClientSession() as session:
+                    async with session.post(
+                        "http://127.0.0.1:%s/" % port, data=form
+                    ) as response:
+                        self.assertEqual(response.status, 200)
+            finally:
+                await runner.cleanup()
+            return aes_key, encrypted.threads
+
+        try:
+            aes_key, threads = loop.run_until_complete(run())
+        finally:
+            loop.close()
+        return aes_key, received[0], threads
+
+    def test_upload_encrypts_in_executor(self):
+        data = os.urandom(2 ** 18 + 7)
+        aes_key, body, threads = self.upload(data, b"SPKC-Type: file\n")
+        self.assertTrue(threads)
+        # the event loop runs in this thread
+        self.assertNotIn(threading.get_ident(), threads)
+        out = io.BytesIO()
+        decryptor = MessageDecryptor(aes_key, out)
+        decryptor.feed(body)
+        decryptor.finalize()
+        self.assertEqual(out.getvalue(), data)
@@ -0,0 +1,411 @@
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.asymmetric import ed25519
+
+from spider_messaging.constants import AttestationResult, KeyTriple
+from spider_messaging.protocols import attestation
+from spider_messaging.protocols.attestation import AttestationChecker
+from spider_messaging.utils.crypto import sign_data
+from spider_messaging.utils.keys import key_fingerprint
+
+
+def generate_keys(amount):
+    return [ed25519.Ed25519PrivateKey.generate() for _ in range(amount)]
+
+
+def signed(private_keys, algo=hashes.SHA512()):
+    """ key list of (hash, key, signature) signing the attestation """
+    hashed = [key_fingerprint(key.public_key(), algo) for key in private_keys]
+    attestation = AttestationChecker.calc_attestation(hashed, algo)
+    return [
+        (digest, key.public_key(), sign_data(key, attestation, algo))
+        for digest, key in zip(hashed, private_keys)
+    ]
+
+
+class AttestationTestCase(unittest.TestCase):
+    algo = hashes.SHA512()
+    dbfile = ":memory:"
+    checker = None
+    tmpdir = None
+
+    def setUp(self):
+        if self.dbfile != ":memory:":
+            self.tmpdir = tempfile.mkdtemp()
+            self.dbfile = os.path.join(self.tmpdir, self.dbfile)
+        self.checker = AttestationChecker(self.dbfile)
+
+    def tearDown(self):
+        self.checker.close()
+        if self.tmpdir:
+            shutil.rmtree(self.tmpdir)
+
+    def attestation(self, key_list):
+        return AttestationChecker.calc_attestation(key_list, self.algo)
+
+    def stored_hashes(self, domain):
+        return set(map(lambda x: x[0], self.checker.con.execute("""
+            SELECT key.hash FROM key
+            JOIN domain ON key.domain=domain.id WHERE domain.url=?
+        """, (domain,))))
+
+
+class CheckManyTests(AttestationTestCase):
+    def test_unchanged(self):
+        domains = {
+            "https://d%s/" % i: signed(generate_keys(3)) for i in range(5)
+        }
+        self.checker.add_many(domains, self.algo)
+        result = self.checker.check_many(domains, self.algo)
+        self.assertEqual(set(result), set(domains))
+        for domain, key_list in domains.items():
+            self.assertEqual(result[domain][0], AttestationResult.success)
+            self.assertEqual(
+                self.checker.get_domain_info(domain).attestation,
+                self.attestation(key_list)
+            )
+
+    def test_changed(self):
+        private_keys = {
+            "https://d%s/" % i: generate_keys(3) for i in range(5)
+        }
+        self.checker.add_many(
+            {
+                domain: signed(keys)
+                for domain, keys in private_keys.items()
+            }, self.algo
+        )
+        changed = {
+            domain: signed(keys[:2] + generate_keys(1))
+            for domain, keys in private_keys.items()
+        }
+        changed["https://unknown/"] = signed(generate_keys(1))
+        result = self.checker.check_many(changed, self.algo)
+        self.assertEqual(
+            result.pop("https://unknown/")[0],
+            AttestationResult.domain_unknown
+        )
+        for domain, (state, errored, _) in result.items():
+            self.assertEqual(state, AttestationResult.partial_success)
+            self.assertEqual(errored, [])
+            self.assertEqual(
+                self.checker.get_domain_info(domain).attestation,
+                self.attestation(changed[domain])
+            )
+            self.assertEqual(
+                self.stored_hashes(domain),
+                set(map(lambda x: x[0], changed[domain]))
+            )
+        # keys were updated, second check succeeds
+        for state, _, _ in self.checker.check_many(
+            {domain: changed[domain] for domain in result}, self.algo
+        ).values():
+            self.assertEqual(state, AttestationResult.success)
+
+
+class StorageTests(AttestationTestCase):
+    dbfile = "attestation.sqlite3"
+
+    def test_wal(self):
+        self.assertEqual(
+            self.checker.con.execute("PRAGMA journal_mode").fetchone()[0],
+            "wal"
+        )
+
+    def test_add_twice(self):
+        domain = "https://d/"
+        key_list = [os.urandom(64) for _ in range(3)]
+        self.checker.add(domain, key_list, self.algo)
+        info = self.checker.get_domain_info(domain)
+        self.assertEqual(info.attestation, self.attestation(key_list))
+        self.assertEqual(info.hash_algo, "SHA512")
+        # updated in place: same id, keys are not orphaned
+        self.checker.add(domain, key_list, self.algo)
+        self.assertEqual(self.checker.get_domain_info(domain), info)
+        self.assertEqual(self.stored_hashes(domain), set(key_list))
+
+    def test_add_many(self):
+        domains = {
+            "https://d%s/" % i: [os.urandom(64) for _ in range(3)]
+            for i in range(50)
+        }
+        attestation = os.urandom(64)
+        ret = self.checker.add_many(
+            [
+                *domains.items(),
+                ("https://explicit/", [os.urandom(64)], attestation)
+            ], self.algo
+        )
+        self.assertEqual(len(ret), 51)
+        self.assertEqual(
+            self.checker.get_domain_info("https://explicit/").attestation,
+            attestation
+        )
+        for domain, key_list in domains.items():
+            self.assertEqual(self.stored_hashes(domain), set(key_list))
+            self.assertEqual(
+                self.checker.get_domain_info(domain).attestation,
+                self.attestation(key_list)
+            )
+
+    def test_check_many_bulk(self):
+        domains = {
+            "https://d%s/" % i: signed(generate_keys(2)) for i in range(50)
+        }
+        self.checker.add_many(domains, self.algo)
+        domains["https://d0/"] = signed(generate_keys(1))
+        result = self.checker.check_many(
+            [*domains.items(), ("https://empty/", [])], self.algo
+        )
+        self.assertEqual(
+            result.pop("https://empty/")[0], AttestationResult.error
+        )
+        self.assertEqual(
+            result.pop("https://d0/")[0], AttestationResult.error
+        )
+        self.assertEqual(
+            set(map(lambda x: x[0], result.values())),
+            {AttestationResult.success}
+        )
+
+    def test_large_key_set(self):
+        domain = "https://large/"
+        private_keys = generate_keys(3000)
+        self.checker.add(domain, signed(private_keys), self.algo)
+        self.assertGreater(3000, self.checker.max_inline_hashes)
+        key_list = signed(private_keys[:2500] + generate_keys(1))
+        self.assertEqual(
+            self.checker.check(domain, key_list, self.algo)[0],
+            AttestationResult.partial_success
+        )
+        self.assertEqual(
+            self.stored_hashes(domain), set(map(lambda x: x[0], key_list))
+        )
+        self.assertEqual(
+            self.checker.check(domain, key_list, self.algo)[0],
+            AttestationResult.success
+        )
+
+    def test_rollback(self):
+        with self.assertRaises(RuntimeError):
+            with self.checker._transaction("IMMEDIATE") as cursor:
+                cursor.execute("""
+                    INSERT INTO domain (url) VALUES ('https://d/')
+                """)
+                raise RuntimeError()
+        self.assertFalse(self.checker.con.in_transaction)
+        self.assertIsNone(self.checker.get_domain_info("https://d/").id)
+
+    def test_reopen(self):
+        domain = "https://d/"
+        key_list = [os.urandom(64) for _ in range(3)]
+        self.checker.add(domain, key_list, self.algo)
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            # connection of the worker thread
+            self.assertEqual(
+                executor.submit(self.stored_hashes, domain).result(),
+                set(key_list)
+            )
+            self.checker.close()
+            # closed connections are replaced on next use
+            self.assertEqual(
+                executor.submit(self.stored_hashes, domain).result(),
+                set(key_list)
+            )
+        self.assertEqual(self.stored_hashes(domain), set(key_list))
+        self.checker.add("https://e/", key_list, self.algo)
+        self.assertEqual(self.stored_hashes("https://e/"), set(key_list))
+
+
+class ConcurrencyTests(AttestationTestCase):
+    threads = 16
+
+    def rotate(self, domain, private_keys):
+        """ replace a key of domain, returns the new private keys """
+        private_keys = private_keys[1:] + generate_keys(1)
+        key_list = signed(private_keys)
+        result = self.checker.check_many({domain: key_list}, self.algo)
+        self.assertEqual(
+            result[domain][0], AttestationResult.partial_success
+        )
+        self.assertEqual(
+            self.checker.check(domain, key_list, self.algo)[0],
+            AttestationResult.success
+        )
+        self.assertEqual(
+            self.checker.get_domain_info(domain).attestation,
+            self.attestation(key_list)
+        )
+        return private_keys
+
+    def work(self, index):
+        domain = "https://d%s/" % index
+        private_keys = generate_keys(3)
+        self.checker.add(domain, signed(private_keys), self.algo)
+        for _ in range(5):
+            private_keys = self.rotate(domain, private_keys)
+            # read other domains, concurrently modified
+            for other in range(self.threads):
+                self.checker.get_domain_info("https://d%s/" % other)
+        return threading.get_ident(), self.checker.con
+
+    def test_threads(self):
+        with ThreadPoolExecutor(self.threads) as executor:
+            connections = dict(
+                executor.map(self.work, range(self.threads))
+            )
+        for index in range(self.threads):
+            self.assertIsNotNone(
+                self.checker.get_domain_info("https://d%s/" % index).id
+            )
+        # executor threads can be reused
+        used = set(map(id, connections.values()))
+        if self.dbfile == ":memory:":
+            self.assertEqual(len(used), 1)
+        else:
+            self.assertEqual(len(used), len(connections))
+            self.assertNotIn(id(self.checker.con), used)
+
+    def test_invalidation(self):
+        domain = "https://d/"
+        key_list = [os.urandom(64) for _ in range(3)]
+        self.checker.add(domain, key_list, self.algo)
+        # fill cache
+        self.checker.get_domain_info(domain)
+        key_list = key_list[:1] + [os.urandom(64)]
+        self.checker.add(domain, key_list, self.algo)
+        # add keeps old keys
+        hashes_before = self.stored_hashes(domain)
+        self.assertEqual(
+            self.checker.get_domain_info(domain).attestation,
+            self.attestation(key_list)
+        )
+        with self.assertRaises(RuntimeError):
+            with self.checker._transaction("IMMEDIATE") as cursor:
+                self.checker._add(
+                    cursor, domain, [KeyTriple(os.urandom(64), None, None)],
+                    self.algo, None
+                )
+                raise RuntimeError()
+        self.assertEqual(
+            self.checker.get_domain_info(domain).attestation,
+            self.attestation(key_list)
+        )
+        self.assertEqual(self.stored_hashes(domain), hashes_before)
+
+    def test_other_thread_sees_write(self):
+        domain = "https://d/"
+        key_list = [os.urandom(64) for _ in range(3)]
+        self.checker.add(domain, key_list, self.algo)
+        read = threading.Event()
+        written = threading.Event()
+        infos = []
+
+        def reader():
+            infos.append(self.checker.get_domain_info(domain))
+            read.set()
+            written.wait(10)
+            infos.append(self.checker.get_domain_info(domain))
+
+        thread = threading.Thread(target=reader)
+        thread.start()
+        read.wait(10)
+        key_list = key_list[:1]
+        self.checker.add(domain, key_list, self.algo)
+        written.set()
+        thread.join(10)
+        self.assertNotEqual(infos[0].attestation, infos[1].attestation)
+        self.assertEqual(infos[1].attestation, self.attestation(key_list))
+
+
+class FileConcurrencyTests(ConcurrencyTests):
+    dbfile = "attestation.sqlite3"
+
+
+class SignatureCacheTests(AttestationTestCase):
+    dbfile = "attestation.sqlite3"
+
+    def check(self, key_list):
+        """ returns (errored, verify_signature calls) """
+        with mock.patch.object(
+            attestation, "verify_signature",
+            side_effect=attestation.verify_signature
+        ) as verify:
+            errored = AttestationChecker.check_signatures(
+                key_list, self.algo, embed=True,
+                signature_cache=self.checker
+            )[1]
+        return errored, verify.call_count
+
+    def key_list(self, private_keys):
+        return [KeyTriple(*entry) for entry in signed(private_keys)]
+
+    def stored_signatures(self):
+        return self.checker.con.execute(
+            "SELECT COUNT(*) FROM signature"
+        ).fetchone()[0]
+
+    def test_cached(self):
+        key_list = self.key_list(generate_keys(3))
+        self.assertEqual(self.check(key_list), ([], 3))
+        self.assertEqual(self.check(key_list), ([], 0))
+        # persisted, also without the in-memory front
+        self.checker._verified_signatures.clear()
+        self.assertEqual(self.check(key_list), ([], 0))
+        self.assertEqual(self.stored_signatures(), 3)
+
+    def test_failed_not_cached(self):
+        key_list = self.key_list(generate_keys(2))
+        # signature of other key
+        key_list[0] = key_list[0]._replace(signature=key_list[1].signature)
+        self.assertEqual(self.check(key_list), ([key_list[0]], 2))
+        self.assertEqual(self.check(key_list), ([key_list[0]], 1))
+        self.assertEqual(self.stored_signatures(), 1)
+
+    def test_attestation_changed(self):
+        domain = "https://d/"
+        private_keys = generate_keys(3)
+        old = self.key_list(private_keys)
+        other = self.key_list(generate_keys(1))
+        self.checker.add(domain, old, self.algo, embed=True)
+        self.check(old)
+        self.check(other)
+        self.assertEqual(self.stored_signatures(), 4)
+        # same attestation: signatures are kept
+        self.checker.add(domain, old, self.algo, embed=True)
+        self.assertEqual(self.stored_signatures(), 4)
+        # keys changed: signatures of the old attestation are purged
+        new = self.key_list(private_keys[:2])
+        self.checker.add(domain, new, self.algo, embed=True)
+        self.assertEqual(self.stored_signatures(), 1)
+        self.assertEqual(self.check(old), ([], 3))
+        self.assertEqual(self.check(new), ([], 2))
+        self.assertEqual(self.check(other), ([], 0))
+
+    def test_purge(self):
+        domain = "https://d/"
+        key_list = self.key_list(generate_keys(2))
+        other = self.key_list(generate_keys(1))
+        self.checker.add(domain, key_list, self.algo, embed=True)
+        self.check(key_list)
+        self.check(other)
+        self.checker.purge_signatures(domain)
+        self.assertEqual(self.stored_signatures(), 1)
+        self.assertEqual(self.check(key_list), ([], 2))
+        self.checker.purge_signatures(
+            attestation=self.attestation(other)
+        )
+        self.assertEqual(self.check(other), ([], 1))
+        # unknown domain: nothing to purge
+        self.checker.purge_signatures("https://unknown/")
+        self.assertEqual(self.stored_signatures(), 3)
+        self.checker.purge_signatures()
+        self.assertEqual(self.stored_signatures(), 0)
+        self.assertEqual(self.checker._verified_signatures, set())
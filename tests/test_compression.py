@@ -0,0 +1,223 @@
+import io
+import os
+import unittest
+import zlib
+
+import requests
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives.asymmetric import ed25519
+from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+
+from spider_messaging.constants import CompressionMethod
+from spider_messaging.protocols.messaging import PostBox
+from spider_messaging.utils.compression import (
+    available_compressions, compression_header, create_compressor,
+    create_decompressor, is_compressible
+)
+from spider_messaging.utils.misc import (
+    CompressedFile, EncryptedFile, MessageDecryptor
+)
+
+from . import fixtures
+
+compressible = b"spkcspider message content " * 20000
+
+
+def compress(data, method):
+    compressor = create_compressor(method)
+    return compressor.compress(data) + compressor.flush()
+
+
+class SizeRecordingFile(io.BytesIO):
+    """ records the sizes of writes """
+
+    def __init__(self):
+        super().__init__()
+        self.sizes = []
+
+    def write(self, data):
+        self.sizes.append(len(data))
+        return super().write(data)
+
+
+def decrypt(key, blob, chunk_size=1000):
+    outfp = io.BytesIO()
+    decryptor = MessageDecryptor(key, outfp, chunk_size=4096)
+    for pos in range(0, len(blob), chunk_size):
+        decryptor.feed(blob[pos:pos + chunk_size])
+    return decryptor.finalize(), outfp.getvalue()
+
+
+class CompressionTests(unittest.TestCase):
+    def methods(self):
+        for method in CompressionMethod:
+            with self.subTest(method=method):
+                if method not in available_compressions():
+                    with self.assertRaises(ValueError):
+                        create_compressor(method)
+                    continue
+                yield method
+
+    def encrypt(self, key, data, method, headers=b"SPKC-Type: file"):
+        nonce = os.urandom(13)
+        return EncryptedFile(
+            Cipher(
+                algorithms.AES(key), modes.GCM(nonce),
+                backend=default_backend()
+            ).encryptor(),
+            CompressedFile(io.BytesIO(data), method, read_size=4096),
+            nonce, b"%b\n%b: %b" % (
+                headers, compression_header.encode("ascii"), bytes(method)
+            )
+        ).read()
+
+    def test_roundtrip(self):
+        key = os.urandom(32)
+        for method in self.methods():
+            for data in [b"", b"x", compressible, os.urandom(100000)]:
+                blob = self.encrypt(key, data, method)
+                headers, content = decrypt(key, blob)
+                self.assertEqual(content, data)
+                self.assertEqual(headers["SPKC-Type"], "file")
+                # transport detail, not part of the message headers
+                self.assertNotIn(compression_header, headers)
+            self.assertLess(
+                len(self.encrypt(key, compressible, method)),
+                len(compressible) // 10
+            )
+
+    def test_compressed_file(self):
+        for method in self.methods():
+            fileob = CompressedFile(io.BytesIO(compressible), method)
+            self.assertIsNone(fileob.length)
+            self.assertTrue(fileob.readable())
+            # small reads over chunk boundaries
+            blob = b"".join(iter(lambda: fileob.read(1000), b""))
+            outfp = io.BytesIO()
+            decompressor = create_decompressor(str(method), outfp, 4096)
+            decompressor.write(blob)
+            decompressor.flush()
+            self.assertEqual(outfp.getvalue(), compressible)
+
+    def test_bounded_output(self):
+        for method in self.methods():
+            outfp = SizeRecordingFile()
+            decompressor = create_decompressor(str(method), outfp, 4096)
+            decompressor.write(compress(bytes(10 ** 6), method))
+            decompressor.flush()
+            self.assertEqual(outfp.getvalue(), bytes(10 ** 6))
+            self.assertLessEqual(max(outfp.sizes), 4096)
+
+    def test_truncated(self):
+        for method in self.methods():
+            blob = compress(compressible + os.urandom(10000), method)
+            for cut in [1, 5, len(blob) // 2, len(blob) - 1]:
+                with self.subTest(cut=cut):
+                    decompressor = create_decompressor(
+                        str(method), io.BytesIO(), 4096
+                    )
+                    with self.assertRaises((ValueError, zlib.error)):
+                        decompressor.write(blob[:cut])
+                        decompressor.flush()
+
+    def test_unknown(self):
+        with self.assertRaises(ValueError):
+            create_decompressor("brotli", io.BytesIO())
+
+    def test_is_compressible(self):
+        self.assertTrue(is_compressible(io.BytesIO(compressible)))
+        self.assertFalse(is_compressible(io.BytesIO(os.urandom(100000))))
+        self.assertFalse(is_compressible(io.BytesIO(b"x" * 100), 1024))
+        # position is kept
+        fileob = io.BytesIO(compressible)
+        fileob.seek(10)
+        is_compressible(fileob)
+        self.assertEqual(fileob.tell(), 10)
+
+
+@unittest.skipIf(
+    CompressionMethod.zstd not in available_compressions(),
+    "zstandard not installed"
+)
+class ZstdFrameTests(unittest.TestCase):
+    def test_frames(self):
+        blob = compress(compressible, CompressionMethod.zstd)
+        # concatenated and skippable frames
+        skippable = b"\x50\x2a\x4d\x18" + (3).to_bytes(4, "little") + b"abc"
+        for content in [blob, blob + blob, skippable + blob]:
+            outfp = io.BytesIO()
+            decompressor = create_decompressor("zstd", outfp, 4096)
+            for pos in range(0, len(content), 3):
+                decompressor.write(content[pos:pos + 3])
+            decompressor.flush()
+            self.assertTrue(outfp.getvalue().startswith(compressible))
+        for content in [b"", skippable, blob + blob[:10]]:
+            decompressor = create_decompressor("zstd", io.BytesIO(), 4096)
+            with self.assertRaises(ValueError):
+                decompressor.write(content)
+                decompressor.flush()
+
+    def test_invalid(self):
+        decompressor = create_decompressor("zstd", io.BytesIO(), 4096)
+        with self.assertRaises(Exception):
+            decompressor.write(b"\x00" * 8)
+
+
+class PostBoxCompressionTests(unittest.TestCase):
+    def setUp(self):
+        key = ed25519.Ed25519PrivateKey.generate()
+        session = requests.Session()
+        session.mount(fixtures.host, fixtures.FakeTransport())
+        self.postbox = PostBox(
+            ":memory:", key, fixtures.postbox_url,
+            graph=fixtures.postbox_graph([key]), session=session
+        )
+        self.postbox.compression = CompressionMethod.zlib
+        self.postbox.segment_size = 4096
+
+    def tearDown(self):
+        self.postbox.attestation_checker.close()
+
+    def roundtrip(self, data):
+        """ returns (compressed, encrypted content) """
+        key = os.urandom(32)
+        inp = io.BytesIO(data)
+        compressed, _ = self.postbox._compress_content(
+            inp, b"SPKC-Type: file"
+        )
+        inp.seek(0)
+        blob = self.postbox._encrypted_content(
+            inp, key, None, None, b"SPKC-Type: file"
+        ).read()
+        headers, content = decrypt(key, blob)
+        self.assertEqual(content, data)
+        self.assertEqual(headers["SPKC-Type"], "file")
+        self.assertNotIn(compression_header, headers)
+        return compressed is not inp, blob
+
+    def test_compressed(self):
+        compressed, blob = self.roundtrip(compressible)
+        self.assertTrue(compressed)
+        self.assertLess(len(blob), len(compressible) // 10)
+
+    def test_incompressible(self):
+        compressed, _ = self.roundtrip(os.urandom(100000))
+        self.assertFalse(compressed)
+
+    def test_below_threshold(self):
+        compressed, _ = self.roundtrip(
+            b"a" * (self.postbox.compression_min_size - 1)
+        )
+        self.assertFalse(compressed)
+
+    def test_disabled(self):
+        self.postbox.compression = None
+        compressed, _ = self.roundtrip(compressible)
+        self.assertFalse(compressed)
+
+    def test_headers(self):
+        inp = io.BytesIO(compressible)
+        _, headers = self.postbox._compress_content(inp, {"SPKC-Type": "file"})
+        self.assertEqual(
+            headers, b"SPKC-Type: file\nSPKC-Compression: zlib"
+        )
@@ -0,0 +1,90 @@
+import threading
+import time
+import unittest
+from collections import Counter
+
+from spider_messaging.utils.concurrency import fan_out, host_key
+
+
+class ConcurrencyRecorder(object):
+    """ records the maximal number of concurrent calls, per key and total """
+
+    def __init__(self, key=None, delay=0.02):
+        self.key = key
+        self.delay = delay
+        self.lock = threading.Lock()
+        self.current = Counter()
+        self.maximum = Counter()
+        self.threads = set()
+
+    def __call__(self, item):
+        keys = [None] if self.key is None else [None, self.key(item)]
+        number = item[1] if isinstance(item, tuple) else item
+        with self.lock:
+            self.threads.add(threading.get_ident())
+            for k in keys:
+                self.current[k] += 1
+                self.maximum[k] = max(self.maximum[k], self.current[k])
+        # later items finish first
+        time.sleep(self.delay / (1 + number))
+        with self.lock:
+            for k in keys:
+                self.current[k] -= 1
+        if number % 5 == 4:
+            raise ValueError(number)
+        return number * 2
+
+
+class FanOutTests(unittest.TestCase):
+    def test_order(self):
+        for max_workers in [None, 1, 4, 20]:
+            with self.subTest(max_workers=max_workers):
+                recorder = ConcurrencyRecorder()
+                results = fan_out(
+                    recorder, range(10), max_workers=max_workers
+                )
+                self.assertEqual(len(results), 10)
+                for item, (result, exc) in enumerate(results):
+                    if item % 5 == 4:
+                        self.assertIsNone(result)
+                        self.assertIsInstance(exc, ValueError)
+                        self.assertEqual(exc.args, (item,))
+                    else:
+                        self.assertEqual((result, exc), (item * 2, None))
+                self.assertLessEqual(recorder.maximum[None], max_workers or 1)
+
+    def test_caller_thread(self):
+        recorder = ConcurrencyRecorder()
+        fan_out(recorder, range(3))
+        self.assertEqual(recorder.threads, {threading.get_ident()})
+        # single item needs no pool
+        recorder = ConcurrencyRecorder()
+        fan_out(recorder, [0], max_workers=4)
+        self.assertEqual(recorder.threads, {threading.get_ident()})
+        self.assertEqual(fan_out(recorder, [], max_workers=4), [])
+
+    def test_per_key_limit(self):
+        items = [
+            ("https://%s/" % host, number)
+            for number, host in enumerate(["a", "b", "c"] * 4)
+        ]
+        recorder = ConcurrencyRecorder(
+            key=lambda item: host_key(item[0]), delay=0.05
+        )
+        results = fan_out(
+            recorder, items, max_workers=6, max_per_key=2,
+            key=lambda item: host_key(item[0])
+        )
+        self.assertEqual(
+            [result for result, _ in results],
+            [None if i % 5 == 4 else i * 2 for i in range(12)]
+        )
+        self.assertLessEqual(recorder.maximum[None], 6)
+        for host in ["a", "b", "c"]:
+            self.assertLessEqual(recorder.maximum[host], 2)
+        # hosts run in parallel
+        self.assertGreater(recorder.maximum[None], 2)
+
+    def test_host_key(self):
+        self.assertEqual(host_key("https://a:8000/x/?y=1"), "a:8000")
+        self.assertNotEqual(host_key("https://a/"), host_key("https://b/"))
@@ -0,0 +1,270 @@
+import base64
+import os
+import unittest
+
+from cryptography.exceptions import InvalidSignature
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ed25519, padding, x25519
+from cryptography.hazmat.primitives.keywrap import InvalidUnwrap
+
+from spider_messaging.constants import KeyTriple
+from spider_messaging.protocols.attestation import AttestationChecker
+from spider_messaging.utils.crypto import (
+    _x25519_private, _x25519_public, generate_private_key, sign_data,
+    unwrap_key, verify_signature, wrap_key, x25519_tag
+)
+from spider_messaging.utils.keys import key_fingerprint
+
+from .fixtures import key_list
+
+
+def raw_public(key):
+    return key.public_bytes(
+        encoding=serialization.Encoding.Raw,
+        format=serialization.PublicFormat.Raw
+    )
+
+
+def pss_signature(private_key, data, algo):
+    """ RSA-PSS signature tagged like sign_data, any hash algorithm """
+    return "%s=%s" % (algo.name, base64.b64encode(private_key.sign(
+        data,
+        padding.PSS(
+            mgf=padding.MGF1(algo), salt_length=padding.PSS.MAX_LENGTH
+        ),
+        algo
+    )).decode("ascii"))
+
+
+def tamper(value, tagged=True):
+    """ flip a bit in the last byte of a base64 value (<tag>=<base64>) """
+    tag = ""
+    if tagged:
+        tag, value = value.split("=", 1)
+        tag += "="
+    raw = bytearray(base64.b64decode(value))
+    raw[-1] ^= 1
+    return tag + base64.b64encode(raw).decode("ascii")
+
+
+class CryptoTestCase(unittest.TestCase):
+    algo = hashes.SHA512()
+    rsa_key = None
+    ed25519_key = None
+    x25519_key = None
+
+    @classmethod
+    def setUpClass(cls):
+        cls.rsa_key = generate_private_key("rsa", 2048)
+        cls.ed25519_key = generate_private_key("ed25519")
+        cls.x25519_key = x25519.X25519PrivateKey.generate()
+
+
+class KeyWrapTests(CryptoTestCase):
+    def roundtrip(self, private_key):
+        aes_key = os.urandom(32)
+        wrapped = wrap_key(private_key.public_key(), aes_key, self.algo)
+        self.assertEqual(unwrap_key(private_key, wrapped, self.algo), aes_key)
+        return wrapped
+
+    def test_rsa_oaep(self):
+        wrapped = self.roundtrip(self.rsa_key)
+        self.assertFalse(wrapped.startswith("%s=" % x25519_tag))
+
+    def test_x25519_from_ed25519(self):
+        wrapped = self.roundtrip(self.ed25519_key)
+        self.assertTrue(wrapped.startswith("%s=" % x25519_tag))
+        # converted public key matches the key derived from the seed
+        self.assertEqual(
+            raw_public(_x25519_public(self.ed25519_key.public_key())),
+            raw_public(_x25519_private(self.ed25519_key).public_key())
+        )
+
+    def test_x25519(self):
+        wrapped = self.roundtrip(self.x25519_key)
+        self.assertTrue(wrapped.startswith("%s=" % x25519_tag))
+
+    def test_mixed_key_list(self):
+        aes_key = os.urandom(32)
+        private_keys = [self.rsa_key, self.ed25519_key, self.x25519_key]
+        keys = key_list(aes_key, private_keys, self.algo)
+        entries = [
+            keys["%s=%s" % (
+                self.algo.name,
+                key_fingerprint(key.public_key(), self.algo).hex()
+            )] for key in private_keys
+        ]
+        self.assertEqual(len(keys), 3)
+        for key, entry in zip(private_keys, entries):
+            self.assertEqual(unwrap_key(key, entry, self.algo), aes_key)
+        # entries are only usable with the matching key type
+        with self.assertRaises(ValueError):
+            unwrap_key(self.ed25519_key, entries[0], self.algo)
+        with self.assertRaises(ValueError):
+            unwrap_key(self.rsa_key, entries[1], self.algo)
+        with self.assertRaises(InvalidUnwrap):
+            unwrap_key(self.x25519_key, entries[1], self.algo)
+
+    def test_low_order(self):
+        # identity (y = 1, u = 0), order 2 (y = -1) and order 4 (y = 0)
+        for y in [1, (1 << 255) - 20, 0]:
+            with self.subTest(y=y):
+                public_key = ed25519.Ed25519PublicKey.from_public_bytes(
+                    y.to_bytes(32, "little")
+                )
+                with self.assertRaises(ValueError):
+                    wrap_key(public_key, os.urandom(32), self.algo)
+        with self.assertRaises(ValueError):
+            wrap_key(
+                x25519.X25519PublicKey.from_public_bytes(bytes(32)),
+                os.urandom(32), self.algo
+            )
+        # ephemeral key of small order
+        with self.assertRaises(ValueError):
+            unwrap_key(
+                self.ed25519_key,
+                "%s=%s" % (
+                    x25519_tag, base64.b64encode(bytes(32 + 40)).decode()
+                ),
+                self.algo
+            )
+
+    def test_tampered(self):
+        for private_key, tagged in (
+            (self.rsa_key, False),
+            (self.ed25519_key, True),
+            (self.x25519_key, True)
+        ):
+            with self.subTest(key=type(private_key).__name__):
+                wrapped = wrap_key(
+                    private_key.public_key(), os.urandom(32), self.algo
+                )
+                with self.assertRaises((ValueError, InvalidUnwrap)):
+                    unwrap_key(
+                        private_key, tamper(wrapped, tagged), self.algo
+                    )
+
+
+class SignatureTests(CryptoTestCase):
+    data = b"attestation"
+
+    def test_roundtrip(self):
+        for private_key, tag in (
+            (self.rsa_key, self.algo.name),
+            (self.ed25519_key, "ed25519")
+        ):
+            with self.subTest(tag=tag):
+                signature = sign_data(private_key, self.data, self.algo)
+                self.assertTrue(signature.startswith("%s=" % tag))
+                verify_signature(
+                    private_key.public_key(), signature, self.data
+                )
+
+    def test_tampered(self):
+        for private_key in (self.rsa_key, self.ed25519_key):
+            with self.subTest(key=type(private_key).__name__):
+                signature = sign_data(private_key, self.data, self.algo)
+                with self.assertRaises(InvalidSignature):
+                    verify_signature(
+                        private_key.public_key(), tamper(signature),
+                        self.data
+                    )
+                with self.assertRaises(InvalidSignature):
+                    verify_signature(
+                        private_key.public_key(), signature, b"other"
+                    )
+
+    def test_wrong_key_type(self):
+        with self.assertRaises(InvalidSignature):
+            verify_signature(
+                self.rsa_key.public_key(),
+                sign_data(self.ed25519_key, self.data, self.algo),
+                self.data
+            )
+        with self.assertRaises(InvalidSignature):
+            verify_signature(
+                self.ed25519_key.public_key(),
+                sign_data(self.rsa_key, self.data, self.algo),
+                self.data
+            )
+
+    def test_hash_allow_list(self):
+        public_key = self.rsa_key.public_key()
+        verify_signature(
+            public_key,
+            pss_signature(self.rsa_key, self.data, hashes.SHA256()),
+            self.data
+        )
+        # weak algorithms are rejected even if the signature is valid
+        for algo in [hashes.MD5(), hashes.SHA1(), hashes.SHA224()]:
+            with self.subTest(algo=algo.name):
+                with self.assertRaises(ValueError):
+                    verify_signature(
+                        public_key,
+                        pss_signature(self.rsa_key, self.data, algo),
+                        self.data
+                    )
+        # algorithms requiring parameters or unknown
+        for tag in ["shake128", "blake2b", "hashalgorithm", "unknown"]:
+            with self.subTest(tag=tag):
+                with self.assertRaises(ValueError):
+                    verify_signature(
+                        public_key, "%s=AAAA" % tag, self.data
+                    )
+
+    def test_required_hash(self):
+        signature = pss_signature(self.rsa_key, self.data, hashes.SHA256())
+        with self.assertRaises(ValueError):
+            verify_signature(
+                self.rsa_key.public_key(), signature, self.data, self.algo
+            )
+        verify_signature(
+            self.rsa_key.public_key(), signature, self.data, hashes.SHA256()
+        )
+        # ed25519 signatures have no hash algorithm
+        verify_signature(
+            self.ed25519_key.public_key(),
+            sign_data(self.ed25519_key, self.data, self.algo),
+            self.data, hashes.SHA256()
+        )
+
+    def test_check_signatures_weak(self):
+        digest = key_fingerprint(self.rsa_key.public_key(), self.algo)
+        attestation = AttestationChecker.calc_attestation([digest], self.algo)
+        for signature in [
+            pss_signature(self.rsa_key, attestation, hashes.SHA1()),
+            pss_signature(self.rsa_key, attestation, hashes.SHA256()),
+            "shake128=AAAA", "no signature"
+        ]:
+            with self.subTest(signature=signature):
+                triple = KeyTriple(
+                    digest, self.rsa_key.public_key(), signature
+                )
+                _, errored, _ = AttestationChecker.check_signatures(
+                    [triple], self.algo
+                )
+                self.assertEqual(errored, [triple])
+
+    def test_check_signatures_mixed(self):
+        private_keys = [self.rsa_key, self.ed25519_key]
+        hashes_ = [
+            key_fingerprint(key.public_key(), self.algo)
+            for key in private_keys
+        ]
+        attestation = AttestationChecker.calc_attestation(hashes_, self.algo)
+        triples = [
+            KeyTriple(
+                digest, key.public_key(),
+                sign_data(key, attestation, self.algo)
+            )
+            for digest, key in zip(hashes_, private_keys)
+        ]
+        _, errored, _ = AttestationChecker.check_signatures(
+            triples, self.algo
+        )
+        self.assertEqual(errored, [])
+        triples[1] = triples[1]._replace(signature=tamper(triples[1][2]))
+        _, errored, _ = AttestationChecker.check_signatures(
+            triples, self.algo
+        )
+        self.assertEqual(errored, [triples[1]])
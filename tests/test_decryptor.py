@@ -0,0 +1,113 @@
+import io
+import os
+import unittest
+
+from cryptography.exceptions import InvalidTag
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+
+from spider_messaging.utils.misc import EncryptedFile, MessageDecryptor
+
+from .legacy import legacy_decrypt
+
+
+def encrypt(data, headers, key=None):
+    """ returns (key, encrypted content) """
+    key = key or os.urandom(32)
+    nonce = os.urandom(13)
+    fencryptor = Cipher(
+        algorithms.AES(key), modes.GCM(nonce), backend=default_backend()
+    ).encryptor()
+    return key, EncryptedFile(
+        fencryptor, io.BytesIO(data), nonce, headers
+    ).read()
+
+
+def split(blob, chunk_size):
+    return [
+        blob[i:i + chunk_size] for i in range(0, len(blob), chunk_size)
+    ]
+
+
+class MessageDecryptorTests(unittest.TestCase):
+    data = None
+
+    def setUp(self):
+        self.data = os.urandom(3 * 2 ** 16 + 123)
+
+    def decrypt(self, key, chunks, **kwargs):
+        out = io.BytesIO()
+        decryptor = MessageDecryptor(key, out, **kwargs)
+        for chunk in chunks:
+            decryptor.feed(chunk)
+        headers = decryptor.finalize()
+        return out.getvalue(), headers
+
+    def legacy(self, key, chunks):
+        out = io.BytesIO()
+        headers = legacy_decrypt(key, chunks, out)
+        return out.getvalue(), headers
+
+    def assertIdentical(self, key, blob, chunks, **kwargs):
+        expected, expected_headers = self.legacy(key, split(blob, 256))
+        result, headers = self.decrypt(key, chunks, **kwargs)
+        self.assertEqual(result, expected)
+        self.assertEqual(headers.items(), expected_headers.items())
+
+    def test_chunk_sizes(self):
+        for headers in [b"SPKC-Type: file\n", b"Subject: test\n"]:
+            key, blob = encrypt(self.data, headers)
+            for chunk_size in [
+                1, 15, 16, 17, 256, 4096, 2 ** 15 - 1, 2 ** 15, 2 ** 16,
+                2 ** 16 + 1, 2 ** 20, len(blob)
+            ]:
+                with self.subTest(headers=headers, chunk_size=chunk_size):
+                    self.assertIdentical(key, blob, split(blob, chunk_size))
+
+    def test_buffer_sizes(self):
+        key, blob = encrypt(self.data, b"SPKC-Type: file\n")
+        for chunk_size in [16, 2 ** 12, 2 ** 20]:
+            with self.subTest(chunk_size=chunk_size):
+                self.assertIdentical(
+                    key, blob, split(blob, 2 ** 16), chunk_size=chunk_size
+                )
+
+    def test_boundaries(self):
+        headers = b"SPKC-Type: file\nSubject: boundaries\n"
+        key, blob = encrypt(self.data, headers)
+        # nonce separator, header separator, tag
+        nonce_end = blob.index(b"\0") + 1
+        header_end = nonce_end + len(headers.strip()) + 2
+        tag_start = len(blob) - 16
+        points = set()
+        for boundary in [nonce_end, header_end, tag_start]:
+            points.update(range(boundary - 17, boundary + 18))
+        for point in sorted(points):
+            with self.subTest(point=point):
+                self.assertIdentical(key, blob, [blob[:point], blob[point:]])
+        # large chunks ending inside the tag window
+        for offset in [1, 8, 15, 16, 17]:
+            with self.subTest(offset=offset):
+                point = tag_start - 2 ** 16 + offset
+                self.assertIdentical(key, blob, [
+                    blob[:point], blob[point:tag_start + offset],
+                    blob[tag_start + offset:]
+                ])
+
+    def test_empty_content(self):
+        key, blob = encrypt(b"", b"SPKC-Type: file\n")
+        for chunk_size in [1, 16, len(blob)]:
+            with self.subTest(chunk_size=chunk_size):
+                result, headers = self.decrypt(key, split(blob, chunk_size))
+                self.assertEqual(result, b"")
+                self.assertEqual(headers["SPKC-Type"], "file")
+
+    def test_tampered(self):
+        key, blob = encrypt(self.data, b"SPKC-Type: file\n")
+        for position in [len(blob) // 2, len(blob) - 1]:
+            tampered = bytearray(blob)
+            tampered[position] ^= 1
+            for chunk_size in [256, 2 ** 16]:
+                with self.subTest(position=position, chunk_size=chunk_size):
+                    with self.assertRaises(InvalidTag):
+                        self.decrypt(key, split(bytes(tampered), chunk_size))
@@ -0,0 +1,253 @@
+import base64
+import json
+import os
+import unittest
+from hashlib import sha256
+from types import SimpleNamespace
+
+import requests
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.asymmetric import ed25519
+
+from spider_messaging.protocols.attestation import AttestationChecker
+from spider_messaging.protocols.messaging import PostBox
+from spider_messaging.utils.cache import DestinationCache
+from spider_messaging.utils.crypto import sign_data
+from spider_messaging.utils.keys import key_fingerprint, key_info
+
+from . import fixtures
+
+try:
+    fixtures.setup_django()
+    from django.test import RequestFactory
+    from spider_messaging.django.spider_messages.models import (
+        PostBox as PostBoxContent
+    )
+except (ImportError, RuntimeError):
+    # spkcspider dependencies missing or spider_messages not installed
+    PostBoxContent = None
+
+dest = "%s/spider/content/2/view/" % fixtures.host
+
+
+def descriptor(private_keys, url=dest, algo=hashes.SHA512()):
+    """ json descriptor of a postbox like get_descriptor """
+    hashed = [
+        key_fingerprint(key.public_key(), algo) for key in private_keys
+    ]
+    attestation = AttestationChecker.calc_attestation(hashed, algo)
+    return {
+        "type": "PostBox",
+        "url": url,
+        "hash_algorithm": algo.name,
+        "attestation": base64.b64encode(attestation).decode("ascii"),
+        "signatures": {
+            "%s-key%s/" % (url, i): {
+                "key": key_info(key.public_key()).pem.decode("ascii"),
+                "hash": "%s=%s" % (algo.name, hashed[i].hex()),
+                "signature": sign_data(key, attestation, algo)
+            } for i, key in enumerate(private_keys)
+        }
+    }
+
+
+class ParseDescriptorTests(unittest.TestCase):
+    def test_valid(self):
+        key = ed25519.Ed25519PrivateKey.generate()
+        data = descriptor([key])
+        for value in [data, json.dumps(data), json.dumps(data).encode()]:
+            url, options = PostBox.parse_descriptor(value)
+            self.assertEqual(url, dest)
+            self.assertIsInstance(options["hash_algorithm"], hashes.SHA512)
+            self.assertEqual(
+                options["attestation"], base64.b64decode(data["attestation"])
+            )
+            self.assertEqual(
+                set(options["signatures"]), set(data["signatures"])
+            )
+        # signature and hash are optional
+        del data["signatures"]["%s-key0/" % dest]["hash"]
+        data["signatures"]["%s-key0/" % dest]["signature"] = None
+        entry = PostBox.parse_descriptor(data)[1]["signatures"][
+            "%s-key0/" % dest
+        ]
+        self.assertEqual((entry["hash"], entry["signature"]), (None, ""))
+
+    def test_invalid(self):
+        key = ed25519.Ed25519PrivateKey.generate()
+        data = descriptor([key])
+        for value in [
+            b"<html></html>",
+            b"[]",
+            dict(data, type="WebReference"),
+            dict(data, hash_algorithm="unknown"),
+            dict(data, attestation="not base64!"),
+            dict(data, signatures=[]),
+            {k: v for k, v in data.items() if k != "url"}
+        ]:
+            with self.subTest(value=value):
+                with self.assertRaises(ValueError):
+                    PostBox.parse_descriptor(value)
+
+
+class DestinationTests(unittest.TestCase):
+    descriptor_url = "%s/spider/content/2/descriptor/" % fixtures.host
+
+    def setUp(self):
+        key = ed25519.Ed25519PrivateKey.generate()
+        self.dest_key = ed25519.Ed25519PrivateKey.generate()
+        self.descriptor = descriptor([self.dest_key])
+        self.dest_graph = fixtures.postbox_graph([self.dest_key], url=dest)
+        self.transport = fixtures.FakeTransport()
+        self.transport.add("GET", self.descriptor_url, self._descriptor)
+        self.transport.add("GET", dest, self._graph)
+        self.transport.add(
+            "POST", "%s/spider/content/2/push_webref/" % fixtures.host,
+            lambda request: (200, {}, b"")
+        )
+        session = requests.Session()
+        session.mount(fixtures.host, self.transport)
+        # entries are stale at once and always revalidated
+        self.dest_cache = DestinationCache(ttl=0)
+        self.postbox = PostBox(
+            ":memory:", key, fixtures.postbox_url,
+            graph=fixtures.postbox_graph([key]), session=session,
+            dest_cache=self.dest_cache
+        )
+
+    def tearDown(self):
+        self.postbox.attestation_checker.close()
+
+    def _descriptor(self, request):
+        if self.descriptor is None:
+            return 404, {}, b""
+        if isinstance(self.descriptor, bytes):
+            return 200, {"Content-Type": "application/json"}, self.descriptor
+        if request.headers.get("If-None-Match") == '"descriptor"':
+            return 304, {"ETag": '"descriptor"'}, b""
+        return 200, {
+            "Content-Type": "application/json", "ETag": '"descriptor"'
+        }, json.dumps(self.descriptor).encode("utf8")
+
+    def _graph(self, request):
+        if request.headers.get("If-None-Match") == '"graph"':
+            return 304, {"ETag": '"graph"'}, b""
+        return 200, {
+            "Content-Type": "text/turtle", "ETag": '"graph"'
+        }, self.dest_graph.serialize(format="turtle").encode("utf8")
+
+    def send(self):
+        """ returns requests (url without query, headers) of send """
+        count = len(self.transport.requests)
+        self.postbox._send_dest(os.urandom(32), "https://fetch/", dest)
+        return [
+            (request.url.split("?", 1)[0], request.headers)
+            for request in self.transport.requests[count:]
+            if request.method == "GET"
+        ]
+
+    def test_descriptor(self):
+        (url, headers), = self.send()
+        self.assertEqual(url, self.descriptor_url)
+        self.assertNotIn("If-None-Match", headers)
+        info = self.dest_cache.get(dest)[0]
+        self.assertEqual(
+            (info.source, info.etag), ("descriptor", '"descriptor"')
+        )
+        self.assertEqual(
+            info.key_list[0][0],
+            key_fingerprint(self.dest_key.public_key(), hashes.SHA512())
+        )
+        # revalidated with the descriptor etag, no graph retrieval
+        (url, headers), = self.send()
+        self.assertEqual(url, self.descriptor_url)
+        self.assertEqual(headers["If-None-Match"], '"descriptor"')
+        self.assertIs(self.dest_cache.get(dest)[0], info)
+
+    def test_fallback(self):
+        for value in [None, b"{invalid", b'{"type": "PostBox"}']:
+            with self.subTest(descriptor=value):
+                self.dest_cache.invalidate()
+                self.descriptor = value
+                (descriptor_url, _), (url, headers) = self.send()
+                self.assertEqual(descriptor_url, self.descriptor_url)
+                self.assertEqual(url, dest)
+                self.assertNotIn("If-None-Match", headers)
+                info = self.dest_cache.get(dest)[0]
+                self.assertEqual(
+                    (info.source, info.etag), ("graph", '"graph"')
+                )
+
+    def test_etag_per_source(self):
+        self.descriptor = None
+        self.send()
+        # descriptor available again: graph etag is not sent to it
+        self.descriptor = descriptor([self.dest_key])
+        (url, headers), = self.send()
+        self.assertEqual(url, self.descriptor_url)
+        self.assertNotIn("If-None-Match", headers)
+        self.assertEqual(self.dest_cache.get(dest)[0].source, "descriptor")
+        # and the descriptor etag not to the graph
+        self.descriptor = None
+        (_, headers), (url, graph_headers) = self.send()
+        self.assertEqual(headers["If-None-Match"], '"descriptor"')
+        self.assertEqual(url, dest)
+        self.assertNotIn("If-None-Match", graph_headers)
+        # graph etag is used for the graph
+        (_, headers), (url, graph_headers) = self.send()
+        self.assertNotIn("If-None-Match", headers)
+        self.assertEqual(graph_headers["If-None-Match"], '"graph"')
+        self.assertEqual(self.dest_cache.get(dest)[0].source, "graph")
+
+
+@unittest.skipIf(not PostBoxContent, "spider_messages app not available")
+class AccessDescriptorTests(unittest.TestCase):
+    def setUp(self):
+        self.descriptor = descriptor([ed25519.Ed25519PrivateKey.generate()])
+        self.public = True
+
+    def access(self, **headers):
+        content = SimpleNamespace(
+            get_descriptor=lambda context: self.descriptor,
+            associated=SimpleNamespace(
+                usercomponent=SimpleNamespace(public=self.public)
+            )
+        )
+        return PostBoxContent.access_descriptor(
+            content, request=RequestFactory().get("/descriptor/", **headers),
+            hostpart=fixtures.host
+        )
+
+    def test_etag(self):
+        response = self.access()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"], "application/json")
+        # canonical json, strong etag over the body
+        self.assertEqual(
+            response.content,
+            json.dumps(
+                self.descriptor, sort_keys=True, separators=(",", ":")
+            ).encode("utf8")
+        )
+        self.assertEqual(
+            response["ETag"], '"%s"' % sha256(response.content).hexdigest()
+        )
+        self.assertTrue(response["Cache-Control"].startswith("public"))
+        self.assertEqual(PostBox.parse_descriptor(response.content)[0], dest)
+        self.public = False
+        self.assertEqual(self.access()["ETag"], response["ETag"])
+        self.assertTrue(self.access()["Cache-Control"].startswith("private"))
+
+    def test_not_modified(self):
+        etag = self.access()["ETag"]
+        for value in [etag, '"other", %s' % etag, "*"]:
+            with self.subTest(value=value):
+                response = self.access(HTTP_IF_NONE_MATCH=value)
+                self.assertEqual(response.status_code, 304)
+                self.assertEqual(response["ETag"], etag)
+                self.assertEqual(response.content, b"")
+        # changed descriptor
+        self.descriptor["url"] = fixtures.postbox_url
+        response = self.access(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
@@ -0,0 +1,147 @@
+import os
+import unittest
+from unittest import mock
+
+import requests
+from cryptography.hazmat.primitives.asymmetric import ed25519
+
+from spider_messaging.exceptions import DestException
+from spider_messaging.protocols.messaging import PostBox
+from spider_messaging.utils import cache
+from spider_messaging.utils.cache import DestinationCache
+
+from . import fixtures
+
+dest = "%s/spider/content/2/view/" % fixtures.host
+
+
+class DestinationCacheTests(unittest.TestCase):
+    def at(self, seconds):
+        return mock.patch.object(
+            cache.time, "monotonic", return_value=seconds
+        )
+
+    def test_ttl(self):
+        dest_cache = DestinationCache(ttl=10)
+        self.assertEqual(dest_cache.get("a"), (None, False))
+        with self.at(100):
+            dest_cache.set("a", "info")
+        with self.at(109):
+            self.assertEqual(dest_cache.get("a"), ("info", True))
+        # stale entries are kept for revalidation
+        with self.at(110):
+            self.assertEqual(dest_cache.get("a"), ("info", False))
+            dest_cache.touch("a")
+        with self.at(119):
+            self.assertEqual(dest_cache.get("a"), ("info", True))
+        with self.at(120):
+            # unknown entries are not created
+            dest_cache.touch("b")
+            self.assertEqual(dest_cache.get("b"), (None, False))
+        self.assertEqual(len(dest_cache), 1)
+
+    def test_lru(self):
+        dest_cache = DestinationCache(maxsize=2)
+        dest_cache.set("a", 1)
+        dest_cache.set("b", 2)
+        # access marks as recently used
+        dest_cache.get("a")
+        dest_cache.set("c", 3)
+        self.assertEqual(len(dest_cache), 2)
+        self.assertEqual(dest_cache.get("b"), (None, False))
+        self.assertEqual(dest_cache.get("a")[0], 1)
+        # replacing also marks as recently used
+        dest_cache.set("c", 4)
+        dest_cache.set("d", 5)
+        self.assertEqual(dest_cache.get("a"), (None, False))
+        self.assertEqual(dest_cache.get("c")[0], 4)
+
+    def test_invalidate(self):
+        dest_cache = DestinationCache()
+        dest_cache.set("a", 1)
+        dest_cache.set("b", 2)
+        dest_cache.invalidate("a")
+        dest_cache.invalidate("unknown")
+        self.assertEqual(dest_cache.get("a"), (None, False))
+        self.assertEqual(len(dest_cache), 1)
+        dest_cache.invalidate()
+        self.assertEqual(len(dest_cache), 0)
+
+
+class CachedSendTests(unittest.TestCase):
+    def setUp(self):
+        key = ed25519.Ed25519PrivateKey.generate()
+        self.dest_graph = fixtures.postbox_graph(
+            [ed25519.Ed25519PrivateKey.generate()], url=dest
+        )
+        self.webref_status = 200
+        self.transport = fixtures.FakeTransport()
+        self.transport.add("GET", dest, self._graph)
+        self.transport.add(
+            "POST", "%s/spider/content/2/push_webref/" % fixtures.host,
+            lambda request: (self.webref_status, {}, b"")
+        )
+        session = requests.Session()
+        session.mount(fixtures.host, self.transport)
+        self.dest_cache = DestinationCache(ttl=60)
+        self.postbox = PostBox(
+            ":memory:", key, fixtures.postbox_url,
+            graph=fixtures.postbox_graph([key]), session=session,
+            dest_cache=self.dest_cache
+        )
+        self.postbox.use_descriptor = False
+
+    def tearDown(self):
+        self.postbox.attestation_checker.close()
+
+    def _graph(self, request):
+        if request.headers.get("If-None-Match") == '"1"':
+            return 304, {"ETag": '"1"'}, b""
+        return 200, {
+            "Content-Type": "text/turtle", "ETag": '"1"'
+        }, self.dest_graph.serialize(format="turtle").encode("utf8")
+
+    def send(self):
+        """ returns GET requests of send """
+        count = len(self.transport.requests)
+        self.postbox._send_dest(os.urandom(32), "https://fetch/", dest)
+        return [
+            request for request in self.transport.requests[count:]
+            if request.method == "GET"
+        ]
+
+    def test_fresh(self):
+        self.assertEqual(len(self.send()), 1)
+        info = self.dest_cache.get(dest)[0]
+        # fresh: no retrieval at all
+        self.assertEqual(self.send(), [])
+        self.assertIs(self.dest_cache.get(dest)[0], info)
+
+    def test_revalidate(self):
+        self.send()
+        info = self.dest_cache.get(dest)[0]
+        with mock.patch.object(
+            cache.time, "monotonic", return_value=cache.time.monotonic() + 60
+        ):
+            self.assertFalse(self.dest_cache.get(dest)[1])
+            request, = self.send()
+            self.assertEqual(request.headers["If-None-Match"], '"1"')
+            # 304 refreshes the entry
+            self.assertEqual(self.dest_cache.get(dest), (info, True))
+
+    def test_failed_webref(self):
+        self.send()
+        self.webref_status = 403
+        with self.assertRaises(DestException):
+            self.send()
+        # keys could have changed
+        self.assertEqual(self.dest_cache.get(dest), (None, False))
+        self.webref_status = 200
+        request, = self.send()
+        self.assertNotIn("If-None-Match", request.headers)
+
+    def test_disabled(self):
+        self.postbox.dest_cache = None
+        self.assertEqual(len(self.send()), 1)
+        self.assertEqual(len(self.send()), 1)
+        self.assertEqual(len(self.dest_cache), 0)
@@ -0,0 +1,188 @@
+import io
+import json
+import os
+import re
+import unittest
+
+import requests
+from cryptography.hazmat.primitives.asymmetric import ed25519
+
+from spider_messaging.constants import AccessMethod
+from spider_messaging.exceptions import DestException
+from spider_messaging.protocols.messaging import PostBox
+from spider_messaging.utils.misc import SegmentedEncryptedFile
+
+from . import fixtures
+
+_range_re = re.compile(r"^bytes=(\d+)-(\d*)$")
+
+
+class RangeServer(object):
+    """ serves a message with Range support, can break connections """
+    etag = '"message"'
+
+    def __init__(self, blob, headers):
+        self.blob = blob
+        self.headers = headers
+        # request number: break connection after amount of bytes
+        self.interrupt = {}
+        self.calls = 0
+
+    def __call__(self, request):
+        index = self.calls
+        self.calls += 1
+        headers = dict(self.headers)
+        if self.etag:
+            headers["ETag"] = self.etag
+            headers["Accept-Ranges"] = "bytes"
+        status, start, end = 200, 0, len(self.blob)
+        match = _range_re.match(request.headers.get("Range", ""))
+        if_range = request.headers.get("If-Range")
+        if match and (if_range is None or if_range == self.etag):
+            status = 206
+            start = int(match.group(1))
+            if match.group(2):
+                end = min(int(match.group(2)) + 1, end)
+            headers["Content-Range"] = "bytes %s-%s/%s" % (
+                start, end - 1, len(self.blob)
+            )
+        body = self.blob[start:end]
+        if index in self.interrupt:
+            body = fixtures.InterruptedBody(
+                body, headers, self.interrupt[index]
+            )
+        return status, headers, body
+
+
+class DownloadTests(unittest.TestCase):
+    message_id = 10
+
+    def setUp(self):
+        self.key = ed25519.Ed25519PrivateKey.generate()
+        self.data = os.urandom(100000)
+        aes_key = os.urandom(32)
+        keys = fixtures.key_list(aes_key, [self.key])
+        graph = fixtures.postbox_graph([self.key])
+        fixtures.add_message(graph, self.message_id, keys)
+        self.server = RangeServer(
+            SegmentedEncryptedFile(
+                aes_key, io.BytesIO(self.data), b"SPKC-Type: file\n",
+                segment_size=4096
+            ).read(),
+            {"X-KEYLIST": json.dumps(keys)}
+        )
+        self.transport = fixtures.FakeTransport()
+        self.transport.add(
+            "POST", fixtures.content_url(self.message_id, "message"),
+            self.server
+        )
+        self.transport.add(
+            "GET", fixtures.postbox_url, lambda request: (
+                200, {"Content-Type": "text/turtle"},
+                graph.serialize(format="turtle").encode("utf8")
+            )
+        )
+        session = requests.Session()
+        session.mount(fixtures.host, self.transport)
+        self.postbox = PostBox(
+            ":memory:", self.key, fixtures.postbox_url, graph=graph,
+            session=session
+        )
+        self.postbox.chunk_size = 1000
+
+    def tearDown(self):
+        self.postbox.attestation_checker.close()
+
+    def receive(self):
+        return self.postbox.receive(
+            self.message_id, io.BytesIO(), access_method=AccessMethod.peek
+        )[0].getvalue()
+
+    def message_requests(self):
+        return [
+            request for request in self.transport.requests
+            if request.method == "POST"
+        ]
+
+    def test_uninterrupted(self):
+        self.assertEqual(self.receive(), self.data)
+        self.assertEqual(len(self.message_requests()), 1)
+        self.assertNotIn("Range", self.message_requests()[0].headers)
+
+    def test_resume(self):
+        self.server.interrupt = {0: 30000, 1: 20000}
+        self.assertEqual(self.receive(), self.data)
+        first, second, third = self.message_requests()
+        self.assertNotIn("Range", first.headers)
+        self.assertEqual(second.headers["Range"], "bytes=30000-")
+        self.assertEqual(third.headers["Range"], "bytes=50000-")
+        for request in [second, third]:
+            self.assertEqual(request.headers["If-Range"], self.server.etag)
+            # same credentials and parameters
+            self.assertEqual(request.body, first.body)
+
+    def test_attempts_exhausted(self):
+        self.postbox.resume_attempts = 2
+        self.server.interrupt = {0: 10000, 1: 10000, 2: 10000}
+        with self.assertRaises(DestException):
+            self.receive()
+        self.assertEqual(len(self.message_requests()), 3)
+
+    def test_not_resumable(self):
+        self.server.etag = None
+        self.server.interrupt = {0: 10000}
+        with self.assertRaises(DestException):
+            self.receive()
+        self.assertEqual(len(self.message_requests()), 1)
+
+    def test_changed(self):
+        self.server.interrupt = {0: 10000}
+
+        def _changing(request):
+            ret = self.server(request)
+            # message replaced after the first response
+            self.server.etag = '"changed"'
+            return ret
+        self.transport.add(
+            "POST", fixtures.content_url(self.message_id, "message"),
+            _changing
+        )
+        # If-Range does not match, server sends the whole message
+        with self.assertRaises(DestException):
+            self.receive()
+        self.assertEqual(
+            self.message_requests()[1].headers["If-Range"], '"message"'
+        )
+
+    def test_parallel_ranges(self):
+        self.postbox.range_workers = 3
+        self.postbox.range_size = 16384
+        # a middle range is interrupted and resumed
+        self.server.interrupt = {2: 1000}
+        self.assertEqual(self.receive(), self.data)
+        ranges = [
+            request.headers["Range"] for request in self.message_requests()
+        ]
+        self.assertEqual(ranges[0], "bytes=0-16383")
+        total = len(self.server.blob)
+        # the final range completes the transmission, it is requested last
+        self.assertEqual(
+            ranges[-1], "bytes=%s-%s" % (
+                (total - 1) // 16384 * 16384, total - 1
+            )
+        )
+        self.assertEqual(len(ranges), -(-total // 16384) + 1)
+
+    def test_parallel_not_ranged(self):
+        # server ignores Range
+        self.postbox.range_workers = 3
+        self.postbox.range_size = 16384
+        self.server.etag = None
+        self.transport.add(
+            "POST", fixtures.content_url(self.message_id, "message"),
+            lambda request: (
+                200, self.server.headers, self.server.blob
+            )
+        )
+        self.assertEqual(self.receive(), self.data)
+        self.assertEqual(len(self.message_requests()), 1)
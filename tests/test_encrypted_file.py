@@ -0,0 +1,169 @@
+import array
+import base64
+import io
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+from spider_messaging.utils.misc import EncryptedFile
+
+data = os.urandom(300000)
+
+
+class ReadOnly(object):
+    """ file like object without readinto and fileno """
+
+    def __init__(self, data):
+        self._fileob = io.BytesIO(data)
+
+    def read(self, size=-1):
+        return self._fileob.read(size)
+
+
+class EncryptedFileTestCase(unittest.TestCase):
+    headers = b"SPKC-Type: file\n"
+
+    def setUp(self):
+        self.key = os.urandom(32)
+        self.nonce = os.urandom(13)
+
+    def encrypted(self, fileob, **kwargs):
+        return EncryptedFile(
+            Cipher(
+                algorithms.AES(self.key), modes.GCM(self.nonce),
+                backend=default_backend()
+            ).encryptor(), fileob, self.nonce, self.headers, **kwargs
+        )
+
+    def expected(self, content=data):
+        return b"%b\0%b" % (
+            base64.b64encode(self.nonce),
+            AESGCM(self.key).encrypt(
+                self.nonce, b"%b\n\n%b" % (self.headers.strip(), content),
+                None
+            )
+        )
+
+
+class ReadintoTests(EncryptedFileTestCase):
+    def readinto(self, fileob, size):
+        ret = bytearray()
+        buffer = bytearray(size)
+        written = fileob.readinto(buffer)
+        while written:
+            ret += buffer[:written]
+            written = fileob.readinto(buffer)
+        return bytes(ret)
+
+    def test_buffer_sizes(self):
+        for size in [1, 15, 16, 4096, 65537, 10 ** 6]:
+            with self.subTest(size=size):
+                fileob = self.encrypted(io.BytesIO(data), read_size=4096)
+                self.assertEqual(self.readinto(fileob, size), self.expected())
+                # exhausted
+                self.assertEqual(fileob.readinto(bytearray(10)), 0)
+
+    def test_mixed(self):
+        fileob = self.encrypted(io.BytesIO(data), read_size=1000)
+        ret = fileob.read(10) + self.readinto(fileob, 333)[:5000]
+        self.assertEqual(ret, self.expected()[:5010])
+        fileob = self.encrypted(io.BytesIO(data), read_size=1000)
+        ret = fileob.read(10)
+        buffer = bytearray(2000)
+        ret += buffer[:fileob.readinto(buffer)]
+        self.assertEqual(ret + fileob.read(), self.expected())
+
+    def test_typed_buffer(self):
+        fileob = self.encrypted(io.BytesIO(data))
+        buffer = array.array("I", bytes(4000))
+        self.assertEqual(fileob.readinto(buffer), 4000)
+        self.assertEqual(buffer.tobytes(), self.expected()[:4000])
+
+    def test_buffered(self):
+        fileob = self.encrypted(io.BytesIO(data), read_size=4096)
+        self.assertTrue(fileob.readable())
+        self.assertEqual(fileob.length, len(self.expected()))
+        reader = io.BufferedReader(fileob, buffer_size=10000)
+        self.assertEqual(
+            b"".join(iter(lambda: reader.read(777), b"")), self.expected()
+        )
+
+    def test_empty(self):
+        fileob = self.encrypted(io.BytesIO())
+        self.assertEqual(fileob.length, len(self.expected(b"")))
+        self.assertEqual(self.readinto(fileob, 7), self.expected(b""))
+
+
+class InputTests(EncryptedFileTestCase):
+    def setUp(self):
+        super().setUp()
+        self.tmp = tempfile.TemporaryFile()
+        self.tmp.write(data)
+        self.tmp.seek(0)
+
+    def tearDown(self):
+        self.tmp.close()
+
+    def test_readinto_input(self):
+        fileob = self.encrypted(io.BytesIO(data), read_size=5000)
+        self.assertEqual(fileob.read(), self.expected())
+
+    def test_read_input(self):
+        fileob = self.encrypted(ReadOnly(data), read_size=5000)
+        # size unknown
+        self.assertIsNone(fileob.length)
+        self.assertEqual(fileob.read(), self.expected())
+
+    def test_pipe(self):
+        read_fd, write_fd = os.pipe()
+        with open(read_fd, "rb") as inp:
+            with open(write_fd, "wb") as out:
+                out.write(data[:10000])
+            self.assertIsNone(EncryptedFile._map_file(inp))
+            fileob = self.encrypted(inp)
+            self.assertIsNone(fileob.length)
+            self.assertEqual(fileob.read(), self.expected(data[:10000]))
+
+    def test_mmap(self):
+        mapped, offset = EncryptedFile._map_file(self.tmp)
+        self.assertEqual((len(mapped), offset), (len(data), 0))
+        mapped.close()
+        fileob = self.encrypted(self.tmp, read_size=4096)
+        self.assertEqual(fileob.length, len(self.expected()))
+        self.assertEqual(fileob.read(), self.expected())
+        # left at the end like a read
+        self.assertEqual(self.tmp.tell(), len(data))
+
+    def test_mmap_offset(self):
+        # not page aligned
+        self.tmp.seek(5000)
+        fileob = self.encrypted(self.tmp, read_size=4096)
+        self.assertEqual(fileob.length, len(self.expected(data[5000:])))
+        self.assertEqual(fileob.read(), self.expected(data[5000:]))
+        # nothing left
+        fileob = self.encrypted(self.tmp)
+        self.assertEqual(fileob.length, len(self.expected(b"")))
+        self.assertEqual(fileob.read(), self.expected(b""))
+
+    def test_mmap_drop(self):
+        with mock.patch.object(EncryptedFile, "drop_size", 8192):
+            self.tmp.seek(100)
+            fileob = self.encrypted(self.tmp, read_size=1000)
+            buffer = bytearray(3000)
+            ret = bytearray()
+            written = fileob.readinto(buffer)
+            while written:
+                ret += buffer[:written]
+                written = fileob.readinto(buffer)
+        self.assertEqual(bytes(ret), self.expected(data[100:]))
+
+    def test_mmap_empty(self):
+        with tempfile.TemporaryFile() as tmp:
+            self.assertEqual(EncryptedFile._map_file(tmp), (None, 0))
+            fileob = self.encrypted(tmp)
+            self.assertEqual(fileob.read(), self.expected(b""))
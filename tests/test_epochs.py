@@ -0,0 +1,204 @@
+import os
+import unittest
+from unittest import mock
+
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.keywrap import InvalidUnwrap
+
+from spider_messaging.utils import epochs
+from spider_messaging.utils.crypto import generate_private_key, unwrap_key
+from spider_messaging.utils.epochs import (
+    EpochKeyCache, EpochKeys, is_epoch_key
+)
+from spider_messaging.utils.keys import key_fingerprint
+
+
+def split(value):
+    """ (wrapped kek, wrapped content key) of key list value """
+    return value[len(epochs.epoch_prefix):].split(":")
+
+
+class EpochTestCase(unittest.TestCase):
+    algo = hashes.SHA512()
+    private_keys = None
+
+    @classmethod
+    def setUpClass(cls):
+        cls.private_keys = [
+            generate_private_key("ed25519"),
+            generate_private_key("rsa", 2048),
+            generate_private_key("ed25519")
+        ]
+
+    def keys(self, private_keys=None, algo=None):
+        return [
+            (key_fingerprint(key.public_key(), algo or self.algo),
+             key.public_key())
+            for key in private_keys or self.private_keys
+        ]
+
+    def entry(self, key_list, private_key, algo=None):
+        algo = algo or self.algo
+        return key_list["%s=%s" % (
+            algo.name, key_fingerprint(private_key.public_key(), algo).hex()
+        )]
+
+
+class EpochKeysTests(EpochTestCase):
+    def test_roundtrip(self):
+        sender = EpochKeys()
+        aes_keys = [os.urandom(32) for _ in range(3)]
+        key_lists = [
+            sender.key_list(aes_key, self.keys(), self.algo)
+            for aes_key in aes_keys
+        ]
+        for private_key in self.private_keys:
+            cache = EpochKeyCache()
+            calls = []
+
+            def decrypt(wrapped_kek):
+                calls.append(wrapped_kek)
+                return unwrap_key(private_key, wrapped_kek, self.algo)
+            for aes_key, key_list in zip(aes_keys, key_lists):
+                value = self.entry(key_list, private_key)
+                self.assertTrue(is_epoch_key(value))
+                self.assertEqual(cache.unwrap(value, decrypt), aes_key)
+            # one private key operation per epoch
+            self.assertEqual(len(calls), 1)
+
+    def test_same_epoch(self):
+        sender = EpochKeys()
+        first = sender.key_list(os.urandom(32), self.keys(), self.algo)
+        # order of keys does not matter
+        second = sender.key_list(
+            os.urandom(32), reversed(self.keys()), self.algo
+        )
+        self.assertEqual(set(first), set(second))
+        for name, value in first.items():
+            self.assertEqual(split(value)[0], split(second[name])[0])
+            self.assertNotEqual(split(value)[1], split(second[name])[1])
+
+    def test_rotation(self):
+        sender = EpochKeys()
+        aes_key = os.urandom(32)
+        first = sender.key_list(aes_key, self.keys(), self.algo)
+        # key removed: new KEK, removed key cannot unwrap it
+        rotated = sender.key_list(
+            aes_key, self.keys(self.private_keys[:2]), self.algo
+        )
+        self.assertEqual(len(rotated), 2)
+        for private_key in self.private_keys[:2]:
+            old = self.entry(first, private_key)
+            new = self.entry(rotated, private_key)
+            self.assertNotEqual(split(old)[0], split(new)[0])
+            self.assertEqual(
+                EpochKeyCache().unwrap(
+                    new, lambda x: unwrap_key(private_key, x, self.algo)
+                ),
+                aes_key
+            )
+        # other hash algorithm: other epoch
+        algo = hashes.SHA256()
+        other = sender.key_list(aes_key, self.keys(algo=algo), algo)
+        self.assertNotEqual(
+            split(self.entry(other, self.private_keys[0], algo))[0],
+            split(self.entry(first, self.private_keys[0]))[0]
+        )
+
+    def test_expiry(self):
+        sender = EpochKeys(max_age=100)
+        with mock.patch.object(epochs.time, "monotonic", return_value=1000):
+            first = sender.key_list(os.urandom(32), self.keys(), self.algo)
+        with mock.patch.object(epochs.time, "monotonic", return_value=1099):
+            same = sender.key_list(os.urandom(32), self.keys(), self.algo)
+        with mock.patch.object(epochs.time, "monotonic", return_value=1100):
+            expired = sender.key_list(
+                os.urandom(32), self.keys(), self.algo
+            )
+        value = self.entry(first, self.private_keys[0])
+        self.assertEqual(
+            split(value)[0], split(self.entry(same, self.private_keys[0]))[0]
+        )
+        self.assertNotEqual(
+            split(value)[0],
+            split(self.entry(expired, self.private_keys[0]))[0]
+        )
+
+    def test_maxsize(self):
+        sender = EpochKeys(maxsize=2)
+        key_sets = [self.keys([key]) for key in self.private_keys]
+
+        def kek(keys):
+            return split(next(iter(
+                sender.key_list(os.urandom(32), keys, self.algo).values()
+            )))[0]
+        keks = [kek(keys) for keys in key_sets]
+        # least recently used key set was evicted
+        self.assertEqual(kek(key_sets[2]), keks[2])
+        self.assertEqual(kek(key_sets[1]), keks[1])
+        self.assertNotEqual(kek(key_sets[0]), keks[0])
+        sender.clear()
+        self.assertNotEqual(kek(key_sets[1]), keks[1])
+
+
+class EpochKeyCacheTests(EpochTestCase):
+    def setUp(self):
+        self.sender = EpochKeys()
+        self.private_key = self.private_keys[0]
+        self.calls = 0
+
+    def decrypt(self, wrapped_kek):
+        self.calls += 1
+        return unwrap_key(self.private_key, wrapped_kek, self.algo)
+
+    def value(self, aes_key, keys=None):
+        return self.entry(
+            self.sender.key_list(aes_key, keys or self.keys(), self.algo),
+            self.private_key
+        )
+
+    def test_maxsize(self):
+        cache = EpochKeyCache(maxsize=1)
+        aes_key = os.urandom(32)
+        first = self.value(aes_key)
+        second = self.value(aes_key, self.keys(self.private_keys[:1]))
+        self.assertEqual(cache.unwrap(first, self.decrypt), aes_key)
+        self.assertEqual(cache.unwrap(second, self.decrypt), aes_key)
+        self.assertEqual(cache.unwrap(first, self.decrypt), aes_key)
+        self.assertEqual(self.calls, 3)
+        cache.clear()
+        cache.unwrap(first, self.decrypt)
+        self.assertEqual(self.calls, 4)
+
+    def test_invalid(self):
+        cache = EpochKeyCache()
+        for value in ["epoch:", "epoch:a", "epoch:a:b:c"]:
+            with self.subTest(value=value):
+                with self.assertRaises(ValueError):
+                    cache.unwrap(value, self.decrypt)
+        self.assertEqual(self.calls, 0)
+        self.assertFalse(is_epoch_key("x25519=AAAA"))
+
+    def test_wrong_content_key(self):
+        cache = EpochKeyCache()
+        value = self.value(os.urandom(32))
+        other = self.value(os.urandom(32), self.keys(self.private_keys[:1]))
+        # content key wrapped under the KEK of another epoch
+        with self.assertRaises(InvalidUnwrap):
+            cache.unwrap(
+                "%s%s:%s" % (
+                    epochs.epoch_prefix, split(value)[0], split(other)[1]
+                ),
+                self.decrypt
+            )
+
+    def test_failed_decrypt(self):
+        cache = EpochKeyCache()
+        value = self.value(os.urandom(32))
+        self.private_key = self.private_keys[2]
+        with self.assertRaises(Exception):
+            cache.unwrap(value, self.decrypt)
+        # failures are not cached
+        self.private_key = self.private_keys[0]
+        cache.unwrap(value, self.decrypt)
+        self.assertEqual(self.calls, 2)
@@ -0,0 +1,284 @@
+import os
+import threading
+import time
+import unittest
+from unittest import mock
+from urllib.parse import parse_qs, urlsplit
+
+import requests
+from cryptography.hazmat.primitives.asymmetric import ed25519
+from rdflib import Graph, Literal, URIRef
+from spkcspider.constants import spkcgraph
+
+from spider_messaging.utils import graph as graph_module
+from spider_messaging.utils.graph import (
+    GraphIndex, extract_property, get_pages, get_postboxes, map_keys,
+    retrieve_pages
+)
+
+from . import fixtures
+
+component_url = "%s/spider/component/2/list/" % fixtures.host
+
+
+def synthetic_postbox_graph(keys, messages, public_keys=(), pages=1):
+    """
+    Postbox with signed keys, messages and public key contents
+
+    Arguments:
+        keys {list} -- private keys of postbox
+        messages {int} -- amount of messages
+    """
+    graph = fixtures.postbox_graph(keys, pages=pages)
+    aes_key = os.urandom(32)
+    key_list = fixtures.key_list(aes_key, keys)
+    for i in range(messages):
+        fixtures.add_message(
+            graph, 1000 + i, key_list,
+            content_type="WebReference" if i % 2 else "MessageContent"
+        )
+    for i, key in enumerate(public_keys):
+        fixtures.add_public_key(
+            graph, component_url, fixtures.content_url(500 + i), key,
+            thirdparty=bool(i % 2) if i % 3 else None
+        )
+    return graph
+
+
+def _postboxes(postboxes):
+    # hash algorithm objects do not compare
+    return {
+        url: {
+            name: value.name if name == "hash_algorithm" else value
+            for name, value in postbox.items()
+        } for url, postbox in postboxes.items()
+    }
+
+
+def _keys(mapped):
+    keys, algo = mapped
+    # key objects do not compare
+    return {
+        digest: {
+            name: value for name, value in item.items() if name != "pubkey"
+        } for digest, item in keys.items()
+    }, algo.name
+
+
+class GraphExtractorTests(unittest.TestCase):
+    keys = None
+    public_keys = None
+
+    @classmethod
+    def setUpClass(cls):
+        cls.keys = [ed25519.Ed25519PrivateKey.generate() for _ in range(3)]
+        cls.public_keys = [
+            ed25519.Ed25519PrivateKey.generate() for _ in range(6)
+        ]
+
+    def assertSameAsSparql(self, func, *args, normalize=None, **kwargs):
+        """ returns result of index """
+        results = []
+        for use_sparql in [True, False]:
+            with mock.patch.object(graph_module, "use_sparql", use_sparql):
+                result = func(*args, **kwargs)
+            if normalize:
+                result = normalize(result)
+            results.append(result)
+        self.assertEqual(results[0], results[1])
+        return results[1]
+
+    def test_get_pages(self):
+        def normalize(result):
+            return result[0], list(result[1])
+        graph = synthetic_postbox_graph(self.keys, 10, pages=5)
+        graph.add((
+            next(graph.subjects(spkcgraph["pages.num_pages"], None)),
+            spkcgraph["pages.current_page"], Literal(3)
+        ))
+        result = self.assertSameAsSparql(
+            get_pages, graph, normalize=normalize
+        )
+        self.assertEqual(result, (fixtures.postbox_url, [2, 4, 5]))
+        self.assertSameAsSparql(
+            get_pages, GraphIndex(graph), normalize=normalize
+        )
+
+    def test_get_pages_empty(self):
+        for use_sparql in [True, False]:
+            with mock.patch.object(graph_module, "use_sparql", use_sparql):
+                with self.assertRaises(IndexError):
+                    get_pages(Graph())
+
+    def test_get_postboxes(self):
+        graph = synthetic_postbox_graph(self.keys, 20)
+        result = self.assertSameAsSparql(
+            get_postboxes, graph, normalize=_postboxes
+        )
+        self.assertEqual(list(result.keys()), [fixtures.postbox_url])
+        self.assertEqual(
+            len(result[fixtures.postbox_url]["signatures"]), len(self.keys)
+        )
+        self.assertSameAsSparql(
+            get_postboxes, GraphIndex(graph), url=fixtures.postbox_url,
+            normalize=_postboxes
+        )
+        self.assertEqual(self.assertSameAsSparql(
+            get_postboxes, graph, url=fixtures.content_url(1000),
+            normalize=_postboxes
+        ), {})
+
+    def test_map_keys(self):
+        graph = synthetic_postbox_graph(self.keys, 5, self.public_keys)
+        result = self.assertSameAsSparql(map_keys, graph, normalize=_keys)
+        self.assertEqual(len(result[0]), len(self.public_keys))
+        result = self.assertSameAsSparql(
+            map_keys, GraphIndex(graph), url=component_url, normalize=_keys
+        )
+        self.assertEqual(len(result[0]), len(self.public_keys))
+        self.assertSameAsSparql(
+            map_keys, graph, url=component_url, field="hash", normalize=_keys
+        )
+
+    def test_extract_property(self):
+        graph = synthetic_postbox_graph(self.keys, 20)
+        result = self.assertSameAsSparql(extract_property, graph, "id")
+        self.assertEqual(len(result), 20)
+        self.assertSameAsSparql(
+            extract_property, GraphIndex(graph), "hash_algorithm",
+            url=fixtures.content_url(1001)
+        )
+
+    def test_partial_index(self):
+        graph = synthetic_postbox_graph(self.keys, 10, self.public_keys)
+        full = GraphIndex(graph)
+        subjects = [
+            fixtures.postbox_url, fixtures.content_url(1003), component_url
+        ]
+        partial = GraphIndex(graph, subjects=map(URIRef, subjects))
+        self.assertFalse(partial.complete)
+        for subject in map(URIRef, subjects):
+            # order of triples differs
+            self.assertEqual(
+                {
+                    name: set(values) for name, values in
+                    partial.properties.get(subject, {}).items()
+                },
+                {
+                    name: set(values) for name, values in
+                    full.properties.get(subject, {}).items()
+                }
+            )
+            self.assertEqual(
+                partial.types.get(subject), full.types.get(subject)
+            )
+            self.assertEqual(
+                set(partial.contents.get(subject, [])),
+                set(full.contents.get(subject, []))
+            )
+        self.assertEqual(partial.pages, full.pages)
+        self.assertNotIn(URIRef(fixtures.content_url(1004)), partial.types)
+        # complete indexes ignore add_subjects
+        full.add_subjects([URIRef(fixtures.postbox_url)])
+        self.assertEqual(
+            len(full.values(URIRef(fixtures.postbox_url), "signatures")),
+            len(self.keys)
+        )
+
+
+class RetrievePagesTests(unittest.TestCase):
+    def setUp(self):
+        keys = [ed25519.Ed25519PrivateKey.generate()]
+        key_list = fixtures.key_list(os.urandom(32), keys)
+        # page: turtle of page with one message
+        self.pages = {}
+        for page in range(1, 6):
+            graph = Graph()
+            fixtures.add_message(graph, page, key_list)
+            self.pages[page] = graph.serialize(format="turtle").encode()
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.failing = set()
+        self.transport = fixtures.FakeTransport()
+        self.transport.add("GET", fixtures.postbox_url, self._page)
+        self.session = requests.Session()
+        self.session.mount(fixtures.host, self.transport)
+
+    def _page(self, request):
+        page = int(parse_qs(urlsplit(request.url).query)["page"][0])
+        with self.lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        # later pages are finished first
+        time.sleep(0.01 * (6 - page))
+        with self.lock:
+            self.in_flight -= 1
+        if page in self.failing:
+            return 500, {}, b""
+        return 200, {"Content-Type": "text/turtle"}, self.pages[page]
+
+    def requested_pages(self):
+        return sorted(
+            int(parse_qs(urlsplit(request.url).query)["page"][0])
+            for request in self.transport.requests
+        )
+
+    def test_merge(self):
+        for stream in [False, True]:
+            with self.subTest(stream=stream):
+                self.transport.requests.clear()
+                graph = fixtures.postbox_graph([], pages=5)
+                size = len(graph)
+                ret = retrieve_pages(
+                    self.session, fixtures.postbox_url, [2, 3, 4, 5], graph,
+                    headers={"X-Test": "1"}, stream=stream
+                )
+                self.assertIs(ret, graph)
+                self.assertEqual(self.requested_pages(), [2, 3, 4, 5])
+                self.assertEqual(
+                    self.transport.requests[0].headers["X-Test"], "1"
+                )
+                self.assertEqual(
+                    sorted(extract_property(graph, "id").values()),
+                    [2, 3, 4, 5]
+                )
+                page_sizes = sum(
+                    len(Graph().parse(data=self.pages[page], format="turtle"))
+                    for page in [2, 3, 4, 5]
+                )
+                self.assertEqual(len(graph), size + page_sizes)
+
+    def test_max_in_flight(self):
+        graph = Graph()
+        retrieve_pages(
+            self.session, fixtures.postbox_url, range(1, 6), graph,
+            max_in_flight=2
+        )
+        self.assertEqual(self.max_in_flight, 2)
+        self.assertEqual(len(extract_property(graph, "id")), 5)
+        self.max_in_flight = 0
+        retrieve_pages(
+            self.session, fixtures.postbox_url, range(1, 6), Graph(),
+            max_in_flight=1
+        )
+        self.assertEqual(self.max_in_flight, 1)
+
+    def test_failed_page(self):
+        self.failing = {3}
+        graph = fixtures.postbox_graph([], pages=5)
+        size = len(graph)
+        with self.assertRaises(requests.HTTPError):
+            retrieve_pages(
+                self.session, fixtures.postbox_url, [2, 3, 4], graph
+            )
+        # nothing merged
+        self.assertEqual(len(graph), size)
+
+    def test_no_pages(self):
+        graph = Graph()
+        self.assertIs(
+            retrieve_pages(self.session, fixtures.postbox_url, [], graph),
+            graph
+        )
+        self.assertEqual(self.transport.requests, [])
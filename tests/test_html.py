@@ -0,0 +1,233 @@
+import unittest
+
+import requests
+from cryptography.hazmat.primitives.asymmetric import ed25519
+from rdflib.parser import Parser
+from rdflib.plugin import PluginException, get as get_plugin
+
+from spider_messaging.exceptions import SrcException
+from spider_messaging.protocols.messaging import PostBox
+from spider_messaging.utils.html import HtmlProperties
+
+from . import fixtures
+
+try:
+    get_plugin("html", Parser)
+    rdfa = True
+except PluginException:
+    rdfa = False
+
+# rendered spider_base/edit_form.html, base_form.html and the
+# view_signatures, entity_list_widget templates of spider_messages
+update_page = """
+<!DOCTYPE html>
+<html lang="en" prefix="spkc: https://spkcspider.net/static/schemes/spkcgraph# xsd: http://www.w3.org/2001/XMLSchema#">
+<body>
+<form method="POST" enctype="multipart/form-data" id="main_form">
+  <input type="hidden" property="spkc:csrftoken" name="csrfmiddlewaretoken" datatype="xsd:string" content="T0KEN&amp;1" value="T0KEN&amp;1">
+  <input type="hidden" name="hidden_field" value="hidden" id="id_hidden_field">
+<ul class="w3-ul spkc-form" rel="spkc:properties">
+      <li id="id_name_wrapper" class="" typeof="spkc:Property">
+        <div>
+          <data hidden="hidden" property="spkc:fieldname" datatype="xsd:string">content_control-name</data>
+          <data hidden="hidden" property="spkc:name" datatype="xsd:string">name</data>
+          <data hidden="hidden" property="spkc:hashable" datatype="xsd:boolean">false</data>
+          <label class="w3-block" for="id_name">
+            Name<sup class="w3-small w3-text-red"></sup>:
+            <span class="w3-tooltip"><i class="fas fa-question-circle" aria-label="info"></i><small class="w3-text spkc-helptag">
+              Name of <b>postbox</b>
+            </small></span>
+          </label>
+              <data hidden="hidden" property="spkc:value" datatype="http://www.w3.org/2001/XMLSchema#string">Post &lt;Box&gt;</data>
+          <input type="text" name="content_control-name" value="Post &lt;Box&gt;" id="id_name">
+        </div>
+    </li>
+      <li id="id_amount_wrapper" class="w3-pale-red" typeof="spkc:Property">
+        <div>
+          <data hidden="hidden" property="spkc:fieldname" datatype="xsd:string">amount</data>
+          <data hidden="hidden" property="spkc:name" datatype="xsd:string">amount</data>
+              <data hidden="hidden" property="spkc:value" datatype="http://www.w3.org/2001/XMLSchema#integer">3</data>
+          <input type="number" name="amount" value="3" id="id_amount" />
+        </div>
+        <div class="w3-text-red">
+          <ul>
+            <li class="">
+              Too large
+            </li>
+          </ul>
+        </div>
+    </li>
+      <li id="id_url_wrapper" class="" typeof="spkc:Property">
+        <div>
+          <data hidden="hidden" property="spkc:fieldname" datatype="xsd:string">url</data>
+          <data hidden="hidden" property="spkc:name" datatype="xsd:string">url</data>
+            <data hidden="hidden" property="spkc:value" about="https://example.com/ref"></data>
+          <textarea name="url" id="id_url">ignored</textarea>
+        </div>
+    </li>
+      <li id="id_keys_wrapper" class="" typeof="spkc:Property">
+        <div>
+          <data hidden="hidden" property="spkc:fieldname" datatype="xsd:string">keys</data>
+          <data hidden="hidden" property="spkc:name" datatype="xsd:string">keys</data>
+              <data hidden="hidden" property="spkc:value" datatype="http://www.w3.org/2001/XMLSchema#string">a</data>
+              <data hidden="hidden" property="spkc:value" datatype="http://www.w3.org/2001/XMLSchema#string">b</data>
+          <select name="keys" multiple><option value="a" selected>a</option><option value="b" selected>b</option></select>
+        </div>
+    </li>
+<li typeof="spkc:Property">
+  <data hidden="hidden" property="spkc:fieldname" datatype="xsd:string">signatures</data>
+  <data hidden="hidden" property="spkc:name" datatype="xsd:string">signatures</data>
+  <data hidden="hidden" property="spkc:hashable" datatype="xsd:boolean">false</data>
+  <div><label for="id_signatures">Signatures:</label></div>
+  <ul class="w3-white">
+      <li style="word-break:break-all;" rel="spkc:value">
+        <a href="https://example.com/key/1/"  resource="">SHA512=abcdef…</a>
+        <span resource="https://example.com/key/1/" rel="spkc:properties">
+          <data hidden="hidden" typeof="spkc:Property">
+            <data hidden="hidden" property="spkc:name" datatype="xsd:string">hash</data>
+            <data hidden="hidden" property="spkc:hashable" datatype="xsd:boolean">false</data>
+            <data hidden="hidden" property="spkc:value" datatype="http://www.w3.org/2001/XMLSchema#string">SHA512=abcdef</data>
+          </data>
+          <span typeof="spkc:Property">
+            <data hidden="hidden" property="spkc:name" datatype="xsd:string">signature</data>
+            <data hidden="hidden" property="spkc:hashable" datatype="xsd:boolean">false</data>
+            <span property="spkc:value" content="ed25519=c2lnMQ==" datatype="http://www.w3.org/2001/XMLSchema#string">ed25519=c2lnMQ==</span>
+          </span>
+        </span>
+      </li>
+      <li style="word-break:break-all;" rel="spkc:value">
+        <a href="https://example.com/key/2/"  resource="">SHA512=012345…</a>
+        <span resource="https://example.com/key/2/" rel="spkc:properties">
+          <span typeof="spkc:Property">
+            <data hidden="hidden" property="spkc:name" datatype="xsd:string">signature</data>
+            <span property="spkc:value" content="" datatype="http://www.w3.org/2001/XMLSchema#string">-</span>
+          </span>
+        </span>
+      </li>
+  </ul>
+</li>
+</ul>
+<data name="entities" hidden="hidden">
+    <data hidden="hidden" typeof="spkc:Content">
+      <data hidden="hidden" rel="spkc:properties">
+          <data hidden="hidden" typeof="spkc:Property">
+            <data hidden="hidden" property="spkc:name" datatype="xsd:string">fetch_url</data>
+            <data hidden="hidden" property="spkc:hashable" datatype="xsd:boolean">false</data>
+            <data hidden="hidden" property="spkc:value" datatype="http://www.w3.org/2001/XMLSchema#anyURI">https://example.com/fetch/?a=1&amp;b=2</data>
+          </data>
+          <data hidden="hidden" typeof="spkc:Property">
+            <data hidden="hidden" property="spkc:name" datatype="xsd:string">tokens</data>
+            <data hidden="hidden" property="spkc:value" datatype="http://www.w3.org/2001/XMLSchema#string">tok1</data>
+          </data>
+      </data>
+    </data>
+</data>
+<button type="submit">Update</button>
+</form>
+</body>
+</html>
+"""  # noqa: E501
+
+form = HtmlProperties(update_page)
+
+
+class PropertyScannerTests(unittest.TestCase):
+    def test_csrftoken(self):
+        self.assertEqual(form.csrftoken, "T0KEN&1")
+        self.assertIsNone(HtmlProperties("<html></html>").csrftoken)
+
+    def test_properties(self):
+        self.assertEqual(form.properties[0], {
+            "name": "name", "fieldname": "content_control-name",
+            "values": ["Post <Box>"]
+        })
+        # typed
+        self.assertEqual(form.values("amount"), [3])
+        # references are no literals
+        self.assertEqual(form.values("url"), [])
+        self.assertEqual(form.values("keys"), ["a", "b"])
+        self.assertEqual(form.values("hash"), ["SHA512=abcdef"])
+        self.assertEqual(
+            form.values("signature"), ["ed25519=c2lnMQ==", ""]
+        )
+        self.assertEqual(
+            form.values("fetch_url"), ["https://example.com/fetch/?a=1&b=2"]
+        )
+        self.assertEqual(form.values("tokens"), ["tok1"])
+        self.assertEqual(form.values("unknown"), [])
+
+    def test_fields(self):
+        self.assertEqual(form.fields(), {
+            "content_control-name": "Post <Box>",
+            "amount": 3,
+            "keys": "b",
+        })
+
+    def test_bytes(self):
+        self.assertEqual(
+            HtmlProperties(update_page.encode("utf8")).properties,
+            form.properties
+        )
+
+    def test_unclosed(self):
+        # unclosed elements end with their parents
+        page = HtmlProperties("""
+            <ul><li typeof="spkc:Property">
+                <data property="spkc:name">a</data>
+                <p>text
+                <data property="spkc:value">1</data>
+            </ul>
+            <div typeof="spkc:Property">
+                <data property="spkc:name">b<br>c</data>
+                <data property="spkc:value">2</data>
+            </div>
+        """)
+        self.assertEqual(page.values("a"), ["1"])
+        self.assertEqual(page.values("bc"), ["2"])
+
+
+class FallbackTests(unittest.TestCase):
+    page = HtmlProperties("<html><body><p>error</p></body></html>")
+
+    def setUp(self):
+        key = ed25519.Ed25519PrivateKey.generate()
+        session = requests.Session()
+        session.mount(fixtures.host, fixtures.FakeTransport())
+        self.postbox = PostBox(
+            ":memory:", key, fixtures.postbox_url,
+            graph=fixtures.postbox_graph([key]), session=session
+        )
+
+    def tearDown(self):
+        self.postbox.attestation_checker.close()
+
+    def test_found_without_fallback(self):
+        self.assertEqual(PostBox._extract_csrftoken(form), "T0KEN&1")
+        self.assertEqual(
+            PostBox._extract_fetch_urls(form, ["receiver"]),
+            ["https://example.com/fetch/?a=1&b=2&token=tok1"]
+        )
+        PostBox._check_signed(form, "ed25519=c2lnMQ==")
+        self.assertIsNone(form._graph)
+
+    @unittest.skipIf(rdfa, "rdflib has a html parser")
+    def test_no_rdfa(self):
+        with self.assertRaises(SrcException):
+            self.page.graph()
+        with self.assertRaises(SrcException):
+            PostBox._extract_csrftoken(self.page)
+        with self.assertRaises(SrcException):
+            PostBox._extract_fetch_urls(self.page, ["receiver"])
+        with self.assertRaises(SrcException):
+            PostBox._check_signed(form, "ed25519=other")
+        with self.assertRaises(SrcException):
+            self.postbox._sign_fields(self.page, b"attestation")
+
+    @unittest.skipIf(not rdfa, "rdflib has no html parser")
+    def test_rdfa(self):
+        with self.assertRaises(SrcException):
+            PostBox._extract_csrftoken(self.page)
+        with self.assertRaises(SrcException):
+            PostBox._extract_fetch_urls(self.page, ["receiver"])
+        with self.assertRaises(SrcException):
+            PostBox._check_signed(self.page, "ed25519=other")
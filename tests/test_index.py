@@ -0,0 +1,195 @@
+import os
+import unittest
+
+import requests
+from cryptography.hazmat.primitives.asymmetric import ed25519
+
+from spider_messaging.constants import IndexedMessage, InboxChanges
+from spider_messaging.protocols.index import (
+    MessageIndex, extract_indexed_messages
+)
+from spider_messaging.protocols.messaging import PostBox
+
+from . import fixtures
+
+
+def message(message_id, name=None, version=b"v1", mtype="WebReference"):
+    return IndexedMessage(
+        url=fixtures.content_url(message_id), id=message_id, type=mtype,
+        name=name or "message %s" % message_id, size=None, version=version
+    )
+
+
+def by_url(*messages):
+    return {m.url: m for m in messages}
+
+
+class MessageIndexTests(unittest.TestCase):
+    postbox = fixtures.postbox_url
+
+    def setUp(self):
+        self.index = MessageIndex(":memory:")
+
+    def tearDown(self):
+        self.index.close()
+
+    def test_update(self):
+        first = [message(1), message(2), message(3, mtype="MessageContent")]
+        changes = self.index.update(self.postbox, by_url(*first), etag='"1"')
+        self.assertEqual(changes, InboxChanges(first, [], []))
+        self.assertEqual(self.index.get_state(self.postbox), ('"1"', None))
+        # unchanged
+        self.assertEqual(
+            self.index.update(self.postbox, by_url(*first)),
+            InboxChanges([], [], [])
+        )
+        # new, changed (version) and removed
+        changed = message(2, version=b"v2")
+        changes = self.index.update(
+            self.postbox, by_url(first[0], changed, message(4)),
+            etag='"2"', last_modified="Thu, 01 Jan 2026 00:00:00 GMT"
+        )
+        self.assertEqual(
+            changes, InboxChanges([message(4)], [changed], [first[2]])
+        )
+        self.assertEqual(
+            self.index.get_state(self.postbox),
+            ('"2"', "Thu, 01 Jan 2026 00:00:00 GMT")
+        )
+        self.assertEqual(
+            self.index.messages(self.postbox),
+            [first[0], changed, message(4)]
+        )
+        self.assertEqual(
+            self.index.messages(self.postbox, include_removed=True),
+            [first[0], changed, first[2], message(4)]
+        )
+        self.assertEqual(
+            self.index.messages(self.postbox, mtype="WebReference"),
+            [first[0], changed, message(4)]
+        )
+
+    def test_removed_again(self):
+        self.index.update(self.postbox, by_url(message(1), message(2)))
+        changes = self.index.update(self.postbox, by_url(message(1)))
+        self.assertEqual(changes.removed, [message(2)])
+        # already removed, not reported twice
+        self.assertEqual(
+            self.index.update(self.postbox, by_url(message(1))),
+            InboxChanges([], [], [])
+        )
+        # reappearing message is new
+        changes = self.index.update(
+            self.postbox, by_url(message(1), message(2))
+        )
+        self.assertEqual(changes, InboxChanges([message(2)], [], []))
+        self.assertEqual(
+            self.index.messages(self.postbox), [message(1), message(2)]
+        )
+
+    def test_postboxes(self):
+        other = "https://other/postbox/"
+        self.index.update(self.postbox, by_url(message(1)), etag='"1"')
+        changes = self.index.update(other, by_url(message(1), message(2)))
+        self.assertEqual(len(changes.new), 2)
+        self.assertEqual(self.index.messages(self.postbox), [message(1)])
+        self.assertEqual(self.index.get_state(other), (None, None))
+        self.assertEqual(
+            self.index.get_state("https://unknown/"), (None, None)
+        )
+
+    def test_not_modified(self):
+        self.index.update(self.postbox, by_url(message(1)), etag='"1"')
+        self.assertEqual(
+            self.index.not_modified(self.postbox), InboxChanges([], [], [])
+        )
+        self.assertEqual(self.index.get_state(self.postbox), ('"1"', None))
+        self.assertEqual(self.index.messages(self.postbox), [message(1)])
+
+
+class ExtractTests(unittest.TestCase):
+    def test_extract(self):
+        key = ed25519.Ed25519PrivateKey.generate()
+        graph = fixtures.postbox_graph([key])
+        keys = fixtures.key_list(os.urandom(32), [key])
+        fixtures.add_message(graph, 1, keys)
+        fixtures.add_message(graph, 2, keys, content_type="MessageContent")
+        # not a message
+        fixtures.add_message(graph, 3, keys, content_type="PublicKey")
+        messages = extract_indexed_messages(graph)
+        self.assertEqual(
+            set(messages),
+            {fixtures.content_url(1), fixtures.content_url(2)}
+        )
+        first = messages[fixtures.content_url(1)]
+        self.assertEqual(
+            first[:5],
+            (fixtures.content_url(1), 1, "WebReference", "message 1", None)
+        )
+        self.assertEqual(
+            messages[fixtures.content_url(2)].type, "MessageContent"
+        )
+        # key list is part of the version
+        graph = fixtures.postbox_graph([key])
+        fixtures.add_message(
+            graph, 1, fixtures.key_list(os.urandom(32), [key])
+        )
+        self.assertNotEqual(
+            extract_indexed_messages(graph)[first.url].version,
+            first.version
+        )
+
+
+class SyncTests(unittest.TestCase):
+    def setUp(self):
+        self.key = ed25519.Ed25519PrivateKey.generate()
+        self.graph = fixtures.postbox_graph([self.key])
+        self.etag = '"1"'
+        self.transport = fixtures.FakeTransport()
+        self.transport.add("GET", fixtures.postbox_url, self._postbox)
+        session = requests.Session()
+        session.mount(fixtures.host, self.transport)
+        self.postbox = PostBox(
+            ":memory:", self.key, fixtures.postbox_url, graph=self.graph,
+            session=session
+        )
+        self.index = MessageIndex(":memory:")
+
+    def tearDown(self):
+        self.index.close()
+        self.postbox.attestation_checker.close()
+
+    def _postbox(self, request):
+        if request.headers.get("If-None-Match") == self.etag:
+            return 304, {"ETag": self.etag}, b""
+        return 200, {
+            "Content-Type": "text/turtle", "ETag": self.etag
+        }, self.graph.serialize(format="turtle").encode("utf8")
+
+    def add_message(self, message_id):
+        fixtures.add_message(
+            self.graph, message_id,
+            fixtures.key_list(os.urandom(32), [self.key])
+        )
+
+    def test_sync(self):
+        self.add_message(1)
+        changes = self.postbox.sync(self.index)
+        self.assertEqual([m.id for m in changes.new], [1])
+        self.assertNotIn("If-None-Match", self.transport.requests[-1].headers)
+        # unchanged: one conditional request
+        count = len(self.transport.requests)
+        self.assertEqual(
+            self.postbox.sync(self.index), InboxChanges([], [], [])
+        )
+        self.assertEqual(len(self.transport.requests) - count, 1)
+        self.assertEqual(
+            self.transport.requests[-1].headers["If-None-Match"], '"1"'
+        )
+        # changed postbox
+        self.add_message(2)
+        self.etag = '"2"'
+        changes = self.postbox.sync(self.index)
+        self.assertEqual([m.id for m in changes.new], [2])
+        self.assertEqual((changes.changed, changes.removed), ([], []))
+        self.assertEqual(self.index.get_state(fixtures.postbox_url)[0], '"2"')
@@ -0,0 +1,99 @@
+import unittest
+
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.asymmetric import ed25519, rsa
+
+from spider_messaging.utils.keys import KeyCache, key_fingerprint
+
+
+class KeyCacheTests(unittest.TestCase):
+    algo = hashes.SHA512()
+
+    def setUp(self):
+        self.private_key = ed25519.Ed25519PrivateKey.generate()
+        self.public_key = self.private_key.public_key()
+        self.cache = KeyCache()
+        self.pem = self.cache.get(self.public_key).pem
+
+    def test_aliasing(self):
+        entry = self.cache.get(self.public_key)
+        self.assertIs(entry.key, self.public_key)
+        # same object, same raw bytes and str resolve to one entry
+        self.assertIs(self.cache.get(self.public_key), entry)
+        self.assertIs(self.cache.get(self.pem), entry)
+        self.assertIs(self.cache.get(self.pem.decode("ascii")), entry)
+        # other objects of the same key share the PEM entry
+        self.assertIs(self.cache.get(self.private_key), entry)
+        self.assertIs(self.cache.get(self.private_key.public_key()), entry)
+        self.assertEqual(len(self.cache._entries), 1)
+
+    def test_raw(self):
+        raw = self.pem + b"\n"
+        entry = self.cache.get(raw)
+        # other raw bytes: own entry with the input bytes
+        self.assertIsNot(entry, self.cache.get(self.pem))
+        self.assertEqual(entry.raw, raw)
+        self.assertEqual(entry.pem, self.pem)
+        self.assertEqual(
+            entry.fingerprint(self.algo),
+            self.cache.get(self.pem).fingerprint(self.algo)
+        )
+        self.assertNotEqual(
+            entry.fingerprint(self.algo, raw=True),
+            entry.fingerprint(self.algo)
+        )
+        # fingerprint of stripped PEM is independent of raw
+        self.assertEqual(
+            self.cache.get(self.pem).fingerprint(self.algo, raw=True),
+            self.cache.get(self.pem).fingerprint(self.algo)
+        )
+        self.assertEqual(
+            entry.fingerprint(self.algo),
+            key_fingerprint(self.public_key, self.algo)
+        )
+
+    def test_fingerprint_algorithms(self):
+        entry = self.cache.get(self.public_key)
+        sha256 = entry.fingerprint(hashes.SHA256())
+        self.assertEqual(len(sha256), 32)
+        self.assertEqual(len(entry.fingerprint(self.algo)), 64)
+        # same name, other digest size
+        self.assertNotEqual(
+            entry.fingerprint(hashes.SHA512_256()),
+            entry.fingerprint(self.algo)[:32]
+        )
+        self.assertIs(entry.fingerprint(hashes.SHA256()), sha256)
+
+    def test_eviction(self):
+        cache = KeyCache(maxsize=2)
+        keys = [
+            ed25519.Ed25519PrivateKey.generate().public_key()
+            for _ in range(2)
+        ]
+        keys.append(
+            rsa.generate_private_key(65537, 2048).public_key()
+        )
+        entries = [cache.get(key) for key in keys[:2]]
+        # touch first entry, second is least recently used
+        self.assertIs(cache.get(entries[0].pem), entries[0])
+        third = cache.get(keys[2])
+        self.assertEqual(len(cache._entries), 2)
+        self.assertIs(cache.get(keys[0]), entries[0])
+        self.assertIs(cache.get(keys[2]), third)
+        # evicted, also for the object lookup
+        self.assertNotIn(id(keys[1]), cache._objects)
+        self.assertIsNot(cache.get(keys[1]), entries[1])
+        self.assertEqual(len(cache._objects), len(cache._entries))
+
+    def test_clear(self):
+        entry = self.cache.get(self.public_key)
+        self.cache.clear()
+        self.assertEqual(self.cache._objects, {})
+        self.assertIsNot(self.cache.get(self.public_key), entry)
+
+    def test_invalid(self):
+        for value in [b"", "not a key", b"-----BEGIN PUBLIC KEY-----\n"]:
+            with self.subTest(value=value):
+                with self.assertRaises(ValueError):
+                    self.cache.get(value)
+        self.assertEqual(len(self.cache._entries), 1)
@@ -0,0 +1,236 @@
+import io
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import requests
+from cryptography.hazmat.primitives.asymmetric import ed25519
+
+from spider_messaging.constants import AccessMethod
+from spider_messaging.exceptions import DestException
+from spider_messaging.protocols.messaging import PostBox
+from spider_messaging.utils.cache import MessageCache
+from spider_messaging.utils.misc import SegmentedEncryptedFile
+
+from . import fixtures
+
+
+class MessageCacheTests(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def add(self, cache, cache_key, data, session_key=None, viewed=False):
+        tmp = cache.create_tempfile()
+        with tmp:
+            tmp.write(data)
+        cache.add(
+            cache_key, tmp.name, "https://host/message/", "sha512", "{}",
+            session_key=session_key, viewed=viewed
+        )
+
+    def test_roundtrip(self):
+        cache = MessageCache(self.directory, local_key=os.urandom(32))
+        cache_key = cache.cache_key(fixtures.postbox_url, 10, b"key")
+        self.assertIsNone(cache.get(cache_key))
+        self.add(cache, cache_key, b"ciphertext", session_key=b"k" * 32)
+        fileob, base, hash_algo, key_list, session_key = cache.get(cache_key)
+        with fileob:
+            self.assertEqual(fileob.read(), b"ciphertext")
+        self.assertEqual(
+            (base, hash_algo, key_list, session_key),
+            ("https://host/message/", "sha512", "{}", b"k" * 32)
+        )
+        # other postbox, other own key
+        self.assertIsNone(
+            cache.get(cache.cache_key("https://other/", 10, b"key"))
+        )
+        self.assertIsNone(
+            cache.get(cache.cache_key(fixtures.postbox_url, 10, b"other"))
+        )
+        cache.close()
+        # other local key cannot read the session key
+        cache = MessageCache(self.directory, local_key=os.urandom(32))
+        fileob, *_, session_key = cache.get(cache_key)
+        fileob.close()
+        self.assertIsNone(session_key)
+        cache.close()
+
+    def test_viewed(self):
+        cache = MessageCache(self.directory)
+        cache_key = cache.cache_key(fixtures.postbox_url, 10, b"key")
+        self.add(cache, cache_key, b"ciphertext")
+        self.assertIsNone(cache.get(cache_key, viewed=True))
+        cache.get(cache_key)[0].close()
+        self.add(cache, cache_key, b"ciphertext", viewed=True)
+        cache.get(cache_key, viewed=True)[0].close()
+        # a later peek keeps the flag
+        self.add(cache, cache_key, b"ciphertext")
+        cache.get(cache_key, viewed=True)[0].close()
+        cache.close()
+
+    def test_old_schema(self):
+        cache = MessageCache(self.directory)
+        cache_key = cache.cache_key(fixtures.postbox_url, 10, b"key")
+        self.add(cache, cache_key, b"ciphertext")
+        cache.con.execute("PRAGMA user_version=1")
+        cache.con.commit()
+        cache.close()
+        cache = MessageCache(self.directory)
+        self.assertIsNone(cache.get(cache_key))
+        cache.close()
+
+    def test_eviction(self):
+        cache = MessageCache(self.directory, max_size=250)
+        cache_keys = [
+            cache.cache_key(fixtures.postbox_url, i, b"key")
+            for i in range(3)
+        ]
+        for cache_key in cache_keys:
+            self.add(cache, cache_key, bytes(100))
+        self.assertIsNone(cache.get(cache_keys[0]))
+        for cache_key in cache_keys[1:]:
+            fileob = cache.get(cache_key)[0]
+            fileob.close()
+        cache.close()
+
+
+class CachedReceiveTests(unittest.TestCase):
+    message_ids = [10, 11, 12]
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.key = ed25519.Ed25519PrivateKey.generate()
+        self.transport = fixtures.FakeTransport()
+        self.messages = {}
+        graph = fixtures.postbox_graph([self.key])
+        for message_id in self.message_ids:
+            data = os.urandom(10000 + message_id)
+            aes_key = os.urandom(32)
+            keys = fixtures.key_list(aes_key, [self.key])
+            fixtures.add_message(graph, message_id, keys)
+            self.messages[message_id] = data
+            self.transport.add(
+                "POST", fixtures.content_url(message_id, "message"),
+                self._message_handler(data, aes_key, keys)
+            )
+        self.transport.add(
+            "GET", fixtures.postbox_url, lambda request: (
+                200, {"Content-Type": "text/turtle"},
+                graph.serialize(format="turtle").encode("utf8")
+            )
+        )
+        session = requests.Session()
+        session.mount(fixtures.host, self.transport)
+        self.postbox = PostBox(
+            ":memory:", self.key, fixtures.postbox_url, graph=graph,
+            session=session
+        )
+        self.postbox.message_cache = MessageCache(
+            self.directory, local_key=os.urandom(32)
+        )
+
+    def tearDown(self):
+        self.postbox.message_cache.close()
+        self.postbox.attestation_checker.close()
+        shutil.rmtree(self.directory)
+
+    @staticmethod
+    def _message_handler(data, aes_key, keys):
+        blob = SegmentedEncryptedFile(
+            aes_key, io.BytesIO(data), b"SPKC-Type: file\n"
+        ).read()
+        return lambda request: (200, {"X-KEYLIST": json.dumps(keys)}, blob)
+
+    def receive(self, message_id, access_method=AccessMethod.peek):
+        """ returns (content, amount of requests) """
+        count = len(self.transport.requests)
+        outfp = self.postbox.receive(
+            message_id, io.BytesIO(), access_method=access_method
+        )[0]
+        return outfp.getvalue(), len(self.transport.requests) - count
+
+    def test_repeated_peek(self):
+        data, requests_made = self.receive(10)
+        self.assertEqual(data, self.messages[10])
+        # postbox graph and message
+        self.assertEqual(requests_made, 2)
+        data, requests_made = self.receive(10)
+        self.assertEqual(data, self.messages[10])
+        self.assertEqual(requests_made, 0)
+
+    def test_view_after_peek(self):
+        self.receive(10)
+        self.assertNotIn("keyhash=", self.transport.requests[-1].body)
+        # server must mark the message as read
+        data, requests_made = self.receive(10, AccessMethod.view)
+        self.assertEqual(data, self.messages[10])
+        self.assertEqual(requests_made, 2)
+        # own key hash marks the message as read
+        self.assertIn("keyhash=", self.transport.requests[-1].body)
+        for access_method in [AccessMethod.view, AccessMethod.peek]:
+            data, requests_made = self.receive(10, access_method)
+            self.assertEqual(data, self.messages[10])
+            self.assertEqual(requests_made, 0)
+
+    def test_rotated_key(self):
+        self.receive(10)
+        self.postbox.priv_key = ed25519.Ed25519PrivateKey.generate()
+        self.assertIsNone(self.postbox._receive_cached(
+            self.postbox._message_cache_key(10, AccessMethod.peek)
+        ))
+
+    def test_hit_without_session_key(self):
+        self.receive(11)
+        self.postbox.message_cache.local_key = None
+        # key list is stored, so no graph is required
+        data, requests_made = self.receive(11)
+        self.assertEqual(data, self.messages[11])
+        self.assertEqual(requests_made, 0)
+
+    def test_bypass(self):
+        self.receive(10)
+        count = len(self.transport.requests)
+        # bypass is never served from cache, the fake server has no route
+        with self.assertRaises(DestException):
+            self.receive(10, AccessMethod.bypass)
+        self.assertGreater(len(self.transport.requests), count)
+
+    def test_corrupted(self):
+        self.receive(12)
+        cache_key = self.postbox._message_cache_key(12, AccessMethod.peek)
+        path = self.postbox.message_cache._path(cache_key)
+        with open(path, "r+b") as f:
+            f.seek(-1, os.SEEK_END)
+            last = f.read(1)
+            f.seek(-1, os.SEEK_END)
+            f.write(bytes([last[0] ^ 1]))
+        with self.assertRaises(Exception):
+            self.receive(12)
+        data, requests_made = self.receive(12)
+        self.assertEqual(data, self.messages[12])
+        self.assertEqual(requests_made, 2)
+
+    def test_receive_many(self):
+        self.receive(10)
+        count = len(self.transport.requests)
+        results = self.postbox.receive_many(
+            self.message_ids, outfps=lambda message_id: io.BytesIO(),
+            access_method=AccessMethod.peek
+        )
+        # one graph for both misses, message 10 is cached
+        self.assertEqual(len(self.transport.requests) - count, 3)
+        count = len(self.transport.requests)
+        results = self.postbox.receive_many(
+            self.message_ids, outfps=lambda message_id: io.BytesIO(),
+            access_method=AccessMethod.peek
+        )
+        self.assertEqual(len(self.transport.requests) - count, 0)
+        for message_id in self.message_ids:
+            ret, exc = results[message_id]
+            self.assertIsNone(exc)
+            self.assertEqual(ret[0].getvalue(), self.messages[message_id])
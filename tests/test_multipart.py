@@ -0,0 +1,89 @@
+import io
+import os
+import tempfile
+import tracemalloc
+import unittest
+
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+
+from spider_messaging.utils.misc import EncryptedFile, MultipartEncoder
+
+
+def encrypted_file(fileob):
+    nonce = os.urandom(13)
+    fencryptor = Cipher(
+        algorithms.AES(os.urandom(32)), modes.GCM(nonce),
+        backend=default_backend()
+    ).encryptor()
+    return EncryptedFile(fencryptor, fileob, nonce, b"SPKC-Type: file\n")
+
+
+class MultipartEncoderTests(unittest.TestCase):
+    # size of synthetic message
+    large_size = 300 * 2 ** 20
+    # maximal traced memory while streaming it
+    max_peak = 4 * 2 ** 20
+
+    def test_large_file_bounded_memory(self):
+        with tempfile.TemporaryFile() as fileob:
+            # sparse file, no disk usage
+            fileob.truncate(self.large_size)
+            fileob.seek(0)
+            encoder = MultipartEncoder(
+                fields={"key_list": "{}", "amount_tokens": 1},
+                files={
+                    "encrypted_content": (
+                        "encrypted_content", encrypted_file(fileob),
+                        "application/octet-stream"
+                    )
+                }
+            )
+            self.assertGreater(encoder.len, self.large_size)
+            tracemalloc.start()
+            try:
+                produced = 0
+                for chunk in encoder:
+                    produced += len(chunk)
+                peak = tracemalloc.get_traced_memory()[1]
+            finally:
+                tracemalloc.stop()
+        self.assertEqual(produced, encoder.len)
+        self.assertLess(peak, self.max_peak)
+
+    def test_read_matches_len(self):
+        data = os.urandom(2 ** 17 + 3)
+        encoder = MultipartEncoder(
+            fields={"key_list": "{}"},
+            files={"encrypted_content": encrypted_file(io.BytesIO(data))}
+        )
+        body = bytearray()
+        chunk = encoder.read(1000)
+        while chunk:
+            body += chunk
+            chunk = encoder.read(1000)
+        self.assertEqual(len(body), encoder.len)
+        self.assertTrue(body.startswith(b"--%b\r\n" % (
+            encoder.boundary.encode("ascii")
+        )))
+        self.assertTrue(body.endswith(b"--%b--\r\n" % (
+            encoder.boundary.encode("ascii")
+        )))
+
+    def test_unknown_size(self):
+        class Stream(io.RawIOBase):
+            def __init__(self, data):
+                self.inner = io.BytesIO(data)
+
+            def readable(self):
+                return True
+
+            def readinto(self, b):
+                return self.inner.readinto(b)
+
+        encoder = MultipartEncoder(files={
+            "encrypted_content": encrypted_file(Stream(b"x" * 1000))
+        })
+        # sent chunked
+        self.assertEqual(encoder.len, 0)
+        self.assertGreater(len(b"".join(encoder)), 1000)
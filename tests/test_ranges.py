@@ -0,0 +1,169 @@
+import io
+import os
+import unittest
+
+try:
+    import django
+    from django.test import Client, override_settings
+    from django.urls import path
+except ImportError:
+    django = None
+
+from . import fixtures
+
+if django:
+    fixtures.setup_django()
+    from spider_messaging.django.spider_messages.http import (
+        CbFileResponse, file_etag, parse_range, ranged_file_response
+    )
+    from spider_messaging.django.spider_messages.signals import (
+        successful_transmitted
+    )
+
+data = os.urandom(10000)
+etag = '"%s"' % ("0" * 64)
+
+
+def message_view(request):
+    # like MessageContentView, Range is also honored for POST
+    return ranged_file_response(request, io.BytesIO(data), len(data), etag)
+
+
+urlpatterns = [path("message/", message_view)] if django else []
+
+
+@unittest.skipIf(not django, "django not installed")
+class ParseRangeTests(unittest.TestCase):
+    def test_parse_range(self):
+        for header, expected in [
+            (None, None),
+            ("", None),
+            ("bytes=0-", (0, 100)),
+            ("bytes=10-19", (10, 20)),
+            (" bytes = 10 - 19 ", (10, 20)),
+            ("bytes=90-200", (90, 100)),
+            ("bytes=99-99", (99, 100)),
+            ("bytes=-10", (90, 100)),
+            ("bytes=-200", (0, 100)),
+            # not satisfiable
+            ("bytes=-0", (100, 100)),
+            ("bytes=100-", (100, 100)),
+            ("bytes=100-200", (100, 100)),
+            # invalid or unsupported, serve whole file
+            ("bytes=20-10", None),
+            ("bytes=-", None),
+            ("bytes=0-1,5-6", None),
+            ("items=0-1", None),
+        ]:
+            with self.subTest(header=header):
+                self.assertEqual(parse_range(header, 100), expected)
+
+    def test_file_etag(self):
+        self.assertEqual(file_etag("a", 1), file_etag("a", 1))
+        self.assertNotEqual(file_etag("a", 1), file_etag("a", 2))
+        self.assertNotEqual(file_etag("a", 1), file_etag("b", 1))
+        self.assertFalse(file_etag("a", 1).startswith("W/"))
+
+
+@unittest.skipIf(not django, "django not installed")
+class RangedResponseTests(unittest.TestCase):
+    def setUp(self):
+        urls = override_settings(ROOT_URLCONF=__name__)
+        urls.enable()
+        self.addCleanup(urls.disable)
+        self.client = Client()
+        self.transmitted = []
+        successful_transmitted.connect(self.receiver)
+
+    def tearDown(self):
+        successful_transmitted.disconnect(self.receiver)
+
+    def receiver(self, sender, response, **kwargs):
+        self.transmitted.append(response)
+
+    def post(self, **headers):
+        # the test client closes streaming responses after consuming them
+        response = self.client.post("/message/", **headers)
+        content = b"".join(response.streaming_content)
+        return response, content
+
+    def test_whole_file(self):
+        response, content = self.post()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(content, data)
+        self.assertEqual(response["Content-Length"], str(len(data)))
+        self.assertEqual(response["Accept-Ranges"], "bytes")
+        self.assertEqual(response["ETag"], etag)
+        self.assertNotIn("Content-Range", response)
+        self.assertEqual(self.transmitted, [response])
+
+    def test_range(self):
+        response, content = self.post(HTTP_RANGE="bytes=100-199")
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(content, data[100:200])
+        self.assertEqual(response["Content-Range"], "bytes 100-199/10000")
+        self.assertEqual(response["Content-Length"], "100")
+        # range does not contain the last byte
+        self.assertEqual(self.transmitted, [])
+
+    def test_final_range(self):
+        for header in ["bytes=9000-", "bytes=-1000", "bytes=9000-20000"]:
+            with self.subTest(header=header):
+                self.transmitted.clear()
+                response, content = self.post(HTTP_RANGE=header)
+                self.assertEqual(response.status_code, 206)
+                self.assertEqual(content, data[9000:])
+                self.assertEqual(
+                    response["Content-Range"], "bytes 9000-9999/10000"
+                )
+                self.assertEqual(self.transmitted, [response])
+
+    def test_if_range(self):
+        response, content = self.post(
+            HTTP_RANGE="bytes=5000-", HTTP_IF_RANGE=etag
+        )
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(content, data[5000:])
+        # changed file or weak etag: whole file
+        for if_range in ['"other"', "W/%s" % etag]:
+            with self.subTest(if_range=if_range):
+                response, content = self.post(
+                    HTTP_RANGE="bytes=5000-", HTTP_IF_RANGE=if_range
+                )
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(content, data)
+                self.assertNotIn("Content-Range", response)
+
+    def test_not_satisfiable(self):
+        response = self.client.post(
+            "/message/", HTTP_RANGE="bytes=10000-"
+        )
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response["Content-Range"], "bytes */10000")
+        self.assertEqual(response["ETag"], etag)
+        self.assertEqual(self.transmitted, [])
+        # If-Range mismatch: whole file instead
+        response, content = self.post(
+            HTTP_RANGE="bytes=10000-", HTTP_IF_RANGE='"other"'
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(content, data)
+
+    def test_get(self):
+        response = self.client.get("/message/", HTTP_RANGE="bytes=0-9")
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(b"".join(response.streaming_content), data[:10])
+
+    def test_interrupted(self):
+        response = self.client.post("/message/")
+        self.assertIsInstance(response, CbFileResponse)
+        # client disconnects before the last byte was sent
+        next(iter(response.streaming_content))
+        response.close()
+        self.assertEqual(self.transmitted, [])
+        # resumed download completes the transmission
+        response, content = self.post(
+            HTTP_RANGE="bytes=4000-", HTTP_IF_RANGE=etag
+        )
+        self.assertEqual(content, data[4000:])
+        self.assertEqual(self.transmitted, [response])
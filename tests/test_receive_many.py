@@ -0,0 +1,121 @@
+import io
+import json
+import os
+import unittest
+
+import requests
+from cryptography.exceptions import InvalidTag
+from cryptography.hazmat.primitives.asymmetric import ed25519
+
+from spider_messaging.constants import AccessMethod
+from spider_messaging.exceptions import (
+    DestException, SrcException, WrongRecipient
+)
+from spider_messaging.protocols.messaging import PostBox
+from spider_messaging.utils.misc import SegmentedEncryptedFile
+
+from . import fixtures
+
+
+class ReceiveManyTests(unittest.TestCase):
+    # ok, server error, not encrypted for key, tampered, ok
+    message_ids = [10, 11, 12, 13, 14]
+
+    def setUp(self):
+        self.key = ed25519.Ed25519PrivateKey.generate()
+        other_key = ed25519.Ed25519PrivateKey.generate()
+        self.transport = fixtures.FakeTransport()
+        self.messages = {}
+        graph = fixtures.postbox_graph([self.key])
+        for message_id in self.message_ids:
+            data = os.urandom(10000 + message_id)
+            aes_key = os.urandom(32)
+            keys = fixtures.key_list(
+                aes_key, [other_key if message_id == 12 else self.key]
+            )
+            fixtures.add_message(graph, message_id, keys)
+            self.messages[message_id] = data
+            blob = SegmentedEncryptedFile(
+                aes_key, io.BytesIO(data), b"SPKC-Type: file\n"
+            ).read()
+            if message_id == 13:
+                blob = blob[:-1] + bytes([blob[-1] ^ 1])
+            self.transport.add(
+                "POST", fixtures.content_url(message_id, "message"),
+                self._message_handler(
+                    500 if message_id == 11 else 200, blob, keys
+                )
+            )
+        self.transport.add(
+            "GET", fixtures.postbox_url, lambda request: (
+                200, {"Content-Type": "text/turtle"},
+                graph.serialize(format="turtle").encode("utf8")
+            )
+        )
+        session = requests.Session()
+        session.mount(fixtures.host, self.transport)
+        self.postbox = PostBox(
+            ":memory:", self.key, fixtures.postbox_url, graph=graph,
+            session=session
+        )
+
+    def tearDown(self):
+        self.postbox.attestation_checker.close()
+
+    @staticmethod
+    def _message_handler(status, blob, keys):
+        return lambda request: (
+            status, {"X-KEYLIST": json.dumps(keys)}, blob
+        )
+
+    def test_errors(self):
+        for max_workers in [1, 4]:
+            with self.subTest(max_workers=max_workers):
+                results = self.postbox.receive_many(
+                    self.message_ids + [99],
+                    outfps=lambda message_id: io.BytesIO(),
+                    access_method=AccessMethod.peek, max_workers=max_workers
+                )
+                self.assertEqual(
+                    set(results), set(self.message_ids + [99])
+                )
+                # failures are reported per message
+                for message_id, exc_type in [
+                    (11, DestException), (12, WrongRecipient),
+                    (13, InvalidTag), (99, SrcException)
+                ]:
+                    ret, exc = results[message_id]
+                    self.assertIsNone(ret)
+                    self.assertIsInstance(exc, exc_type)
+                for message_id in [10, 14]:
+                    ret, exc = results[message_id]
+                    self.assertIsNone(exc)
+                    self.assertEqual(
+                        ret[0].getvalue(), self.messages[message_id]
+                    )
+                    self.assertEqual(ret[1]["SPKC-Type"], "file")
+
+    def test_outfps(self):
+        outfps = {message_id: io.BytesIO() for message_id in [10, 11]}
+        results = self.postbox.receive_many(
+            [10, 11], outfps=outfps, access_method=AccessMethod.peek
+        )
+        self.assertIs(results[10][0][0], outfps[10])
+        self.assertEqual(outfps[10].getvalue(), self.messages[10])
+        self.assertIsNotNone(results[11][1])
+        # one graph retrieval for all messages
+        self.assertEqual(
+            [request.method for request in self.transport.requests].count(
+                "GET"
+            ), 1
+        )
+
+    def test_temporary_files(self):
+        results = self.postbox.receive_many(
+            [10, 13], access_method=AccessMethod.peek
+        )
+        outfp = results[10][0][0]
+        outfp.seek(0)
+        self.assertEqual(outfp.read(), self.messages[10])
+        outfp.close()
+        self.assertIsNotNone(results[13][1])
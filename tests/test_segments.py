@@ -0,0 +1,243 @@
+import io
+import os
+import unittest
+
+from cryptography.exceptions import InvalidTag
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+
+from spider_messaging.utils.misc import (
+    EncryptedFile, MessageDecryptor, SegmentedEncryptedFile
+)
+from spider_messaging.utils.segments import (
+    SegmentReader, header_size, is_segmented, seal_segments,
+    segmented_length, split_segments, tag_size
+)
+
+
+def split(blob, chunk_size):
+    return [
+        blob[i:i + chunk_size] for i in range(0, len(blob), chunk_size)
+    ]
+
+
+def seal(key, data, segment_size, **kwargs):
+    return b"".join(seal_segments(
+        key, split_segments(split(data, 1000) or [b""], segment_size),
+        segment_size, **kwargs
+    ))
+
+
+def read(key, blob, chunk_size, max_workers=1):
+    reader = SegmentReader(key, max_workers=max_workers)
+    out = []
+    for chunk in split(blob, chunk_size):
+        out.extend(reader.feed(chunk))
+    out.extend(reader.finalize())
+    return b"".join(out)
+
+
+def segments(blob, segment_size):
+    """ returns (header, encrypted segments) """
+    return (
+        blob[:header_size],
+        split(blob[header_size:], segment_size + tag_size)
+    )
+
+
+class SegmentTests(unittest.TestCase):
+    segment_size = 4096
+
+    def setUp(self):
+        self.key = os.urandom(32)
+
+    def test_split_segments(self):
+        for size in [0, 1, 4095, 4096, 4097, 3 * 4096]:
+            with self.subTest(size=size):
+                data = os.urandom(size)
+                items = list(split_segments(
+                    split(data, 1000), self.segment_size
+                ))
+                self.assertEqual(b"".join(x[1] for x in items), data)
+                self.assertEqual(
+                    [x[0] for x in items], list(range(len(items)))
+                )
+                self.assertEqual(
+                    [x[2] for x in items],
+                    [False] * (len(items) - 1) + [True]
+                )
+                self.assertEqual(len(items), max(1, -(-size // 4096)))
+
+    def test_roundtrip(self):
+        for size in [0, 1, 4096, 4097, 5 * 4096 + 17]:
+            data = os.urandom(size)
+            blob = seal(self.key, data, self.segment_size)
+            self.assertTrue(is_segmented(blob))
+            self.assertEqual(
+                len(blob), segmented_length(size, self.segment_size)
+            )
+            for chunk_size in [1, 17, 4096 + tag_size, 10000, len(blob)]:
+                for max_workers in [1, 3]:
+                    with self.subTest(
+                        size=size, chunk_size=chunk_size,
+                        max_workers=max_workers
+                    ):
+                        self.assertEqual(
+                            read(self.key, blob, chunk_size, max_workers),
+                            data
+                        )
+
+    def test_parallel_seal(self):
+        data = os.urandom(7 * 4096 + 3)
+        prefix = os.urandom(7)
+        self.assertEqual(
+            seal(self.key, data, self.segment_size, nonce_prefix=prefix),
+            seal(
+                self.key, data, self.segment_size, nonce_prefix=prefix,
+                max_workers=4
+            )
+        )
+
+    def test_decrypt_range(self):
+        data = os.urandom(5 * 4096 + 17)
+        fileob = io.BytesIO(seal(self.key, data, self.segment_size))
+        reader = SegmentReader(self.key)
+        for start, end in [
+            (0, None), (0, 1), (4095, 4097), (4096, 8192), (100, 3 * 4096),
+            (5 * 4096, None), (5 * 4096 + 16, 10 ** 9), (10, 10),
+            (10 ** 9, None)
+        ]:
+            with self.subTest(start=start, end=end):
+                self.assertEqual(
+                    reader.decrypt_range(fileob, start, end),
+                    data[start:end]
+                )
+
+    def assertRejected(self, blob, chunk_size=4096):
+        with self.assertRaises((InvalidTag, ValueError)):
+            read(self.key, blob, chunk_size)
+
+    def test_truncated(self):
+        data = os.urandom(3 * 4096 + 10)
+        blob = seal(self.key, data, self.segment_size)
+        header, parts = segments(blob, self.segment_size)
+        # at every segment boundary and inside the last segment
+        for count in range(len(parts)):
+            with self.subTest(segments=count):
+                self.assertRejected(header + b"".join(parts[:count]))
+        self.assertRejected(blob[:-1])
+        self.assertRejected(blob[:header_size - 1])
+        # random access notices the missing last segment
+        with self.assertRaises(InvalidTag):
+            SegmentReader(self.key).decrypt_range(
+                io.BytesIO(header + b"".join(parts[:2])), 4096, 8192
+            )
+
+    def test_truncated_aligned(self):
+        # content fills complete segments, last segment is not empty
+        blob = seal(self.key, os.urandom(3 * 4096), self.segment_size)
+        header, parts = segments(blob, self.segment_size)
+        self.assertEqual(len(parts), 3)
+        self.assertRejected(header + b"".join(parts[:2]))
+
+    def test_reordered(self):
+        blob = seal(self.key, os.urandom(3 * 4096 + 10), self.segment_size)
+        header, parts = segments(blob, self.segment_size)
+        parts[0], parts[1] = parts[1], parts[0]
+        self.assertRejected(header + b"".join(parts))
+
+    def test_last_flag(self):
+        data = os.urandom(3 * 4096)
+        prefix = os.urandom(7)
+        items = list(split_segments([data], self.segment_size))
+
+        def sealed(items):
+            return b"".join(seal_segments(
+                self.key, items, self.segment_size, nonce_prefix=prefix
+            ))
+        # unflagged last segment: truncation cannot be detected otherwise
+        self.assertRejected(sealed(
+            [(index, part, False) for index, part, _ in items]
+        ))
+        # flagged segment followed by more segments
+        self.assertRejected(sealed(
+            [(index, part, index == 1) for index, part, _ in items]
+        ))
+        self.assertEqual(read(self.key, sealed(items), 4096), data)
+
+    def test_header(self):
+        blob = seal(self.key, os.urandom(2 * 4096), self.segment_size)
+        other = seal(self.key, os.urandom(2 * 4096), self.segment_size)
+        # segments of another stream (other nonce prefix)
+        self.assertRejected(blob[:header_size] + other[header_size:])
+        # header is authenticated
+        modified = bytearray(blob)
+        # segment size
+        modified[4] ^= 1
+        self.assertRejected(bytes(modified))
+        modified = bytearray(blob)
+        modified[header_size - 1] ^= 1
+        self.assertRejected(bytes(modified))
+        with self.assertRaises(ValueError):
+            read(self.key, b"\x01" + bytes(4) + bytes(7), 4096)
+        with self.assertRaises(InvalidTag):
+            read(os.urandom(32), blob, 4096)
+
+
+class FormatDetectionTests(unittest.TestCase):
+    data = b"content" * 10000
+    headers = b"SPKC-Type: file\n"
+
+    def decrypt(self, key, blob, chunk_size, first=None):
+        out = io.BytesIO()
+        decryptor = MessageDecryptor(key, out)
+        chunks = split(blob, chunk_size)
+        if first is not None:
+            chunks.insert(0, first)
+        for chunk in chunks:
+            decryptor.feed(chunk)
+        headers = decryptor.finalize()
+        return headers, out.getvalue()
+
+    def legacy(self, key):
+        nonce = os.urandom(13)
+        return EncryptedFile(
+            Cipher(
+                algorithms.AES(key), modes.GCM(nonce),
+                backend=default_backend()
+            ).encryptor(),
+            io.BytesIO(self.data), nonce, self.headers
+        ).read()
+
+    def test_detection(self):
+        key = os.urandom(32)
+        segmented = SegmentedEncryptedFile(
+            key, io.BytesIO(self.data), self.headers, segment_size=4096
+        ).read()
+        legacy = self.legacy(key)
+        self.assertTrue(is_segmented(segmented))
+        # legacy contents start with the base64 nonce
+        self.assertFalse(is_segmented(legacy))
+        for name, blob in [("legacy", legacy), ("segmented", segmented)]:
+            # the first byte decides, also if it arrives alone or late
+            for chunk_size, first in [
+                (1, None), (2 ** 16, None), (len(blob), None), (7, b"")
+            ]:
+                with self.subTest(
+                    format=name, chunk_size=chunk_size, first=first
+                ):
+                    headers, content = self.decrypt(
+                        key, blob, chunk_size, first
+                    )
+                    self.assertEqual(content, self.data)
+                    self.assertEqual(headers["SPKC-Type"], "file")
+
+    def test_segmented_truncated(self):
+        key = os.urandom(32)
+        blob = SegmentedEncryptedFile(
+            key, io.BytesIO(self.data), self.headers, segment_size=4096
+        ).read()
+        with self.assertRaises(InvalidTag):
+            self.decrypt(
+                key, blob[:header_size + 2 * (4096 + tag_size)], 100
+            )
@@ -0,0 +1,102 @@
+import unittest
+
+import requests
+from cryptography.hazmat.primitives.asymmetric import ed25519
+
+from spider_messaging.protocols.messaging import PostBox
+from spider_messaging.utils.session import (
+    clear_sessions, create_session, get_session
+)
+
+from . import fixtures
+
+
+class CookieTests(unittest.TestCase):
+    url = "%s/cookie/" % fixtures.host
+
+    def tearDown(self):
+        clear_sessions()
+
+    def mount(self, session):
+        transport = fixtures.FakeTransport()
+        transport.add("GET", self.url, lambda request: (
+            200, {"Set-Cookie": "sessionid=secret; Path=/"}, b""
+        ))
+        session.mount(fixtures.host, transport)
+        return transport
+
+    def cookie_sent(self, session):
+        """ request twice, returns Cookie header of second request """
+        transport = self.mount(session)
+        session.get(self.url).close()
+        session.get(self.url).close()
+        return transport.requests[-1].headers.get("Cookie")
+
+    def test_own_session(self):
+        self.assertEqual(
+            self.cookie_sent(create_session()), "sessionid=secret"
+        )
+
+    def test_shared_session(self):
+        session = get_session("test")
+        self.assertIsNone(self.cookie_sent(session))
+        self.assertEqual(len(session.cookies), 0)
+        # also cookies set by hand are not sent
+        session.cookies.set("sessionid", "secret")
+        self.assertIsNone(self.cookie_sent(session))
+        self.assertIs(get_session("test"), session)
+
+    def test_shared_session_with_cookies(self):
+        session = get_session("test", cookies=True)
+        self.assertEqual(self.cookie_sent(session), "sessionid=secret")
+
+
+class PostBoxSessionTests(unittest.TestCase):
+    def setUp(self):
+        self.key = ed25519.Ed25519PrivateKey.generate()
+        self.graph = fixtures.postbox_graph([self.key])
+        self.postboxes = []
+
+    def tearDown(self):
+        for postbox in self.postboxes:
+            postbox.attestation_checker.close()
+        clear_sessions()
+
+    def postbox(self, **kwargs):
+        postbox = PostBox(
+            ":memory:", self.key, fixtures.postbox_url, graph=self.graph,
+            **kwargs
+        )
+        self.postboxes.append(postbox)
+        return postbox
+
+    def test_own_sessions(self):
+        first, second = self.postbox(), self.postbox()
+        self.assertIsNot(first.session, second.session)
+        self.assertIsNot(first.session, get_session())
+        # update keeps the session
+        session = first.session
+        first.update(graph=self.graph)
+        self.assertIs(first.session, session)
+        first.update(graph=self.graph, session=False)
+        self.assertIsNot(first.session, session)
+
+    def test_explicit_session(self):
+        session = requests.Session()
+        self.assertIs(self.postbox(session=session).session, session)
+
+    def test_shared_session(self):
+        class SharedPostBox(PostBox):
+            shared_session = "postboxes"
+        first = SharedPostBox(
+            ":memory:", self.key, fixtures.postbox_url, graph=self.graph
+        )
+        second = SharedPostBox(
+            ":memory:", self.key, fixtures.postbox_url, graph=self.graph
+        )
+        self.postboxes.extend([first, second])
+        self.assertIs(first.session, second.session)
+        self.assertIs(first.session, get_session("postboxes"))
+        # postboxes need cookies for csrftokens
+        first.session.cookies.set("csrftoken", "token")
+        self.assertEqual(len(second.session.cookies), 1)
@@ -0,0 +1,165 @@
+import random
+import unittest
+
+from cryptography.hazmat.primitives.asymmetric import ed25519
+from rdflib import RDF, Graph
+from rdflib.compare import isomorphic, to_isomorphic
+
+from spider_messaging.utils.turtle import (
+    TurtleStream, is_spkc_predicate, parse_stream
+)
+
+from . import fixtures
+
+document = r'''
+@prefix ex: <http://example.com/ns#> .
+@prefix : <http://example.com/default#> .
+PREFIX sp: <http://example.com/sparql#>
+@base <http://example.com/base/> .
+
+# comment with "quotes" and <brackets> .
+<relative> ex:name "plain" ;
+    ex:lang "bonjour"@fr , "hi"@en-US ;
+    ex:typed "5"^^<http://www.w3.org/2001/XMLSchema#integer> ;
+    ex:ptyped "x"^^ex:type ;
+    ex:single 'single "quoted"' ;
+    ex:escapes "tab\tnewline\nquote\"backslash\\ é \U0001F600" ;
+    ex:unicode "äöü € 𝄞" ;
+    ex:long """line one
+line "two" with ""quotes""
+# no comment
+""" ;
+    ex:empty "" , '' , """""" ;
+    ex:numbers 1 , -2 , +3 , 4.5 , .5 , 1e3 , -1.5E-2 ;
+    ex:bools true , false ;
+    a ex:Thing ;
+    ex:trailing "semicolons" ; ; .
+
+_:b1 :p _:b2 .
+_:b2 :p _:b1 , [ :q "nested" ; :r [ :s ( 1 "two" [ :t 3 ] ) ] ] .
+[ :anon "subject" ] :p () .
+( "list" ( "nested" ) ) :p sp:object .
+<http://example.com/absolute> <#fragment> <../up/> .
+ex:local\.escaped ex:name ex:with-dash.and.dots ;
+    ex:percent ex:a%20b .
+'''
+# long strings with single quotes
+document += r"""
+<single> ex:longsingle '''it's ''long'' . ''' .
+"""
+
+
+def chunked(data, sizes):
+    pos = 0
+    for size in sizes:
+        if pos >= len(data):
+            return
+        yield data[pos:pos + size]
+        pos += size
+    if pos < len(data):
+        yield data[pos:]
+
+
+def random_sizes(seed, maximum=64):
+    rand = random.Random(seed)
+    while True:
+        yield rand.randint(1, maximum)
+
+
+def reference(data, keep=None):
+    graph = Graph().parse(data=data, format="turtle")
+    if keep is not None:
+        for triple in list(graph):
+            if not keep(triple[1]):
+                graph.remove(triple)
+    return graph
+
+
+class TurtleStreamTests(unittest.TestCase):
+    def assertSameGraph(self, data, keep=None):
+        expected = reference(data, keep)
+        self.assertGreater(len(expected), 0)
+        encoded = data.encode("utf8")
+        for name, chunks in [
+            ("whole", [encoded]),
+            ("bytes", chunked(encoded, iter(lambda: 1, 0))),
+            ("random", chunked(encoded, random_sizes(len(encoded)))),
+            ("random small", chunked(encoded, random_sizes(1, 5))),
+        ]:
+            with self.subTest(chunks=name):
+                graph = parse_stream(Graph(), chunks, keep=keep)
+                self.assertEqual(len(graph), len(expected))
+                difference = set(to_isomorphic(graph)).symmetric_difference(
+                    to_isomorphic(expected)
+                )
+                self.assertTrue(
+                    isomorphic(graph, expected),
+                    "\n".join(sorted(map(str, difference)))
+                )
+
+    def test_document(self):
+        self.assertSameGraph(document)
+
+    def test_long_strings(self):
+        self.assertSameGraph(
+            '<http://a/> <http://b/> """%s""" , \'%s\' .' % (
+                ('x"y' * 5000) + "\n" * 3, "z" * 20000
+            )
+        )
+
+    def test_postbox_graph(self):
+        key = ed25519.Ed25519PrivateKey.generate()
+        graph = fixtures.postbox_graph([key])
+        for message_id in range(5):
+            fixtures.add_message(
+                graph, message_id, fixtures.key_list(b"k" * 32, [key])
+            )
+        data = graph.serialize(format="turtle")
+        if isinstance(data, bytes):
+            data = data.decode("utf8")
+        self.assertSameGraph(data)
+        self.assertSameGraph(data, keep=is_spkc_predicate)
+
+    def test_filter(self):
+        self.assertSameGraph(
+            document, keep=lambda predicate: predicate in {
+                RDF.type, RDF.first
+            }
+        )
+
+    def test_feed_returns_completed(self):
+        stream = TurtleStream(keep=None)
+        self.assertEqual(stream.feed(b"<http://a/> <http://b/> 1"), [])
+        # "." could start a decimal until the next character arrives
+        self.assertEqual(stream.feed(b"2 ."), [])
+        self.assertEqual(len(stream.feed(b"\n")), 1)
+        self.assertEqual(stream.close(), [])
+        with self.assertRaises(ValueError):
+            stream.feed(b"")
+
+    def test_token_at_chunk_end(self):
+        stream = TurtleStream(keep=None)
+        self.assertEqual(
+            stream.feed(b'<http://a/> <http://b/> """x"""'), []
+        )
+        self.assertEqual(len(stream.feed(b" .\n")), 1)
+        self.assertEqual(stream.feed(b"# comment"), [])
+        self.assertEqual(stream.feed(b" continued"), [])
+        self.assertEqual(
+            stream.feed(b"\n<http://a/> <http://b/> '''y'''"), []
+        )
+        self.assertEqual(len(stream.feed(b" .\n")), 1)
+        self.assertEqual(stream.close(), [])
+
+    def test_errors(self):
+        for data in [
+            "<http://a/> <http://b/> 1",
+            "<http://a/> <http://b/> .",
+            "unknown:a <http://b/> 1 .",
+            '<http://a/> <http://b/> "\\q" .',
+            "<http://a/> <http://b/> \"unterminated .",
+            "@prefix x <http://a/> .",
+        ]:
+            with self.subTest(data=data):
+                with self.assertRaises(ValueError):
+                    parse_stream(Graph(), [data.encode("utf8")], keep=None)